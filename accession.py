@@ -0,0 +1,178 @@
+"""
+Sample Accession Module
+Handles batch accessioning of scanned sample tubes: one request per rack instead of one per tube
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ACCESSION_MAX_ITEMS = 500
+ACCESSION_ATTEMPTS = 3  # generated sample IDs can collide with a concurrent batch; regenerate and retry
+
+# Orders a tube can be accessioned against, and the ones that move to 'collected' when it is
+ACCESSIBLE_ORDER_STATUSES = ('ordered', 'pending', 'collected', 'processing')
+COLLECTABLE_ORDER_STATUSES = ('ordered', 'pending')
+
+SAMPLE_FIELDS = ('sample_type', 'collection_method', 'collection_site', 'volume', 'container_type',
+                 'collected_by', 'storage_condition', 'storage_location', 'notes')
+
+def parse_items(raw_items):
+    """Normalize scanned entries (plain order numbers or dicts) to dicts with an order_number"""
+    items = []
+    for raw in raw_items or []:
+        item = {'order_number': raw} if isinstance(raw, str) else dict(raw or {})
+        item['order_number'] = str(item.get('order_number') or '').strip()
+        if item.get('barcode'):
+            item['barcode'] = str(item['barcode']).strip()
+        items.append(item)
+    return items
+
+def _next_sample_ids(count, now):
+    """count unused sample IDs continuing today's SMP<date><seq> sequence"""
+    from app import db
+    from models import Sample
+
+    prefix = f"SMP{now.strftime('%Y%m%d')}"
+    latest = db.session.query(func.max(Sample.sample_id)).filter(Sample.sample_id.like(f'{prefix}%')).scalar()
+    try:
+        start = int(latest[len(prefix):]) + 1 if latest else 1
+    except ValueError:
+        start = Sample.query.count() + 1
+    return [f"{prefix}{str(start + i).zfill(4)}" for i in range(count)]
+
+def _resolve(laboratory_id, items):
+    """Match items to orders with one query per lookup; returns (per-item errors, orders by number)"""
+    from models import TestOrder, Sample
+
+    numbers = {item['order_number'] for item in items if item['order_number']}
+    orders = {order.order_number: order for order in TestOrder.query.filter(
+        TestOrder.laboratory_id == laboratory_id, TestOrder.order_number.in_(numbers)
+    ).all()} if numbers else {}
+
+    # Orders that already have a usable tube; a second one needs an explicit recollect
+    collected = {order_id for (order_id,) in Sample.query.with_entities(Sample.test_order_id).filter(
+        Sample.test_order_id.in_([order.id for order in orders.values()]),
+        Sample.quality_status == 'acceptable'
+    ).distinct()} if orders else set()
+
+    barcodes = {item['barcode'] for item in items if item.get('barcode')}
+    taken = {sample_id for (sample_id,) in Sample.query.with_entities(Sample.sample_id).filter(
+        Sample.sample_id.in_(barcodes)
+    )} if barcodes else set()
+
+    errors = []
+    seen_orders, seen_barcodes = set(), set()
+    for item in items:
+        order = orders.get(item['order_number'])
+        barcode = item.get('barcode')
+        if not item['order_number']:
+            error = 'Missing order number'
+        elif order is None:
+            error = 'Unknown order number'
+        elif order.status not in ACCESSIBLE_ORDER_STATUSES:
+            error = f"Order is {order.status}"
+        elif order.id in seen_orders:
+            error = 'Order scanned twice in this batch'
+        elif order.id in collected and not item.get('recollect'):
+            error = 'Order already has a sample; pass recollect to add another'
+        elif barcode and len(barcode) > 20:
+            error = 'Barcode longer than 20 characters'
+        elif barcode and (barcode in taken or barcode in seen_barcodes):
+            error = 'Barcode already used'
+        elif not item.get('sample_type'):
+            error = 'Missing sample type'
+        else:
+            error = None
+            seen_orders.add(order.id)
+            if barcode:
+                seen_barcodes.add(barcode)
+        errors.append(error)
+
+    return errors, orders
+
+def accession_samples(laboratory_id, raw_items, defaults=None, collected_at=None):
+    """Create a sample for every valid scanned item in one transaction and mark their orders collected
+
+    `defaults` supplies collection metadata shared by the rack; an item may override any of it.
+    Invalid items are reported and skipped, they never fail the rest of the batch.
+    """
+    from app import db
+    from models import Sample, TestOrder
+
+    items = parse_items(raw_items)
+    if not items:
+        return {'success': False, 'error': 'No items to accession'}
+    if len(items) > ACCESSION_MAX_ITEMS:
+        return {'success': False, 'error': f'At most {ACCESSION_MAX_ITEMS} items per batch'}
+
+    defaults = defaults or {}
+    collected_at = collected_at or datetime.utcnow()
+    items = [dict({k: v for k, v in defaults.items() if k in SAMPLE_FIELDS}, **item) for item in items]
+
+    for attempt in range(1, ACCESSION_ATTEMPTS + 1):
+        errors, orders = _resolve(laboratory_id, items)
+        accepted = [index for index, error in enumerate(errors) if error is None]
+        now = datetime.utcnow()
+        generated = iter(_next_sample_ids(sum(1 for i in accepted if not items[i].get('barcode')), now))
+
+        rows = []
+        for index in accepted:
+            item = items[index]
+            order = orders[item['order_number']]
+            rows.append(dict(
+                sample_id=item.get('barcode') or next(generated),
+                test_order_id=order.id,
+                patient_id=order.patient_id,
+                laboratory_id=order.laboratory_id,
+                collection_date=collected_at,
+                status='collected',
+                **{field: item.get(field) for field in SAMPLE_FIELDS}
+            ))
+
+        try:
+            # One executemany INSERT ... RETURNING for the rack (batched into multi-row VALUES) and one
+            # bulk UPDATE; the ids are read from RETURNING, before the commit, so nothing is reloaded
+            samples = {}
+            if rows:
+                # RETURNING order is not guaranteed across batches; sample IDs are unique, so match on them
+                ids = dict(db.session.execute(insert(Sample).returning(Sample.sample_id, Sample.id), rows).all())
+                for index, row in zip(accepted, rows):
+                    samples[index] = {'id': ids[row['sample_id']], 'sample_id': row['sample_id'],
+                                      'test_order_id': row['test_order_id'], 'patient_id': row['patient_id']}
+            collectable = [orders[items[i]['order_number']].id for i in accepted
+                           if orders[items[i]['order_number']].status in COLLECTABLE_ORDER_STATUSES]
+            if collectable:
+                TestOrder.query.filter(TestOrder.id.in_(collectable)).update(
+                    {'status': 'collected', 'collected_at': collected_at}, synchronize_session=False
+                )
+            db.session.commit()
+            break
+        except IntegrityError as e:
+            db.session.rollback()
+            if attempt == ACCESSION_ATTEMPTS:
+                logger.error(f"Sample accession failed after {attempt} attempts: {str(e)}")
+                return {'success': False, 'error': 'Sample IDs conflicted with concurrent accessions, please retry'}
+            logger.warning(f"Sample ID conflict during accession, retrying (attempt {attempt})")
+
+    results = []
+    for index, (item, error) in enumerate(zip(items, errors)):
+        result = {'index': index, 'order_number': item['order_number'], 'success': error is None}
+        if error is None:
+            result.update(samples[index])
+        else:
+            result['error'] = error
+        results.append(result)
+
+    logger.info(f"Accessioned {len(accepted)} of {len(items)} scanned samples for lab {laboratory_id}")
+    return {
+        'success': True,
+        'accepted': len(accepted),
+        'rejected': len(items) - len(accepted),
+        'collected_orders': len(collectable),
+        'results': results
+    }
@@ -2,6 +2,7 @@ import json
 import os
 from datetime import datetime
 from openai import OpenAI
+from metrics import llm_call
 from ai_report_prompts import (
     get_comprehensive_analysis_prompt, 
     get_detailed_disease_analysis_prompt,
@@ -12,7 +13,13 @@ from ai_report_prompts import (
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai = OpenAI(api_key=OPENAI_API_KEY)
+openai = OpenAI(api_key=OPENAI_API_KEY, base_url=os.environ.get("OPENAI_API_BASE"))
+
+def _chat_completion(**request):
+    """openai.chat.completions.create, timed and token-counted for /metrics"""
+    with llm_call('openai', request.get('model')) as call:
+        call['response'] = openai.chat.completions.create(**request)
+    return call['response']
 
 def generate_patient_report_analysis(patient_data, test_results):
     """Generate comprehensive AI-powered medical analysis with enhanced 5-disease analysis"""
@@ -53,7 +60,7 @@ def generate_patient_report_analysis(patient_data, test_results):
         # Use the comprehensive analysis prompt
         prompt = get_comprehensive_analysis_prompt(patient_context, lab_results)
         
-        response = openai.chat.completions.create(
+        response = _chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -90,7 +97,7 @@ def generate_detailed_disease_analysis(patient_data, lab_results_context):
     try:
         prompt = get_detailed_disease_analysis_prompt(patient_data, {}, lab_results_context)
         
-        response = openai.chat.completions.create(
+        response = _chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -140,7 +147,7 @@ def generate_trend_analysis(lab_data, time_period="monthly"):
         Format as JSON with Persian text.
         """
         
-        response = openai.chat.completions.create(
+        response = _chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -193,7 +200,7 @@ def generate_lab_efficiency_report(efficiency_data):
         Format as comprehensive JSON report in Persian.
         """
         
-        response = openai.chat.completions.create(
+        response = _chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -229,7 +236,7 @@ def analyze_critical_values(test_results):
     try:
         prompt = get_critical_values_prompt(test_results)
         
-        response = openai.chat.completions.create(
+        response = _chat_completion(
             model="gpt-4o",
             messages=[
                 {
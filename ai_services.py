@@ -10,18 +10,34 @@ from openai import OpenAI
 from anthropic import Anthropic
 from google import genai
 import requests
+from health import circuit_breaker
+from metrics import llm_call
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+OPENROUTER_API_BASE = 'https://openrouter.ai/api/v1'
+
+def _ai_config(name, default=None):
+    """Provider endpoint overrides from app.config (e.g. llm_standin.py in load tests)"""
+    try:
+        from flask import current_app
+        return current_app.config.get(name) or default
+    except RuntimeError:
+        return default
+
+def _gemini_client(api_key):
+    base_url = _ai_config('GEMINI_API_BASE')
+    return genai.Client(api_key=api_key, http_options={'base_url': base_url}) if base_url else genai.Client(api_key=api_key)
+
 def test_openai_connection(api_key, model='gpt-4o'):
     """Test OpenAI API connection"""
     try:
         if not api_key:
             return {'success': False, 'error': 'API key is required'}
         
-        client = OpenAI(api_key=api_key)
+        client = OpenAI(api_key=api_key, base_url=_ai_config('OPENAI_API_BASE'))
         
         # Test with a simple completion
         response = client.chat.completions.create(
@@ -51,7 +67,7 @@ def test_claude_connection(api_key, model='claude-sonnet-4-20250514'):
         if not api_key:
             return {'success': False, 'error': 'API key is required'}
         
-        client = Anthropic(api_key=api_key)
+        client = Anthropic(api_key=api_key, base_url=_ai_config('ANTHROPIC_API_BASE'))
         
         # Test with a simple message
         response = client.messages.create(
@@ -80,7 +96,7 @@ def test_gemini_connection(api_key, model='gemini-2.5-flash'):
         if not api_key:
             return {'success': False, 'error': 'API key is required'}
         
-        client = genai.Client(api_key=api_key)
+        client = _gemini_client(api_key)
         
         # Test with a simple generation
         response = client.models.generate_content(
@@ -123,7 +139,7 @@ def test_openrouter_connection(api_key, model):
         }
         
         response = requests.post(
-            'https://openrouter.ai/api/v1/chat/completions',
+            f"{_ai_config('OPENROUTER_API_BASE', OPENROUTER_API_BASE)}/chat/completions",
             headers=headers,
             json=data,
             timeout=30
@@ -172,14 +188,23 @@ def generate_medical_analysis(patient_data, test_results, ai_service='openai', s
         Format response as JSON with Persian text.
         """
         
-        if ai_service == 'openai' and settings and settings.openai_enabled:
-            return _generate_with_openai(prompt, settings.openai_api_key, settings.openai_model)
-        elif ai_service == 'claude' and settings and settings.claude_enabled:
-            return _generate_with_claude(prompt, settings.claude_api_key, settings.claude_model)
-        elif ai_service == 'gemini' and settings and settings.gemini_enabled:
-            return _generate_with_gemini(prompt, settings.gemini_api_key, settings.gemini_model)
-        elif ai_service == 'openrouter' and settings and settings.openrouter_enabled:
-            return _generate_with_openrouter(prompt, settings.openrouter_api_key, settings.openrouter_model)
+        generators = {
+            'openai': lambda: _generate_with_openai(prompt, settings.openai_api_key, settings.openai_model),
+            'claude': lambda: _generate_with_claude(prompt, settings.claude_api_key, settings.claude_model),
+            'gemini': lambda: _generate_with_gemini(prompt, settings.gemini_api_key, settings.gemini_model),
+            'openrouter': lambda: _generate_with_openrouter(prompt, settings.openrouter_api_key, settings.openrouter_model)
+        }
+        if ai_service in generators and settings and getattr(settings, f'{ai_service}_enabled', False):
+            # A provider that keeps failing is skipped for a while instead of holding a request thread
+            breaker = circuit_breaker(f'llm:{ai_service}')
+            if not breaker.allow():
+                return {'success': False, 'error': f'AI service {ai_service} is temporarily unavailable, try again shortly'}
+            result = generators[ai_service]()
+            if result.get('success'):
+                breaker.record_success()
+            else:
+                breaker.record_failure(result.get('error'))
+            return result
         else:
             return {'success': False, 'error': f'AI service {ai_service} is not enabled or configured'}
             
@@ -190,14 +215,15 @@ def generate_medical_analysis(patient_data, test_results, ai_service='openai', s
 def _generate_with_openai(prompt, api_key, model):
     """Generate analysis using OpenAI"""
     try:
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"},
-            max_tokens=2000,
-            temperature=0.7
-        )
+        client = OpenAI(api_key=api_key, base_url=_ai_config('OPENAI_API_BASE'))
+        with llm_call('openai', model) as call:
+            call['response'] = response = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"},
+                max_tokens=2000,
+                temperature=0.7
+            )
         
         if response.choices and response.choices[0].message.content:
             analysis = json.loads(response.choices[0].message.content)
@@ -211,12 +237,13 @@ def _generate_with_openai(prompt, api_key, model):
 def _generate_with_claude(prompt, api_key, model):
     """Generate analysis using Claude"""
     try:
-        client = Anthropic(api_key=api_key)
-        response = client.messages.create(
-            model=model,
-            max_tokens=2000,
-            messages=[{"role": "user", "content": f"{prompt}\n\nPlease respond with valid JSON format."}]
-        )
+        client = Anthropic(api_key=api_key, base_url=_ai_config('ANTHROPIC_API_BASE'))
+        with llm_call('claude', model) as call:
+            call['response'] = response = client.messages.create(
+                model=model,
+                max_tokens=2000,
+                messages=[{"role": "user", "content": f"{prompt}\n\nPlease respond with valid JSON format."}]
+            )
         
         if response.content and len(response.content) > 0:
             content = response.content[0].text if hasattr(response.content[0], 'text') else str(response.content[0])
@@ -231,11 +258,12 @@ def _generate_with_claude(prompt, api_key, model):
 def _generate_with_gemini(prompt, api_key, model):
     """Generate analysis using Gemini"""
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model=model,
-            contents=f"{prompt}\n\nPlease respond with valid JSON format."
-        )
+        client = _gemini_client(api_key)
+        with llm_call('gemini', model) as call:
+            call['response'] = response = client.models.generate_content(
+                model=model,
+                contents=f"{prompt}\n\nPlease respond with valid JSON format."
+            )
         
         if response.text:
             analysis = json.loads(response.text)
@@ -261,15 +289,20 @@ def _generate_with_openrouter(prompt, api_key, model):
             'temperature': 0.7
         }
         
-        response = requests.post(
-            'https://openrouter.ai/api/v1/chat/completions',
-            headers=headers,
-            json=data,
-            timeout=120
-        )
+        with llm_call('openrouter', model) as call:
+            response = requests.post(
+                f"{_ai_config('OPENROUTER_API_BASE', OPENROUTER_API_BASE)}/chat/completions",
+                headers=headers,
+                json=data,
+                timeout=120
+            )
+            if response.status_code == 200:
+                call['response'] = response.json()
+            else:
+                call['outcome'] = 'error'
         
         if response.status_code == 200:
-            result = response.json()
+            result = call['response']
             if 'choices' in result and len(result['choices']) > 0:
                 content = result['choices'][0]['message']['content']
                 analysis = json.loads(content)
@@ -4,6 +4,13 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from fragment_cache import fragment_cache
+from pdf_renderer import pdf_renderer
+from critical_alerts import alert_broker
+from health import health_monitor
+import metrics
+from sql_profiler import sql_profiler
+from db_config import engine_options, statement_timeouts
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -20,14 +27,122 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///medlab.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Connection pool, sized from the gunicorn config (gunicorn.conf.py reads the same variables): one
+# connection per request thread plus a small overflow, checked against DB_MAX_CONNECTIONS for
+# WEB_REPLICAS containers. Pre-ping is off by default; recycling and TCP keepalives catch dead connections
+app.config["GUNICORN_WORKERS"] = int(os.environ.get("WEB_CONCURRENCY", 4))
+app.config["GUNICORN_THREADS"] = int(os.environ.get("GUNICORN_THREADS", 4))
+app.config["WEB_REPLICAS"] = int(os.environ.get("WEB_REPLICAS", 1))
+app.config["DB_POOL_SIZE"] = int(os.environ["DB_POOL_SIZE"]) if os.environ.get("DB_POOL_SIZE") else None
+app.config["DB_MAX_OVERFLOW"] = int(os.environ["DB_MAX_OVERFLOW"]) if os.environ.get("DB_MAX_OVERFLOW") else None
+app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+app.config["DB_POOL_RECYCLE"] = int(os.environ.get("DB_POOL_RECYCLE", 300))
+app.config["DB_POOL_PRE_PING"] = os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true"
+app.config["DB_MAX_CONNECTIONS"] = int(os.environ.get("DB_MAX_CONNECTIONS", 200))
+app.config["DB_QUERY_CACHE_SIZE"] = int(os.environ.get("DB_QUERY_CACHE_SIZE", 1200))
+
+# Server-side statement timeouts (ms) for interactive and export routes; export routes also share
+# DB_EXPORT_CONCURRENCY slots per worker, so a runaway export cannot hold every thread and starve login
+app.config["DB_STATEMENT_TIMEOUT_MS"] = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 5000))
+app.config["DB_EXPORT_STATEMENT_TIMEOUT_MS"] = int(os.environ.get("DB_EXPORT_STATEMENT_TIMEOUT_MS", 120000))
+app.config["DB_IDLE_IN_TRANSACTION_TIMEOUT_MS"] = int(os.environ.get("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS", 60000))
+app.config["DB_EXPORT_CONCURRENCY"] = int(os.environ.get("DB_EXPORT_CONCURRENCY", 1))
+
+# PgBouncer transaction pooling: no startup options or server-side prepared statements, so every
+# transaction gets its statement_timeout by SET LOCAL; DATABASE_DIRECT_URL bypasses PgBouncer for the
+# scheduler's session-level advisory locks
+app.config["DB_PGBOUNCER"] = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"
+app.config["DATABASE_DIRECT_URL"] = os.environ.get("DATABASE_DIRECT_URL")
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+# Rendered report fragments are cached in Redis when available, otherwise on local disk
+app.config["REDIS_URL"] = os.environ.get("REDIS_URL")
+app.config["FRAGMENT_CACHE_DIR"] = os.environ.get("FRAGMENT_CACHE_DIR")
+app.config["FRAGMENT_CACHE_TTL"] = int(os.environ.get("FRAGMENT_CACHE_TTL", 86400))
+
+# Server-side PDF rendering runs in a per-worker process pool; finished PDFs are kept on disk
+app.config["PDF_CACHE_DIR"] = os.environ.get("PDF_CACHE_DIR")
+app.config["PDF_RENDER_WORKERS"] = int(os.environ.get("PDF_RENDER_WORKERS", 2))
+app.config["PDF_RENDER_TIMEOUT"] = float(os.environ.get("PDF_RENDER_TIMEOUT", 20))
+
+# MediSina exports are sent as gzip pages; a failed page is retried with backoff, then resumed later
+app.config["MEDISINA_EXPORT_PAGE_SIZE"] = int(os.environ.get("MEDISINA_EXPORT_PAGE_SIZE", 200))
+app.config["MEDISINA_EXPORT_MAX_RETRIES"] = int(os.environ.get("MEDISINA_EXPORT_MAX_RETRIES", 5))
+app.config["MEDISINA_IMPORT_PAGE_SIZE"] = int(os.environ.get("MEDISINA_IMPORT_PAGE_SIZE", 1000))
+
+# With the scheduler process running, manual syncs are queued for it instead of blocking a web thread
+app.config["MEDISINA_SCHEDULER_ENABLED"] = os.environ.get("MEDISINA_SCHEDULER_ENABLED", "false").lower() == "true"
+app.config["MEDISINA_SCHEDULER_POLL_SECONDS"] = int(os.environ.get("MEDISINA_SCHEDULER_POLL_SECONDS", 30))
+app.config["MEDISINA_SCHEDULER_CONCURRENCY"] = int(os.environ.get("MEDISINA_SCHEDULER_CONCURRENCY", 2))
+
+# Bulk SMS is sent concurrently, capped at SMS_RATE_PER_SECOND; TWILIO_API_BASE can point at a stand-in
+app.config["TWILIO_API_BASE"] = os.environ.get("TWILIO_API_BASE")
+app.config["SMS_RATE_PER_SECOND"] = float(os.environ.get("SMS_RATE_PER_SECOND", 10))
+app.config["SMS_MAX_WORKERS"] = int(os.environ.get("SMS_MAX_WORKERS", 8))
+
+# Patient SMS go through the sms_outbox table; the relay process (sms_outbox.py) sends them
+app.config["SMS_OUTBOX_BATCH_SIZE"] = int(os.environ.get("SMS_OUTBOX_BATCH_SIZE", 200))
+app.config["SMS_RELAY_POLL_SECONDS"] = int(os.environ.get("SMS_RELAY_POLL_SECONDS", 5))
+app.config["SMS_STATUS_CALLBACK_URL"] = os.environ.get("SMS_STATUS_CALLBACK_URL")
+
+# AI provider endpoints, unset for the providers' defaults; load tests point them at llm_standin.py
+app.config["OPENAI_API_BASE"] = os.environ.get("OPENAI_API_BASE")
+app.config["ANTHROPIC_API_BASE"] = os.environ.get("ANTHROPIC_API_BASE")
+app.config["GEMINI_API_BASE"] = os.environ.get("GEMINI_API_BASE")
+app.config["OPENROUTER_API_BASE"] = os.environ.get("OPENROUTER_API_BASE")
+
+# Critical results page on-call staff and push to dashboards; latency is judged against this SLA
+app.config["CRITICAL_ALERT_SLA_SECONDS"] = int(os.environ.get("CRITICAL_ALERT_SLA_SECONDS", 60))
+app.config["ALERT_STREAM_SECONDS"] = int(os.environ.get("ALERT_STREAM_SECONDS", 55))
+# Open dashboard alert streams per worker (each holds a request thread); default half of GUNICORN_THREADS
+app.config["ALERT_STREAM_MAX"] = int(os.environ["ALERT_STREAM_MAX"]) if os.environ.get("ALERT_STREAM_MAX") else None
+
+# Analyzer result files: the ingest process watches INSTRUMENT_DROP_DIR/<laboratory_id>/; rows of
+# uploaded files that cannot be applied are written to INSTRUMENT_DEAD_LETTER_DIR
+app.config["INSTRUMENT_DROP_DIR"] = os.environ.get("INSTRUMENT_DROP_DIR", "instrument_data/drop")
+app.config["INSTRUMENT_DEAD_LETTER_DIR"] = os.environ.get("INSTRUMENT_DEAD_LETTER_DIR", "instrument_data/dead_letter")
+app.config["INSTRUMENT_POLL_SECONDS"] = int(os.environ.get("INSTRUMENT_POLL_SECONDS", 10))
+
+# HL7 v2 MLLP listener; messages map to a lab by sending facility (HL7_FACILITY_LABS="FAC=1,...")
+# and otherwise go to HL7_LABORATORY_ID
+app.config["HL7_HOST"] = os.environ.get("HL7_HOST", "0.0.0.0")
+app.config["HL7_PORT"] = int(os.environ.get("HL7_PORT", 2575))
+app.config["HL7_LABORATORY_ID"] = int(os.environ["HL7_LABORATORY_ID"]) if os.environ.get("HL7_LABORATORY_ID") else None
+app.config["HL7_FACILITY_LABS"] = os.environ.get("HL7_FACILITY_LABS", "")
+app.config["HL7_QUEUE_SIZE"] = int(os.environ.get("HL7_QUEUE_SIZE", 1000))
+app.config["HL7_BATCH_SIZE"] = int(os.environ.get("HL7_BATCH_SIZE", 200))
+
+# /readyz reuses a database probe for HEALTH_DB_TTL seconds and reports not-ready once
+# HEALTH_SATURATION_RATIO of the pool or of the HEALTH_REQUEST_THREADS gunicorn threads are busy
+app.config["HEALTH_DB_TTL"] = float(os.environ.get("HEALTH_DB_TTL", 5))
+app.config["HEALTH_SATURATION_RATIO"] = float(os.environ.get("HEALTH_SATURATION_RATIO", 0.8))
+app.config["HEALTH_REQUEST_THREADS"] = int(os.environ.get("HEALTH_REQUEST_THREADS", app.config["GUNICORN_THREADS"]))
+
+# Prometheus metrics: gunicorn workers share samples through METRICS_DIR (a per-master temp dir by
+# default); background processes serve their own on METRICS_PORT
+app.config["METRICS_DIR"] = os.environ.get("METRICS_DIR")
+app.config["METRICS_FLUSH_SECONDS"] = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+app.config["METRICS_PORT"] = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None
+
+# SQL profiler: dev mode profiles every request and adds the X-SQL-Profile header and page summary;
+# otherwise SQL_PROFILER_SAMPLE_RATE of requests are checked for N+1 patterns. Slow statements are always logged
+app.config["SQL_PROFILER_DEV"] = os.environ.get("SQL_PROFILER_DEV", str(os.environ.get("FLASK_ENV") == "development")).lower() == "true"
+app.config["SQL_PROFILER_SAMPLE_RATE"] = float(os.environ.get("SQL_PROFILER_SAMPLE_RATE", 0.01))
+app.config["SQL_SLOW_QUERY_MS"] = float(os.environ.get("SQL_SLOW_QUERY_MS", 200))
+app.config["SQL_N_PLUS_ONE_THRESHOLD"] = int(os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", 5))
+
 # Initialize the app with the extension
 db.init_app(app)
+fragment_cache.init_app(app)
+pdf_renderer.init_app(app)
+alert_broker.init_app(app)
+health_monitor.init_app(app)
+metrics.init_app(app)
+sql_profiler.init_app(app)
+# Last: its before_request may answer 429, which skips the hooks registered after it
+statement_timeouts.init_app(app)
 
 # Add custom template filter for JSON parsing
 @app.template_filter('from_json')
@@ -52,11 +167,19 @@ def inject_session_data():
         'translations': get_all_translations(current_language)
     }
 
-with app.app_context():
+with app.app_context(), statement_timeouts.statement_class('maintenance'):
     # Import models to create tables
     import models  # noqa: F401
     db.create_all()
     logging.info("Database tables created")
+
+    # Apply additive schema changes to tables that already existed (index builds and backfills
+    # may run longer than the interactive statement timeout)
+    try:
+        from migrations import run_migrations
+        run_migrations()
+    except Exception as e:
+        logging.warning(f"Could not apply schema migrations: {e}")
     
     # Initialize sample data
     try:
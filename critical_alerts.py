@@ -0,0 +1,381 @@
+"""
+Critical Alerts Module
+Handles detection of critical results at flush time, paging of on-call staff through the SMS
+outbox, live dashboard pushes over server-sent events, and the write-to-delivery latency SLO
+"""
+import json
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, inspect, insert, select, and_
+from sqlalchemy.orm import Session
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # Redis client is optional; alerts then only reach this process's dashboards
+    redis = None
+
+CHANNEL_PREFIX = 'alerts:lab'
+RELAY_WAKE_CHANNEL = 'sms-outbox:wake'
+
+# A repeat critical for the same patient and test within this window of an open alert is not paged again
+DEDUPE_WINDOW = timedelta(hours=1)
+
+# Histogram bucket upper bounds in seconds, Prometheus style (cumulative, +Inf implied)
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+DEFAULT_SLA_SECONDS = 60
+
+class _LocalSubscription:
+    def __init__(self, broker, laboratory_id):
+        self.broker = broker
+        self.laboratory_id = laboratory_id
+        self.queue = queue.Queue(maxsize=100)
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+class LocalAlertBroker:
+    """In-process fan-out, for development and single-process deployments"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, laboratory_id, payload):
+        with self.lock:
+            subscribers = list(self.subscribers.get(laboratory_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(payload)
+            except queue.Full:
+                logger.warning(f"Dropping alert event for a slow subscriber of lab {laboratory_id}")
+
+    def subscribe(self, laboratory_id):
+        subscription = _LocalSubscription(self, laboratory_id)
+        with self.lock:
+            self.subscribers.setdefault(laboratory_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.get(subscription.laboratory_id, set()).discard(subscription)
+
+    def wake_sms_relay(self):
+        pass
+
+class _RedisSubscription:
+    def __init__(self, client, channel):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(channel)
+
+    def get(self, timeout):
+        message = self.pubsub.get_message(timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+class RedisAlertBroker:
+    """Fan-out through Redis pub/sub, so an alert written on one replica reaches dashboards on all"""
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=0.5, health_check_interval=30)
+
+    def publish(self, laboratory_id, payload):
+        self.client.publish(f'{CHANNEL_PREFIX}:{laboratory_id}', json.dumps(payload))
+
+    def subscribe(self, laboratory_id):
+        return _RedisSubscription(self.client, f'{CHANNEL_PREFIX}:{laboratory_id}')
+
+    def wake_sms_relay(self):
+        self.client.publish(RELAY_WAKE_CHANNEL, '1')
+
+class AlertBroker:
+    """Publishes alert events to dashboards and wakes the SMS relay, off the request thread"""
+
+    def __init__(self):
+        self.backend = LocalAlertBroker()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='alert-fanout')
+        self.max_streams = 2
+        self.streams_open = 0
+        self._stream_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Choose a backend from the app configuration"""
+        # Each open SSE stream holds a gthread worker thread; keep the rest for ordinary requests
+        self.max_streams = int(app.config.get('ALERT_STREAM_MAX') or max(1, int(app.config.get('GUNICORN_THREADS') or 4) // 2))
+        redis_url = app.config.get('REDIS_URL')
+        if redis_url and redis is not None:
+            self.backend = RedisAlertBroker(redis_url)
+            logger.info("Critical alerts using Redis pub/sub")
+
+    def subscribe(self, laboratory_id):
+        return self.backend.subscribe(laboratory_id)
+
+    def acquire_stream(self):
+        """Take one of this worker's ALERT_STREAM_MAX stream slots; False when all are in use"""
+        with self._stream_lock:
+            if self.streams_open >= self.max_streams:
+                return False
+            self.streams_open += 1
+            return True
+
+    def release_stream(self):
+        with self._stream_lock:
+            self.streams_open -= 1
+
+    def _safely(self, function, *args):
+        try:
+            function(*args)
+        except Exception as e:
+            logger.error(f"Critical alert fan-out failed: {str(e)}")
+
+    def fan_out(self, events, page_staff):
+        """Push events to dashboards and wake the SMS relay in parallel; returns immediately"""
+        for payload in events:
+            self.executor.submit(self._safely, self.backend.publish, payload['laboratory_id'], payload)
+        if page_staff:
+            self.executor.submit(self._safely, self.backend.wake_sms_relay)
+
+alert_broker = AlertBroker()
+
+def on_call_numbers(settings):
+    """On-call phone numbers from the lab settings"""
+    if not settings or not settings.critical_alert_phones:
+        return []
+    return [number.strip() for number in settings.critical_alert_phones.replace('\n', ',').split(',') if number.strip()]
+
+def _critical_changes(session):
+    """TestOrders in this flush that were created or changed with result_status 'critical'"""
+    from models import TestOrder
+
+    changed = []
+    for order in list(session.new) + list(session.dirty):
+        if not isinstance(order, TestOrder) or order.result_status != 'critical':
+            continue
+        state = inspect(order)
+        if order in session.new or any(
+                state.attrs[name].history.has_changes() for name in ('result_status', 'result_value')):
+            changed.append(order)
+    return changed
+
+def _record_alerts(connection, orders, recorded_at):
+    """Insert alert rows and queue staff SMS on the flush connection; returns event payloads"""
+    from models import CriticalAlert, Settings, TestType, Patient
+    from sms_outbox import enqueue_sms
+
+    alerts = CriticalAlert.__table__
+    events = []
+
+    for order in orders:
+        # Re-saving the same critical value is not a new alert
+        already = connection.execute(select(alerts.c.id).where(
+            alerts.c.test_order_id == order.id, alerts.c.result_value == order.result_value
+        )).first()
+        if already:
+            continue
+
+        open_alert = connection.execute(select(alerts.c.id).where(and_(
+            alerts.c.patient_id == order.patient_id,
+            alerts.c.test_type_id == order.test_type_id,
+            alerts.c.status == 'open',
+            alerts.c.created_at >= recorded_at - DEDUPE_WINDOW
+        )).order_by(alerts.c.id.desc())).first()
+
+        alert_id = connection.execute(insert(alerts).values(
+            laboratory_id=order.laboratory_id,
+            test_order_id=order.id,
+            patient_id=order.patient_id,
+            test_type_id=order.test_type_id,
+            result_value=order.result_value,
+            result_unit=order.result_unit,
+            status='suppressed' if open_alert else 'open',
+            duplicate_of_id=open_alert.id if open_alert else None,
+            pages_sent=0,
+            result_recorded_at=recorded_at,
+            created_at=recorded_at
+        )).inserted_primary_key[0]
+
+        test_type = connection.execute(select(TestType.name, TestType.normal_range).where(
+            TestType.id == order.test_type_id)).first()
+        patient = connection.execute(select(Patient.first_name, Patient.last_name).where(
+            Patient.id == order.patient_id)).first()
+        payload = {
+            'type': 'duplicate' if open_alert else 'critical',
+            'alert_id': alert_id,
+            'duplicate_of': open_alert.id if open_alert else None,
+            'laboratory_id': order.laboratory_id,
+            'test_order_id': order.id,
+            'order_number': order.order_number,
+            'patient_name': f'{patient.first_name} {patient.last_name}' if patient else '',
+            'test_name': test_type.name if test_type else '',
+            'result_value': order.result_value,
+            'result_unit': order.result_unit,
+            'recorded_at': recorded_at.isoformat()
+        }
+
+        if not open_alert:
+            settings = connection.execute(select(Settings.__table__).where(
+                Settings.laboratory_id == order.laboratory_id)).first()
+            pages = 0
+            if settings and settings.sms_enabled:
+                data = {
+                    'patient_name': payload['patient_name'],
+                    'test_name': payload['test_name'],
+                    'critical_value': f"{order.result_value} {order.result_unit or ''}".strip(),
+                    'reference_range': order.reference_range or (test_type.normal_range if test_type else '')
+                }
+                for number in on_call_numbers(settings):
+                    pages += enqueue_sms(order.laboratory_id, number, 'critical_result', data, 'critical_alert',
+                                         alert_id, audience='staff', connection=connection)
+            if pages:
+                connection.execute(alerts.update().where(alerts.c.id == alert_id).values(pages_sent=pages))
+            payload['pages_sent'] = pages
+
+        events.append(payload)
+
+    return events
+
+def record_critical_results(session, orders):
+    """Write alerts for critical orders in the session's transaction; events go out after commit
+
+    The flush listener calls this for ORM changes. Bulk UPDATEs bypass the unit of work, so their
+    writers call it directly with objects carrying the TestOrder columns the alerts need.
+    """
+    connection = session.connection()
+    try:
+        # In a savepoint, so a failure here rolls back only the alert rows
+        with connection.begin_nested():
+            events = _record_alerts(connection, orders, datetime.utcnow())
+    except Exception as e:
+        # Never lose the result because alerting failed; the dashboard still shows it as critical
+        logger.error(f"Could not record critical alerts: {str(e)}")
+        return []
+    session.info.setdefault('critical_alert_events', []).extend(events)
+    return events
+
+@event.listens_for(Session, 'after_flush')
+def detect_critical_results(session, flush_context):
+    """Write alerts for critical results in the same transaction as the result itself"""
+    orders = _critical_changes(session)
+    if orders:
+        record_critical_results(session, orders)
+
+@event.listens_for(Session, 'after_commit')
+def publish_critical_alerts(session):
+    events = session.info.pop('critical_alert_events', None)
+    if events:
+        alert_broker.fan_out(events, page_staff=any(e.get('pages_sent') for e in events))
+
+@event.listens_for(Session, 'after_rollback')
+def discard_critical_alerts(session):
+    session.info.pop('critical_alert_events', None)
+
+def mark_sse_delivered(alert_ids):
+    """Stamp first dashboard delivery; later deliveries of the same alert keep the first time"""
+    from app import db
+    from models import CriticalAlert
+
+    if not alert_ids:
+        return
+    CriticalAlert.query.filter(
+        CriticalAlert.id.in_(alert_ids), CriticalAlert.sse_delivered_at.is_(None)
+    ).update({'sse_delivered_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+def alert_payload(alert):
+    """Event payload for an alert read back from the database (replay after reconnect)"""
+    return {
+        'type': 'duplicate' if alert.status == 'suppressed' else 'critical',
+        'alert_id': alert.id,
+        'duplicate_of': alert.duplicate_of_id,
+        'laboratory_id': alert.laboratory_id,
+        'test_order_id': alert.test_order_id,
+        'result_value': alert.result_value,
+        'result_unit': alert.result_unit,
+        'status': alert.status,
+        'recorded_at': alert.result_recorded_at.isoformat()
+    }
+
+def acknowledge_alert(alert, user_id):
+    """Close an open alert and the duplicates suppressed under it; the caller commits"""
+    from models import CriticalAlert
+
+    now = datetime.utcnow()
+    CriticalAlert.query.filter(
+        (CriticalAlert.id == alert.id) | (CriticalAlert.duplicate_of_id == alert.id),
+        CriticalAlert.acknowledged_at.is_(None)
+    ).update({'status': 'acknowledged', 'acknowledged_at': now, 'acknowledged_by': user_id},
+             synchronize_session=False)
+    return {'type': 'acknowledged', 'alert_id': alert.id, 'laboratory_id': alert.laboratory_id,
+            'acknowledged_at': now.isoformat()}
+
+def latency_histogram(latencies, buckets=LATENCY_BUCKETS, sla_seconds=DEFAULT_SLA_SECONDS):
+    """Cumulative bucket counts, percentiles and SLA attainment for latencies in seconds"""
+    values = np.asarray([v for v in latencies if v is not None], dtype=np.float64)
+    counts = {str(bound): int((values <= bound).sum()) for bound in buckets}
+    counts['+Inf'] = int(values.size)
+
+    summary = {'count': int(values.size), 'buckets': counts, 'sla_seconds': sla_seconds}
+    if values.size:
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary.update({
+            'sum': round(float(values.sum()), 3),
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'max': round(float(values.max()), 3),
+            'within_sla': round(float((values <= sla_seconds).mean()), 4)
+        })
+    return summary
+
+def alert_latency_report(laboratory_id, since=None, sla_seconds=DEFAULT_SLA_SECONDS):
+    """Write-to-delivery latency histograms per channel for a lab's paged alerts"""
+    from sqlalchemy import func
+    from app import db
+    from models import CriticalAlert, SmsOutbox
+
+    since = since or datetime.utcnow() - timedelta(days=7)
+
+    sms = db.session.query(
+        SmsOutbox.entity_id.label('alert_id'),
+        func.min(SmsOutbox.sent_at).label('sent_at'),
+        func.min(SmsOutbox.delivered_at).label('delivered_at')
+    ).filter(SmsOutbox.entity_type == 'critical_alert').group_by(SmsOutbox.entity_id).subquery()
+
+    rows = db.session.query(
+        CriticalAlert.result_recorded_at, CriticalAlert.sse_delivered_at, sms.c.sent_at, sms.c.delivered_at
+    ).outerjoin(sms, sms.c.alert_id == CriticalAlert.id).filter(
+        CriticalAlert.laboratory_id == laboratory_id,
+        CriticalAlert.status != 'suppressed',
+        CriticalAlert.created_at >= since
+    ).all()
+
+    def seconds(start, end):
+        return (end - start).total_seconds() if start and end else None
+
+    first_delivery = [
+        min([v for v in (seconds(r[0], r[1]), seconds(r[0], r[2])) if v is not None], default=None) for r in rows
+    ]
+    return {
+        'since': since.isoformat(),
+        'alerts': len(rows),
+        'dashboard': latency_histogram([seconds(r[0], r[1]) for r in rows], sla_seconds=sla_seconds),
+        'sms_sent': latency_histogram([seconds(r[0], r[2]) for r in rows], sla_seconds=sla_seconds),
+        'sms_delivered': latency_histogram([seconds(r[0], r[3]) for r in rows], sla_seconds=sla_seconds),
+        'first_delivery': latency_histogram(first_delivery, sla_seconds=sla_seconds)
+    }
@@ -0,0 +1,258 @@
+"""
+Database Config Module
+Handles SQLAlchemy engine options sized from the gunicorn configuration, server-side statement
+timeouts per route class (interactive, export, maintenance), a per-worker cap on concurrent
+export-class requests, PgBouncer transaction-pooling mode and the pool exhaustion/timeout metrics.
+"""
+import os
+import sys
+import logging
+import threading
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Route classes and their statement_timeout in milliseconds (0 = none)
+STATEMENT_TIMEOUTS = {'interactive': 5000, 'export': 120000, 'maintenance': 0}
+DEFAULT_CLASS = 'interactive'
+DB_EXPORT_CONCURRENCY = 1  # export-class requests running at once per worker
+EXPORT_SLOT_WAIT = 2.0  # seconds an export request waits for a slot before getting 429
+RESERVED_CONNECTIONS = 20  # kept free for the background processes, migrations and psql
+
+# Endpoints that read or write a whole laboratory's data in one request
+EXPORT_ENDPOINTS = {
+    'export_patient_reports',
+    'export_patient_data',
+    'import_patient_reports',
+    'medisina_sync',
+    'api_ingest_instrument_results',
+}
+
+QUERY_CANCELED = '57014'  # PostgreSQL SQLSTATE of a statement cancelled by statement_timeout
+
+def route_class(endpoint):
+    return 'export' if endpoint in EXPORT_ENDPOINTS else DEFAULT_CLASS
+
+def pool_sizing(config):
+    """(pool_size, max_overflow) per process
+
+    Each gunicorn thread holds at most one connection, so the pool matches the thread count; the
+    overflow covers in-process helpers (alert fan-out, the readiness probe) rather than more requests.
+    """
+    threads = int(config.get('GUNICORN_THREADS') or 4)
+    pool_size = config.get('DB_POOL_SIZE') or threads
+    max_overflow = config.get('DB_MAX_OVERFLOW')
+    if max_overflow is None:
+        max_overflow = max(2, threads // 2)
+    return pool_size, max_overflow
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+    url = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    options = {
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 300),
+        # Off by default: a ping is a round trip on every checkout. Recycling below the server's idle
+        # timeout plus TCP keepalives catches dead connections; the rare one left invalidates the pool
+        'pool_pre_ping': bool(config.get('DB_POOL_PRE_PING')),
+    }
+    if not url.startswith('postgresql'):
+        return options
+
+    pool_size, max_overflow = pool_sizing(config)
+    pgbouncer = bool(config.get('DB_PGBOUNCER'))
+    connect_args = {
+        'application_name': f"medlab:{os.path.basename(sys.argv[0]) or 'python'}"[:63],
+        'connect_timeout': int(config.get('DB_CONNECT_TIMEOUT', 5)),
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    }
+    if pgbouncer:
+        # PgBouncer rejects the startup "options" parameter, and in transaction mode a session SET would
+        # leak to other clients: every class, the interactive default included, uses SET LOCAL per
+        # transaction (StatementTimeouts.set_local_default)
+        if url.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = None  # server-side prepared statements do not survive it
+    else:
+        connect_args['options'] = (
+            f"-c statement_timeout={int(config.get('DB_STATEMENT_TIMEOUT_MS', STATEMENT_TIMEOUTS[DEFAULT_CLASS]))} "
+            f"-c idle_in_transaction_session_timeout={int(config.get('DB_IDLE_IN_TRANSACTION_TIMEOUT_MS', 60000))}"
+        )
+        if url.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = int(config.get('DB_PREPARE_THRESHOLD', 5))
+
+    options.update({
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 5),
+        # Compiled statements are cached per engine; the hot queries vary only in parameters
+        'query_cache_size': config.get('DB_QUERY_CACHE_SIZE', 1200),
+        'connect_args': connect_args,
+    })
+
+    budget = int(config.get('DB_MAX_CONNECTIONS', 200)) - RESERVED_CONNECTIONS
+    fleet = (pool_size + max_overflow) * int(config.get('GUNICORN_WORKERS') or 4) * int(config.get('WEB_REPLICAS') or 1)
+    if not pgbouncer and fleet > budget:
+        logger.warning(f"Web fleet may open {fleet} connections ({pool_size}+{max_overflow} per worker), more than "
+                       f"the {budget} left of DB_MAX_CONNECTIONS; lower DB_POOL_SIZE/DB_MAX_OVERFLOW or use PgBouncer")
+    return options
+
+class StatementTimeouts:
+    """Per-thread route class; transactions outside the default class get SET LOCAL statement_timeout,
+    and behind PgBouncer those of the default class do too"""
+
+    def __init__(self):
+        self.timeouts = dict(STATEMENT_TIMEOUTS)
+        self.export_slots = threading.BoundedSemaphore(DB_EXPORT_CONCURRENCY)
+        self.export_concurrency = DB_EXPORT_CONCURRENCY
+        self.exports_running = 0
+        self._count_lock = threading.Lock()
+        self.set_local_default = False  # no startup options behind PgBouncer, so no session default
+        self._local = threading.local()
+        self._listening = False
+
+    @property
+    def current_class(self):
+        return getattr(self._local, 'route_class', DEFAULT_CLASS)
+
+    def set_local_statement(self, route_class):
+        """SQL that gives the current transaction route_class's timeout, or None when the connection's
+        startup options already set it"""
+        if route_class == DEFAULT_CLASS and not self.set_local_default:
+            return None
+        return f'SET LOCAL statement_timeout = {int(self.timeouts[route_class])}'
+
+    @contextmanager
+    def statement_class(self, route_class):
+        """Run the block's transactions under route_class's statement timeout (background jobs)"""
+        previous = self.current_class
+        self._local.route_class = route_class
+        if route_class != previous:
+            # A transaction the session already began will not see the begin event again
+            self._apply_to_open_session(route_class)
+        try:
+            yield
+        finally:
+            self._local.route_class = previous
+            if route_class != previous:
+                self._apply_to_open_session(previous)
+
+    def _apply_to_open_session(self, route_class):
+        from flask import has_app_context, current_app
+        from sqlalchemy import text
+
+        if not has_app_context():
+            return
+        # Not "from app import db": this also runs while app.py itself is being imported
+        db = current_app.extensions['sqlalchemy']
+        # db.session is the scoped_session registry; the transaction state lives on the thread's Session
+        if db.session().in_transaction() and db.engine.dialect.name == 'postgresql':
+            db.session.execute(text(f'SET LOCAL statement_timeout = {int(self.timeouts[route_class])}'))
+
+    def listen(self):
+        """Attach the transaction and error hooks to every engine (once)"""
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        if self._listening:
+            return
+        event.listen(Engine, 'begin', self._on_begin)
+        event.listen(Engine, 'handle_error', self._on_error)
+        self._listening = True
+
+    def _on_begin(self, conn):
+        statement = self.set_local_statement(self.current_class)
+        if statement and conn.dialect.name == 'postgresql':
+            conn.exec_driver_sql(statement)
+
+    def _on_error(self, context):
+        if getattr(context.original_exception, 'pgcode', None) != QUERY_CANCELED:
+            return
+        from metrics import metrics
+
+        route_class = self.current_class
+        metrics.inc('medlab_db_statement_timeouts_total', {'class': route_class})
+        logger.warning(f"Statement cancelled after the {route_class} timeout of {self.timeouts[route_class]} ms: "
+                       f"{' '.join((context.statement or '').split())[:300]}")
+
+    def init_app(self, app):
+        from flask import request, jsonify
+        from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+        self.timeouts['interactive'] = int(app.config.get('DB_STATEMENT_TIMEOUT_MS', self.timeouts['interactive']))
+        self.timeouts['export'] = int(app.config.get('DB_EXPORT_STATEMENT_TIMEOUT_MS', self.timeouts['export']))
+        self.export_concurrency = int(app.config.get('DB_EXPORT_CONCURRENCY', self.export_concurrency))
+        self.set_local_default = bool(app.config.get('DB_PGBOUNCER'))
+        self.export_slots = threading.BoundedSemaphore(self.export_concurrency)
+        self.listen()
+
+        @app.before_request
+        def _enter_route_class():
+            name = route_class(request.endpoint)
+            self._local.route_class = name
+            self._local.holds_export_slot = False
+            if name != 'export':
+                return None
+
+            # Exports share a few slots so they can never occupy every request thread (or connection)
+            if not self.export_slots.acquire(timeout=EXPORT_SLOT_WAIT):
+                self._local.route_class = DEFAULT_CLASS
+                response = jsonify({'success': False, 'error': 'Another export is running; please retry shortly'})
+                response.status_code = 429
+                response.headers['Retry-After'] = '10'
+                return response
+            self._local.holds_export_slot = True
+            with self._count_lock:
+                self.exports_running += 1
+            return None
+
+        @app.teardown_request
+        def _leave_route_class(exc=None):
+            if getattr(self._local, 'holds_export_slot', False):
+                self._local.holds_export_slot = False
+                with self._count_lock:
+                    self.exports_running -= 1
+                self.export_slots.release()
+            self._local.route_class = DEFAULT_CLASS
+
+        @app.errorhandler(PoolTimeoutError)
+        def _pool_exhausted(error):
+            from metrics import metrics
+
+            metrics.inc('medlab_db_pool_timeouts_total', {'endpoint': request.endpoint or 'unmatched'})
+            logger.warning(f"No database connection within the pool timeout for {request.endpoint}: {error}")
+            # No template here: rendering the error page needs the database too
+            response = jsonify({'success': False, 'error': 'The service is busy; please retry shortly'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+
+statement_timeouts = StatementTimeouts()
+
+_direct_engine = None
+_direct_engine_lock = threading.Lock()
+
+def session_engine():
+    """Engine for session-level features (advisory locks): DATABASE_DIRECT_URL behind PgBouncer,
+    otherwise the app's engine"""
+    global _direct_engine
+    from flask import current_app
+    from app import db
+
+    direct_url = current_app.config.get('DATABASE_DIRECT_URL')
+    if not current_app.config.get('DB_PGBOUNCER') or not direct_url:
+        if current_app.config.get('DB_PGBOUNCER'):
+            logger.warning('DB_PGBOUNCER is set without DATABASE_DIRECT_URL; session-level locks may not hold')
+        return db.engine
+
+    with _direct_engine_lock:
+        if _direct_engine is None:
+            from sqlalchemy import create_engine
+
+            config = dict(current_app.config, SQLALCHEMY_DATABASE_URI=direct_url, DB_PGBOUNCER=False,
+                          DB_POOL_SIZE=2, DB_MAX_OVERFLOW=2, GUNICORN_WORKERS=1, WEB_REPLICAS=1)
+            _direct_engine = create_engine(direct_url, **engine_options(config))
+        return _direct_engine
@@ -0,0 +1,198 @@
+"""
+Delta Check Module
+Handles comparison of new results with each patient's prior result for the same test
+"""
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per test code defaults; TestType.delta_* columns override them. Absolute and rate limits are
+# in the unit the two results are compared in (SI when both normalize, otherwise as reported).
+DEFAULT_DELTA_RULES = {
+    'GLU': {'percent': 50.0},
+    'FBS': {'percent': 50.0},
+    'CREA': {'absolute': 26.5, 'window_days': 2},  # KDIGO: +0.3 mg/dL within 48 hours
+    'K': {'absolute': 1.0, 'window_days': 7},
+    'NA': {'absolute': 8.0, 'window_days': 7},
+    'HB': {'absolute': 20.0, 'window_days': 14},
+    'PLT': {'percent': 50.0, 'window_days': 14},
+    'WBC': {'percent': 100.0, 'window_days': 14},
+    'HBA1C': {'absolute': 11.0, 'window_days': 365},
+    'TSH': {'percent': 100.0, 'window_days': 365},
+}
+DEFAULT_RULE = {'absolute': None, 'percent': 50.0, 'rate_per_day': None, 'window_days': 180}
+
+# Shortest interval used for rate-of-change, so same-hour repeats do not divide by ~0
+MIN_ELAPSED_DAYS = 1.0 / 24
+
+def rule_for(test_type):
+    """Effective thresholds for a test type: its own columns, then code defaults, then DEFAULT_RULE"""
+    rule = dict(DEFAULT_RULE)
+    rule.update(DEFAULT_DELTA_RULES.get((test_type.code or '').upper(), {}))
+
+    overrides = {
+        'absolute': test_type.delta_absolute_limit,
+        'percent': test_type.delta_percent_limit,
+        'rate_per_day': test_type.delta_rate_limit,
+        'window_days': test_type.delta_window_days,
+    }
+    rule.update({key: value for key, value in overrides.items() if value is not None})
+    return rule
+
+def compute_deltas(current, previous, elapsed_days, absolute_limit, percent_limit, rate_limit):
+    """Vectorized change, percent change and rate-of-change plus the failed mask
+
+    All arguments are equal-length float arrays; a NaN limit disables that check.
+    """
+    current = np.asarray(current, dtype=np.float64)
+    previous = np.asarray(previous, dtype=np.float64)
+
+    change = current - previous
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = np.where(previous != 0, change / np.abs(previous) * 100.0, np.nan)
+        rate = np.abs(change) / np.maximum(np.asarray(elapsed_days, dtype=np.float64), MIN_ELAPSED_DAYS)
+
+        # Comparisons against NaN are False, so disabled limits and incomparable pairs never fail
+        failed = ((np.abs(change) >= absolute_limit)
+                  | (np.abs(percent) >= percent_limit)
+                  | (rate >= rate_limit))
+
+    return {'change': change, 'percent': percent, 'rate': rate, 'failed': failed}
+
+def match_priors(current_groups, current_times, prior_groups, prior_times):
+    """Index into the prior arrays of each current result's latest strictly-earlier prior, or -1
+
+    Groups are small non-negative ints (one per patient/test pair), times are epoch seconds.
+    """
+    current_keys = (np.asarray(current_groups, dtype=np.int64) << 32) + np.asarray(current_times, dtype=np.int64)
+    prior_keys = (np.asarray(prior_groups, dtype=np.int64) << 32) + np.asarray(prior_times, dtype=np.int64)
+
+    order = np.argsort(prior_keys, kind='stable')
+    sorted_keys = prior_keys[order]
+
+    position = np.searchsorted(sorted_keys, current_keys, side='left') - 1
+    valid = position >= 0
+    position = np.where(valid, position, 0)
+
+    # The candidate must belong to the same patient/test group
+    if len(sorted_keys):
+        valid &= (sorted_keys[position] >> 32) == np.asarray(current_groups, dtype=np.int64)
+    else:
+        valid[:] = False
+
+    return np.where(valid, order[position] if len(order) else -1, -1)
+
+def _epoch_seconds(timestamps):
+    return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+
+def run_delta_checks(orders, checked_at=None):
+    """Delta-check numeric results in bulk and write the flags onto the TestOrder objects
+
+    Prior results for the whole batch are loaded in one query; earlier results within the
+    batch also count as priors. Censored results ('<5') are neither checked nor used as priors,
+    since their change is unknown. The caller commits.
+    """
+    from sqlalchemy import tuple_
+    from app import db
+    from models import TestOrder, TestType
+
+    checked_at = checked_at or datetime.utcnow()
+    orders = [o for o in orders if o.result_numeric is not None and o.ordered_at is not None]
+    for order in orders:
+        if order.result_qualifier:
+            order.delta_flag = 'censored'
+            order.delta_change = order.delta_percent = order.delta_rate = None
+            order.delta_prior_order_id = None
+            order.delta_checked_at = checked_at
+    orders = [o for o in orders if not o.result_qualifier]
+    if not orders:
+        return {'checked': 0, 'flagged': []}
+
+    pairs = sorted({(o.patient_id, o.test_type_id) for o in orders})
+    group_of = {pair: index for index, pair in enumerate(pairs)}
+
+    test_types = TestType.query.filter(TestType.id.in_({test_type_id for _, test_type_id in pairs})).all()
+    rules = {test_type.id: rule_for(test_type) for test_type in test_types}
+    max_window = max(rule['window_days'] for rule in rules.values())
+
+    batch_ids = [o.id for o in orders if o.id is not None]
+    query = db.session.query(
+        TestOrder.id, TestOrder.patient_id, TestOrder.test_type_id, TestOrder.ordered_at,
+        TestOrder.result_numeric, TestOrder.result_si_value, TestOrder.result_si_unit, TestOrder.result_unit
+    ).filter(
+        tuple_(TestOrder.patient_id, TestOrder.test_type_id).in_(pairs),
+        TestOrder.result_numeric.isnot(None),
+        TestOrder.result_qualifier.is_(None),
+        TestOrder.ordered_at >= min(o.ordered_at for o in orders) - timedelta(days=max_window),
+        TestOrder.ordered_at < max(o.ordered_at for o in orders)
+    )
+    if batch_ids:
+        query = query.filter(TestOrder.id.notin_(batch_ids))
+
+    priors = query.all() + [
+        (o.id, o.patient_id, o.test_type_id, o.ordered_at, o.result_numeric,
+         o.result_si_value, o.result_si_unit, o.result_unit)
+        for o in orders
+    ]
+
+    prior_index = match_priors(
+        [group_of[(o.patient_id, o.test_type_id)] for o in orders],
+        _epoch_seconds([o.ordered_at for o in orders]),
+        [group_of[(p[1], p[2])] for p in priors],
+        _epoch_seconds([p[3] for p in priors])
+    )
+
+    current_values, previous_values, elapsed_days = [], [], []
+    limits = {'absolute': [], 'percent': [], 'rate_per_day': []}
+    for order, index in zip(orders, prior_index):
+        rule = rules.get(order.test_type_id, DEFAULT_RULE)
+        for key in limits:
+            limits[key].append(np.nan if rule[key] is None else rule[key])
+
+        prior = priors[index] if index >= 0 else None
+        elapsed = (order.ordered_at - prior[3]).total_seconds() / 86400.0 if prior else np.nan
+
+        current, previous = np.nan, np.nan
+        if prior is not None and elapsed <= rule['window_days']:
+            if order.result_si_value is not None and prior[5] is not None and order.result_si_unit == prior[6]:
+                current, previous = order.result_si_value, prior[5]
+            elif (order.result_unit or '').lower() == (prior[7] or '').lower():
+                current, previous = order.result_numeric, prior[4]
+
+        current_values.append(current)
+        previous_values.append(previous)
+        elapsed_days.append(elapsed)
+
+    deltas = compute_deltas(current_values, previous_values, elapsed_days,
+                            np.array(limits['absolute']), np.array(limits['percent']),
+                            np.array(limits['rate_per_day']))
+
+    flagged = []
+    for i, order in enumerate(orders):
+        order.delta_checked_at = checked_at
+        if np.isnan(previous_values[i]):
+            order.delta_flag = 'no_prior'
+            order.delta_change = order.delta_percent = order.delta_rate = None
+            order.delta_prior_order_id = None
+            continue
+
+        order.delta_prior_order_id = priors[prior_index[i]][0]
+        order.delta_change = round(float(deltas['change'][i]), 4)
+        order.delta_percent = None if np.isnan(deltas['percent'][i]) else round(float(deltas['percent'][i]), 2)
+        order.delta_rate = round(float(deltas['rate'][i]), 4)
+        order.delta_flag = 'fail' if deltas['failed'][i] else 'pass'
+        if deltas['failed'][i]:
+            flagged.append(order)
+
+    if flagged:
+        logger.info(f"Delta check flagged {len(flagged)} of {len(orders)} results")
+
+    return {'checked': len(orders), 'flagged': flagged}
+
+def check_result(order):
+    """Delta-check a single freshly recorded result (inline path)"""
+    return run_delta_checks([order])
@@ -0,0 +1,159 @@
+"""
+Fragment Cache Module
+Caches rendered report HTML in Redis (when REDIS_URL is set) or on local disk
+"""
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # Redis client is optional; fall back to the disk backend
+    redis = None
+
+KEY_PREFIX = 'fragment:report'
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+class RedisFragmentStore:
+    """Fragment store backed by a shared Redis instance"""
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value.encode('utf-8'), ex=ttl)
+
+    def delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=f'{prefix}*', count=100))
+        if keys:
+            self.client.delete(*keys)
+        return len(keys)
+
+class DiskFragmentStore:
+    """Fragment store backed by files on local disk, one directory per report"""
+
+    def __init__(self, root, ttl=DEFAULT_TTL_SECONDS):
+        self.root = root
+        self.ttl = ttl
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        # Keys look like "fragment:report:<id>:<rest>"; group files by report id
+        parts = key.split(':')
+        report_dir = os.path.join(self.root, parts[2] if len(parts) > 2 else '_')
+        return os.path.join(report_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial fragment
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    def delete_prefix(self, prefix):
+        parts = prefix.rstrip(':').split(':')
+        report_dir = os.path.join(self.root, parts[2]) if len(parts) > 2 else None
+        if report_dir and os.path.isdir(report_dir):
+            shutil.rmtree(report_dir, ignore_errors=True)
+            return 1
+        return 0
+
+class FragmentCache:
+    """Versioned cache of rendered report fragments"""
+
+    def __init__(self, store=None, ttl=DEFAULT_TTL_SECONDS):
+        self.store = store
+        self.ttl = ttl
+        self._template_hashes = {}
+
+    def init_app(self, app):
+        """Choose a backend from the app configuration"""
+        self.ttl = int(app.config.get('FRAGMENT_CACHE_TTL', self.ttl))
+        redis_url = app.config.get('REDIS_URL')
+
+        if redis_url and redis is not None:
+            self.store = RedisFragmentStore(redis_url)
+            logger.info("Fragment cache using Redis backend")
+        else:
+            cache_dir = app.config.get('FRAGMENT_CACHE_DIR') or os.path.join(app.instance_path, 'fragment_cache')
+            self.store = DiskFragmentStore(cache_dir, self.ttl)
+            logger.info(f"Fragment cache using disk backend at {cache_dir}")
+
+    def template_hash(self, jinja_env, *template_names):
+        """Short hash of the template sources so template deploys invalidate old fragments"""
+        cache_key = tuple(template_names)
+        if cache_key in self._template_hashes and not jinja_env.auto_reload:
+            return self._template_hashes[cache_key]
+
+        digest = hashlib.sha1()
+        for name in template_names:
+            source, _, _ = jinja_env.loader.get_source(jinja_env, name)
+            digest.update(source.encode('utf-8'))
+
+        value = digest.hexdigest()[:12]
+        self._template_hashes[cache_key] = value
+        return value
+
+    @staticmethod
+    def report_key(report_id, version, language, template_hash):
+        return f'{KEY_PREFIX}:{report_id}:v{version}:{language}:{template_hash}'
+
+    def get(self, key):
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(key)
+        except Exception as e:
+            logger.warning(f"Fragment cache read failed: {str(e)}")
+            return None
+
+    def set(self, key, value):
+        if self.store is None:
+            return
+        try:
+            self.store.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"Fragment cache write failed: {str(e)}")
+
+    def get_or_render(self, key, render):
+        """Return the cached fragment for key, rendering and storing it on a miss"""
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = render()
+            self.set(key, fragment)
+        return fragment
+
+    def invalidate_report(self, report_id):
+        """Drop every cached fragment of a report, whatever its version"""
+        if self.store is None:
+            return 0
+        try:
+            return self.store.delete_prefix(f'{KEY_PREFIX}:{report_id}:')
+        except Exception as e:
+            logger.warning(f"Fragment cache invalidation failed for report {report_id}: {str(e)}")
+            return 0
+
+fragment_cache = FragmentCache()
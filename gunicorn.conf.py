@@ -0,0 +1,21 @@
+"""
+Gunicorn Configuration
+Worker and thread counts come from WEB_CONCURRENCY and GUNICORN_THREADS, which app.py also reads
+to size each worker's database connection pool (see db_config.py).
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+worker_connections = 1000
+max_requests = 1000
+max_requests_jitter = 100
+timeout = 30
+keepalive = 2
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+capture_output = True
+enable_stdio_inheritance = True
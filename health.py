@@ -0,0 +1,230 @@
+"""
+Health Module
+Handles liveness and readiness reporting for probes and load balancers: liveness never touches a
+dependency, readiness serves a cached database probe alongside connection pool, request thread and
+background queue levels, and the state of the circuit breakers guarding external integrations
+"""
+import os
+import math
+import time
+import logging
+import threading
+from datetime import datetime
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEALTH_DB_TTL = 5.0  # seconds a database probe (and the queue counts read with it) is reused
+# A worker reports not-ready at this share of its pool connections or request threads in use,
+# so the balancer stops sending it work before requests start queueing
+HEALTH_SATURATION_RATIO = 0.8
+
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+class CircuitBreaker:
+    """Stops calling a failing integration for a cool-down, then lets a single trial call through"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may be made now; moves an expired open breaker to half-open"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200] if error else None
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"Circuit {self.name} opened after {self.failures} failures: {self.last_error}")
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == 'open':
+                retry_in = max(0.0, round(self.reset_seconds - (self.clock() - self.opened_at), 1))
+            return {'state': self.state, 'failures': self.failures, 'retry_in_seconds': retry_in,
+                    'last_error': self.last_error}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def circuit_breaker(name):
+    """The process-wide breaker for an integration, created on first use"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+def pool_status(engine):
+    """Checkout and overflow levels of a QueuePool; None for pools without them (SQLite)"""
+    pool = engine.pool
+    if not all(hasattr(pool, name) for name in ('size', 'checkedout', 'overflow')):
+        return None
+    size = pool.size()
+    max_overflow = getattr(pool, '_max_overflow', 0)
+    capacity = size + max(max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        'size': size,
+        'max_overflow': max_overflow,
+        'checked_out': checked_out,
+        'overflow': max(pool.overflow(), 0),
+        'utilization': round(checked_out / capacity, 3) if capacity else None
+    }
+
+class HealthMonitor:
+    """Per-process liveness and readiness state"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.db_ttl = HEALTH_DB_TTL
+        self.saturation_ratio = HEALTH_SATURATION_RATIO
+        self.request_threads = None
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._probe = None
+        self._probe_at = 0.0
+
+    def init_app(self, app):
+        self.db_ttl = float(app.config.get('HEALTH_DB_TTL', self.db_ttl))
+        self.saturation_ratio = float(app.config.get('HEALTH_SATURATION_RATIO', self.saturation_ratio))
+        self.request_threads = app.config.get('HEALTH_REQUEST_THREADS')
+
+        @app.before_request
+        def _count_request():
+            with self._lock:
+                self.in_flight += 1
+
+        @app.teardown_request
+        def _uncount_request(exc=None):
+            with self._lock:
+                self.in_flight -= 1
+
+    def liveness(self):
+        """The process is up and serving requests; deliberately checks nothing else"""
+        return {'status': 'alive', 'pid': os.getpid(), 'uptime_seconds': round(time.time() - self.started_at)}
+
+    def _probe_database(self):
+        """SELECT 1 plus background queue depths on one pooled connection"""
+        from sqlalchemy import text
+        from app import db
+
+        started = time.monotonic()
+        probe = {'checked_at': datetime.utcnow().isoformat()}
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                probe['database'] = {'ok': True, 'latency_ms': round((time.monotonic() - started) * 1000, 1)}
+                probe['queues'] = self._queue_depths(connection)
+        except Exception as e:
+            probe['database'] = {'ok': False, 'error': str(e)[:200]}
+            probe.setdefault('queues', {})
+        return probe
+
+    def _queue_depths(self, connection):
+        from sqlalchemy import text
+
+        depths = {}
+        for name, statement in (
+            ('sms_outbox_pending', "SELECT COUNT(*) FROM sms_outbox WHERE status = 'pending'"),
+            ('sync_runs_queued', "SELECT COUNT(*) FROM sync_runs WHERE status = 'queued'"),
+        ):
+            try:
+                depths[name] = connection.execute(text(statement)).scalar()
+            except Exception as e:
+                connection.rollback()
+                logger.warning(f"Could not read queue depth {name}: {str(e)}")
+        return depths
+
+    def cached_probe(self):
+        """The last database probe if younger than the TTL; one thread refreshes it while the others
+        keep answering from the previous result"""
+        if self._probe is not None and time.monotonic() - self._probe_at < self.db_ttl:
+            return self._probe
+        if not self._probe_lock.acquire(blocking=self._probe is None):
+            return self._probe
+        try:
+            self._probe = self._probe_database()
+            self._probe_at = time.monotonic()
+            return self._probe
+        finally:
+            self._probe_lock.release()
+
+    def readiness(self):
+        """Readiness report; ready is False when the database is down or this worker is near saturation"""
+        from app import db
+        from critical_alerts import alert_broker
+        from pdf_renderer import pdf_renderer
+
+        probe = self.cached_probe()
+        pool = pool_status(db.engine)
+        streams = alert_broker.streams_open
+        with self._lock:
+            # The readiness request itself is one of the requests in flight, and so is every open alert
+            # stream; streams are capped separately, so they reduce the threads left rather than count as load
+            busy = max(self.in_flight - 1 - streams, 0)
+        saturated_at = None
+        if self.request_threads:
+            # Counted in whole threads: with 4 threads and a 0.8 ratio that is 3, every thread but the probe's
+            saturated_at = max(math.floor((self.request_threads - streams) * self.saturation_ratio), 1)
+
+        reasons = []
+        if not probe['database']['ok']:
+            reasons.append('database unavailable')
+        if pool and pool['utilization'] is not None and pool['utilization'] >= self.saturation_ratio:
+            reasons.append('connection pool saturated')
+        if saturated_at is not None and busy >= saturated_at:
+            reasons.append('request threads saturated')
+
+        queues = dict(probe['queues'])
+        queues['alert_fanout'] = alert_broker.executor._work_queue.qsize()
+        queues['pdf_renders'] = len(pdf_renderer._in_flight)
+
+        breakers = breaker_states()
+        return {
+            'status': 'ready' if not reasons else 'not_ready',
+            'ready': not reasons,
+            'reasons': reasons,
+            'degraded': sorted(name for name, state in breakers.items() if state['state'] != 'closed'),
+            'pid': os.getpid(),
+            'database': dict(probe['database'], checked_at=probe['checked_at']),
+            'pool': pool,
+            'requests': {'in_flight': busy, 'threads': self.request_threads, 'alert_streams': streams},
+            'queues': queues,
+            'circuit_breakers': breakers
+        }
+
+health_monitor = HealthMonitor()
@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+"""
+HL7 Listener Module
+Handles HL7 v2 order (ORM^O01) and result (ORU^R01) messages from the LIS/HIS over MLLP: an
+asyncio server reads frames from many connections, parses them as it goes, and feeds a bounded
+queue that a single writer drains in batches into Patient/TestOrder updates. ACKs are pipelined:
+a sender may keep sending while earlier messages are still being written, and receives the ACKs
+in message order once each batch has committed.
+
+Usage:
+    python hl7_listener.py                                  # listen on HL7_HOST:HL7_PORT
+    python hl7_listener.py --send messages.hl7 --port 2575  # send a file of messages and print the ACKs
+"""
+
+import re
+import time
+import signal
+import asyncio
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# MLLP frame: <VT> message <FS><CR>
+START_BLOCK = b'\x0b'
+END_BLOCK = b'\x1c\x0d'
+
+HL7_PORT = 2575
+HL7_QUEUE_SIZE = 1000  # messages waiting for the writer; a full queue stops reading from sockets
+HL7_BATCH_SIZE = 200  # messages per database transaction
+HL7_BATCH_LINGER = 0.05  # seconds the writer waits for a batch to fill once the first message arrives
+HL7_MAX_IN_FLIGHT = 100  # unacknowledged messages per connection
+HL7_MAX_MESSAGE_BYTES = 1 << 20
+
+# OBX-11 result statuses that carry a usable result: final, corrected, or not given
+APPLIED_RESULT_STATUSES = {'F', 'C', ''}
+URGENT_PRIORITIES = {'S', 'A'}  # stat, ASAP
+GENDERS = {'M': 'male', 'F': 'female', 'O': 'other', 'U': None}
+
+# Rows handed to instrument_ingest.apply_result_rows; the last column maps a row back to its message
+RESULT_COLUMNS = {'order_number': 0, 'test_code': 1, 'result_value': 2, 'result_unit': 3,
+                  'reference_range': 4, 'flag': 5, 'completed_at': 6}
+
+class MllpFrameDecoder:
+    """Splits a byte stream into MLLP message payloads, across arbitrary read boundaries"""
+
+    def __init__(self, max_message_bytes=HL7_MAX_MESSAGE_BYTES):
+        self.buffer = bytearray()
+        self.max_message_bytes = max_message_bytes
+
+    def feed(self, data):
+        """Add received bytes; returns the complete payloads they finished"""
+        self.buffer.extend(data)
+        messages = []
+        while True:
+            start = self.buffer.find(START_BLOCK)
+            if start < 0:
+                # Bytes outside a frame are noise (keepalives, stray CRs)
+                self.buffer.clear()
+                break
+            end = self.buffer.find(END_BLOCK, start + 1)
+            if end < 0:
+                if start:
+                    del self.buffer[:start]
+                if len(self.buffer) > self.max_message_bytes:
+                    raise ValueError(f'MLLP frame larger than {self.max_message_bytes} bytes')
+                break
+            messages.append(bytes(self.buffer[start + 1:end]))
+            del self.buffer[:end + len(END_BLOCK)]
+        return messages
+
+def frame(message):
+    """MLLP-frame an HL7 message given as text"""
+    return START_BLOCK + message.encode('utf-8') + END_BLOCK
+
+class Segment:
+    """One HL7 segment; fields are numbered as in the standard (PID-3 is field(3))"""
+
+    def __init__(self, text, separators):
+        self.separators = separators
+        self.fields = text.split(separators['field'])
+        self.name = self.fields[0]
+        if self.name == 'MSH':
+            # MSH-1 is the field separator itself, so MSH fields sit one position to the left
+            self.fields.insert(1, separators['field'])
+
+    def field(self, number, component=None, repetition=0):
+        if number >= len(self.fields):
+            return ''
+        value = self.fields[number]
+        if self.name != 'MSH' or number > 2:
+            value = value.split(self.separators['repetition'])[repetition] if value else ''
+            if component is not None:
+                parts = value.split(self.separators['component'])
+                value = parts[component - 1] if component <= len(parts) else ''
+                value = value.split(self.separators['subcomponent'])[0]
+        return unescape(value, self.separators)
+
+def unescape(value, separators):
+    """Resolve the HL7 escape sequences for the delimiters (\\F\\, \\S\\, \\T\\, \\R\\, \\E\\)"""
+    escape = separators['escape']
+    if not escape or escape not in value:
+        return value
+    replacements = {'F': separators['field'], 'S': separators['component'], 'T': separators['subcomponent'],
+                    'R': separators['repetition'], 'E': escape}
+    pattern = re.escape(escape) + r'([FSTRE])' + re.escape(escape)
+    return re.sub(pattern, lambda match: replacements[match.group(1)], value)
+
+def iter_segments(message):
+    """Yield the segments of a message one at a time, delimiters taken from its MSH header"""
+    if not message.startswith('MSH') or len(message) < 8:
+        raise ValueError('Message does not start with an MSH segment')
+    encoding = message[4:8]
+    separators = {'field': message[3], 'component': encoding[0], 'repetition': encoding[1],
+                  'escape': encoding[2], 'subcomponent': encoding[3]}
+
+    for text in re.split(r'\r\n|\r|\n', message):
+        if text:
+            yield Segment(text, separators)
+
+def parse_timestamp(value):
+    """HL7 TS (YYYYMMDD[HHMM[SS[.S+]]][+ZZZZ]) as a naive datetime, or None"""
+    digits = re.match(r'^(\d{8})(\d{4})?(\d{2})?', value or '')
+    if not digits:
+        return None
+    try:
+        return datetime.strptime(digits.group(1) + (digits.group(2) or '0000') + (digits.group(3) or '00'),
+                                 '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+
+def _provider_name(segment, number):
+    # XCN: ID^family^given
+    return ' '.join(part for part in (segment.field(number, 3), segment.field(number, 2)) if part)
+
+def parse_message(message):
+    """Header, patient, orders and results of an ORM/ORU message, read in a single pass"""
+    parsed = {'patient': None, 'orders': [], 'results': []}
+    order = None
+    common = {}
+
+    for segment in iter_segments(message):
+        if segment.name == 'MSH':
+            parsed.update({
+                'sending_app': segment.field(3, 1),
+                'sending_facility': segment.field(4, 1),
+                'receiving_app': segment.field(5, 1),
+                'receiving_facility': segment.field(6, 1),
+                'type': segment.field(9, 1),
+                'trigger': segment.field(9, 2),
+                'control_id': segment.field(10),
+                'processing_id': segment.field(11, 1) or 'P',
+                'version': segment.field(12, 1) or '2.5'
+            })
+        elif segment.name == 'PID':
+            born = parse_timestamp(segment.field(7))
+            parsed['patient'] = {
+                'patient_id': segment.field(3, 1),
+                'last_name': segment.field(5, 1),
+                'first_name': segment.field(5, 2),
+                'date_of_birth': born.date() if born else None,
+                'gender': GENDERS.get(segment.field(8).upper(), None),
+                'phone': segment.field(13, 1),
+                'national_id': segment.field(19)
+            }
+        elif segment.name == 'ORC':
+            common = {
+                'control': segment.field(1).upper() or 'NW',
+                'order_number': segment.field(2, 1),
+                'ordered_at': parse_timestamp(segment.field(9)),
+                'ordered_by': _provider_name(segment, 12),
+                'priority': segment.field(7, 6).upper()
+            }
+        elif segment.name == 'OBR':
+            order = {
+                'control': common.get('control', 'NW'),
+                'order_number': segment.field(2, 1) or common.get('order_number', ''),
+                'test_code': segment.field(4, 1),
+                'ordered_at': parse_timestamp(segment.field(6)) or common.get('ordered_at'),
+                'ordered_by': _provider_name(segment, 16) or common.get('ordered_by', ''),
+                'priority': segment.field(27, 6).upper() or common.get('priority', '')
+            }
+            parsed['orders'].append(order)
+        elif segment.name == 'OBX' and order is not None:
+            value = segment.field(5, 2) if segment.field(2) in ('CE', 'CWE') else segment.field(5)
+            # OBX-3 is the analyte; apply_messages matches it against the order's test
+            parsed['results'].append({
+                'order_number': order['order_number'],
+                'test_code': segment.field(3, 1),
+                'value': value,
+                'unit': segment.field(6, 1),
+                'reference_range': segment.field(7),
+                'flag': segment.field(8),
+                'status': segment.field(11).upper(),
+                'observed_at': parse_timestamp(segment.field(14))
+            })
+
+    if not parsed.get('control_id'):
+        raise ValueError('MSH-10 message control ID is missing')
+    return parsed
+
+def build_ack(parsed, code, text=''):
+    """ACK for a parsed message; code is AA (accepted), AE (error) or AR (rejected, resend later)"""
+    now = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    control_id = parsed.get('control_id', '')
+    text = (text or '').replace('|', '/').replace('\r', ' ')[:200]
+    return '\r'.join([
+        f"MSH|^~\\&|{parsed.get('receiving_app') or 'MEDLAB'}|{parsed.get('receiving_facility') or ''}|"
+        f"{parsed.get('sending_app', '')}|{parsed.get('sending_facility', '')}|{now}||"
+        f"ACK^{parsed.get('trigger', '')}^ACK|ACK{control_id}|{parsed.get('processing_id', 'P')}|"
+        f"{parsed.get('version', '2.5')}",
+        f"MSA|{code}|{control_id}|{text}"
+    ]) + '\r'
+
+def message_key(parsed):
+    """Idempotency key of a message: sender plus control ID, as senders resend on a lost ACK"""
+    key = f"hl7:{parsed.get('sending_facility', '')}:{parsed.get('sending_app', '')}:{parsed['control_id']}"
+    return key if len(key) <= 64 else hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class _Rejections:
+    """Collects rows apply_result_rows could not apply, by message"""
+
+    def __init__(self):
+        self.by_message = {}
+
+    def write(self, row, reason):
+        self.by_message.setdefault(row[-1], reason)
+
+def apply_messages(laboratory_id, messages, received_at=None):
+    """Write a batch of parsed messages for one lab in a single transaction; returns an (ACK code,
+    text) per message
+
+    Patients, test types and orders for the whole batch are loaded with one query each; results go
+    through the instrument ingestion path, so they are normalized, classified, delta-checked and
+    alerted exactly like analyzer files. The caller handles a failed commit.
+    """
+    from app import db
+    from models import Patient, TestType, TestOrder, IngestBatch
+    from instrument_ingest import apply_result_rows, CLOSED_ORDER_STATUSES
+
+    received_at = received_at or datetime.utcnow()
+    outcomes = [None] * len(messages)
+    keys = [message_key(m) for m in messages]
+
+    applied_keys = {key for (key,) in db.session.query(IngestBatch.idempotency_key).filter(
+        IngestBatch.laboratory_id == laboratory_id, IngestBatch.idempotency_key.in_(keys)
+    )}
+    for index, message in enumerate(messages):
+        if message['type'] not in ('ORM', 'ORU'):
+            outcomes[index] = ('AR', f"Unsupported message type {message['type']}^{message['trigger']}")
+        elif keys[index] in applied_keys or keys[index] in keys[:index]:
+            outcomes[index] = ('AA', 'Duplicate message, already applied')
+        elif not message['patient'] or not message['patient']['patient_id']:
+            outcomes[index] = ('AE', 'PID-3 patient identifier is missing')
+
+    live = [index for index, outcome in enumerate(outcomes) if outcome is None]
+
+    # One query each for the batch's patients, test types and existing orders (with their test codes)
+    patient_ids = {messages[i]['patient']['patient_id'] for i in live}
+    patients = {p.patient_id: p for p in Patient.query.filter(Patient.patient_id.in_(patient_ids)).all()} if patient_ids else {}
+    codes = {order['test_code'] for i in live for order in messages[i]['orders']}
+    test_types = {t.code.upper(): t for t in TestType.query.filter(
+        TestType.code.in_(codes | {code.upper() for code in codes})).all()} if codes else {}
+    numbers = {order['order_number'] for i in live for order in messages[i]['orders']}
+    orders, order_codes = {}, {}
+    if numbers:
+        for order, code in db.session.query(TestOrder, TestType.code).join(
+                TestType, TestType.id == TestOrder.test_type_id).filter(TestOrder.order_number.in_(numbers)):
+            orders[order.order_number] = order
+            order_codes[order.order_number] = code
+    created_for = {}  # order number -> patient, for orders created earlier in this batch
+
+    # Each message is checked completely before anything of it is written, so a message answered
+    # AE leaves no patient or order behind
+    latest = {}  # a later message in the batch supersedes an earlier one for the same order
+    for index in live:
+        message = messages[index]
+        info = message['patient']
+        patient = patients.get(info['patient_id'])
+        error = None
+        if patient is not None and patient.laboratory_id != laboratory_id:
+            error = f"Patient {info['patient_id']} belongs to another laboratory"
+        elif patient is None and (not info['first_name'] or not info['last_name']):
+            error = 'PID-5 patient name is missing'
+
+        changes = []  # (order info, existing order or None, test type for a new order)
+        rows = []
+        for order_info in message['orders'] if error is None else ():
+            number = order_info['order_number']
+            order = orders.get(number)
+            if number in created_for:
+                foreign = created_for[number] is not patient
+            else:
+                # A patient new to this batch owns no stored order
+                foreign = order is not None and (patient is None or order.patient_id != patient.id)
+            if not number:
+                error = 'OBR-2 placer order number is missing'
+            elif foreign:
+                error = f"Order {number} belongs to another patient"
+            elif order_info['control'] == 'CA':
+                if order is not None and order.status in ('completed',) + CLOSED_ORDER_STATUSES:
+                    error = f"Order {number} is {order.status} and cannot be cancelled"
+                elif order is not None:
+                    changes.append((order_info, order, None))
+            elif order is None and message['type'] == 'ORU':
+                error = f"Unknown order number {number}"
+            elif order is None:
+                test_type = test_types.get(order_info['test_code'].upper())
+                if test_type is None:
+                    error = f"Unknown test code {order_info['test_code']}"
+                else:
+                    changes.append((order_info, None, test_type))
+            if error is None and message['type'] == 'ORU':
+                # One result per order: exactly one OBX of the OBR must carry the order's test
+                code = (order_codes.get(number) or '').upper()
+                matching = [r for r in message['results']
+                            if r['order_number'] == number and r['test_code'].upper() == code]
+                if len(matching) != 1:
+                    error = (f"{len(matching)} OBX results for test {order_codes.get(number)} of order {number}; "
+                             f"expected exactly one")
+                elif matching[0]['status'] in APPLIED_RESULT_STATUSES and matching[0]['value']:
+                    result = matching[0]
+                    rows.append([
+                        result['order_number'], result['test_code'], result['value'], result['unit'],
+                        result['reference_range'], result['flag'],
+                        (result['observed_at'] or received_at).isoformat(), index
+                    ])
+            if error:
+                break
+        if error:
+            outcomes[index] = ('AE', error)
+            continue
+
+        if patient is None:
+            patient = Patient(laboratory_id=laboratory_id, **{k: v for k, v in info.items() if v})
+            patients[info['patient_id']] = patient
+            db.session.add(patient)
+        else:
+            for field in ('first_name', 'last_name', 'date_of_birth', 'gender', 'phone', 'national_id'):
+                if info[field]:
+                    setattr(patient, field, info[field])
+        for order_info, order, test_type in changes:
+            if order is not None:
+                order.status = 'cancelled'
+                continue
+            order = TestOrder(
+                order_number=order_info['order_number'], patient=patient, test_type_id=test_type.id,
+                laboratory_id=laboratory_id, ordered_by=order_info['ordered_by'] or None,
+                priority='urgent' if order_info['priority'] in URGENT_PRIORITIES else 'normal',
+                ordered_at=order_info['ordered_at'] or received_at, status='ordered'
+            )
+            orders[order.order_number] = order
+            order_codes[order.order_number] = test_type.code
+            created_for[order.order_number] = patient
+            db.session.add(order)
+        for row in rows:
+            latest[row[0]] = row
+    db.session.flush()
+
+    live = [index for index in live if outcomes[index] is None]
+    rejections = _Rejections()
+    if latest:
+        apply_result_rows(laboratory_id, list(latest.values()), RESULT_COLUMNS, rejections, set(), received_at)
+
+    for index in live:
+        reason = rejections.by_message.get(index)
+        outcomes[index] = ('AE', reason) if reason else ('AA', '')
+        if reason:
+            # Not recorded, so the sender can resend the message once the cause is fixed
+            continue
+        db.session.add(IngestBatch(
+            laboratory_id=laboratory_id, idempotency_key=keys[index], source='hl7',
+            filename=f"{messages[index]['type']}^{messages[index]['trigger']}",
+            instrument=messages[index]['sending_app'] or None,
+            rows_total=len(messages[index]['results']),
+            rows_applied=len(messages[index]['results']),
+            started_at=received_at, finished_at=datetime.utcnow()
+        ))
+
+    db.session.commit()
+    return outcomes
+
+class MllpServer:
+    """Asyncio MLLP listener with a bounded queue in front of a batching database writer"""
+
+    def __init__(self, app=None, host='0.0.0.0', port=HL7_PORT, laboratory_for=None, queue_size=HL7_QUEUE_SIZE,
+                 batch_size=HL7_BATCH_SIZE, linger=HL7_BATCH_LINGER, max_in_flight=HL7_MAX_IN_FLIGHT,
+                 write_batch=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.laboratory_for = laboratory_for or (lambda parsed: None)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_in_flight = max_in_flight
+        # write_batch(list of parsed messages) -> list of (code, text); replaceable for tests
+        self.write_batch = write_batch or self._write_to_database
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hl7-writer')
+        self.queue = None
+        self.server = None
+        self.writer_task = None
+        self.stats = {'connections': 0, 'received': 0, 'acknowledged': 0, 'batches': 0, 'max_queue_depth': 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.writer_task = asyncio.ensure_future(self._writer_loop())
+        logger.info(f"HL7 MLLP listener on {self.host}:{self.port} (queue {self.queue_size}, batch {self.batch_size})")
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        """Stop accepting connections, then let the writer finish what is queued"""
+        self.server.close()
+        await self.server.wait_closed()
+        await self.queue.join()
+        self.writer_task.cancel()
+        self.executor.shutdown(wait=True)
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        self.stats['connections'] += 1
+        decoder = MllpFrameDecoder()
+        pending = asyncio.Queue()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        ack_task = asyncio.ensure_future(self._send_acks(writer, pending, in_flight))
+
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    # Backpressure: a connection with too many unacknowledged messages, or a full
+                    # writer queue, stops being read, so the sender's TCP window closes
+                    await in_flight.acquire()
+                    await pending.put(await self._submit(payload))
+        except (ValueError, ConnectionError) as e:
+            logger.warning(f"HL7 connection {peer} dropped: {str(e)}")
+        finally:
+            await pending.put(None)
+            await ack_task
+            writer.close()
+
+    async def _submit(self, payload):
+        """Parse a payload and queue it; returns (parsed, future resolving to the ACK text)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.stats['received'] += 1
+
+        try:
+            text = payload.decode('utf-8')
+        except UnicodeDecodeError:
+            text = payload.decode('latin-1')
+        try:
+            parsed = parse_message(text)
+        except ValueError as e:
+            future.set_result(build_ack({}, 'AR', f'Unparseable message: {str(e)}'))
+            return future
+
+        await self.queue.put((parsed, future))
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.queue.qsize())
+        return future
+
+    async def _send_acks(self, writer, pending, in_flight):
+        """Write ACKs in the order the messages arrived, each once its batch has been written"""
+        while True:
+            future = await pending.get()
+            if future is None:
+                return
+            ack = await future
+            in_flight.release()
+            try:
+                writer.write(frame(ack))
+                await writer.drain()
+                self.stats['acknowledged'] += 1
+            except ConnectionError:
+                logger.warning("HL7 sender went away before its ACK was written")
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+            try:
+                outcomes = await loop.run_in_executor(self.executor, self.write_batch, [p for p, _ in batch])
+            except Exception as e:
+                logger.error(f"HL7 batch of {len(batch)} failed: {str(e)}")
+                outcomes = [('AR', 'Temporarily unable to store the message, resend later')] * len(batch)
+
+            self.stats['batches'] += 1
+            for (parsed, future), (code, text) in zip(batch, outcomes):
+                future.set_result(build_ack(parsed, code, text))
+                self.queue.task_done()
+
+    def _write_to_database(self, messages):
+        """Group a batch by laboratory and apply it; a failing group is retried message by message"""
+        from app import db
+
+        outcomes = [None] * len(messages)
+        groups = {}
+        for index, message in enumerate(messages):
+            laboratory_id = self.laboratory_for(message)
+            if laboratory_id is None:
+                outcomes[index] = ('AR', f"No laboratory configured for facility {message.get('sending_facility')}")
+            else:
+                groups.setdefault(laboratory_id, []).append(index)
+
+        started = time.monotonic()
+        with self.app.app_context():
+            for laboratory_id, indexes in groups.items():
+                try:
+                    for index, outcome in zip(indexes, apply_messages(laboratory_id, [messages[i] for i in indexes])):
+                        outcomes[index] = outcome
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"HL7 batch write failed, retrying {len(indexes)} messages singly: {str(e)}")
+                    for index in indexes:
+                        try:
+                            outcomes[index] = apply_messages(laboratory_id, [messages[index]])[0]
+                        except Exception as single_error:
+                            db.session.rollback()
+                            outcomes[index] = ('AR', f'Could not store the message: {str(single_error)}')
+
+        logger.info(f"HL7 wrote {len(messages)} messages in {(time.monotonic() - started) * 1000:.0f} ms")
+        return outcomes
+
+def laboratory_resolver(app):
+    """Map a message to a laboratory: HL7_FACILITY_LABS ("FACILITY=lab_id,...") then HL7_LABORATORY_ID"""
+    facilities = {}
+    for entry in (app.config.get('HL7_FACILITY_LABS') or '').split(','):
+        facility, _, laboratory_id = entry.partition('=')
+        if facility.strip() and laboratory_id.strip().isdigit():
+            facilities[facility.strip()] = int(laboratory_id)
+    default = app.config.get('HL7_LABORATORY_ID')
+
+    def laboratory_for(parsed):
+        return facilities.get(parsed.get('sending_facility'), default)
+    return laboratory_for
+
+async def send_messages(host, port, messages, timeout=30):
+    """Local MLLP client: send all messages without waiting, then collect one ACK per message"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for message in messages:
+            writer.write(frame(message))
+        await writer.drain()
+
+        decoder = MllpFrameDecoder()
+        acks = []
+        while len(acks) < len(messages):
+            data = await asyncio.wait_for(reader.read(65536), timeout)
+            if not data:
+                break
+            acks.extend(payload.decode('utf-8') for payload in decoder.feed(data))
+        return acks
+    finally:
+        writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='HL7 v2 MLLP listener')
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--send', metavar='FILE', help='send the messages in FILE (blank-line separated) and print the ACKs')
+    args = parser.parse_args()
+
+    if args.send:
+        with open(args.send, encoding='utf-8') as handle:
+            messages = [m.strip().replace('\n', '\r') for m in handle.read().split('\n\n') if m.strip()]
+        acks = asyncio.run(send_messages(args.host or '127.0.0.1', args.port or HL7_PORT, messages))
+        for ack in acks:
+            print(ack.replace('\r', '\n'))
+        return
+
+    from app import app
+
+    server = MllpServer(
+        app, host=args.host or app.config.get('HL7_HOST', '0.0.0.0'),
+        port=args.port or int(app.config.get('HL7_PORT', HL7_PORT)),
+        laboratory_for=laboratory_resolver(app),
+        queue_size=int(app.config.get('HL7_QUEUE_SIZE', HL7_QUEUE_SIZE)),
+        batch_size=int(app.config.get('HL7_BATCH_SIZE', HL7_BATCH_SIZE))
+    )
+
+    if app.config.get('METRICS_PORT'):
+        from metrics import start_http_server
+        start_http_server(app.config['METRICS_PORT'])
+
+    async def run():
+        await server.start()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopping.set)
+        serving = asyncio.ensure_future(server.serve_forever())
+        await stopping.wait()
+        logger.info("HL7 listener stopping")
+        serving.cancel()
+        await server.stop()
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+HTTP Conditional Request Module
+Builds version-based ETags and answers If-None-Match / If-Modified-Since with 304s
+"""
+import hashlib
+from datetime import datetime, timezone
+from flask import request, make_response
+
+def make_etag(*parts):
+    """Hash the given version components into a short ETag value"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8'))
+    return digest.hexdigest()[:20]
+
+def _as_utc(value):
+    """Convert a naive UTC datetime from the database into an aware one"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return value.replace(microsecond=0)
+
+def is_not_modified(etag, last_modified=None):
+    """Check the current request's validators against the resource's current ones"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    last_modified = _as_utc(last_modified)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+
+    return False
+
+def set_validators(response, etag, last_modified=None):
+    """Attach ETag/Last-Modified and force clients to revalidate private content"""
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = _as_utc(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def not_modified_response(etag, last_modified=None):
+    """Empty 304 response carrying the current validators"""
+    response = make_response('', 304)
+    return set_validators(response, etag, last_modified)
+
+def conditional(etag, last_modified, build_response):
+    """Return a 304 when the client copy is current, otherwise build and tag a full response"""
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    response = make_response(build_response())
+    if response.status_code == 200:
+        set_validators(response, etag, last_modified)
+    return response
+
+def latest(*timestamps):
+    """Most recent of the given timestamps, ignoring missing ones"""
+    values = [ts for ts in timestamps if isinstance(ts, datetime)]
+    return max(values) if values else None
@@ -14,6 +14,11 @@ CREATE INDEX IF NOT EXISTS idx_reports_created_at ON reports(created_at);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_user_id ON audit_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON audit_logs(timestamp);
 
+-- Keyset pagination indexes: (sort key, id) so every list page is a single index range scan.
+-- Test orders, samples and reports carry laboratory_id themselves; their tenant-leading
+-- composite indexes are declared on the models and created by migrations.py.
+CREATE INDEX IF NOT EXISTS idx_patients_lab_created_id ON patients(laboratory_id, created_at DESC, id DESC);
+
 -- Set up row-level security (optional, for multi-tenant security)
 -- ALTER TABLE patients ENABLE ROW LEVEL SECURITY;
 -- ALTER TABLE test_orders ENABLE ROW LEVEL SECURITY;
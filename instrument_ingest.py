@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Instrument Ingest Module
+Handles analyzer result files (CSV) dropped into a watched directory or uploaded over the API:
+files are parsed as a stream, matched to test orders in bulk, normalized and classified with
+NumPy, and applied with batched UPDATEs in one transaction per file.
+
+Drop directory layout (one subdirectory per laboratory id):
+    <drop>/<laboratory_id>/*.csv          new files; picked up once unchanged for a few seconds
+    <drop>/<laboratory_id>/processed/     applied files
+    <drop>/<laboratory_id>/failed/        files that could not be read at all
+    <drop>/<laboratory_id>/dead_letter/   rows that could not be applied, with the reason
+
+Usage:
+    python instrument_ingest.py            # watch the drop directory until SIGTERM
+    python instrument_ingest.py --once     # ingest what is there now and exit
+"""
+
+import os
+import csv
+import time
+import signal
+import hashlib
+import logging
+import argparse
+import threading
+from types import SimpleNamespace
+from datetime import datetime
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INGEST_CHUNK_ROWS = 2000
+INGEST_POLL_INTERVAL = 10  # seconds between drop directory scans
+STABLE_SECONDS = 5  # a file still being written changes size; wait until it has been quiet this long
+DROP_EXTENSIONS = ('.csv', '.txt')
+
+# Accepted header names per field, compared lower-cased; analyzers and middleware name them differently
+COLUMN_ALIASES = {
+    'order_number': ('order_number', 'order', 'order_no', 'accession', 'accession_number', 'specimen_id', 'barcode'),
+    'result_value': ('result_value', 'result', 'value'),
+    'result_unit': ('result_unit', 'unit', 'units'),
+    'reference_range': ('reference_range', 'ref_range', 'range', 'normal_range'),
+    'flag': ('flag', 'abnormal_flag', 'flags'),
+    'test_code': ('test_code', 'test', 'analyte', 'assay', 'code'),
+    'result_notes': ('result_notes', 'comment', 'comments', 'notes'),
+    'completed_at': ('completed_at', 'result_time', 'resulted_at', 'timestamp'),
+}
+REQUIRED_COLUMNS = ('order_number', 'result_value')
+
+# Instrument flags; a flag can raise the computed classification but never lower it
+CRITICAL_FLAGS = {'HH', 'LL', 'C', 'CRIT', 'CRITICAL', 'PANIC', '*'}
+ABNORMAL_FLAGS = {'H', 'L', 'A', 'HIGH', 'LOW', 'ABN', 'ABNORMAL'}
+SEVERITY = {None: 0, 'normal': 1, 'abnormal': 2, 'critical': 3}
+
+# Orders that no longer take instrument results; corrections to them go through the UI
+CLOSED_ORDER_STATUSES = ('reported', 'cancelled')
+
+UPDATE_COLUMNS = ('result_value', 'result_unit', 'result_numeric', 'result_qualifier', 'result_si_value',
+                  'result_si_unit', 'result_status', 'reference_range', 'result_notes', 'status', 'completed_at',
+                  'updated_at', 'delta_flag', 'delta_change', 'delta_percent', 'delta_rate', 'delta_prior_order_id',
+                  'delta_checked_at')
+
+def file_key(stream, block_size=1 << 20):
+    """SHA-256 of a binary stream, read in blocks; the stream is rewound afterwards"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def map_columns(header):
+    """Field name -> column index for a CSV header row"""
+    positions = {name.strip().lower(): index for index, name in enumerate(header)}
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in positions:
+                columns[field] = positions[alias]
+                break
+    return columns
+
+def _parse_time(text):
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text.strip())
+    except ValueError:
+        return None
+
+class DeadLetter:
+    """Rejected rows with their reason, written next to the batch and kept only if the batch commits"""
+
+    def __init__(self, directory, filename, key, header):
+        self.directory = directory
+        self.header = header
+        stem = os.path.splitext(os.path.basename(filename or 'upload'))[0]
+        self.path = os.path.join(directory, f'{stem}.{key[:12]}.rejected.csv')
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, row, reason):
+        if self._writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.path + '.part', 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(list(self.header) + ['error'])
+        self._writer.writerow(list(row) + [reason])
+        self.count += 1
+
+    def commit(self):
+        """Publish the file; returns its path or None when nothing was rejected"""
+        if self._file is None:
+            return None
+        self._file.close()
+        os.replace(self.path + '.part', self.path)
+        return self.path
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path + '.part')
+
+def _bulk_update_orders(updates):
+    """Apply result updates keyed by order id; one UPDATE ... FROM (VALUES ...) on PostgreSQL"""
+    from sqlalchemy import update, values, column, cast
+    from app import db
+    from models import TestOrder
+
+    if not updates:
+        return
+    if db.session.get_bind().dialect.name != 'postgresql':
+        # Elsewhere executemany is in-process, so the ORM bulk UPDATE by primary key is already cheap
+        db.session.execute(update(TestOrder), updates)
+        return
+
+    table = TestOrder.__table__
+    names = ('id',) + UPDATE_COLUMNS
+    rows = values(*[column(name, table.c[name].type) for name in names], name='incoming').data(
+        [tuple(update_row[name] for name in names) for update_row in updates]
+    )
+    # Casts, because a VALUES column that is NULL in every row would otherwise be typed as text
+    db.session.execute(
+        table.update().where(table.c.id == rows.c.id).values(
+            {name: cast(rows.c[name], table.c[name].type) for name in UPDATE_COLUMNS}
+        )
+    )
+
+def apply_result_rows(laboratory_id, chunk, columns, dead_letter, seen_orders, ingested_at):
+    """Match, normalize, classify, delta-check and write one chunk of rows; returns counts
+
+    Rows are lists of strings located through `columns` (as from map_columns); rejected rows go to
+    `dead_letter.write(row, reason)`. Orders in `seen_orders` are rejected as repeats. The caller commits.
+    """
+    from app import db
+    from models import TestOrder, TestType
+    from lab_results import normalize_batch, parse_reference_range, classify_results
+    from delta_checks import run_delta_checks
+    from critical_alerts import record_critical_results
+
+    def cell(row, field):
+        index = columns.get(field)
+        return row[index].strip() if index is not None and index < len(row) else ''
+
+    numbers = {cell(row, 'order_number') for row in chunk} - {''}
+    orders = {order.order_number: order for order in db.session.query(
+        TestOrder.id, TestOrder.order_number, TestOrder.patient_id, TestOrder.test_type_id,
+        TestOrder.laboratory_id, TestOrder.status, TestOrder.ordered_at, TestOrder.result_value,
+        TestOrder.result_unit, TestOrder.reference_range, TestOrder.result_notes,
+        TestType.code.label('test_code'), TestType.unit.label('default_unit'), TestType.normal_range
+    ).join(TestType, TestType.id == TestOrder.test_type_id).filter(
+        TestOrder.laboratory_id == laboratory_id, TestOrder.order_number.in_(numbers)
+    ).all()} if numbers else {}
+
+    counts = {'applied': 0, 'unchanged': 0, 'dead_lettered': 0, 'critical': 0}
+    accepted = []
+    for row in chunk:
+        number, value = cell(row, 'order_number'), cell(row, 'result_value')
+        order = orders.get(number)
+        unit = cell(row, 'result_unit') or (order.result_unit or order.default_unit if order else '')
+
+        if not number:
+            reason = 'Missing order number'
+        elif order is None:
+            reason = 'Unknown order number'
+        elif order.status in CLOSED_ORDER_STATUSES:
+            reason = f'Order is {order.status}'
+        elif cell(row, 'test_code') and cell(row, 'test_code').upper() != (order.test_code or '').upper():
+            reason = f"Test {cell(row, 'test_code')} does not match the order's test {order.test_code}"
+        elif not value:
+            reason = 'Missing result value'
+        elif order.id in seen_orders:
+            reason = 'Order appears more than once in this file'
+        else:
+            reason = None
+
+        if reason:
+            dead_letter.write(row, reason)
+            counts['dead_lettered'] += 1
+            continue
+
+        seen_orders.add(order.id)
+        if order.result_value == value and (order.result_unit or '') == (unit or ''):
+            # Re-delivery of a result we already hold
+            counts['unchanged'] += 1
+            continue
+        accepted.append((row, order, value, unit))
+
+    if not accepted:
+        return counts
+
+    numeric, si_values, si_units, qualifiers = normalize_batch(
+        [value for _, _, value, _ in accepted], [unit for _, _, _, unit in accepted],
+        [order.test_code for _, order, _, _ in accepted]
+    )
+
+    ranges = [cell(row, 'reference_range') or order.reference_range or order.normal_range for row, order, _, _ in accepted]
+    parsed = {text: parse_reference_range(text) for text in set(ranges)}
+    low = np.array([np.nan if parsed[text][0] is None else parsed[text][0] for text in ranges])
+    high = np.array([np.nan if parsed[text][1] is None else parsed[text][1] for text in ranges])
+    statuses = classify_results(numeric, low, high, si_values, si_units, [order.test_code for _, order, _, _ in accepted],
+                                qualifiers)
+
+    results = []
+    for i, (row, order, value, unit) in enumerate(accepted):
+        status = statuses[i]
+        flag = cell(row, 'flag').upper()
+        flagged = 'critical' if flag in CRITICAL_FLAGS else 'abnormal' if flag in ABNORMAL_FLAGS else None
+        if SEVERITY[flagged] > SEVERITY[status]:
+            status = flagged
+
+        results.append(SimpleNamespace(
+            id=order.id, order_number=order.order_number, patient_id=order.patient_id,
+            test_type_id=order.test_type_id, laboratory_id=order.laboratory_id, ordered_at=order.ordered_at,
+            result_value=value, result_unit=unit or None,
+            result_numeric=None if np.isnan(numeric[i]) else float(numeric[i]), result_qualifier=qualifiers[i],
+            result_si_value=None if np.isnan(si_values[i]) else float(si_values[i]),
+            result_si_unit=si_units[i], result_status=status, reference_range=ranges[i],
+            result_notes=cell(row, 'result_notes') or order.result_notes,
+            status='completed', completed_at=_parse_time(cell(row, 'completed_at')) or ingested_at,
+            updated_at=ingested_at, delta_flag=None, delta_change=None, delta_percent=None, delta_rate=None,
+            delta_prior_order_id=None, delta_checked_at=None
+        ))
+
+    # Delta checks write their flags onto these plain objects, one prior-result query for the chunk
+    run_delta_checks(results, checked_at=ingested_at)
+    _bulk_update_orders([dict({name: getattr(r, name) for name in UPDATE_COLUMNS}, id=r.id) for r in results])
+
+    # The bulk UPDATE bypasses the flush listener, so critical results are alerted explicitly
+    critical = [r for r in results if r.result_status == 'critical']
+    if critical:
+        record_critical_results(db.session, critical)
+
+    counts['applied'] = len(results)
+    counts['critical'] = len(critical)
+    return counts
+
+def ingest_stream(laboratory_id, text_stream, idempotency_key, dead_letter_dir, filename=None, source='upload',
+                  instrument=None, uploaded_by=None, chunk_rows=INGEST_CHUNK_ROWS):
+    """Apply one result file in a single transaction; a key that was already applied is a no-op"""
+    from sqlalchemy.exc import IntegrityError
+    from app import db
+    from models import IngestBatch
+
+    existing = IngestBatch.query.filter_by(laboratory_id=laboratory_id, idempotency_key=idempotency_key).first()
+    if existing:
+        return {'success': True, 'duplicate': True, 'batch': existing.to_dict()}
+
+    reader = csv.reader(text_stream)
+    header = next(reader, None)
+    columns = map_columns(header or [])
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        return {'success': False, 'error': f"Missing columns: {', '.join(missing)}"}
+
+    started = time.monotonic()
+    batch = IngestBatch(laboratory_id=laboratory_id, idempotency_key=idempotency_key, source=source,
+                        filename=filename, instrument=instrument, uploaded_by=uploaded_by,
+                        started_at=datetime.utcnow())
+    dead_letter = DeadLetter(dead_letter_dir, filename, idempotency_key, header)
+    totals = {'rows': 0, 'applied': 0, 'unchanged': 0, 'dead_lettered': 0, 'critical': 0}
+    seen_orders = set()
+
+    try:
+        # Claims the key first; a concurrent upload of the same file fails here and reports a duplicate
+        db.session.add(batch)
+        db.session.flush()
+
+        chunk = []
+        for row in reader:
+            if not any(field.strip() for field in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                for name, count in apply_result_rows(laboratory_id, chunk, columns, dead_letter, seen_orders, batch.started_at).items():
+                    totals[name] += count
+                totals['rows'] += len(chunk)
+                chunk = []
+        if chunk:
+            for name, count in apply_result_rows(laboratory_id, chunk, columns, dead_letter, seen_orders, batch.started_at).items():
+                totals[name] += count
+            totals['rows'] += len(chunk)
+
+        batch.rows_total = totals['rows']
+        batch.rows_applied = totals['applied']
+        batch.rows_unchanged = totals['unchanged']
+        batch.rows_dead_lettered = totals['dead_lettered']
+        batch.critical_results = totals['critical']
+        batch.finished_at = datetime.utcnow()
+        batch.duration_ms = int((time.monotonic() - started) * 1000)
+        batch.dead_letter_path = dead_letter.path if dead_letter.count else None
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        dead_letter.discard()
+        existing = IngestBatch.query.filter_by(laboratory_id=laboratory_id, idempotency_key=idempotency_key).first()
+        if existing:
+            return {'success': True, 'duplicate': True, 'batch': existing.to_dict()}
+        raise
+    except Exception:
+        db.session.rollback()
+        dead_letter.discard()
+        raise
+
+    dead_letter.commit()
+    rate = totals['rows'] / max(batch.duration_ms / 1000.0, 0.001)
+    logger.info(f"Ingested {filename or 'upload'} for lab {laboratory_id}: {totals['applied']} applied, "
+                f"{totals['unchanged']} unchanged, {totals['dead_lettered']} dead-lettered, "
+                f"{totals['critical']} critical in {batch.duration_ms} ms ({rate:.0f} rows/s)")
+    return {'success': True, 'duplicate': False, 'batch': batch.to_dict()}
+
+def ingest_file(laboratory_id, path, dead_letter_dir, source='drop_directory', **options):
+    """Ingest a result file from disk, keyed by its content hash"""
+    with open(path, 'rb') as raw:
+        key = file_key(raw)
+    with open(path, newline='', encoding='utf-8-sig') as text_stream:
+        return ingest_stream(laboratory_id, text_stream, key, dead_letter_dir, filename=os.path.basename(path),
+                             source=source, **options)
+
+class DropDirectoryWatcher:
+    """Polls <drop>/<laboratory_id>/ for result files and ingests each once it stops changing"""
+
+    def __init__(self, app, drop_dir, poll_interval=INGEST_POLL_INTERVAL, stable_seconds=STABLE_SECONDS):
+        self.app = app
+        self.drop_dir = drop_dir
+        self.poll_interval = poll_interval
+        self.stable_seconds = stable_seconds
+        self._stop = threading.Event()
+
+    def stop(self, *args):
+        logger.info("Instrument watcher stopping")
+        self._stop.set()
+
+    def pending_files(self):
+        """(laboratory_id, path) of files ready for ingestion"""
+        ready = []
+        if not os.path.isdir(self.drop_dir):
+            return ready
+
+        now = time.time()
+        for entry in sorted(os.listdir(self.drop_dir)):
+            lab_dir = os.path.join(self.drop_dir, entry)
+            if not entry.isdigit() or not os.path.isdir(lab_dir):
+                continue
+            for name in sorted(os.listdir(lab_dir)):
+                path = os.path.join(lab_dir, name)
+                if (name.lower().endswith(DROP_EXTENSIONS) and os.path.isfile(path)
+                        and now - os.path.getmtime(path) >= self.stable_seconds):
+                    ready.append((int(entry), path))
+        return ready
+
+    def _move(self, path, folder):
+        target_dir = os.path.join(os.path.dirname(path), folder)
+        os.makedirs(target_dir, exist_ok=True)
+        os.replace(path, os.path.join(target_dir, os.path.basename(path)))
+
+    def scan_once(self):
+        """Ingest every ready file; returns the number of files moved to processed/ or, when the file itself
+        is unreadable or lacks required columns, to failed/"""
+        from db_config import statement_timeouts
+
+        handled = 0
+        for laboratory_id, path in self.pending_files():
+            if self._stop.is_set():
+                break
+            dead_letter_dir = os.path.join(os.path.dirname(path), 'dead_letter')
+            with self.app.app_context(), statement_timeouts.statement_class('export'):
+                try:
+                    result = ingest_file(laboratory_id, path, dead_letter_dir)
+                except (UnicodeDecodeError, csv.Error) as e:
+                    result = {'success': False, 'error': f"Unreadable file: {str(e)}"}
+                except Exception as e:
+                    # Database or other operational trouble says nothing about the file; it stays in
+                    # place and the next scan tries it again
+                    logger.error(f"Ingestion of {path} failed, will retry: {str(e)}")
+                    continue
+
+            if result['success']:
+                self._move(path, 'processed')
+            else:
+                logger.error(f"Rejected {path}: {result['error']}")
+                self._move(path, 'failed')
+            handled += 1
+        return handled
+
+    def run_forever(self):
+        logger.info(f"Instrument watcher started on {self.drop_dir} (poll every {self.poll_interval}s)")
+        while not self._stop.is_set():
+            self.scan_once()
+            self._stop.wait(self.poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description='Instrument result ingestion')
+    parser.add_argument('--once', action='store_true', help='ingest the files present now and exit')
+    args = parser.parse_args()
+
+    from app import app
+
+    watcher = DropDirectoryWatcher(
+        app, app.config.get('INSTRUMENT_DROP_DIR', 'instrument_data/drop'),
+        poll_interval=int(app.config.get('INSTRUMENT_POLL_SECONDS', INGEST_POLL_INTERVAL))
+    )
+
+    if args.once:
+        watcher.scan_once()
+        return
+
+    if app.config.get('METRICS_PORT'):
+        from metrics import start_http_server
+        start_http_server(app.config['METRICS_PORT'])
+
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    watcher.run_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Lab Results Module
+Handles numeric parsing, SI normalization and per-patient analyte time series
+"""
+import re
+import logging
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Persian and Arabic-Indic digits as typed on local keyboards
+_DIGIT_TRANSLATION = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩٫٬', '01234567890123456789.,')
+# Optional censoring qualifier, then the leading number with whatever separators it was typed with
+_NUMBER_PATTERN = re.compile(r'^\s*([<>]=?|≤|≥)?\s*([-+]?[\d.,]*\d(?:[eE][-+]?\d+)?)')
+_QUALIFIERS = {'≤': '<=', '≥': '>='}
+
+# Analyte-specific conversions (test code, conventional unit) -> (SI unit, factor)
+SI_CONVERSIONS = {
+    ('GLU', 'mg/dl'): ('mmol/L', 0.0555),
+    ('FBS', 'mg/dl'): ('mmol/L', 0.0555),
+    ('CHOL', 'mg/dl'): ('mmol/L', 0.02586),
+    ('HDL', 'mg/dl'): ('mmol/L', 0.02586),
+    ('LDL', 'mg/dl'): ('mmol/L', 0.02586),
+    ('TG', 'mg/dl'): ('mmol/L', 0.01129),
+    ('CREA', 'mg/dl'): ('µmol/L', 88.42),
+    ('BUN', 'mg/dl'): ('mmol/L', 0.357),
+    ('UA', 'mg/dl'): ('µmol/L', 59.48),
+    ('CA', 'mg/dl'): ('mmol/L', 0.2495),
+    ('TBIL', 'mg/dl'): ('µmol/L', 17.1),
+}
+
+# Conversions that do not depend on the analyte, keyed by lower-cased unit
+GENERIC_SI_CONVERSIONS = {
+    'g/dl': ('g/L', 10.0),
+    'mg/l': ('mg/L', 1.0),
+    'mmol/l': ('mmol/L', 1.0),
+    'µmol/l': ('µmol/L', 1.0),
+    'umol/l': ('µmol/L', 1.0),
+    'u/l': ('U/L', 1.0),
+    'iu/l': ('U/L', 1.0),
+    'miu/l': ('mIU/L', 1.0),
+    'µiu/ml': ('mIU/L', 1.0),
+    'uiu/ml': ('mIU/L', 1.0),
+    'cells/μl': ('10^9/L', 0.001),
+    'cells/µl': ('10^9/L', 0.001),
+    '10^3/µl': ('10^9/L', 1.0),
+    '10^3/ul': ('10^9/L', 1.0),
+}
+
+def _decimal_point(number):
+    """Rewrite a number typed with any thousands/decimal separators to use a plain '.' decimal point"""
+    if ',' in number and '.' in number:
+        # Whichever separator comes last is the decimal one: "1.250,5" and "1,250.5"
+        if number.rfind(',') > number.rfind('.'):
+            return number.replace('.', '').replace(',', '.')
+        return number.replace(',', '')
+    if number.count(',') == 1:
+        whole, fraction = number.split(',')
+        # "8,2" and "0,125" are decimal commas; "1,250" groups thousands
+        if len(fraction) != 3 or whole.lstrip('+-') in ('', '0'):
+            return f'{whole}.{fraction}'
+    if number.count('.') > 1:
+        return number.replace('.', '')  # "1.250.000"
+    return number.replace(',', '')
+
+def parse_result(value):
+    """(qualifier, number) of a free-text result: ('<', 5.0) for '<5', (None, 8.2) for '8,2 %'
+
+    The qualifier is '<', '<=', '>' or '>=' for censored results and None otherwise; the number
+    is None when the result does not start with one.
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, (int, float)):
+        return None, float(value)
+
+    match = _NUMBER_PATTERN.match(str(value).translate(_DIGIT_TRANSLATION))
+    if not match:
+        return None, None
+
+    try:
+        number = float(_decimal_point(match.group(2)))
+    except ValueError:
+        return None, None
+    qualifier = match.group(1)
+    return _QUALIFIERS.get(qualifier, qualifier), number
+
+def parse_numeric_result(value):
+    """Leading numeric value of a free-text result ('145', '<5', '8,2 %', '۱۴۵'), or None"""
+    return parse_result(value)[1]
+
+def si_conversion(test_code, unit):
+    """(SI unit, factor, offset) so that SI = (value + offset) * factor, or None when unknown"""
+    if not unit:
+        return None
+
+    unit_key = unit.strip().lower()
+    code = (test_code or '').upper()
+
+    if code == 'HBA1C' and unit_key == '%':
+        # NGSP % to IFCC mmol/mol is affine, not a plain factor
+        return 'mmol/mol', 10.929, -2.15
+
+    conversion = SI_CONVERSIONS.get((code, unit_key)) or GENERIC_SI_CONVERSIONS.get(unit_key)
+    if conversion is not None:
+        si_unit, factor = conversion
+        return si_unit, factor, 0.0
+
+    return None
+
+def normalize_to_si(test_code, value, unit):
+    """(SI value, SI unit) for a numeric result, or (None, None) when no conversion is known"""
+    conversion = si_conversion(test_code, unit) if value is not None else None
+    if conversion is None:
+        return None, None
+
+    si_unit, factor, offset = conversion
+    return round((value + offset) * factor, 4), si_unit
+
+def numeric_fields(result_value, result_unit, test_code=None, default_unit=None):
+    """Typed columns derived from a free-text result, ready to assign onto a TestOrder"""
+    qualifier, numeric = parse_result(result_value)
+    si_value, si_unit = normalize_to_si(test_code, numeric, result_unit or default_unit)
+    return {
+        'result_numeric': numeric,
+        'result_qualifier': qualifier if numeric is not None else None,
+        'result_si_value': si_value,
+        'result_si_unit': si_unit
+    }
+
+def normalize_batch(values, units, test_codes):
+    """Vectorized numeric_fields for many results: (numeric, SI value, SI unit, qualifier) arrays
+
+    Conversions are looked up once per distinct (test code, unit) pair and applied with NumPy.
+    """
+    count = len(values)
+    parsed = [parse_result(value) for value in values]
+    numeric = np.fromiter((np.nan if v is None else v for _, v in parsed), dtype=np.float64, count=count)
+    qualifiers = np.array([q if v is not None else None for q, v in parsed], dtype=object)
+    factors = np.full(count, np.nan)
+    offsets = np.zeros(count)
+    si_units = np.empty(count, dtype=object)
+
+    pairs = {}
+    for index, key in enumerate(zip(test_codes, units)):
+        pairs.setdefault(key, []).append(index)
+    for (test_code, unit), indexes in pairs.items():
+        conversion = si_conversion(test_code, unit)
+        if conversion is not None:
+            si_units[indexes] = conversion[0]
+            factors[indexes] = conversion[1]
+            offsets[indexes] = conversion[2]
+
+    si_values = np.round((numeric + offsets) * factors, 4)
+    si_units[np.isnan(si_values)] = None
+    return numeric, si_values, si_units, qualifiers
+
+_RANGE_PATTERN = re.compile(r'^\s*([-+]?\d+(?:\.\d+)?)\s*(?:-|–|—|to)\s*([-+]?\d+(?:\.\d+)?)')
+_BOUND_PATTERN = re.compile(r'^\s*([<>]=?|≤|≥)\s*([-+]?\d+(?:\.\d+)?)')
+
+def parse_reference_range(text):
+    """(low, high) of a reference range such as '70-100', '<100' or '>40'; a missing side is None"""
+    if not text:
+        return None, None
+
+    text = str(text).translate(_DIGIT_TRANSLATION)
+    match = _RANGE_PATTERN.match(text)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+
+    match = _BOUND_PATTERN.match(text)
+    if match:
+        bound = float(match.group(2))
+        return (None, bound) if match.group(1) in ('<', '<=', '≤') else (bound, None)
+
+    return None, None
+
+# Critical (panic) limits in SI units; a result outside them is paged to on-call staff
+CRITICAL_LIMITS = {
+    'K': ('mmol/L', 2.8, 6.2),
+    'NA': ('mmol/L', 120.0, 160.0),
+    'GLU': ('mmol/L', 2.2, 22.2),
+    'FBS': ('mmol/L', 2.2, 22.2),
+    'CA': ('mmol/L', 1.5, 3.25),
+    'HB': ('g/L', 70.0, 200.0),
+    'PLT': ('10^9/L', 20.0, 1000.0),
+    'WBC': ('10^9/L', 2.0, 30.0),
+}
+
+RESULT_STATUSES = np.array([None, 'normal', 'abnormal', 'critical'], dtype=object)
+
+def classify_results(numeric, low, high, si_values, si_units, test_codes, qualifiers=None):
+    """Vectorized result_status: 'critical' outside CRITICAL_LIMITS, 'abnormal' outside the
+    reference range, 'normal' inside it, None when the result or the range is not numeric
+
+    low/high are reference bounds in the reported unit (NaN for an open side). Censored results
+    (a qualifier such as '<5') are never critical: the limit is a detection bound, not a value.
+    """
+    numeric = np.asarray(numeric, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    si_values = np.asarray(si_values, dtype=np.float64)
+
+    crit_low = np.full(len(numeric), np.nan)
+    crit_high = np.full(len(numeric), np.nan)
+    for index, (code, si_unit) in enumerate(zip(test_codes, si_units)):
+        limits = CRITICAL_LIMITS.get((code or '').upper())
+        if limits is not None and limits[0] == si_unit:
+            crit_low[index], crit_high[index] = limits[1], limits[2]
+
+    # Comparisons against NaN are False, so open bounds and missing values never trip a check
+    with np.errstate(invalid='ignore'):
+        has_range = ~np.isnan(numeric) & ~(np.isnan(low) & np.isnan(high))
+        outside = (numeric < low) | (numeric > high)
+        critical = (si_values < crit_low) | (si_values > crit_high)
+    if qualifiers is not None:
+        critical &= np.array([q is None for q in qualifiers], dtype=bool)
+
+    codes = np.where(critical, 3, np.where(outside, 2, np.where(has_range, 1, 0)))
+    return RESULT_STATUSES[codes]
+
+def analyte_series(patient_id, test_type_id, start=None, end=None):
+    """Chronological numeric results of one analyte for one patient as NumPy arrays"""
+    from app import db
+    from models import TestOrder
+
+    query = db.session.query(
+        TestOrder.ordered_at,
+        TestOrder.result_numeric,
+        TestOrder.result_si_value,
+        TestOrder.result_si_unit
+    ).filter(
+        TestOrder.patient_id == patient_id,
+        TestOrder.test_type_id == test_type_id,
+        TestOrder.result_numeric.isnot(None)
+    )
+    if start is not None:
+        query = query.filter(TestOrder.ordered_at >= start)
+    if end is not None:
+        query = query.filter(TestOrder.ordered_at < end)
+
+    rows = query.order_by(TestOrder.ordered_at).all()
+
+    return {
+        'timestamps': np.array([row[0] for row in rows], dtype='datetime64[s]'),
+        'values': np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+        'si_values': np.fromiter((np.nan if row[2] is None else row[2] for row in rows), dtype=np.float64, count=len(rows)),
+        'si_units': sorted({row[3] for row in rows if row[3]})
+    }
+
+def series_summary(timestamps, values):
+    """Min/max/mean/last plus the linear trend per 30 days of a series"""
+    if len(values) == 0:
+        return {'count': 0}
+
+    summary = {
+        'count': int(len(values)),
+        'min': float(np.min(values)),
+        'max': float(np.max(values)),
+        'mean': round(float(np.mean(values)), 4),
+        'last': float(values[-1]),
+        'trend_per_30_days': None
+    }
+
+    if len(values) >= 2:
+        days = (timestamps - timestamps[0]).astype('timedelta64[s]').astype(np.float64) / 86400.0
+        if np.ptp(days) > 0:
+            slope = np.polyfit(days, values, 1)[0]
+            summary['trend_per_30_days'] = round(float(slope * 30), 4)
+
+    return summary
+
+def trend_chart_data(patient_id, test_type, start=None, end=None):
+    """Labels, values and summary for a Chart.js line chart of one analyte"""
+    series = analyte_series(patient_id, test_type.id, start, end)
+    # Plot SI values only when every point converted to the same unit; otherwise raw values
+    use_si = (len(series['si_units']) == 1 and len(series['si_values']) > 0
+              and not np.isnan(series['si_values']).any())
+    values = series['si_values'] if use_si else series['values']
+
+    return {
+        'test_type_id': test_type.id,
+        'test_code': test_type.code,
+        'test_name': test_type.name,
+        'unit': series['si_units'][0] if use_si else test_type.unit,
+        'labels': [str(ts) for ts in series['timestamps'].astype('datetime64[m]')],
+        'values': [round(float(v), 4) for v in values],
+        'summary': series_summary(series['timestamps'], values)
+    }
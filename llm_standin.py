@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+LLM Stand-in Server
+Minimal local imitation of the OpenAI / OpenRouter chat completions, Anthropic messages and Gemini
+generateContent APIs, answering every prompt with a canned Persian lab analysis in JSON, with
+configurable latency and error injection. Standard library only.
+
+Usage:
+    python llm_standin.py --port 8767 --latency 2.0 --jitter 0.5 --fail-rate 0.02
+    # then set OPENAI_API_BASE=http://localhost:8767/v1, ANTHROPIC_API_BASE=http://localhost:8767,
+    # GEMINI_API_BASE=http://localhost:8767, OPENROUTER_API_BASE=http://localhost:8767/api/v1
+"""
+
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OPENAI_PATHS = ('/v1/chat/completions', '/chat/completions', '/api/v1/chat/completions')
+ANTHROPIC_PATH = '/v1/messages'
+GEMINI_PATH = re.compile(r'^/v1(?:beta)?/models/(?P<model>[^/:]+):generateContent$')
+
+# Covers the keys read by ai_reports.py and ai_services.py
+CANNED_ANALYSIS = {
+    'overall_assessment': 'وضعیت کلی بیمار پایدار است. این تحلیل توسط سرور آزمایشی تولید شده است.',
+    'individual_tests': {'CBC': {'status': 'normal', 'interpretation': 'در محدوده طبیعی'}},
+    'probable_diseases': {'anemia': {'probability': 10, 'reasoning': 'شواهد کافی وجود ندارد'}},
+    'recommendations': ['پیگیری دوره‌ای آزمایش‌ها'],
+    'red_flags': [],
+    'interpretation': 'نتایج در محدوده قابل قبول هستند.',
+    'follow_up': 'تکرار آزمایش در سه ماه آینده'
+}
+
+class StandInState:
+    """Requests answered so far, plus latency and failure injection knobs"""
+
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, rate_limit_rate=0.0, fail_first=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.fail_first = fail_first
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_seen = 0
+        self.by_provider = {}
+
+    def admit(self, provider):
+        """(delay in seconds, error status or None) for the next request"""
+        with self.lock:
+            self.requests_seen += 1
+            self.by_provider[provider] = self.by_provider.get(provider, 0) + 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+            if self.requests_seen <= self.fail_first or roll < self.fail_rate:
+                return delay, 500
+            if roll < self.fail_rate + self.rate_limit_rate:
+                return 0.0, 429
+            return delay, None
+
+def _tokens(text):
+    # Close enough for load accounting: about four characters per token
+    return max(1, len(text) // 4)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = 'LLMStandIn/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == '/_standin/stats':
+            with state.lock:
+                return self._send_json(200, {'requests_seen': state.requests_seen, 'by_provider': dict(state.by_provider)})
+        self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        gemini = GEMINI_PATH.match(path)
+        if path in OPENAI_PATHS:
+            provider = 'openrouter' if path.startswith('/api/') else 'openai'
+        elif path == ANTHROPIC_PATH:
+            provider = 'anthropic'
+        elif gemini:
+            provider = 'gemini'
+        else:
+            return self._send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+        request = self._read_json()
+        delay, error = self.server.state.admit(provider)
+        if delay:
+            time.sleep(delay)
+        if error == 429:
+            return self._send_json(429, {'error': {'type': 'rate_limit_error', 'message': 'Rate limited'}},
+                                   {'Retry-After': '1'})
+        if error:
+            return self._send_json(500, {'error': {'type': 'api_error', 'message': 'Injected failure'}})
+
+        prompt = json.dumps(request, ensure_ascii=False)
+        content = json.dumps(CANNED_ANALYSIS, ensure_ascii=False)
+        prompt_tokens, completion_tokens = _tokens(prompt), _tokens(content)
+
+        if provider in ('openai', 'openrouter'):
+            return self._send_json(200, {
+                'id': 'chatcmpl-' + uuid.uuid4().hex, 'object': 'chat.completion', 'created': int(time.time()),
+                'model': request.get('model', 'gpt-4o'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens}
+            })
+        if provider == 'anthropic':
+            return self._send_json(200, {
+                'id': 'msg_' + uuid.uuid4().hex, 'type': 'message', 'role': 'assistant',
+                'model': request.get('model', 'claude'), 'content': [{'type': 'text', 'text': content}],
+                'stop_reason': 'end_turn', 'stop_sequence': None,
+                'usage': {'input_tokens': prompt_tokens, 'output_tokens': completion_tokens}
+            })
+        self._send_json(200, {
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': content}]}, 'finishReason': 'STOP', 'index': 0}],
+            'usageMetadata': {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': completion_tokens,
+                              'totalTokenCount': prompt_tokens + completion_tokens},
+            'modelVersion': gemini.group('model')
+        })
+
+class LLMStandIn:
+    """Runs the stand-in on a background thread, for tests and load runs"""
+
+    def __init__(self, host='127.0.0.1', port=0, **state_options):
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.daemon_threads = True
+        self.server.state = StandInState(**state_options)
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def environment(self):
+        """Settings that point every provider at this stand-in"""
+        return {'OPENAI_API_BASE': f'{self.url}/v1', 'ANTHROPIC_API_BASE': self.url,
+                'GEMINI_API_BASE': self.url, 'OPENROUTER_API_BASE': f'{self.url}/api/v1'}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OpenAI/Anthropic/Gemini/OpenRouter stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each answer')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform +/- seconds added to the latency')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    args = parser.parse_args()
+
+    standin = LLMStandIn(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                         fail_rate=args.fail_rate, rate_limit_rate=args.rate_limit_rate)
+    print(f'LLM stand-in listening on {standin.url}')
+    for name, value in standin.environment().items():
+        print(f'  {name}={value}')
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.stop()
+
+if __name__ == '__main__':
+    main()
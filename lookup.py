@@ -0,0 +1,152 @@
+"""
+Lookup Module
+Handles bounded typeahead searches for patients and open test orders, so forms no longer
+preload every record of the lab into a dropdown
+"""
+import re
+import logging
+from sqlalchemy import and_, or_, func, desc
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOOKUP_DEFAULT_LIMIT = 10
+LOOKUP_MAX_LIMIT = 25
+LOOKUP_MIN_CHARS = 2
+# Substring (trigram) matching only kicks in for queries at least this long; shorter ones are too unselective
+TRIGRAM_MIN_CHARS = 3
+
+# Orders that can still take a sample
+OPEN_ORDER_STATUSES = ('ordered', 'pending', 'processing')
+
+def lookup_limit(requested):
+    """Clamp a client-supplied result limit"""
+    if not requested or requested < 1:
+        return LOOKUP_DEFAULT_LIMIT
+    return min(requested, LOOKUP_MAX_LIMIT)
+
+def normalize_query(text):
+    """Lowercased search text with runs of whitespace collapsed"""
+    return re.sub(r'\s+', ' ', (text or '').strip()).lower()
+
+def _prefix_pattern(text):
+    """LIKE pattern matching values that start with text, wildcards in text escaped"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def _starts_with(expression, text):
+    return func.lower(expression).like(_prefix_pattern(text), escape='\\')
+
+def _patient_match(patient_model, query):
+    """Every word prefixes the first or last name, or the whole query prefixes an identifier"""
+    words = query.split(' ')
+    name_match = and_(*[
+        or_(_starts_with(patient_model.first_name, word), _starts_with(patient_model.last_name, word))
+        for word in words
+    ])
+
+    identifiers = [_starts_with(patient_model.patient_id, query)]
+    digits = re.sub(r'[\s\-()+]', '', query)
+    if digits.isdigit():
+        identifiers.append(patient_model.phone.like(_prefix_pattern(digits), escape='\\'))
+        identifiers.append(patient_model.national_id.like(_prefix_pattern(digits), escape='\\'))
+
+    return or_(name_match, *identifiers)
+
+def _full_name(patient_model):
+    return func.lower(patient_model.first_name + ' ' + patient_model.last_name)
+
+def _trigram_fallback(query, model_query, patient_model, seen_ids, remaining, id_column):
+    """Substring matches on the full name, best first; PostgreSQL only, where pg_trgm indexes them"""
+    from app import db
+
+    if remaining <= 0 or len(query) < TRIGRAM_MIN_CHARS or db.session.get_bind().dialect.name != 'postgresql':
+        return []
+
+    full_name = _full_name(patient_model)
+    query_filter = full_name.like('%' + _prefix_pattern(query), escape='\\')
+    if seen_ids:
+        model_query = model_query.filter(~id_column.in_(seen_ids))
+    try:
+        # In a savepoint, so a failure leaves the prefix matches already loaded untouched
+        with db.session.begin_nested():
+            return model_query.filter(query_filter).order_by(
+                desc(func.similarity(full_name, query)), id_column
+            ).limit(remaining).all()
+    except Exception as e:
+        # similarity() is missing when the pg_trgm extension could not be installed
+        logger.warning(f"Trigram lookup unavailable: {str(e)}")
+        return []
+
+def search_patients(laboratory_id, text, limit=LOOKUP_DEFAULT_LIMIT):
+    """Patients of a lab matching typeahead text; returns (patients, truncated)"""
+    from models import Patient
+
+    query = normalize_query(text)
+    if len(query) < LOOKUP_MIN_CHARS:
+        return [], False
+
+    base = Patient.query.filter(Patient.laboratory_id == laboratory_id)
+    # One extra row tells the client there are more matches than shown
+    matches = base.filter(_patient_match(Patient, query)).order_by(
+        Patient.last_name, Patient.first_name, Patient.id
+    ).limit(limit + 1).all()
+
+    if len(matches) <= limit:
+        matches += _trigram_fallback(query, base, Patient, [p.id for p in matches], limit + 1 - len(matches), Patient.id)
+
+    return matches[:limit], len(matches) > limit
+
+def search_open_orders(laboratory_id, text, limit=LOOKUP_DEFAULT_LIMIT):
+    """Open orders of a lab matching typeahead text; returns (orders, truncated)
+
+    Without text the most recent open orders are returned, for the initial list of a picker.
+    """
+    from sqlalchemy.orm import contains_eager, joinedload
+    from models import TestOrder, Patient
+
+    query = normalize_query(text)
+    base = TestOrder.query.join(Patient, TestOrder.patient_id == Patient.id).options(
+        contains_eager(TestOrder.patient), joinedload(TestOrder.test_type)
+    ).filter(
+        TestOrder.laboratory_id == laboratory_id,
+        TestOrder.status.in_(OPEN_ORDER_STATUSES)
+    )
+
+    if not query:
+        matches = base.order_by(desc(TestOrder.ordered_at), desc(TestOrder.id)).limit(limit + 1).all()
+        return matches[:limit], len(matches) > limit
+    if len(query) < LOOKUP_MIN_CHARS:
+        return [], False
+
+    matches = base.filter(or_(
+        _starts_with(TestOrder.order_number, query),
+        _patient_match(Patient, query)
+    )).order_by(desc(TestOrder.ordered_at), desc(TestOrder.id)).limit(limit + 1).all()
+
+    if len(matches) <= limit:
+        matches += _trigram_fallback(query, base, Patient, [o.id for o in matches], limit + 1 - len(matches), TestOrder.id)
+
+    return matches[:limit], len(matches) > limit
+
+def patient_option(patient):
+    """Typeahead entry for a patient"""
+    return {
+        'id': patient.id,
+        'label': f"{patient.first_name} {patient.last_name}",
+        'detail': ' · '.join(str(part) for part in (patient.patient_id, patient.age, patient.phone) if part),
+        'patient_id': patient.patient_id,
+        'age': patient.age
+    }
+
+def order_option(order):
+    """Typeahead entry for a test order"""
+    patient = order.patient
+    return {
+        'id': order.id,
+        'label': f"{patient.first_name} {patient.last_name} - {order.test_type.name if order.test_type else ''}",
+        'detail': ' · '.join(part for part in (order.order_number, patient.patient_id, order.status) if part),
+        'order_number': order.order_number,
+        'patient_id': order.patient_id,
+        'status': order.status
+    }
@@ -3,12 +3,20 @@ MediSina API Integration Module
 Handles patient data exchange with MediSina platform in JSON/Excel formats
 """
 import json
+import gzip
+import time
+import uuid
+import hashlib
 import logging
 import requests
 import pandas as pd
 from datetime import datetime, timedelta
+from sqlalchemy import func
 from io import BytesIO
 import base64
+from health import circuit_breaker
+from metrics import metrics, external_call
+from retry_utils import backoff_delay, retry_after_seconds
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -83,262 +91,559 @@ def test_medisina_connection(api_url, api_key, username, password):
         logger.error(f"MediSina connection test failed: {str(e)}")
         return {'success': False, 'error': f'Connection failed: {str(e)}'}
 
-def export_to_medisina(settings, patient_ids=None):
-    """Export patient data to MediSina platform"""
+# Export transport tuning; overridable through app.config (MEDISINA_EXPORT_PAGE_SIZE etc.)
+EXPORT_PAGE_SIZE = 200
+EXPORT_MAX_RETRIES = 5
+EXPORT_BACKOFF_BASE = 1.0  # seconds
+EXPORT_BACKOFF_MAX = 60.0
+EXPORT_REQUEST_TIMEOUT = 60
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+def _export_config(name, default):
+    try:
+        from flask import current_app
+        return current_app.config.get(name, default)
+    except RuntimeError:
+        return default
+
+def gzip_json(payload):
+    """Serialize payload to gzip-compressed JSON; returns (compressed bytes, raw size)"""
+    raw = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+    return gzip.compress(raw, compresslevel=6), len(raw)
+
+def post_with_retry(url, body, headers, max_retries=EXPORT_MAX_RETRIES, timeout=EXPORT_REQUEST_TIMEOUT,
+                    sleep=time.sleep, session=None):
+    """POST body, retrying transient failures; returns (response or None, retries used, last error)"""
+    http = session or requests
+    last_error = None
+    breaker = circuit_breaker('medisina')
+    if not breaker.allow():
+        return None, 0, 'MediSina API is temporarily unavailable after repeated failures'
+
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        # Like the import path, only connection errors and 5xx count against the breaker; a 4xx
+        # (throttling included) means MediSina is up
+        server_failure = False
+        try:
+            with external_call('medisina', 'export_page') as call:
+                response = http.post(url, data=body, headers=headers, timeout=timeout)
+                if response.status_code not in [200, 201, 202]:
+                    call['outcome'] = f'http_{response.status_code}'
+            if response.status_code in [200, 201, 202]:
+                breaker.record_success()
+                return response, attempt, None
+
+            last_error = f'MediSina API error: {response.status_code} - {response.text[:500]}'
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response, attempt, last_error
+
+            server_failure = response.status_code >= 500
+            retry_after = retry_after_seconds(response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            last_error = f'Connection failed: {str(e)}'
+            server_failure = True
+
+        if attempt < max_retries:
+            delay = backoff_delay(attempt, base=EXPORT_BACKOFF_BASE, cap=EXPORT_BACKOFF_MAX, retry_after=retry_after)
+            logger.warning(f"MediSina request failed ({last_error}); retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            sleep(delay)
+
+    if server_failure:
+        breaker.record_failure(last_error)
+    return None, max_retries, last_error
+
+def _serialize_patient(patient, test_results, reports):
+    """MediSina v1 representation of a patient with their latest results and reports"""
+    patient_data = {
+        'patient_info': {
+            'patient_id': patient.patient_id,
+            'first_name': patient.first_name,
+            'last_name': patient.last_name,
+            'date_of_birth': patient.date_of_birth.isoformat() if patient.date_of_birth else None,
+            'age': patient.age,
+            'gender': patient.gender,
+            'phone': patient.phone,
+            'email': patient.email,
+            'national_id': patient.national_id,
+            'address': patient.address,
+            'blood_type': patient.blood_type,
+            'height': patient.height,
+            'weight': patient.weight,
+            'bmi': patient.bmi
+        },
+        'medical_info': {
+            'medical_history': patient.medical_history,
+            'current_symptoms': patient.current_symptoms,
+            'pain_description': patient.pain_description,
+            'test_reason': patient.test_reason,
+            'disease_type': patient.disease_type,
+            'allergies': patient.allergies,
+            'current_medications': patient.current_medications
+        },
+        'emergency_contact': {
+            'name': patient.emergency_contact,
+            'phone': patient.emergency_phone,
+            'relation': patient.emergency_relation
+        },
+        'test_results': [],
+        'ai_reports': []
+    }
+    
+    # Add test results
+    for test in test_results:
+        patient_data['test_results'].append({
+            'order_number': test.order_number,
+            'test_type': test.test_type.name if test.test_type else None,
+            'result_value': test.result_value,
+            'result_unit': test.result_unit,
+            'result_status': test.result_status,
+            'reference_range': test.reference_range,
+            'ordered_at': test.ordered_at.isoformat() if test.ordered_at else None,
+            'completed_at': test.completed_at.isoformat() if test.completed_at else None,
+            'status': test.status
+        })
+    
+    # Add AI reports
+    for report in reports:
+        report_data = {
+            'report_number': report.report_number,
+            'report_type': report.report_type,
+            'title': report.title,
+            'overall_assessment': report.overall_assessment,
+            'interpretation': report.interpretation,
+            'follow_up': report.follow_up,
+            'created_at': report.created_at.isoformat() if report.created_at else None,
+            'ai_confidence_score': report.ai_confidence_score
+        }
+        
+        # Parse JSON fields
+        for field in ['individual_tests', 'probable_diseases', 'recommendations']:
+            value = getattr(report, field)
+            if value:
+                try:
+                    report_data[field] = json.loads(value)
+                except (json.JSONDecodeError, TypeError):
+                    pass
+        
+        patient_data['ai_reports'].append(report_data)
+    
+    return patient_data
+
+def _load_page_details(patient_ids, results_per_patient=50, reports_per_patient=10):
+    """Latest test results and reports for a page of patients, one windowed query each"""
+    from patient_loaders import latest_test_orders, latest_reports
+    
+    return (latest_test_orders(patient_ids, limit=results_per_patient),
+            latest_reports(patient_ids, limit=reports_per_patient))
+
+def _export_scope_hash(laboratory_id, patient_ids):
+    scope = f"{laboratory_id}:{','.join(str(i) for i in sorted(patient_ids or []))}"
+    return hashlib.sha1(scope.encode('utf-8')).hexdigest()
+
+def export_to_medisina(settings, patient_ids=None, page_size=None, resume=True, sleep=time.sleep):
+    """Export patient data to MediSina platform in gzip pages, resuming from the last acknowledged page"""
     try:
-        from models import Patient, TestOrder, Report
+        from models import Patient, SyncCheckpoint
         from app import db
         
         if not settings.medisina_enabled:
             return {'success': False, 'error': 'MediSina integration not enabled'}
         
+        laboratory_id = settings.laboratory_id
+        page_size = page_size or int(_export_config('MEDISINA_EXPORT_PAGE_SIZE', EXPORT_PAGE_SIZE))
+        max_retries = int(_export_config('MEDISINA_EXPORT_MAX_RETRIES', EXPORT_MAX_RETRIES))
+        
         # Build query for patients
-        query = Patient.query.filter_by(laboratory_id=settings.laboratory_id)
+        query = Patient.query.filter_by(laboratory_id=laboratory_id)
         if patient_ids:
             query = query.filter(Patient.id.in_(patient_ids))
         
-        patients = query.all()
-        
-        if not patients:
+        total_patients = query.count()
+        if not total_patients:
             return {'success': False, 'error': 'No patients found for export'}
         
-        # Prepare data for export
-        export_data = {
-            'export_info': {
-                'timestamp': datetime.utcnow().isoformat(),
-                'laboratory_id': settings.laboratory_id,
-                'total_patients': len(patients),
-                'export_format': 'medisina_v1'
-            },
-            'patients': []
-        }
+        # Resume an interrupted run over the same patients, otherwise start over
+        scope_hash = _export_scope_hash(laboratory_id, patient_ids)
+        checkpoint = SyncCheckpoint.query.filter_by(
+            laboratory_id=laboratory_id, direction='export'
+        ).first()
+        if checkpoint is None:
+            checkpoint = SyncCheckpoint(laboratory_id=laboratory_id, direction='export')
+            db.session.add(checkpoint)
+        
+        resuming = (resume and checkpoint.status in ('running', 'failed')
+                    and checkpoint.scope_hash == scope_hash and checkpoint.cursor)
+        if not resuming:
+            checkpoint.run_id = str(uuid.uuid4())
+            checkpoint.scope_hash = scope_hash
+            checkpoint.cursor = None
+            checkpoint.pages_done = checkpoint.records_done = 0
+            checkpoint.bytes_raw = checkpoint.bytes_sent = checkpoint.retries = 0
+            checkpoint.started_at = datetime.utcnow()
+            checkpoint.completed_at = None
+        checkpoint.status = 'running'
+        checkpoint.last_error = None
+        db.session.commit()
         
-        for patient in patients:
-            # Get patient's latest test results
-            test_results = TestOrder.query.filter_by(
-                patient_id=patient.id
-            ).order_by(TestOrder.ordered_at.desc()).limit(50).all()
-            
-            # Get patient's latest reports
-            reports = Report.query.filter_by(
-                patient_id=patient.id
-            ).order_by(Report.created_at.desc()).limit(10).all()
+        headers = {
+            'Authorization': f'Bearer {settings.medisina_api_key}',
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'
+        }
+        url = f"{settings.medisina_api_url.rstrip('/')}/api/v1/patients/import"
+        last_id = int(checkpoint.cursor) if checkpoint.cursor else 0
+        http = requests.Session()
+        medisina_response = None
+        
+        while True:
+            # Keyset over the primary key so each page is an index range scan; one extra row tells
+            # whether another page follows (a short page cannot, as the total may be an exact multiple)
+            patients = query.filter(Patient.id > last_id).order_by(Patient.id).limit(page_size + 1).all()
+            if not patients:
+                break
+            is_last_page = len(patients) <= page_size
+            patients = patients[:page_size]
             
-            patient_data = {
-                'patient_info': {
-                    'patient_id': patient.patient_id,
-                    'first_name': patient.first_name,
-                    'last_name': patient.last_name,
-                    'date_of_birth': patient.date_of_birth.isoformat() if patient.date_of_birth else None,
-                    'age': patient.age,
-                    'gender': patient.gender,
-                    'phone': patient.phone,
-                    'email': patient.email,
-                    'national_id': patient.national_id,
-                    'address': patient.address,
-                    'blood_type': patient.blood_type,
-                    'height': patient.height,
-                    'weight': patient.weight,
-                    'bmi': patient.bmi
-                },
-                'medical_info': {
-                    'medical_history': patient.medical_history,
-                    'current_symptoms': patient.current_symptoms,
-                    'pain_description': patient.pain_description,
-                    'test_reason': patient.test_reason,
-                    'disease_type': patient.disease_type,
-                    'allergies': patient.allergies,
-                    'current_medications': patient.current_medications
+            page_number = checkpoint.pages_done + 1
+            test_results, reports = _load_page_details([p.id for p in patients])
+            body, raw_size = gzip_json({
+                'export_info': {
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'laboratory_id': laboratory_id,
+                    'total_patients': total_patients,
+                    'export_format': 'medisina_v1',
+                    'export_id': checkpoint.run_id,
+                    'page': page_number,
+                    'page_size': page_size,
+                    'is_last_page': is_last_page
                 },
-                'emergency_contact': {
-                    'name': patient.emergency_contact,
-                    'phone': patient.emergency_phone,
-                    'relation': patient.emergency_relation
-                },
-                'test_results': [],
-                'ai_reports': []
-            }
+                'patients': [_serialize_patient(p, test_results[p.id], reports[p.id]) for p in patients]
+            })
             
-            # Add test results
-            for test in test_results:
-                patient_data['test_results'].append({
-                    'order_number': test.order_number,
-                    'test_type': test.test_type.name if test.test_type else None,
-                    'result_value': test.result_value,
-                    'result_unit': test.result_unit,
-                    'result_status': test.result_status,
-                    'reference_range': test.reference_range,
-                    'ordered_at': test.ordered_at.isoformat() if test.ordered_at else None,
-                    'completed_at': test.completed_at.isoformat() if test.completed_at else None,
-                    'status': test.status
-                })
+            # The idempotency key lets MediSina drop a page it already applied before a lost ack
+            response, retries, error = post_with_retry(
+                url, body, dict(headers, **{'Idempotency-Key': f'{checkpoint.run_id}:{page_number}'}),
+                max_retries=max_retries, sleep=sleep, session=http
+            )
+            checkpoint.retries += retries
             
-            # Add AI reports
-            for report in reports:
-                report_data = {
-                    'report_number': report.report_number,
-                    'report_type': report.report_type,
-                    'title': report.title,
-                    'overall_assessment': report.overall_assessment,
-                    'interpretation': report.interpretation,
-                    'follow_up': report.follow_up,
-                    'created_at': report.created_at.isoformat() if report.created_at else None,
-                    'ai_confidence_score': report.ai_confidence_score
+            if error:
+                checkpoint.status = 'failed'
+                checkpoint.last_error = error
+                db.session.commit()
+                logger.error(f"MediSina export stopped at page {page_number}: {error}")
+                return {
+                    'success': False,
+                    'error': error,
+                    'resumable': True,
+                    'progress': checkpoint.to_dict()
                 }
-                
-                # Parse JSON fields
-                if report.individual_tests:
-                    try:
-                        report_data['individual_tests'] = json.loads(report.individual_tests)
-                    except:
-                        pass
-                
-                if report.probable_diseases:
-                    try:
-                        report_data['probable_diseases'] = json.loads(report.probable_diseases)
-                    except:
-                        pass
-                
-                if report.recommendations:
-                    try:
-                        report_data['recommendations'] = json.loads(report.recommendations)
-                    except:
-                        pass
-                
-                patient_data['ai_reports'].append(report_data)
             
-            export_data['patients'].append(patient_data)
-        
-        # Send data to MediSina API
-        headers = {
-            'Authorization': f'Bearer {settings.medisina_api_key}',
-            'Content-Type': 'application/json'
-        }
+            last_id = patients[-1].id
+            checkpoint.cursor = str(last_id)
+            checkpoint.pages_done = page_number
+            checkpoint.records_done += len(patients)
+            metrics.inc('medlab_sync_rows_total', {'direction': 'export'}, len(patients))
+            checkpoint.bytes_raw += raw_size
+            checkpoint.bytes_sent += len(body)
+            db.session.commit()
+            
+            medisina_response = response.json() if response.content else {}
+            if is_last_page:
+                break
         
-        api_url = settings.medisina_api_url.rstrip('/')
+        checkpoint.status = 'completed'
+        checkpoint.completed_at = datetime.utcnow()
+        db.session.commit()
         
-        response = requests.post(
-            f"{api_url}/api/v1/patients/import",
-            headers=headers,
-            json=export_data,
-            timeout=120
-        )
+        progress = checkpoint.to_dict()
+        logger.info(f"MediSina export {checkpoint.run_id}: {progress['records_done']} patients in "
+                    f"{progress['pages_done']} pages, {progress['bytes_sent']} bytes sent")
         
-        if response.status_code in [200, 201, 202]:
-            result = response.json() if response.content else {}
-            return {
-                'success': True,
-                'message': 'Data exported to MediSina successfully',
-                'patient_count': len(patients),
-                'medisina_response': result
-            }
-        else:
-            return {
-                'success': False,
-                'error': f'MediSina API error: {response.status_code} - {response.text}'
-            }
+        return {
+            'success': True,
+            'message': 'Data exported to MediSina successfully',
+            'patient_count': checkpoint.records_done,
+            'resumed': bool(resuming),
+            'progress': progress,
+            'medisina_response': medisina_response
+        }
         
     except Exception as e:
         logger.error(f"MediSina export failed: {str(e)}")
         return {'success': False, 'error': f'Export failed: {str(e)}'}
 
-def import_from_medisina(settings):
-    """Import patient data from MediSina platform"""
+def export_progress(laboratory_id):
+    """Progress and throughput of the lab's latest MediSina export run"""
+    from models import SyncCheckpoint
+    
+    checkpoint = SyncCheckpoint.query.filter_by(laboratory_id=laboratory_id, direction='export').first()
+    return checkpoint.to_dict() if checkpoint else None
+
+# Incremental import tuning
+IMPORT_PAGE_SIZE = 1000
+IMPORT_UPSERT_CHUNK = 1000
+IMPORT_INITIAL_LOOKBACK_DAYS = 7
+
+# Columns written by the import; on conflict only the MEDISINA_UPDATED_COLUMNS are refreshed
+PATIENT_IMPORT_COLUMNS = [
+    'patient_id', 'first_name', 'last_name', 'date_of_birth', 'age', 'gender', 'phone', 'email',
+    'national_id', 'address', 'medical_history', 'current_symptoms', 'allergies', 'current_medications'
+]
+MEDISINA_UPDATED_COLUMNS = ['first_name', 'last_name', 'phone', 'email', 'medical_history', 'current_medications']
+
+def _parse_iso_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except (TypeError, ValueError):
+        return None
+
+def _record_updated_at(patient_data):
+    """MediSina's modification time of a record, as an ISO string (used as the watermark)"""
+    return patient_data.get('updated_at') or (patient_data.get('patient_info') or {}).get('updated_at')
+
+def _import_row(patient_data, laboratory_id, now):
+    """Flatten a MediSina patient record into a patients row, or None if it is unusable"""
+    patient_info = patient_data.get('patient_info', {})
+    medical_info = patient_data.get('medical_info', {})
+    
+    if not patient_info.get('patient_id') or not patient_info.get('first_name') or not patient_info.get('last_name'):
+        return None
+    
+    return {
+        'patient_id': patient_info.get('patient_id'),
+        'first_name': patient_info.get('first_name'),
+        'last_name': patient_info.get('last_name'),
+        'date_of_birth': _parse_iso_date(patient_info.get('date_of_birth')),
+        'age': patient_info.get('age'),
+        'gender': patient_info.get('gender'),
+        'phone': patient_info.get('phone'),
+        'email': patient_info.get('email'),
+        'national_id': patient_info.get('national_id'),
+        'address': patient_info.get('address'),
+        'medical_history': medical_info.get('medical_history'),
+        'current_symptoms': medical_info.get('current_symptoms'),
+        'allergies': medical_info.get('allergies'),
+        'current_medications': medical_info.get('current_medications'),
+        'laboratory_id': laboratory_id,
+        'status': 'active',
+        'language_preference': 'en',
+        'created_at': now,
+        'updated_at': now
+    }
+
+def upsert_patients(rows, laboratory_id, resent=()):
+    """Insert-or-update one chunk of patient rows in a single statement; returns (inserted, updated, errors)
+
+    Uses INSERT ... ON CONFLICT (patient_id) on PostgreSQL and SQLite, and a select-then-bulk
+    fallback elsewhere. patient_id is globally unique, so rows owned by another lab are rejected.
+    Existing patients listed in `resent` are re-read copies and are not counted as updated.
+    """
+    from sqlalchemy import insert, update, bindparam
+    from models import Patient
+    from app import db
+    
+    # One row per patient_id; ON CONFLICT cannot touch the same row twice in a statement
+    rows = list({row['patient_id']: row for row in rows}.values())
+    
+    owners = dict(db.session.query(Patient.patient_id, Patient.laboratory_id).filter(
+        Patient.patient_id.in_([row['patient_id'] for row in rows])
+    ).all())
+    errors = [{'patient_id': row['patient_id'], 'error': 'Patient ID belongs to another laboratory'}
+              for row in rows if owners.get(row['patient_id'], laboratory_id) != laboratory_id]
+    rows = [row for row in rows if owners.get(row['patient_id'], laboratory_id) == laboratory_id]
+    if not rows:
+        return 0, 0, errors
+    
+    inserted = sum(1 for row in rows if row['patient_id'] not in owners)
+    updated = sum(1 for row in rows if row['patient_id'] in owners and row['patient_id'] not in resent)
+    dialect = db.session.get_bind().dialect.name
+    table = Patient.__table__
+    
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        
+        statement = dialect_insert(table)
+        # Missing values keep what we already have, matching the old per-record update
+        set_ = {column: func.coalesce(statement.excluded[column], table.c[column])
+                for column in MEDISINA_UPDATED_COLUMNS}
+        set_['updated_at'] = statement.excluded.updated_at
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.patient_id],
+            set_=set_,
+            where=table.c.laboratory_id == laboratory_id
+        )
+        db.session.execute(statement, rows)
+    else:
+        new_rows = [row for row in rows if row['patient_id'] not in owners]
+        if new_rows:
+            db.session.execute(insert(table), new_rows)
+        existing_rows = [row for row in rows if row['patient_id'] in owners]
+        if existing_rows:
+            db.session.execute(
+                update(table).where(table.c.patient_id == bindparam('key')).values({
+                    column: func.coalesce(bindparam(f'new_{column}'), table.c[column])
+                    for column in MEDISINA_UPDATED_COLUMNS
+                } | {'updated_at': bindparam('new_updated_at')}),
+                [{'key': row['patient_id'], 'new_updated_at': row['updated_at'],
+                  **{f'new_{column}': row[column] for column in MEDISINA_UPDATED_COLUMNS}}
+                 for row in existing_rows]
+            )
+    
+    return inserted, updated, errors
+
+def import_from_medisina(settings, page_size=None, full=False):
+    """Import patients changed in MediSina since the lab's last sync watermark"""
     try:
-        from models import Patient, TestType, TestOrder
+        from models import SyncCheckpoint
         from app import db
         
         if not settings.medisina_enabled:
             return {'success': False, 'error': 'MediSina integration not enabled'}
         
+        laboratory_id = settings.laboratory_id
+        page_size = page_size or int(_export_config('MEDISINA_IMPORT_PAGE_SIZE', IMPORT_PAGE_SIZE))
         headers = {
             'Authorization': f'Bearer {settings.medisina_api_key}',
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip'
         }
-        
-        api_url = settings.medisina_api_url.rstrip('/')
-        
-        # Get updated patient data from MediSina
-        response = requests.get(
-            f"{api_url}/api/v1/patients/export",
-            headers=headers,
-            params={
-                'laboratory_id': settings.laboratory_id,
-                'updated_since': (datetime.utcnow() - timedelta(days=7)).isoformat()
-            },
-            timeout=120
-        )
-        
-        if response.status_code != 200:
-            return {
-                'success': False,
-                'error': f'MediSina API error: {response.status_code} - {response.text}'
-            }
-        
-        import_data = response.json()
-        patients_data = import_data.get('patients', [])
+        url = f"{settings.medisina_api_url.rstrip('/')}/api/v1/patients/export"
+        
+        checkpoint = SyncCheckpoint.query.filter_by(laboratory_id=laboratory_id, direction='import').first()
+        if checkpoint is None:
+            checkpoint = SyncCheckpoint(laboratory_id=laboratory_id, direction='import')
+            db.session.add(checkpoint)
+        
+        # MediSina returns records oldest-first with a keyset next_cursor. The watermark is inclusive,
+        # so records sharing its timestamp are re-read and upserted idempotently, but not counted
+        watermark = None if full else checkpoint.cursor
+        resumed_from = watermark
+        if not watermark:
+            watermark = (datetime.utcnow() - timedelta(days=IMPORT_INITIAL_LOOKBACK_DAYS)).isoformat()
+        
+        checkpoint.run_id = str(uuid.uuid4())
+        checkpoint.status = 'running'
+        checkpoint.started_at = datetime.utcnow()
+        checkpoint.completed_at = None
+        checkpoint.last_error = None
+        checkpoint.pages_done = checkpoint.records_done = checkpoint.retries = 0
+        checkpoint.bytes_raw = checkpoint.bytes_sent = 0
+        db.session.commit()
         
         imported_count = 0
         updated_count = 0
+        total_processed = 0
         errors = []
-        
-        for patient_data in patients_data:
-            try:
-                patient_info = patient_data.get('patient_info', {})
-                medical_info = patient_data.get('medical_info', {})
-                
-                # Find existing patient or create new
-                existing_patient = Patient.query.filter_by(
-                    patient_id=patient_info.get('patient_id'),
-                    laboratory_id=settings.laboratory_id
-                ).first()
-                
-                if existing_patient:
-                    # Update existing patient
-                    existing_patient.first_name = patient_info.get('first_name', existing_patient.first_name)
-                    existing_patient.last_name = patient_info.get('last_name', existing_patient.last_name)
-                    existing_patient.phone = patient_info.get('phone', existing_patient.phone)
-                    existing_patient.email = patient_info.get('email', existing_patient.email)
-                    existing_patient.medical_history = medical_info.get('medical_history', existing_patient.medical_history)
-                    existing_patient.current_medications = medical_info.get('current_medications', existing_patient.current_medications)
-                    updated_count += 1
+        page_cursor = None
+        watermark_frozen = False
+        http = requests.Session()
+        
+        while True:
+            params = {'laboratory_id': laboratory_id, 'updated_since': watermark, 'limit': page_size}
+            if page_cursor:
+                params['cursor'] = page_cursor
+            
+            breaker = circuit_breaker('medisina')
+            if not breaker.allow():
+                response, error = None, 'MediSina API is temporarily unavailable after repeated failures'
+            else:
+                try:
+                    with external_call('medisina', 'import_page') as call:
+                        response = http.get(url, headers=headers, params=params, timeout=120)
+                        if response.status_code != 200:
+                            call['outcome'] = f'http_{response.status_code}'
+                except requests.exceptions.RequestException as e:
+                    response, error = None, f'Connection failed: {str(e)}'
                 else:
-                    # Create new patient
-                    new_patient = Patient(
-                        patient_id=patient_info.get('patient_id'),
-                        first_name=patient_info.get('first_name'),
-                        last_name=patient_info.get('last_name'),
-                        date_of_birth=datetime.fromisoformat(patient_info['date_of_birth']).date() if patient_info.get('date_of_birth') else None,
-                        age=patient_info.get('age'),
-                        gender=patient_info.get('gender'),
-                        phone=patient_info.get('phone'),
-                        email=patient_info.get('email'),
-                        national_id=patient_info.get('national_id'),
-                        address=patient_info.get('address'),
-                        medical_history=medical_info.get('medical_history'),
-                        current_symptoms=medical_info.get('current_symptoms'),
-                        allergies=medical_info.get('allergies'),
-                        current_medications=medical_info.get('current_medications'),
-                        laboratory_id=settings.laboratory_id
-                    )
-                    db.session.add(new_patient)
-                    imported_count += 1
-                
+                    error = None if response.status_code == 200 else \
+                        f'MediSina API error: {response.status_code} - {response.text[:500]}'
+                if error and (response is None or response.status_code >= 500):
+                    breaker.record_failure(error)
+                elif not error:
+                    breaker.record_success()
+            
+            if error:
+                checkpoint.status = 'failed'
+                checkpoint.last_error = error
                 db.session.commit()
+                return {
+                    'success': False,
+                    'error': error,
+                    'imported_count': imported_count,
+                    'updated_count': updated_count,
+                    'total_processed': total_processed,
+                    'watermark': checkpoint.cursor
+                }
+            
+            import_data = response.json()
+            patients_data = import_data.get('patients', [])
+            page_watermark = None
+            now = datetime.utcnow()
+            rows = []
+            resent = set()
+            
+            for patient_data in patients_data:
+                row = _import_row(patient_data, laboratory_id, now)
+                if row is None:
+                    errors.append({
+                        'patient_id': (patient_data.get('patient_info') or {}).get('patient_id', 'Unknown'),
+                        'error': 'Missing patient_id, first_name or last_name'
+                    })
+                else:
+                    rows.append(row)
                 
-            except Exception as e:
-                errors.append({
-                    'patient_id': patient_info.get('patient_id', 'Unknown'),
-                    'error': str(e)
-                })
-                db.session.rollback()
+                updated_at = _record_updated_at(patient_data)
+                if row is not None and resumed_from and updated_at == resumed_from:
+                    resent.add(row['patient_id'])
+                if updated_at and (page_watermark is None or updated_at > page_watermark):
+                    page_watermark = updated_at
+            
+            # Chunked transactions: a failure rolls back only its chunk, and from then on the
+            # watermark stays put so the next sync fetches the failed records again
+            for start in range(0, len(rows), IMPORT_UPSERT_CHUNK):
+                chunk = rows[start:start + IMPORT_UPSERT_CHUNK]
+                try:
+                    inserted, updated, chunk_errors = upsert_patients(chunk, laboratory_id, resent)
+                    db.session.commit()
+                    imported_count += inserted
+                    updated_count += updated
+                    errors.extend(chunk_errors)
+                except Exception as e:
+                    db.session.rollback()
+                    watermark_frozen = True
+                    errors.extend({'patient_id': row['patient_id'], 'error': str(e)} for row in chunk)
+            
+            total_processed += len(patients_data)
+            metrics.inc('medlab_sync_rows_total', {'direction': 'import'}, len(patients_data))
+            checkpoint.pages_done += 1
+            checkpoint.records_done = total_processed
+            checkpoint.bytes_raw += len(response.content)
+            if page_watermark and not watermark_frozen and (not checkpoint.cursor or page_watermark > checkpoint.cursor):
+                checkpoint.cursor = page_watermark
+            db.session.commit()
+            
+            page_cursor = import_data.get('next_cursor')
+            if not page_cursor or not patients_data:
+                break
+        
+        checkpoint.status = 'completed'
+        checkpoint.completed_at = datetime.utcnow()
+        db.session.commit()
         
         return {
             'success': True,
             'message': 'Data imported from MediSina successfully',
             'imported_count': imported_count,
             'updated_count': updated_count,
-            'total_processed': len(patients_data),
+            'total_processed': total_processed,
+            'watermark': checkpoint.cursor,
             'errors': errors
         }
         
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+MediSina Stand-in Server
+Minimal local imitation of the MediSina v1 API for exercising exports and imports
+without the real platform. Standard library only.
+
+Usage:
+    python medisina_standin.py --port 8765 --fail-rate 0.2
+    # then point Settings.medisina_api_url at http://localhost:8765
+"""
+
+import json
+import gzip
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class StandInState:
+    """Everything the stand-in has received, plus its failure injection knobs"""
+
+    def __init__(self, fail_rate=0.0, fail_first=0, latency=0.0, seed=None):
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_seen = 0
+        self.pages = {}  # idempotency key -> export_info
+        self.duplicates = 0
+        self.patients = {}  # patient_id -> patient record, as exported to us
+
+    def should_fail(self):
+        with self.lock:
+            self.requests_seen += 1
+            if self.requests_seen <= self.fail_first:
+                return True
+            return self.random.random() < self.fail_rate
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = 'MediSinaStandIn/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body.decode('utf-8')) if body else {}
+
+    def do_GET(self):
+        state = self.server.state
+        path = self.path.split('?', 1)[0]
+
+        if path in ('/health', '/status', '/api/v1/health', '/ping'):
+            return self._send_json(200, {'status': 'ok'})
+
+        if path == '/api/v1/patients/export':
+            return self._send_json(200, self._export_page(state))
+
+        if path == '/_standin/stats':
+            with state.lock:
+                return self._send_json(200, {
+                    'requests_seen': state.requests_seen,
+                    'pages': len(state.pages),
+                    'duplicates': state.duplicates,
+                    'patients': len(state.patients)
+                })
+
+        self._send_json(404, {'error': 'not found'})
+
+    def _export_page(self, state):
+        """Records changed since updated_since, oldest first, keyset-paged like the real API"""
+        params = parse_qs(urlparse(self.path).query)
+        updated_since = params.get('updated_since', [''])[0]
+        limit = int(params.get('limit', ['1000'])[0])
+        cursor = params.get('cursor', [None])[0]
+        after = tuple(cursor.split('|', 1)) if cursor else None
+
+        with state.lock:
+            records = sorted(
+                (r for r in state.patients.values() if r['updated_at'] >= updated_since),
+                key=lambda r: (r['updated_at'], r['patient_info']['patient_id'])
+            )
+        if after:
+            records = [r for r in records if (r['updated_at'], r['patient_info']['patient_id']) > after]
+
+        page = records[:limit]
+        next_cursor = None
+        if len(records) > limit:
+            last = page[-1]
+            next_cursor = f"{last['updated_at']}|{last['patient_info']['patient_id']}"
+        return {'patients': page, 'next_cursor': next_cursor}
+
+    def do_POST(self):
+        state = self.server.state
+        path = self.path.split('?', 1)[0]
+
+        if path == '/auth/login':
+            return self._send_json(200, {'token': 'standin'})
+
+        if path != '/api/v1/patients/import':
+            return self._send_json(404, {'error': 'not found'})
+
+        if state.latency:
+            time.sleep(state.latency)
+
+        if state.should_fail():
+            return self._send_json(503, {'error': 'injected failure'}, {'Retry-After': '0'})
+
+        try:
+            payload = self._read_json()
+        except (ValueError, OSError) as e:
+            return self._send_json(400, {'error': f'bad payload: {e}'})
+
+        key = self.headers.get('Idempotency-Key')
+        with state.lock:
+            if key and key in state.pages:
+                state.duplicates += 1
+                return self._send_json(200, {'accepted': 0, 'duplicate': True})
+
+            for patient in payload.get('patients', []):
+                record = dict(patient)
+                record['updated_at'] = datetime.utcnow().isoformat()
+                state.patients[patient['patient_info']['patient_id']] = record
+            if key:
+                state.pages[key] = payload.get('export_info', {})
+
+        self._send_json(200, {'accepted': len(payload.get('patients', [])), 'duplicate': False})
+
+class MediSinaStandIn:
+    """Runs the stand-in on a background thread, for tests"""
+
+    def __init__(self, host='127.0.0.1', port=0, **state_options):
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.state = StandInState(**state_options)
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local MediSina API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of import requests answered with 503')
+    parser.add_argument('--fail-first', type=int, default=0, help='answer the first N import requests with 503')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering each import page')
+    args = parser.parse_args()
+
+    standin = MediSinaStandIn(args.host, args.port, fail_rate=args.fail_rate, fail_first=args.fail_first,
+                              latency=args.latency)
+    print(f'MediSina stand-in listening on {standin.url}')
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+Metrics Module
+Handles Prometheus metrics: per-endpoint request latency, SQL work per request, connection pool
+levels and timeouts, LLM latency and tokens, MediSina/Twilio call latency and sync row throughput.
+Each process keeps its samples in memory and periodically writes a snapshot to a shared directory;
+/metrics merges the snapshots, so the numbers cover every gunicorn worker whichever one is scraped.
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_FLUSH_SECONDS = 5.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500)
+EXTERNAL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'medlab_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status', None),
+    'medlab_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint', LATENCY_BUCKETS),
+    'medlab_sql_queries_per_request': ('histogram', 'SQL statements executed per HTTP request', QUERY_COUNT_BUCKETS),
+    'medlab_sql_seconds_per_request': ('histogram', 'Time spent in SQL statements per HTTP request', LATENCY_BUCKETS),
+    'medlab_sql_slow_queries_total': ('counter', 'Statements slower than SQL_SLOW_QUERY_MS by endpoint', None),
+    'medlab_sql_n_plus_one_total': ('counter', 'Profiled requests that repeated a statement shape (N+1)', None),
+    'medlab_db_pool_size': ('gauge', 'Configured connection pool size', None),
+    'medlab_db_pool_checked_out': ('gauge', 'Pool connections currently checked out', None),
+    'medlab_db_pool_overflow': ('gauge', 'Pool connections open beyond pool_size', None),
+    'medlab_db_pool_max_overflow': ('gauge', 'Configured connections allowed beyond pool_size', None),
+    'medlab_db_pool_timeouts_total': ('counter', 'Requests that got no pool connection within DB_POOL_TIMEOUT', None),
+    'medlab_db_statement_timeouts_total': ('counter', 'Statements cancelled by statement_timeout by route class', None),
+    'medlab_db_exports_running': ('gauge', 'Export-class requests holding one of the DB_EXPORT_CONCURRENCY slots', None),
+    'medlab_llm_request_duration_seconds': ('histogram', 'LLM request latency by provider and model', EXTERNAL_BUCKETS),
+    'medlab_llm_tokens_total': ('counter', 'LLM tokens by provider, model and kind (prompt, completion)', None),
+    'medlab_external_request_duration_seconds': ('histogram', 'MediSina and Twilio request latency', EXTERNAL_BUCKETS),
+    'medlab_sync_rows_total': ('counter', 'Patient records exported to or imported from MediSina', None),
+}
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in (labels or {}).items()))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class MetricsRegistry:
+    """In-process samples plus the snapshot files of sibling worker processes"""
+
+    def __init__(self):
+        self.directory = None
+        self.flush_interval = METRICS_FLUSH_SECONDS
+        self.values = {}  # (name, label pairs) -> float, or [bucket counts..., sum, count] for histograms
+        self.gauge_callbacks = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def configure(self, directory=None, flush_interval=None):
+        """Share samples through directory (one per gunicorn master by default)"""
+        self.directory = directory or os.path.join(tempfile.gettempdir(), f'medlab-metrics-{os.getppid()}')
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self._ensure_flusher()
+
+    def observe(self, name, value, labels=None):
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = self.values[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    sample[index] += 1
+                    break
+            sample[-2] += value
+            sample[-1] += 1
+        self._ensure_flusher()
+
+    def _gauges(self):
+        gauges = {}
+        for callback in self.gauge_callbacks:
+            try:
+                for name, labels, value in callback():
+                    gauges[(name, _label_key(dict(labels, pid=os.getpid())))] = value
+            except Exception as e:
+                logger.debug(f"Metrics gauge callback failed: {str(e)}")
+        return gauges
+
+    def snapshot(self):
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self.values.items()}
+        values.update(self._gauges())
+        return values
+
+    # Snapshot files
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def flush(self):
+        """Write this process's samples for the other workers to merge"""
+        if not self.directory:
+            return
+        rows = [[name, labels, value] for (name, labels), value in self.snapshot().items()]
+        temporary = self._path(os.getpid()) + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(rows, handle)
+        os.replace(temporary, self._path(os.getpid()))
+
+    def _ensure_flusher(self):
+        # gunicorn forks workers after import, so each worker starts its own flusher on first use
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+        thread.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+    def _fold_dead_workers(self):
+        """Move counters of exited workers (gunicorn recycles them) into archive.json; drop their gauges"""
+        archive_path = os.path.join(self.directory, 'archive.json')
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = None
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.json') or not filename[:-5].isdigit():
+                    continue
+                pid = int(filename[:-5])
+                try:
+                    os.kill(pid, 0)
+                    continue
+                except ProcessLookupError:
+                    pass
+                except PermissionError:
+                    continue
+                if archive is None:
+                    archive = self._read(archive_path)
+                path = os.path.join(self.directory, filename)
+                for key, value in self._read(path).items():
+                    if METRICS[key[0]][0] != 'gauge':
+                        archive[key] = _merge(archive.get(key), value)
+                os.remove(path)
+            if archive is not None:
+                temporary = archive_path + '.tmp'
+                with open(temporary, 'w') as handle:
+                    json.dump([[name, labels, value] for (name, labels), value in archive.items()], handle)
+                os.replace(temporary, archive_path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as handle:
+                rows = json.load(handle)
+        except (OSError, ValueError):
+            return {}
+        return {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in rows if name in METRICS}
+
+    def collect(self):
+        """Samples of every worker: live snapshot files, the archive, and this process's current values"""
+        if not self.directory:
+            return self.snapshot()
+
+        self.flush()
+        self._fold_dead_workers()
+        merged = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                for key, value in self._read(os.path.join(self.directory, filename)).items():
+                    merged[key] = _merge(merged.get(key), value)
+        return merged
+
+    def exposition(self):
+        """All metrics in the Prometheus text format"""
+        samples = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = sorted((labels, value) for (metric, labels), value in samples.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in series:
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value[:-2]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {value[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def _merge(current, value):
+    if current is None:
+        return list(value) if isinstance(value, list) else value
+    if isinstance(value, list):
+        return [a + b for a, b in zip(current, value)]
+    return current + value
+
+metrics = MetricsRegistry()
+
+# Instrumentation helpers
+
+_request_stats = threading.local()
+_query_observers = []  # observer(statement, parameters, seconds), e.g. the SQL profiler
+_listening = False
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    stats = getattr(_request_stats, 'current', None)
+    if stats is not None:
+        stats['queries'] += 1
+        stats['seconds'] += seconds
+    for observer in _query_observers:
+        observer(statement, parameters, seconds)
+
+def listen_queries(observer=None):
+    """Attach the cursor hooks to every engine (once); observer, if given, is also called with
+    (statement, parameters, seconds) after each statement"""
+    global _listening
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if observer is not None and observer not in _query_observers:
+        _query_observers.append(observer)
+    if _listening:
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    _listening = True
+
+def init_app(app):
+    """Time requests and their SQL, and report the app's connection pool"""
+    from flask import request
+
+    metrics.configure(app.config.get('METRICS_DIR'), app.config.get('METRICS_FLUSH_SECONDS'))
+    listen_queries()
+
+    @app.before_request
+    def _start_request_metrics():
+        _request_stats.current = {'started': time.perf_counter(), 'queries': 0, 'seconds': 0.0}
+
+    @app.after_request
+    def _record_request_metrics(response):
+        stats = getattr(_request_stats, 'current', None)
+        if stats is None:
+            return response
+        _request_stats.current = None
+
+        # The endpoint name, not the path, keeps label cardinality bounded
+        endpoint = request.endpoint or 'unmatched'
+        labels = {'endpoint': endpoint, 'method': request.method}
+        metrics.inc('medlab_http_requests_total', dict(labels, status=response.status_code))
+        metrics.observe('medlab_http_request_duration_seconds', time.perf_counter() - stats['started'], labels)
+        metrics.observe('medlab_sql_queries_per_request', stats['queries'], {'endpoint': endpoint})
+        metrics.observe('medlab_sql_seconds_per_request', stats['seconds'], {'endpoint': endpoint})
+        return response
+
+    def pool_gauges():
+        from health import pool_status
+        from db_config import statement_timeouts
+        from app import db
+
+        with app.app_context():
+            status = pool_status(db.engine)
+        exports = [('medlab_db_exports_running', {}, statement_timeouts.exports_running)]
+        if not status:
+            return exports
+        return exports + [('medlab_db_pool_size', {}, status['size']),
+                          ('medlab_db_pool_max_overflow', {}, status['max_overflow']),
+                          ('medlab_db_pool_checked_out', {}, status['checked_out']),
+                          ('medlab_db_pool_overflow', {}, status['overflow'])]
+
+    metrics.gauge_callbacks.append(pool_gauges)
+
+def llm_usage(response):
+    """(prompt tokens, completion tokens) from an OpenAI, Anthropic, Gemini or OpenRouter JSON response"""
+    if response is None:
+        return None, None
+    if isinstance(response, dict):
+        usage = response.get('usage') or {}
+        return usage.get('prompt_tokens'), usage.get('completion_tokens')
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        prompt = getattr(usage, 'prompt_tokens', None) or getattr(usage, 'input_tokens', None)
+        completion = getattr(usage, 'completion_tokens', None) or getattr(usage, 'output_tokens', None)
+        return prompt, completion
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None:
+        return getattr(usage, 'prompt_token_count', None), getattr(usage, 'candidates_token_count', None)
+    return None, None
+
+@contextmanager
+def llm_call(provider, model):
+    """Time an LLM request; set call['response'] inside the block to count its tokens, and
+    call['outcome'] to label a failure that did not raise"""
+    call = {'response': None, 'outcome': 'ok'}
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call['outcome'] = 'error'
+        raise
+    finally:
+        labels = {'provider': provider, 'model': model or 'unknown'}
+        metrics.observe('medlab_llm_request_duration_seconds', time.perf_counter() - started,
+                        dict(labels, outcome=call['outcome']))
+        prompt, completion = llm_usage(call['response'])
+        if prompt:
+            metrics.inc('medlab_llm_tokens_total', dict(labels, kind='prompt'), prompt)
+        if completion:
+            metrics.inc('medlab_llm_tokens_total', dict(labels, kind='completion'), completion)
+
+@contextmanager
+def external_call(service, operation):
+    """Time a request to an external service; set call['outcome'] to label a non-exception failure"""
+    call = {'outcome': 'ok'}
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call['outcome'] = 'error'
+        raise
+    finally:
+        metrics.observe('medlab_external_request_duration_seconds', time.perf_counter() - started,
+                        {'service': service, 'operation': operation, 'outcome': call['outcome']})
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, host='0.0.0.0'):
+    """Serve /metrics from a background process (sync scheduler, SMS relay, ingest, HL7 listener)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Serving metrics on {host}:{port}")
+    return server
@@ -0,0 +1,280 @@
+"""
+Schema Migration Module
+Applies additive schema changes that db.create_all() cannot make to existing tables, and builds
+missing indexes and backfills parsed results from one-off maintenance commands
+
+Usage:
+    python migrations.py --create-indexes     # CREATE INDEX CONCURRENTLY on PostgreSQL
+    python migrations.py --backfill-results   # parse stored results into the numeric columns
+"""
+import sys
+import logging
+import argparse
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (table, column, column DDL) - only ever add nullable or defaulted columns here
+COLUMN_MIGRATIONS = [
+    ('reports', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('reports', 'updated_at', 'TIMESTAMP'),
+    ('test_orders', 'updated_at', 'TIMESTAMP'),
+    ('test_orders', 'laboratory_id', 'INTEGER REFERENCES laboratories(id)'),
+    ('samples', 'laboratory_id', 'INTEGER REFERENCES laboratories(id)'),
+    ('reports', 'laboratory_id', 'INTEGER REFERENCES laboratories(id)'),
+    ('test_orders', 'result_numeric', 'FLOAT'),
+    ('test_orders', 'result_qualifier', 'VARCHAR(2)'),
+    ('test_orders', 'result_si_value', 'FLOAT'),
+    ('test_orders', 'result_si_unit', 'VARCHAR(20)'),
+    ('test_types', 'delta_absolute_limit', 'FLOAT'),
+    ('test_types', 'delta_percent_limit', 'FLOAT'),
+    ('test_types', 'delta_rate_limit', 'FLOAT'),
+    ('test_types', 'delta_window_days', 'INTEGER'),
+    ('test_orders', 'delta_flag', 'VARCHAR(20)'),
+    ('test_orders', 'delta_change', 'FLOAT'),
+    ('test_orders', 'delta_percent', 'FLOAT'),
+    ('test_orders', 'delta_rate', 'FLOAT'),
+    ('test_orders', 'delta_prior_order_id', 'INTEGER REFERENCES test_orders(id)'),
+    ('test_orders', 'delta_checked_at', 'TIMESTAMP'),
+    ('settings', 'critical_alert_phones', 'TEXT'),
+]
+
+# (table, UPDATE statement) - idempotent data fixes for columns added above, run on every start: replicas
+# still running the previous release insert rows without laboratory_id during a rolling deploy, and the
+# next start picks those up. The (laboratory_id, ...) indexes make the NULL probe before each UPDATE cheap.
+BACKFILL_MIGRATIONS = [
+    ('test_orders', 'UPDATE test_orders SET laboratory_id = '
+                    '(SELECT patients.laboratory_id FROM patients WHERE patients.id = test_orders.patient_id) '
+                    'WHERE laboratory_id IS NULL'),
+    ('samples', 'UPDATE samples SET laboratory_id = '
+                '(SELECT patients.laboratory_id FROM patients WHERE patients.id = samples.patient_id) '
+                'WHERE laboratory_id IS NULL'),
+    ('reports', 'UPDATE reports SET laboratory_id = '
+                '(SELECT patients.laboratory_id FROM patients WHERE patients.id = reports.patient_id) '
+                'WHERE laboratory_id IS NULL'),
+]
+
+# (name, statement) - PostgreSQL-only objects the models cannot declare portably, built by create_indexes()
+POSTGRESQL_DDL = [
+    ('pg_trgm', 'CREATE EXTENSION IF NOT EXISTS pg_trgm'),
+    ('ix_patients_full_name_trgm', "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_patients_full_name_trgm ON patients "
+                                   "USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)"),
+]
+
+def _add_missing_columns(inspector, table_names):
+    """Add columns declared in COLUMN_MIGRATIONS that are missing from the database"""
+    added = []
+    for table, column, ddl in COLUMN_MIGRATIONS:
+        if table not in table_names:
+            continue
+
+        existing_columns = {col['name'] for col in inspector.get_columns(table)}
+        if column in existing_columns:
+            continue
+
+        try:
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            db.session.commit()
+            added.append(f'{table}.{column}')
+        except Exception as e:
+            # Another worker may have applied the same migration concurrently
+            db.session.rollback()
+            logger.warning(f"Could not add column {table}.{column}: {str(e)}")
+
+    return added
+
+def _backfill(table_names):
+    """Run the BACKFILL_MIGRATIONS for tables that still have rows without a laboratory_id"""
+    updated = {}
+    for table, statement in BACKFILL_MIGRATIONS:
+        if table not in table_names:
+            continue
+
+        try:
+            # Read-only probe first, so a normal start takes no row locks
+            if db.session.execute(text(f'SELECT 1 FROM {table} WHERE laboratory_id IS NULL LIMIT 1')).first() is None:
+                db.session.rollback()
+                continue
+            result = db.session.execute(text(statement))
+            db.session.commit()
+            if result.rowcount:
+                updated[table] = updated.get(table, 0) + result.rowcount
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Backfill of {table} failed: {str(e)}")
+
+    return updated
+
+def backfill_results(batch_size=1000):
+    """Parse free-text results into the typed columns (needs Python, so not plain SQL); returns rows updated
+
+    Walks test_orders by id one batch at a time, committing each, so it never holds more than a batch
+    in memory and an interrupted run can simply be started again. Rows are rewritten only when the
+    numeric value or a censored result's qualifier is missing, so re-runs change nothing.
+    """
+    from lab_results import numeric_fields
+
+    select = text(
+        'SELECT test_orders.id, test_orders.result_value, test_orders.result_unit, test_orders.result_numeric, '
+        'test_orders.result_qualifier, test_types.code, test_types.unit '
+        'FROM test_orders LEFT JOIN test_types ON test_types.id = test_orders.test_type_id '
+        'WHERE test_orders.id > :last_id AND test_orders.result_value IS NOT NULL '
+        'AND (test_orders.result_numeric IS NULL OR test_orders.result_qualifier IS NULL) '
+        'ORDER BY test_orders.id LIMIT :limit'
+    )
+    statement = text(
+        'UPDATE test_orders SET result_numeric = :result_numeric, result_qualifier = :result_qualifier, '
+        'result_si_value = :result_si_value, result_si_unit = :result_si_unit WHERE id = :id'
+    )
+
+    last_id = 0
+    updated = 0
+    while True:
+        rows = db.session.execute(select, {'last_id': last_id, 'limit': batch_size}).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for order_id, result_value, result_unit, numeric, qualifier, test_code, default_unit in rows:
+            fields = numeric_fields(result_value, result_unit, test_code, default_unit)
+            if fields['result_numeric'] is None:
+                continue
+            if numeric is None or (qualifier is None and fields['result_qualifier']):
+                updates.append(dict(fields, id=order_id))
+        if updates:
+            db.session.execute(statement, updates)
+        db.session.commit()
+        updated += len(updates)
+        logger.info(f"Backfilled results up to test order {last_id} ({updated} updated)")
+
+    return updated
+
+def _existing_index_names(bind):
+    """Names of the indexes in the database, read from the catalog
+
+    Not inspector.get_indexes(): SQLAlchemy cannot reflect expression indexes such as
+    lower(last_name), so it warns on every boot and reports them missing.
+    """
+    if bind.dialect.name == 'postgresql':
+        statement = 'SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()'
+    elif bind.dialect.name == 'sqlite':
+        statement = "SELECT name FROM sqlite_master WHERE type = 'index'"
+    else:
+        inspector = inspect(bind)
+        return {index['name'] for table in inspector.get_table_names() for index in inspector.get_indexes(table)}
+
+    with bind.connect() as connection:
+        return set(connection.exec_driver_sql(statement).scalars())
+
+def missing_indexes(bind, table_names):
+    """Indexes declared on the models that existing tables do not have yet"""
+    existing_indexes = _existing_index_names(bind)
+    return [index for table in db.metadata.sorted_tables if table.name in table_names
+            for index in table.indexes if index.name not in existing_indexes]
+
+def create_indexes():
+    """Build missing model indexes and POSTGRESQL_DDL without blocking writes; returns the names built
+
+    On PostgreSQL each index is built with CREATE INDEX CONCURRENTLY, which cannot run inside a
+    transaction, on a direct (non-PgBouncer) connection without a statement timeout. A build that
+    failed part-way leaves an INVALID index behind; those are dropped and rebuilt.
+    """
+    from db_config import session_engine
+
+    engine = session_engine()
+    postgres = engine.dialect.name == 'postgresql'
+    indexes = missing_indexes(engine, set(inspect(engine).get_table_names()))
+    built = []
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if postgres:
+            connection.exec_driver_sql('SET statement_timeout = 0')
+            invalid = connection.exec_driver_sql(
+                'SELECT index_class.relname FROM pg_index JOIN pg_class index_class '
+                'ON index_class.oid = pg_index.indexrelid WHERE NOT pg_index.indisvalid'
+            ).scalars().all()
+            declared = {index.name for table in db.metadata.sorted_tables for index in table.indexes}
+            for name in invalid:
+                if name in declared or name in dict(POSTGRESQL_DDL):
+                    logger.warning(f"Rebuilding invalid index {name} left by an interrupted build")
+                    connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+                    indexes.extend(index for table in db.metadata.sorted_tables for index in table.indexes
+                                   if index.name == name)
+
+        for index in indexes:
+            index.dialect_options['postgresql']['concurrently'] = postgres
+            try:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+                built.append(index.name)
+                logger.info(f"Created index {index.name}")
+            except Exception as e:
+                logger.warning(f"Could not create index {index.name}: {str(e)}")
+            finally:
+                index.dialect_options['postgresql']['concurrently'] = False
+
+        for name, statement in POSTGRESQL_DDL if postgres else []:
+            try:
+                connection.exec_driver_sql(statement)
+                built.append(name)
+            except Exception as e:
+                # pg_trgm needs a role allowed to create extensions; lookups still work without it
+                logger.warning(f"Could not apply {name}: {str(e)}")
+
+        if postgres:
+            connection.exec_driver_sql('RESET statement_timeout')
+
+    return built
+
+def run_migrations():
+    """Bring an existing database up to date with the current models"""
+    inspector = inspect(db.engine)
+    table_names = set(inspector.get_table_names())
+
+    added = _add_missing_columns(inspector, table_names)
+    if added:
+        logger.info(f"Added columns: {', '.join(added)}")
+
+    backfilled = _backfill(table_names)
+    if backfilled:
+        logger.info(f"Backfilled rows: {backfilled}")
+    if {'test_orders.result_numeric', 'test_orders.result_qualifier'} & set(added):
+        # Parsing every stored result is a long job, so like index builds it is left to the maintenance command
+        logger.warning("New typed result columns are empty; run: python migrations.py --backfill-results")
+
+    # Index builds lock writes or take minutes on big tables, so they never run at import
+    indexes = [index.name for index in missing_indexes(db.engine, table_names)]
+    if indexes:
+        logger.warning(f"Missing indexes {', '.join(indexes)}; run: python migrations.py --create-indexes")
+
+    return {'columns_added': added, 'rows_backfilled': backfilled, 'indexes_missing': indexes}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Schema maintenance tasks')
+    parser.add_argument('--create-indexes', action='store_true',
+                        help='build missing indexes (CONCURRENTLY on PostgreSQL, outside a transaction)')
+    parser.add_argument('--backfill-results', action='store_true',
+                        help='parse stored free-text results into the numeric columns, in batches; safe to re-run')
+    parser.add_argument('--batch-size', type=int, default=1000, help='test orders per --backfill-results batch')
+    args = parser.parse_args(argv)
+
+    if not args.create_indexes and not args.backfill_results:
+        parser.print_help()
+        return 2
+
+    from app import app
+
+    with app.app_context():
+        if args.create_indexes:
+            built = create_indexes()
+            print(f"Built {len(built)} index(es){': ' + ', '.join(built) if built else ''}")
+        if args.backfill_results:
+            print(f"Backfilled {backfill_results(args.batch_size)} result(s)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
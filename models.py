@@ -1,5 +1,7 @@
 from datetime import datetime
+from sqlalchemy import event, inspect, select
 from app import db
+from lab_results import numeric_fields
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class Laboratory(db.Model):
@@ -97,6 +99,20 @@ class Patient(db.Model):
     # Relationships
     test_orders = db.relationship('TestOrder', backref='patient', lazy=True)
     samples = db.relationship('Sample', backref='patient', lazy=True)
+    
+    # Typeahead lookups match prefixes of the lowercased names and identifiers; the pattern_ops
+    # classes let PostgreSQL use them for LIKE 'abc%' under any collation. The trigram index for
+    # substring matches is PostgreSQL-only and created in migrations.py.
+    __table_args__ = (
+        db.Index('ix_patients_lab_last_name_lower', 'laboratory_id', db.func.lower(last_name).label('last_name_lower'),
+                 postgresql_ops={'last_name_lower': 'text_pattern_ops'}),
+        db.Index('ix_patients_lab_first_name_lower', 'laboratory_id', db.func.lower(first_name).label('first_name_lower'),
+                 postgresql_ops={'first_name_lower': 'text_pattern_ops'}),
+        db.Index('ix_patients_patient_id_lower', db.func.lower(patient_id).label('patient_id_lower'),
+                 postgresql_ops={'patient_id_lower': 'text_pattern_ops'}),
+        db.Index('ix_patients_phone', 'phone', postgresql_ops={'phone': 'varchar_pattern_ops'}),
+        db.Index('ix_patients_national_id', 'national_id', postgresql_ops={'national_id': 'varchar_pattern_ops'}),
+    )
 
 class TestType(db.Model):
     __tablename__ = 'test_types'
@@ -113,6 +129,12 @@ class TestType(db.Model):
     turnaround_time = db.Column(db.Integer)  # in hours
     preparation_instructions = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True)
+    
+    # Delta check thresholds; NULL falls back to delta_checks.DEFAULT_DELTA_RULES
+    delta_absolute_limit = db.Column(db.Float)
+    delta_percent_limit = db.Column(db.Float)
+    delta_rate_limit = db.Column(db.Float)  # change per day
+    delta_window_days = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -130,6 +152,10 @@ class TestOrder(db.Model):
     status = db.Column(db.String(20), default='ordered')  # ordered, collected, processing, completed, reported
     result_value = db.Column(db.String(100))
     result_unit = db.Column(db.String(20))
+    result_numeric = db.Column(db.Float)  # parsed from result_value on write
+    result_qualifier = db.Column(db.String(2))  # <, <=, > or >= for censored results such as '<5'
+    result_si_value = db.Column(db.Float)  # result_numeric normalized to SI units
+    result_si_unit = db.Column(db.String(20))
     result_status = db.Column(db.String(20))  # normal, abnormal, critical
     result_notes = db.Column(db.Text)
     reference_range = db.Column(db.String(100))
@@ -138,13 +164,36 @@ class TestOrder(db.Model):
     processed_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
     reported_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     technician_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     verified_by = db.Column(db.Integer, db.ForeignKey('users.id'))
     
+    # Copied from the patient on insert so tenant-scoped queries need no join
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'))
+    
+    # Delta check against the patient's previous result for the same test
+    delta_flag = db.Column(db.String(20))  # pass, fail, no_prior, censored
+    delta_change = db.Column(db.Float)
+    delta_percent = db.Column(db.Float)
+    delta_rate = db.Column(db.Float)  # absolute change per day
+    delta_prior_order_id = db.Column(db.Integer, db.ForeignKey('test_orders.id'))
+    delta_checked_at = db.Column(db.DateTime)
+    
     # Relationships
     samples = db.relationship('Sample', backref='test_order', lazy=True)
     technician = db.relationship('User', foreign_keys=[technician_id], backref='processed_tests')
     verifier = db.relationship('User', foreign_keys=[verified_by], backref='verified_tests')
+    
+    __table_args__ = (
+        db.Index('ix_test_orders_lab_status_ordered', 'laboratory_id', 'status', 'ordered_at'),
+        db.Index('ix_test_orders_lab_ordered', 'laboratory_id', 'ordered_at', 'id'),
+        db.Index('ix_test_orders_lab_result_status', 'laboratory_id', 'result_status'),
+        db.Index('ix_test_orders_lab_completed', 'laboratory_id', 'completed_at'),
+        db.Index('ix_test_orders_patient_analyte_ordered', 'patient_id', 'test_type_id', 'ordered_at'),
+        db.Index('ix_test_orders_patient_ordered', 'patient_id', 'ordered_at', 'id'),
+        db.Index('ix_test_orders_number_lower', db.func.lower(order_number).label('order_number_lower'),
+                 postgresql_ops={'order_number_lower': 'text_pattern_ops'}),
+    )
 
 class Sample(db.Model):
     __tablename__ = 'samples'
@@ -169,6 +218,14 @@ class Sample(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Copied from the patient on insert so tenant-scoped queries need no join
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'))
+    
+    __table_args__ = (
+        db.Index('ix_samples_lab_status_collected', 'laboratory_id', 'status', 'collection_date'),
+        db.Index('ix_samples_lab_collected', 'laboratory_id', 'collection_date', 'id'),
+    )
 
 class Report(db.Model):
     __tablename__ = 'reports'
@@ -220,13 +277,58 @@ class Report(db.Model):
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     finalized_at = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
     
+    # Incremented by the ORM on every UPDATE; keys rendered-page caches
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    
+    # Copied from the patient on insert so tenant-scoped queries need no join
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'))
+    
     # Relationships
     patient = db.relationship('Patient', backref='reports')
     generator = db.relationship('User', foreign_keys=[generated_by], backref='generated_reports')
     reviewer = db.relationship('User', foreign_keys=[reviewed_by], backref='reviewed_reports')
+    
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        db.Index('ix_reports_lab_created', 'laboratory_id', 'created_at', 'id'),
+        db.Index('ix_reports_patient_created', 'patient_id', 'created_at', 'id'),
+    )
+
+@event.listens_for(TestOrder, 'before_insert')
+@event.listens_for(Sample, 'before_insert')
+@event.listens_for(Report, 'before_insert')
+def inherit_laboratory_id(mapper, connection, target):
+    """Keep the denormalized laboratory_id in step with the owning patient"""
+    if target.laboratory_id is not None:
+        return
+    
+    patient = target.__dict__.get('patient')
+    if patient is not None and patient.laboratory_id is not None:
+        target.laboratory_id = patient.laboratory_id
+    elif target.patient_id is not None:
+        target.laboratory_id = connection.execute(
+            select(Patient.laboratory_id).where(Patient.id == target.patient_id)
+        ).scalar()
+
+@event.listens_for(TestOrder, 'before_insert')
+@event.listens_for(TestOrder, 'before_update')
+def sync_numeric_result(mapper, connection, target):
+    """Derive the typed result columns whenever the free-text result changes"""
+    state = inspect(target)
+    if state.persistent and not (state.attrs.result_value.history.has_changes()
+                                 or state.attrs.result_unit.history.has_changes()):
+        return
+    
+    test_code, default_unit = connection.execute(
+        select(TestType.code, TestType.unit).where(TestType.id == target.test_type_id)
+    ).first() or (None, None)
+    
+    for column, value in numeric_fields(target.result_value, target.result_unit, test_code, default_unit).items():
+        setattr(target, column, value)
 
 class Settings(db.Model):
     __tablename__ = 'settings'
@@ -283,6 +385,7 @@ class Settings(db.Model):
     email_notifications = db.Column(db.Boolean, default=True)
     sms_notifications = db.Column(db.Boolean, default=False)
     critical_alerts_only = db.Column(db.Boolean, default=False)
+    critical_alert_phones = db.Column(db.Text)  # on-call numbers paged for critical results, comma separated
     
     # System Settings
     ai_analysis_language = db.Column(db.String(5), default='en')
@@ -314,3 +417,216 @@ class AuditLog(db.Model):
     
     # Relationships
     user = db.relationship('User', backref='audit_logs')
+
+class SyncCheckpoint(db.Model):
+    __tablename__ = 'sync_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'), nullable=False)
+    direction = db.Column(db.String(10), nullable=False)  # export, import
+    run_id = db.Column(db.String(36))
+    scope_hash = db.Column(db.String(40))  # which patients the run covers
+    cursor = db.Column(db.String(100))  # last acknowledged position
+    status = db.Column(db.String(20), default='running')  # running, completed, failed
+    
+    # Progress metrics
+    pages_done = db.Column(db.Integer, default=0)
+    records_done = db.Column(db.Integer, default=0)
+    bytes_raw = db.Column(db.BigInteger, default=0)
+    bytes_sent = db.Column(db.BigInteger, default=0)
+    retries = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('laboratory_id', 'direction', name='uq_sync_checkpoints_lab_direction'),
+    )
+    
+    def to_dict(self):
+        elapsed = ((self.completed_at or datetime.utcnow()) - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            'direction': self.direction,
+            'run_id': self.run_id,
+            'status': self.status,
+            'cursor': self.cursor,
+            'pages_done': self.pages_done,
+            'records_done': self.records_done,
+            'bytes_raw': self.bytes_raw,
+            'bytes_sent': self.bytes_sent,
+            'compression_ratio': round(self.bytes_raw / self.bytes_sent, 2) if self.bytes_sent else None,
+            'records_per_second': round(self.records_done / elapsed, 2) if elapsed > 0 else None,
+            'retries': self.retries,
+            'last_error': self.last_error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+class SyncRun(db.Model):
+    __tablename__ = 'sync_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'), nullable=False)
+    direction = db.Column(db.String(10), nullable=False)  # export, import, both
+    trigger = db.Column(db.String(20), default='schedule')  # schedule, manual
+    status = db.Column(db.String(20), default='queued')  # queued, running, succeeded, failed
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    host = db.Column(db.String(100))  # scheduler instance that ran it
+    records = db.Column(db.Integer)
+    result = db.Column(db.Text)  # JSON summary per direction
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    
+    __table_args__ = (
+        db.Index('ix_sync_runs_lab_created', 'laboratory_id', 'created_at'),
+        db.Index('ix_sync_runs_status', 'status'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'direction': self.direction,
+            'trigger': self.trigger,
+            'status': self.status,
+            'host': self.host,
+            'records': self.records,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_ms': self.duration_ms
+        }
+
+class SmsOutbox(db.Model):
+    __tablename__ = 'sms_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'), nullable=False)
+    recipient = db.Column(db.String(30), nullable=False)  # phone number as entered
+    audience = db.Column(db.String(10), default='patient')  # patient, staff
+    message_type = db.Column(db.String(50), nullable=False)  # test_ready, report_ready, critical_result, ...
+    entity_type = db.Column(db.String(30), nullable=False)  # what the message is about: test_order, report, ...
+    entity_id = db.Column(db.Integer, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    
+    # pending -> sending -> sent | failed | skipped | unknown (no answer from Twilio, so never resent);
+    # transient failures go back to pending
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    message_sid = db.Column(db.String(64))
+    delivery_status = db.Column(db.String(20))  # provider status: queued, sent, delivered, undelivered, failed
+    error_code = db.Column(db.String(20))
+    last_error = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    delivered_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        # The same notification about the same record is only ever sent once
+        db.UniqueConstraint('recipient', 'message_type', 'entity_type', 'entity_id', name='uq_sms_outbox_dedupe'),
+        db.Index('ix_sms_outbox_status_next', 'status', 'next_attempt_at'),
+        db.Index('ix_sms_outbox_message_sid', 'message_sid'),
+        db.Index('ix_sms_outbox_lab_created', 'laboratory_id', 'created_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'audience': self.audience,
+            'message_type': self.message_type,
+            'entity_type': self.entity_type,
+            'entity_id': self.entity_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'message_sid': self.message_sid,
+            'delivery_status': self.delivery_status,
+            'error_code': self.error_code,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None
+        }
+
+class CriticalAlert(db.Model):
+    __tablename__ = 'critical_alerts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'), nullable=False)
+    test_order_id = db.Column(db.Integer, db.ForeignKey('test_orders.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
+    test_type_id = db.Column(db.Integer, db.ForeignKey('test_types.id'), nullable=False)
+    result_value = db.Column(db.String(100))
+    result_unit = db.Column(db.String(20))
+    
+    # open -> acknowledged; a repeat for the same patient and test while one is open is suppressed
+    status = db.Column(db.String(20), nullable=False, default='open')
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('critical_alerts.id'))
+    pages_sent = db.Column(db.Integer, default=0)  # staff SMS queued for this alert
+    
+    # result_recorded_at is the flush that wrote the critical result; deliveries are measured from it
+    result_recorded_at = db.Column(db.DateTime, nullable=False)
+    sse_delivered_at = db.Column(db.DateTime)  # first push to a connected dashboard
+    acknowledged_at = db.Column(db.DateTime)
+    acknowledged_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_critical_alerts_lab_status', 'laboratory_id', 'status', 'created_at'),
+        db.Index('ix_critical_alerts_patient_test', 'patient_id', 'test_type_id', 'status'),
+        db.Index('ix_critical_alerts_order', 'test_order_id'),
+    )
+
+class IngestBatch(db.Model):
+    __tablename__ = 'ingest_batches'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    laboratory_id = db.Column(db.Integer, db.ForeignKey('laboratories.id'), nullable=False)
+    # SHA-256 of the file unless the uploader sent an Idempotency-Key; a key is only ever applied once
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    source = db.Column(db.String(20), default='upload')  # upload, drop_directory, hl7 (one row per message)
+    filename = db.Column(db.String(255))
+    instrument = db.Column(db.String(100))
+    rows_total = db.Column(db.Integer, default=0)
+    rows_applied = db.Column(db.Integer, default=0)
+    rows_unchanged = db.Column(db.Integer, default=0)  # same value already recorded
+    rows_dead_lettered = db.Column(db.Integer, default=0)
+    critical_results = db.Column(db.Integer, default=0)
+    dead_letter_path = db.Column(db.String(500))
+    uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    
+    __table_args__ = (
+        db.UniqueConstraint('laboratory_id', 'idempotency_key', name='uq_ingest_batches_lab_key'),
+        db.Index('ix_ingest_batches_lab_started', 'laboratory_id', 'started_at'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'idempotency_key': self.idempotency_key,
+            'source': self.source,
+            'filename': self.filename,
+            'instrument': self.instrument,
+            'rows_total': self.rows_total,
+            'rows_applied': self.rows_applied,
+            'rows_unchanged': self.rows_unchanged,
+            'rows_dead_lettered': self.rows_dead_lettered,
+            'critical_results': self.critical_results,
+            'dead_letter_path': self.dead_letter_path,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_ms': self.duration_ms
+        }
@@ -0,0 +1,170 @@
+"""
+Keyset Pagination Module
+Seek-based paging on (timestamp, id) with opaque cursors and planner-estimated totals
+"""
+import json
+import base64
+import logging
+from datetime import datetime, date
+from sqlalchemy import tuple_, func, and_, or_
+from app import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class InvalidCursor(ValueError):
+    """A cursor that was not produced by encode_cursor (tampered, truncated or from another list)"""
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+def encode_cursor(direction, row_key):
+    """Opaque, URL-safe cursor pointing just past row_key in the given direction"""
+    payload = json.dumps({'d': direction, 'k': [_encode_value(v) for v in row_key]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Return (direction, [timestamp, id]) for a cursor, or (None, None) when there is none
+
+    Raises InvalidCursor for anything encode_cursor could not have produced.
+    """
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        direction, key = payload['d'], [_decode_value(v) for v in payload['k']]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise InvalidCursor(f'Malformed cursor: {str(e)}')
+
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor('Cursor direction must be next or prev')
+    if len(key) != 2:
+        raise InvalidCursor('Cursor key must have exactly two values')
+    sort_value, id_value = key
+    if sort_value is not None and not isinstance(sort_value, (datetime, date)):
+        raise InvalidCursor('Cursor sort value must be a date or timestamp')
+    if not isinstance(id_value, int) or isinstance(id_value, bool):
+        raise InvalidCursor('Cursor id must be an integer')
+    return direction, key
+
+def estimate_count(query):
+    """Planner row estimate for a query on PostgreSQL; None on other databases"""
+    engine = db.session.get_bind()
+    if engine.dialect.name != 'postgresql':
+        return None
+
+    try:
+        compiled = query.order_by(None).statement.compile(dialect=engine.dialect)
+        result = db.session.connection().exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+        ).scalar()
+        plan = result if isinstance(result, list) else json.loads(result)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.warning(f"Row estimate failed: {str(e)}")
+        return None
+
+def exact_count(query):
+    """Exact COUNT(*) of a query, for callers that explicitly ask for it"""
+    return query.order_by(None).with_entities(func.count()).scalar()
+
+class KeysetPage:
+    """One page of keyset results plus the cursors for its neighbours"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None, total_is_estimate=True):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        return {
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'per_page': self.per_page,
+            'total': self.total,
+            'total_is_estimate': self.total_is_estimate
+        }
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=20, total='estimate'):
+    """Page through query newest-first on (sort_column, id_column) without OFFSET
+
+    Rows with a NULL sort value come first, as if newer than any other (PostgreSQL's own order
+    for DESC, so the (timestamp, id) indexes still serve it). total is 'estimate' (planner
+    estimate, PostgreSQL only), 'exact' (COUNT(*)) or None. Raises InvalidCursor for a bad cursor.
+    """
+    direction, key = decode_cursor(cursor)
+    row_key = tuple_(sort_column, id_column)
+    base_query = query
+    newest_first = (sort_column.desc().nulls_first(), id_column.desc())
+
+    if direction == 'next':
+        if key[0] is None:
+            query = query.filter(or_(and_(sort_column.is_(None), id_column < key[1]), sort_column.isnot(None)))
+        else:
+            query = query.filter(row_key < tuple_(*key))
+        query = query.order_by(*newest_first)
+    elif direction == 'prev':
+        if key[0] is None:
+            query = query.filter(sort_column.is_(None), id_column > key[1])
+        else:
+            query = query.filter(or_(row_key > tuple_(*key), sort_column.is_(None)))
+        query = query.order_by(sort_column.asc().nulls_last(), id_column.asc())
+    else:
+        query = query.order_by(*newest_first)
+
+    # Fetch one extra row to learn whether another page exists in this direction
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if direction == 'prev':
+        rows.reverse()
+
+    def key_of(item):
+        return (getattr(item, sort_column.key), getattr(item, id_column.key))
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if direction == 'prev':
+            next_cursor = encode_cursor('next', key_of(rows[-1]))
+            prev_cursor = encode_cursor('prev', key_of(rows[0])) if more else None
+        else:
+            next_cursor = encode_cursor('next', key_of(rows[-1])) if more else None
+            prev_cursor = encode_cursor('prev', key_of(rows[0])) if direction == 'next' else None
+
+    if total == 'exact':
+        total_value, is_estimate = exact_count(base_query), False
+    elif total == 'estimate':
+        total_value, is_estimate = estimate_count(base_query), True
+        if total_value is None:
+            # No planner estimates outside PostgreSQL (e.g. the SQLite dev database); those are small
+            total_value, is_estimate = exact_count(base_query), False
+    else:
+        total_value, is_estimate = None, True
+
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor, total_value, is_estimate)
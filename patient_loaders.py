@@ -0,0 +1,62 @@
+"""
+Patient Loaders Module
+Handles batch loading of each patient's latest test orders and reports in a single query
+"""
+import logging
+from collections import defaultdict
+from sqlalchemy import func
+from sqlalchemy.orm import aliased, joinedload
+from app import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def latest_per_patient_query(model, patient_ids, order_column, limit=None, eager=()):
+    """Query for up to `limit` newest rows of `model` per patient, newest first within each patient
+
+    Uses ROW_NUMBER() OVER (PARTITION BY patient_id ...) so the whole batch is one statement; with
+    limit=None every row is returned. `eager` names relationships to join-load in the same query.
+    Rows without a timestamp rank first, which is PostgreSQL's own DESC order, so the
+    (patient_id, timestamp, id) indexes serve the sort as in keyset_paginate.
+    """
+    ordering = (order_column.desc().nulls_first(), model.id.desc())
+
+    if limit is None:
+        query = db.session.query(model).filter(model.patient_id.in_(patient_ids))
+        query = query.options(*(joinedload(getattr(model, name)) for name in eager))
+        return query.order_by(model.patient_id, *ordering)
+
+    row_number = func.row_number().over(partition_by=model.patient_id, order_by=ordering).label('row_number')
+    ranked = db.session.query(model, row_number).filter(model.patient_id.in_(patient_ids)).subquery()
+    latest = aliased(model, ranked)
+
+    query = db.session.query(latest).filter(ranked.c.row_number <= limit)
+    query = query.options(*(joinedload(getattr(latest, name)) for name in eager))
+    return query.order_by(ranked.c.patient_id, ranked.c.row_number)
+
+def _group_by_patient(rows, patient_ids):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.patient_id].append(row)
+    return {patient_id: grouped.get(patient_id, []) for patient_id in patient_ids}
+
+def latest_test_orders(patient_ids, limit=None):
+    """{patient_id: [TestOrder, ...]} newest first, with test types loaded"""
+    from models import TestOrder
+
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return {}
+    query = latest_per_patient_query(TestOrder, patient_ids, TestOrder.ordered_at, limit, eager=('test_type',))
+    return _group_by_patient(query.all(), patient_ids)
+
+def latest_reports(patient_ids, limit=None):
+    """{patient_id: [Report, ...]} newest first"""
+    from models import Report
+
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return {}
+    query = latest_per_patient_query(Report, patient_ids, Report.created_at, limit)
+    return _group_by_patient(query.all(), patient_ids)
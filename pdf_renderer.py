@@ -0,0 +1,177 @@
+"""
+PDF Rendering Module
+Renders report HTML to PDF in a process pool and keeps finished PDFs in a content-addressed store
+"""
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _atomic_write(path, data):
+    """Write bytes to path via a temp file so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def render_pdf_file(html, base_url, target_path):
+    """Convert HTML to PDF and store it at target_path (runs inside a pool process)"""
+    # WeasyPrint shapes Persian/Arabic text with HarfBuzz and honours dir="rtl"
+    from weasyprint import HTML
+
+    pdf_bytes = HTML(string=html, base_url=base_url).write_pdf()
+    _atomic_write(target_path, pdf_bytes)
+    return len(pdf_bytes)
+
+class PDFArtifactStore:
+    """Content-addressed PDF blobs plus per-report pointers to the current blob"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'reports'), exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], f'{digest}.pdf')
+
+    def _pointer_path(self, report_id, variant):
+        return os.path.join(self.root, 'reports', str(report_id), variant)
+
+    def lookup(self, report_id, variant):
+        """Path of the stored PDF for this report variant, if one has been rendered"""
+        try:
+            with open(self._pointer_path(report_id, variant), 'r') as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return None
+
+        path = self.blob_path(digest)
+        return path if os.path.exists(path) else None
+
+    def link(self, report_id, variant, digest):
+        _atomic_write(self._pointer_path(report_id, variant), digest.encode('ascii'))
+
+    def invalidate_report(self, report_id):
+        """Forget every rendered variant of a report and delete its blobs"""
+        report_dir = os.path.join(self.root, 'reports', str(report_id))
+        if not os.path.isdir(report_dir):
+            return 0
+
+        digests = set()
+        for name in os.listdir(report_dir):
+            try:
+                with open(os.path.join(report_dir, name), 'r') as f:
+                    digests.add(f.read().strip())
+            except OSError:
+                continue
+        shutil.rmtree(report_dir, ignore_errors=True)
+
+        # The rendered HTML embeds the report number, so blobs are never shared between reports
+        removed = 0
+        for digest in digests:
+            try:
+                os.remove(self.blob_path(digest))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+class PDFRenderer:
+    """Renders report PDFs off the web threads and serves repeat downloads from disk"""
+
+    def __init__(self):
+        self.store = None
+        self.max_workers = 2
+        self.timeout = 20
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.RLock()
+        self._in_flight = {}
+
+    def init_app(self, app):
+        cache_dir = app.config.get('PDF_CACHE_DIR') or os.path.join(app.instance_path, 'pdf_cache')
+        self.store = PDFArtifactStore(cache_dir)
+        self.max_workers = int(app.config.get('PDF_RENDER_WORKERS', self.max_workers))
+        self.timeout = float(app.config.get('PDF_RENDER_TIMEOUT', self.timeout))
+        if not self.available:
+            logger.warning("WeasyPrint is not installed: report downloads fall back to the JSON export "
+                           "until it (and its Pango/HarfBuzz system libraries) is installed")
+
+    @property
+    def available(self):
+        """True when the PDF engine is installed in this environment"""
+        return importlib.util.find_spec('weasyprint') is not None
+
+    def _get_executor(self):
+        # gunicorn forks workers after import, so each worker process owns its own pool
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._executor_pid = os.getpid()
+                self._in_flight = {}
+            return self._executor
+
+    def cached_pdf(self, report_id, variant):
+        if self.store is None:
+            return None
+        return self.store.lookup(report_id, variant)
+
+    def render(self, report_id, variant, html, base_url=None):
+        """Render HTML to a stored PDF; returns its path, or None if still rendering after the timeout"""
+        digest = hashlib.sha256(html.encode('utf-8')).hexdigest()
+        target_path = self.store.blob_path(digest)
+
+        # Identical content was already rendered (e.g. for another variant)
+        if os.path.exists(target_path):
+            self.store.link(report_id, variant, digest)
+            return target_path
+
+        executor = self._get_executor()
+        with self._lock:
+            future = self._in_flight.get(digest)
+            if future is None:
+                future = executor.submit(render_pdf_file, html, base_url, target_path)
+                self._in_flight[digest] = future
+                future.add_done_callback(lambda f: self._finish(f, report_id, variant, digest))
+
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            logger.info(f"PDF for report {report_id} still rendering after {self.timeout}s")
+            return None
+
+        return target_path
+
+    def _finish(self, future, report_id, variant, digest):
+        with self._lock:
+            self._in_flight.pop(digest, None)
+
+        if future.exception() is not None:
+            logger.error(f"PDF rendering failed for report {report_id}: {future.exception()}")
+            return
+
+        self.store.link(report_id, variant, digest)
+
+    def invalidate_report(self, report_id):
+        if self.store is None:
+            return 0
+        try:
+            return self.store.invalidate_report(report_id)
+        except Exception as e:
+            logger.warning(f"PDF cache invalidation failed for report {report_id}: {str(e)}")
+            return 0
+
+pdf_renderer = PDFRenderer()
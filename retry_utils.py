@@ -0,0 +1,16 @@
+"""
+Retry Utilities Module
+Handles backoff delays and Retry-After parsing shared by the outbound HTTP integrations
+"""
+import random
+
+def backoff_delay(attempt, base=1.0, cap=60.0, retry_after=None):
+    """Exponential backoff with full jitter; honours a server-provided Retry-After"""
+    if retry_after is not None:
+        return min(cap, retry_after)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def retry_after_seconds(response):
+    """Retry-After of a response in seconds, or None when absent or given as an HTTP date"""
+    header = response.headers.get('Retry-After')
+    return float(header) if header and header.isdigit() else None
@@ -1,18 +1,38 @@
 import os
+import csv
 import json
+import hashlib
+import time
+import logging
 from datetime import datetime, date, timedelta
-from flask import render_template, request, redirect, url_for, flash, session, jsonify, send_file, make_response
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, send_file, make_response, abort, Response, stream_with_context
+from markupsafe import Markup
 from werkzeug.security import check_password_hash, generate_password_hash
-from sqlalchemy import func, desc, and_, or_
+from sqlalchemy import func, desc, and_, or_, true
 from werkzeug.utils import secure_filename
 import pandas as pd
 import io
 from app import app, db
-from models import Laboratory, User, Patient, TestType, TestOrder, Sample, Report, AuditLog, Settings
+from fragment_cache import fragment_cache
+from pdf_renderer import pdf_renderer
+from pagination import keyset_paginate, estimate_count, exact_count, InvalidCursor
+from patient_loaders import latest_test_orders, latest_reports
+from lab_results import trend_chart_data
+from delta_checks import check_result
+from http_caching import make_etag, latest, is_not_modified, not_modified_response, set_validators, conditional
+from models import Laboratory, User, Patient, TestType, TestOrder, Sample, Report, AuditLog, Settings, SyncRun, SmsOutbox, CriticalAlert, IngestBatch
 from translations import get_all_translations
 from ai_services import test_openai_connection, test_claude_connection, test_gemini_connection, test_openrouter_connection, generate_medical_analysis
-from sms_service import test_twilio_connection, send_patient_notification, send_staff_alert
-from medisina_api import test_medisina_connection, export_to_medisina, import_from_medisina
+from sms_service import test_twilio_connection, valid_twilio_signature
+from sms_outbox import enqueue_sms, record_delivery_status, outbox_stats
+from critical_alerts import alert_broker, alert_payload, mark_sse_delivered, acknowledge_alert, alert_latency_report
+from medisina_api import test_medisina_connection, export_to_medisina, import_from_medisina, export_progress
+from sync_scheduler import queue_sync
+from accession import accession_samples, SAMPLE_FIELDS
+from instrument_ingest import ingest_stream, file_key
+from lookup import lookup_limit, search_patients, search_open_orders, patient_option, order_option
+from health import health_monitor
+from metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 def login_required(f):
     """Decorator to require login for protected routes"""
@@ -52,24 +72,25 @@ def landing():
     """Landing page for مدیسیتا (Medisita)"""
     return render_template('landing.html')
 
+@app.route('/livez')
+def liveness_check():
+    """Liveness probe: answers from memory, never touches a dependency"""
+    return jsonify(health_monitor.liveness()), 200
+
+@app.route('/readyz')
 @app.route('/health')
-def health_check():
-    """Health check endpoint for Docker and load balancers"""
-    try:
-        # Check database connection
-        db.session.execute(db.text('SELECT 1'))
-        return jsonify({
-            'status': 'healthy',
-            'timestamp': datetime.now().isoformat(),
-            'version': '1.0.0',
-            'database': 'connected'
-        }), 200
-    except Exception as e:
-        return jsonify({
-            'status': 'unhealthy',
-            'timestamp': datetime.now().isoformat(),
-            'error': str(e)
-        }), 503
+def readiness_check():
+    """Readiness probe for load balancers; 503 when the database is down or this worker is saturated"""
+    report = health_monitor.readiness()
+    report.update(timestamp=datetime.now().isoformat(), version='1.0.0')
+    response = jsonify(report)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if report['ready'] else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint, merged across the gunicorn workers of this replica"""
+    return Response(metrics.exposition(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/home')
 def index():
@@ -158,16 +179,20 @@ def dashboard():
     """Main dashboard"""
     user = get_current_user()
     
-    # Get dashboard statistics
-    total_tests = TestOrder.query.filter_by().count()
-    pending_results = TestOrder.query.filter_by(status='processing').count()
-    completed_today = TestOrder.query.filter(
-        func.date(TestOrder.completed_at) == date.today()
+    # Get dashboard statistics (scoped to the user's laboratory)
+    lab_orders = TestOrder.query.filter(TestOrder.laboratory_id == user.laboratory_id)
+    today_start = datetime.combine(date.today(), datetime.min.time())
+    
+    total_tests = lab_orders.count()
+    pending_results = lab_orders.filter(TestOrder.status == 'processing').count()
+    completed_today = lab_orders.filter(
+        TestOrder.completed_at >= today_start,
+        TestOrder.completed_at < today_start + timedelta(days=1)
     ).count()
-    critical_values = TestOrder.query.filter_by(result_status='critical').count()
+    critical_values = lab_orders.filter(TestOrder.result_status == 'critical').count()
     
     # Get recent activity (last 10 test orders)
-    recent_tests = TestOrder.query.join(Patient).join(TestType).order_by(
+    recent_tests = lab_orders.join(Patient).join(TestType).order_by(
         desc(TestOrder.ordered_at)
     ).limit(10).all()
     
@@ -175,14 +200,19 @@ def dashboard():
     test_distribution = db.session.query(
         TestType.category,
         func.count(TestOrder.id).label('count')
-    ).join(TestOrder).group_by(TestType.category).all()
+    ).join(TestOrder).filter(
+        TestOrder.laboratory_id == user.laboratory_id
+    ).group_by(TestType.category).all()
     
-    # Get monthly trends (last 6 months) - PostgreSQL compatible
+    # Get monthly trends (last 6 months)
     six_months_ago = datetime.utcnow() - timedelta(days=180)
     monthly_trends = db.session.query(
-        func.to_char(TestOrder.ordered_at, 'YYYY-MM').label('month'),
+        _year_month(TestOrder.ordered_at).label('month'),
         func.count(TestOrder.id).label('count')
-    ).filter(TestOrder.ordered_at >= six_months_ago).group_by('month').all()
+    ).filter(
+        TestOrder.laboratory_id == user.laboratory_id,
+        TestOrder.ordered_at >= six_months_ago
+    ).group_by('month').all()
     
     stats = {
         'total_tests': total_tests,
@@ -204,9 +234,22 @@ def dashboard():
 def patients():
     """Patients list page"""
     user = get_current_user()
-    page = request.args.get('page', 1, type=int)
     search = request.args.get('search', '')
     
+    patients_pagination = keyset_paginate(
+        _patients_query(user, search), Patient.created_at, Patient.id,
+        cursor=request.args.get('cursor'), per_page=20, total=_pagination_total_mode()
+    )
+    
+    return render_template('patients.html', 
+                         user=user,
+                         patients=patients_pagination.items,
+                         pagination=patients_pagination,
+                         search=search,
+                         translations=get_all_translations(session.get('language', 'en')))
+
+def _patients_query(user, search=''):
+    """Lab-scoped patient query with the list page's search filter"""
     query = Patient.query.filter_by(laboratory_id=user.laboratory_id)
     
     if search:
@@ -220,16 +263,14 @@ def patients():
             )
         )
     
-    patients_pagination = query.order_by(desc(Patient.created_at)).paginate(
-        page=page, per_page=20, error_out=False
-    )
-    
-    return render_template('patients.html', 
-                         user=user,
-                         patients=patients_pagination.items,
-                         pagination=patients_pagination,
-                         search=search,
-                         translations=get_all_translations(session.get('language', 'en')))
+    return query
+
+def _pagination_total_mode():
+    """Lists show planner-estimated totals unless the caller asks for ?total=exact or ?total=none"""
+    mode = request.args.get('total', 'estimate')
+    if mode == 'none':
+        return None
+    return mode if mode in ('estimate', 'exact') else 'estimate'
 
 @app.route('/patients/add', methods=['GET', 'POST'])
 @login_required
@@ -303,37 +344,40 @@ def add_patient():
 def tests():
     """Test orders page"""
     user = get_current_user()
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
     
-    query = TestOrder.query.join(Patient).filter(
-        Patient.laboratory_id == user.laboratory_id
-    )
-    
-    if status_filter:
-        query = query.filter(TestOrder.status == status_filter)
-    
-    test_orders = query.order_by(desc(TestOrder.ordered_at)).paginate(
-        page=page, per_page=20, error_out=False
+    test_orders = keyset_paginate(
+        _test_orders_query(user, status_filter), TestOrder.ordered_at, TestOrder.id,
+        cursor=request.args.get('cursor'), per_page=20, total=_pagination_total_mode()
     )
     
     # Get available test types
     test_types = TestType.query.filter_by(is_active=True).all()
     
-    # Get patients for new order form
-    patients_list = Patient.query.filter_by(laboratory_id=user.laboratory_id).order_by(
-        Patient.first_name, Patient.last_name
-    ).all()
-    
+    # Patients for the new order form are looked up as the user types (/api/lookup/patients)
     return render_template('tests.html',
                          user=user,
                          test_orders=test_orders.items,
                          pagination=test_orders,
                          test_types=test_types,
-                         patients=patients_list,
                          status_filter=status_filter,
                          translations=get_all_translations(session.get('language', 'en')))
 
+def _year_month(column):
+    """'YYYY-MM' of a timestamp column; SQLite (dev and load-test databases) has no to_char"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.strftime('%Y-%m', column)
+    return func.to_char(column, 'YYYY-MM')
+
+def _test_orders_query(user, status_filter=''):
+    """Lab-scoped test order query with the list page's status filter"""
+    query = TestOrder.query.filter(TestOrder.laboratory_id == user.laboratory_id)
+    
+    if status_filter:
+        query = query.filter(TestOrder.status == status_filter)
+    
+    return query
+
 @app.route('/tests/add', methods=['POST'])
 @login_required
 def add_test_order():
@@ -365,39 +409,96 @@ def add_test_order():
     flash('Test order created successfully!', 'success')
     return redirect(url_for('tests'))
 
+@app.route('/api/tests/<int:order_id>/result', methods=['POST'])
+@login_required
+def api_record_result(order_id):
+    """Record a test result and delta-check it against the patient's previous result"""
+    user = get_current_user()
+    test_order = TestOrder.query.filter_by(id=order_id, laboratory_id=user.laboratory_id).first_or_404()
+    data = request.get_json(silent=True) or request.form
+    
+    result_value = (data.get('result_value') or '').strip()
+    if not result_value:
+        return jsonify({'success': False, 'error': 'result_value is required'}), 400
+    
+    old_values = {'result_value': test_order.result_value, 'result_unit': test_order.result_unit}
+    test_order.result_value = result_value
+    test_order.result_unit = data.get('result_unit') or test_order.result_unit
+    test_order.result_status = data.get('result_status') or test_order.result_status
+    test_order.result_notes = data.get('result_notes') or test_order.result_notes
+    test_order.status = 'completed'
+    test_order.completed_at = test_order.completed_at or datetime.utcnow()
+    
+    # Flush so the typed numeric columns are derived before comparing
+    db.session.flush()
+    check_result(test_order)
+    _queue_patient_sms(test_order.laboratory_id, test_order.patient, 'test_ready', {
+        'test_number': test_order.order_number,
+        'date': test_order.completed_at.strftime('%Y-%m-%d')
+    }, 'test_order', test_order.id)
+    db.session.commit()
+    
+    log_activity("Test Result Recorded", "test_orders", test_order.id, old_values, {
+        'result_value': test_order.result_value,
+        'result_unit': test_order.result_unit,
+        'delta_flag': test_order.delta_flag
+    })
+    
+    return jsonify({
+        'success': True,
+        'order_id': test_order.id,
+        'result_numeric': test_order.result_numeric,
+        'result_si_value': test_order.result_si_value,
+        'result_si_unit': test_order.result_si_unit,
+        'delta': {
+            'flag': test_order.delta_flag,
+            'change': test_order.delta_change,
+            'percent': test_order.delta_percent,
+            'rate_per_day': test_order.delta_rate,
+            'prior_order_id': test_order.delta_prior_order_id
+        }
+    })
+
+def _queue_patient_sms(laboratory_id, patient, message_type, data, entity_type, entity_id):
+    """Queue a patient SMS in the current transaction if the lab sends patient notifications"""
+    settings = Settings.query.filter_by(laboratory_id=laboratory_id).first()
+    if not settings or not settings.sms_enabled or not settings.sms_notifications or not patient.phone:
+        return False
+    if settings.critical_alerts_only and message_type != 'critical_result':
+        return False
+    
+    data = dict(data, patient_name=f"{patient.first_name} {patient.last_name}")
+    return enqueue_sms(laboratory_id, patient.phone, message_type, data, entity_type, entity_id)
+
 @app.route('/samples')
 @login_required
 def samples():
     """Sample tracking page"""
     user = get_current_user()
-    page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
     
-    query = Sample.query.join(TestOrder).join(Patient).filter(
-        Patient.laboratory_id == user.laboratory_id
+    samples_pagination = keyset_paginate(
+        _samples_query(user, status_filter), Sample.collection_date, Sample.id,
+        cursor=request.args.get('cursor'), per_page=20, total=_pagination_total_mode()
     )
     
-    if status_filter:
-        query = query.filter(Sample.status == status_filter)
-    
-    samples_pagination = query.order_by(desc(Sample.collection_date)).paginate(
-        page=page, per_page=20, error_out=False
-    )
-    
-    # Get test orders for new sample form
-    test_orders = TestOrder.query.join(Patient).filter(
-        Patient.laboratory_id == user.laboratory_id,
-        TestOrder.status.in_(['pending', 'processing'])
-    ).all()
-    
+    # Test orders for the new sample form are looked up as the user types (/api/lookup/orders)
     return render_template('samples.html',
                          user=user,
                          samples=samples_pagination.items,
-                         test_orders=test_orders,
                          pagination=samples_pagination,
                          status_filter=status_filter,
                          translations=get_all_translations(session.get('language', 'en')))
 
+def _samples_query(user, status_filter=''):
+    """Lab-scoped sample query with the list page's status filter"""
+    query = Sample.query.filter(Sample.laboratory_id == user.laboratory_id)
+    
+    if status_filter:
+        query = query.filter(Sample.status == status_filter)
+    
+    return query
+
 @app.route('/reports')
 @login_required
 def reports():
@@ -405,8 +506,8 @@ def reports():
     user = get_current_user()
     
     # Get recent reports
-    recent_reports = Report.query.join(Patient).filter(
-        Patient.laboratory_id == user.laboratory_id
+    recent_reports = Report.query.filter(
+        Report.laboratory_id == user.laboratory_id
     ).order_by(desc(Report.created_at)).limit(10).all()
     
     return render_template('reports.html',
@@ -465,15 +566,19 @@ def add_sample():
 def patient_reports():
     """Patient reports management page with import/export functionality"""
     user = get_current_user()
-    page = request.args.get('page', 1, type=int)
     
     # Get patients with pagination
-    patients_query = Patient.query.filter_by(laboratory_id=user.laboratory_id).order_by(desc(Patient.created_at))
-    patients_pagination = patients_query.paginate(page=page, per_page=15, error_out=False)
+    patients_pagination = keyset_paginate(
+        _patients_query(user), Patient.created_at, Patient.id,
+        cursor=request.args.get('cursor'), per_page=15, total='estimate'
+    )
     
-    # Get statistics
-    total_patients = Patient.query.filter_by(laboratory_id=user.laboratory_id).count()
-    total_reports = Report.query.join(Patient).filter(Patient.laboratory_id == user.laboratory_id).count()
+    # Get statistics (planner estimates on PostgreSQL instead of full COUNT(*) scans)
+    total_patients = patients_pagination.total
+    reports_query = Report.query.filter(Report.laboratory_id == user.laboratory_id)
+    total_reports = estimate_count(reports_query)
+    if total_reports is None:
+        total_reports = exact_count(reports_query)
     imports_today = AuditLog.query.filter(
         AuditLog.action.like('%Import%'),
         func.date(AuditLog.timestamp) == date.today()
@@ -560,12 +665,21 @@ def export_patient_reports():
         export_format = request.args.get('format', 'json')
         
         if patient_id:
-            patient = Patient.query.get_or_404(patient_id)
-            if patient.laboratory_id != user.laboratory_id:
+            stamp = _patient_export_stamp(patient_id)
+            if not stamp:
+                abort(404)
+            if stamp.laboratory_id != user.laboratory_id:
                 flash('Access denied', 'error')
                 return redirect(url_for('patient_reports'))
             
-            return _export_single_patient(patient, export_format, user)
+            etag = make_etag('patient-export', patient_id, export_format, *stamp)
+            last_modified = latest(stamp.patient_updated_at, stamp.orders_updated_at, stamp.reports_updated_at)
+            
+            def build_export():
+                patient = Patient.query.get_or_404(patient_id)
+                return _export_single_patient(patient, export_format, user)
+            
+            return conditional(etag, last_modified, build_export)
     
     # Handle POST request for bulk export
     export_format = request.form.get('export_format')
@@ -620,6 +734,34 @@ def export_patient_reports():
         flash(f'Export failed: {str(e)}', 'error')
         return redirect(url_for('patient_reports'))
 
+def _patient_export_stamp(patient_id):
+    """Version stamp of everything a single-patient export contains, without loading the rows"""
+    return _patient_export_stamp_query(patient_id).first()
+
+def _patient_export_stamp_query(patient_id):
+    orders = db.session.query(
+        func.count(TestOrder.id).label('order_count'),
+        func.max(func.coalesce(TestOrder.updated_at, TestOrder.ordered_at)).label('orders_updated_at')
+    ).filter(TestOrder.patient_id == patient_id).subquery()
+    
+    reports = db.session.query(
+        func.count(Report.id).label('report_count'),
+        func.coalesce(func.sum(Report.version), 0).label('report_versions'),
+        func.max(func.coalesce(Report.updated_at, Report.created_at)).label('reports_updated_at')
+    ).filter(Report.patient_id == patient_id).subquery()
+    
+    return db.session.query(
+        Patient.laboratory_id,
+        Patient.updated_at.label('patient_updated_at'),
+        orders.c.order_count,
+        orders.c.orders_updated_at,
+        reports.c.report_count,
+        reports.c.report_versions,
+        reports.c.reports_updated_at
+    ).select_from(Patient).join(orders, true()).join(reports, true()).filter(
+        Patient.id == patient_id
+    )
+
 def _import_from_json(data, user, validate_data):
     """Import patients from JSON data"""
     imported_count = 0
@@ -808,9 +950,10 @@ def _export_single_patient(patient, export_format, user):
             basic_df.to_excel(writer, sheet_name='Patient Info', index=False)
             
             # Test results
-            if patient.test_orders:
+            test_orders = latest_test_orders([patient.id])[patient.id]
+            if test_orders:
                 test_data = []
-                for test_order in patient.test_orders:
+                for test_order in test_orders:
                     test_data.append({
                         'Order Number': test_order.order_number,
                         'Test Type': test_order.test_type.name if test_order.test_type else '',
@@ -827,9 +970,10 @@ def _export_single_patient(patient, export_format, user):
                     test_df.to_excel(writer, sheet_name='Test Results', index=False)
             
             # Reports
-            if patient.reports:
+            reports = latest_reports([patient.id])[patient.id]
+            if reports:
                 report_data = []
-                for report in patient.reports:
+                for report in reports:
                     report_data.append({
                         'Report Number': report.report_number,
                         'Type': report.report_type,
@@ -927,9 +1071,10 @@ def _export_patients_excel(patients, include_fields, user):
         
         # Test results sheet
         if 'test_results' in include_fields:
+            orders_by_patient = latest_test_orders([patient.id for patient in patients])
             test_data = []
             for patient in patients:
-                for test_order in patient.test_orders:
+                for test_order in orders_by_patient[patient.id]:
                     test_data.append({
                         'Patient ID': patient.patient_id,
                         'Patient Name': f"{patient.first_name} {patient.last_name}",
@@ -949,9 +1094,10 @@ def _export_patients_excel(patients, include_fields, user):
         
         # Reports sheet
         if 'reports' in include_fields:
+            reports_by_patient = latest_reports([patient.id for patient in patients])
             report_data = []
             for patient in patients:
-                for report in patient.reports:
+                for report in reports_by_patient[patient.id]:
                     report_data.append({
                         'Patient ID': patient.patient_id,
                         'Patient Name': f"{patient.first_name} {patient.last_name}",
@@ -986,6 +1132,11 @@ def _format_patient_data(patients, include_fields):
     """Format patient data for export"""
     patients_data = []
     
+    # Orders (with test types) and reports for all patients up front, instead of lazy loads per patient
+    patient_ids = [patient.id for patient in patients]
+    orders_by_patient = latest_test_orders(patient_ids) if 'test_results' in include_fields else {}
+    reports_by_patient = latest_reports(patient_ids) if 'reports' in include_fields else {}
+    
     for patient in patients:
         patient_dict = {}
         
@@ -1014,7 +1165,7 @@ def _format_patient_data(patients, include_fields):
         
         if 'test_results' in include_fields:
             test_results = []
-            for test_order in patient.test_orders:
+            for test_order in orders_by_patient[patient.id]:
                 test_results.append({
                     'order_number': test_order.order_number,
                     'test_type': test_order.test_type.name if test_order.test_type else None,
@@ -1029,7 +1180,7 @@ def _format_patient_data(patients, include_fields):
         
         if 'reports' in include_fields:
             reports = []
-            for report in patient.reports:
+            for report in reports_by_patient[patient.id]:
                 reports.append({
                     'report_number': report.report_number,
                     'report_type': report.report_type,
@@ -1044,6 +1195,34 @@ def _format_patient_data(patients, include_fields):
     
     return patients_data
 
+@app.route('/api/samples/accession', methods=['POST'])
+@login_required
+def api_accession_samples():
+    """Accession a rack of scanned tubes in one request"""
+    user = get_current_user()
+    data = request.get_json(silent=True) or {}
+    
+    collected_at = None
+    if data.get('collected_at'):
+        try:
+            collected_at = datetime.fromisoformat(data['collected_at'])
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'collected_at must be an ISO 8601 timestamp'}), 400
+    
+    defaults = {field: data.get(field) for field in SAMPLE_FIELDS if data.get(field)}
+    defaults.setdefault('collected_by', user.full_name)
+    result = accession_samples(user.laboratory_id, data.get('items'), defaults, collected_at)
+    if not result['success']:
+        return jsonify(result), 400
+    
+    log_activity("Samples Accessioned", "samples", None, None, {
+        'accepted': result['accepted'],
+        'rejected': result['rejected'],
+        'sample_ids': [item['sample_id'] for item in result['results'] if item['success']]
+    })
+    
+    return jsonify(result)
+
 @app.route('/reports/generate', methods=['GET', 'POST'])
 @login_required
 def generate_report():
@@ -1052,11 +1231,13 @@ def generate_report():
     
     # Handle GET request to display the page
     if request.method == 'GET':
-        # Get all patients for the dropdown
-        patients = Patient.query.filter_by(laboratory_id=user.laboratory_id).all()
+        # The patient picker searches /api/lookup/patients; only whether the lab has any patient is needed here
+        has_patients = db.session.query(
+            Patient.query.filter_by(laboratory_id=user.laboratory_id).exists()
+        ).scalar()
         return render_template('generate_report.html',
                              user=user,
-                             patients=patients,
+                             has_patients=has_patients,
                              translations=get_all_translations(user.language if user and hasattr(user, 'language') else 'en'))
     
     # Handle POST request to generate report
@@ -1081,7 +1262,7 @@ def generate_report():
         'allergies': patient.allergies,
         'current_symptoms': patient.current_symptoms,
         'disease_type': patient.disease_type,
-        'chief_complaint': patient.chief_complaint,
+        'chief_complaint': getattr(patient, 'chief_complaint', None),
         'pain_description': patient.pain_description,
         'test_reason': patient.test_reason
     }
@@ -1097,7 +1278,8 @@ def generate_report():
             'date': test_order.completed_at.strftime('%Y-%m-%d') if test_order.completed_at else None
         })
     
-    # Generate AI analysis
+    # Generate AI analysis (ai_reports builds its OpenAI client at import, so not at module level)
+    from ai_reports import generate_patient_report_analysis
     ai_analysis = generate_patient_report_analysis(patient_data, test_data)
     
     if ai_analysis['success']:
@@ -1126,6 +1308,10 @@ def generate_report():
         )
         
         db.session.add(report)
+        db.session.flush()
+        _queue_patient_sms(report.laboratory_id, patient, 'report_ready', {
+            'report_number': report.report_number
+        }, 'report', report.id)
         db.session.commit()
         
         log_activity("AI Report Generated", "reports", report.id, None, {
@@ -1145,53 +1331,80 @@ def generate_report():
 def view_report(report_id):
     """View individual report"""
     user = get_current_user()
-    
-    report = Report.query.get_or_404(report_id)
-    
-    # Parse AI analysis from new fields
-    ai_analysis = {
-        'overall_assessment': report.overall_assessment,
-        'individual_tests': json.loads(report.individual_tests) if report.individual_tests else {},
-        'probable_diseases': json.loads(report.probable_diseases) if report.probable_diseases else {},
-        'recommendations': json.loads(report.recommendations) if report.recommendations else [],
-        'red_flags': json.loads(report.red_flags) if report.red_flags else [],
-        'interpretation': report.interpretation,
-        'follow_up': report.follow_up
-    }
-    
-    # Check if this should be the comprehensive format
-    if report.report_type == 'comprehensive':
-        from datetime import date
-        return render_template('comprehensive_report.html',
+    language = user.language if user and hasattr(user, 'language') else 'en'
+    
+    # Look up only the columns needed to build the cache key and validators
+    report_meta = db.session.query(
+        Report.version, Report.report_type, Report.updated_at, Report.created_at
+    ).filter(Report.id == report_id).first()
+    if not report_meta:
+        abort(404)
+    
+    comprehensive = report_meta.report_type == 'comprehensive'
+    template_name = 'comprehensive_report.html' if comprehensive else '_report_detail_body.html'
+    template_hash = fragment_cache.template_hash(app.jinja_env, template_name)
+    cache_key = fragment_cache.report_key(report_id, report_meta.version, language, template_hash)
+    etag = make_etag('report', report_id, report_meta.version, language, template_hash)
+    last_modified = latest(report_meta.updated_at, report_meta.created_at)
+    
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    def render_fragment():
+        report = Report.query.get_or_404(report_id)
+        ai_analysis = _report_ai_analysis(report)
+        
+        return render_template(template_name,
                              user=user,
                              report=report,
                              ai_analysis=ai_analysis,
                              date=date,
-                             translations=get_all_translations(user.language if user and hasattr(user, 'language') else 'en'))
+                             translations=get_all_translations(language))
+    
+    report_body = fragment_cache.get_or_render(cache_key, render_fragment)
+    
+    # The comprehensive format is a standalone page; others are wrapped in the app layout
+    if comprehensive:
+        response = make_response(report_body)
     else:
-        return render_template('report_detail.html',
-                             user=user,
-                             report=report,
-                             ai_analysis=ai_analysis,
-                             translations=get_all_translations(user.language if user and hasattr(user, 'language') else 'en'))
+        response = make_response(render_template('report_detail.html',
+                                                 user=user,
+                                                 report_body=Markup(report_body),
+                                                 translations=get_all_translations(language)))
+    
+    return set_validators(response, etag, last_modified)
 
 @app.route('/reports/<int:report_id>/download')
 @login_required
 def download_report(report_id):
-    """Download report as PDF"""
+    """Download report as PDF (or JSON with ?format=json)"""
     user = get_current_user()
-    report = Report.query.get_or_404(report_id)
+    export_format = request.args.get('format', 'pdf')
+    use_pdf = export_format == 'pdf' and pdf_renderer.available
+    
+    # The download embeds the patient's name and age, so their row's timestamp is part of the version
+    report_meta = db.session.query(
+        Report.report_number, Report.version, Report.updated_at, Report.created_at,
+        Patient.updated_at.label('patient_updated_at')
+    ).join(Patient, Report.patient_id == Patient.id).filter(Report.id == report_id).first()
+    if not report_meta:
+        abort(404)
+    
+    if use_pdf:
+        template_hash = fragment_cache.template_hash(app.jinja_env, 'report_pdf.html')
+        etag = make_etag('report-pdf', report_id, report_meta.version, report_meta.patient_updated_at, template_hash)
+    else:
+        etag = make_etag('report-download', report_id, report_meta.version, report_meta.patient_updated_at, date.today())
+    last_modified = latest(report_meta.updated_at, report_meta.created_at, report_meta.patient_updated_at)
     
-    # For now, return JSON format - can be extended to PDF generation
-    ai_analysis = {
-        'overall_assessment': report.overall_assessment,
-        'individual_tests': json.loads(report.individual_tests) if report.individual_tests else {},
-        'probable_diseases': json.loads(report.probable_diseases) if report.probable_diseases else {},
-        'recommendations': json.loads(report.recommendations) if report.recommendations else [],
-        'red_flags': json.loads(report.red_flags) if report.red_flags else [],
-        'interpretation': report.interpretation,
-        'follow_up': report.follow_up
-    }
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    if use_pdf:
+        return _download_report_pdf(report_id, report_meta.report_number, etag, last_modified)
+    
+    report = Report.query.get_or_404(report_id)
+    ai_analysis = _report_ai_analysis(report)
     
     from flask import Response
     
@@ -1213,7 +1426,56 @@ def download_report(report_id):
         headers={'Content-Disposition': f'attachment; filename=report_{report.report_number}.json'}
     )
     
-    return response
+    return set_validators(response, etag, last_modified)
+
+def _download_report_pdf(report_id, report_number, etag, last_modified):
+    """Serve the stored PDF for this report version, rendering it in the PDF pool on first request"""
+    # The ETag already identifies report version, patient data and template, so it doubles as the variant key
+    pdf_path = pdf_renderer.cached_pdf(report_id, etag)
+    
+    if not pdf_path:
+        report = Report.query.get_or_404(report_id)
+        html = render_template('report_pdf.html',
+                             report=report,
+                             ai_analysis=_report_ai_analysis(report),
+                             date=date)
+        try:
+            pdf_path = pdf_renderer.render(report_id, etag, html)
+        except Exception as e:
+            logging.error(f"PDF rendering failed for report {report_id}: {str(e)}")
+            return jsonify({'success': False, 'error': f'PDF rendering failed: {str(e)}'}), 500
+        
+        if not pdf_path:
+            # Rendering continues in the pool; the client retries and then gets the stored file
+            if request.accept_mimetypes.accept_html and not request.accept_mimetypes.accept_json:
+                response = make_response('<meta http-equiv="refresh" content="2">Generating PDF...', 202)
+            else:
+                response = jsonify({'success': True, 'status': 'rendering', 'message': 'PDF is being generated'})
+                response.status_code = 202
+            response.headers['Retry-After'] = '2'
+            return response
+    
+    response = send_file(
+        pdf_path,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f'report_{report_number}.pdf',
+        etag=False,
+        conditional=False
+    )
+    return set_validators(response, etag, last_modified)
+
+def _report_ai_analysis(report):
+    """Parse the report's stored AI analysis JSON fields"""
+    return {
+        'overall_assessment': report.overall_assessment,
+        'individual_tests': json.loads(report.individual_tests) if report.individual_tests else {},
+        'probable_diseases': json.loads(report.probable_diseases) if report.probable_diseases else {},
+        'recommendations': json.loads(report.recommendations) if report.recommendations else [],
+        'red_flags': json.loads(report.red_flags) if report.red_flags else [],
+        'interpretation': report.interpretation,
+        'follow_up': report.follow_up
+    }
 
 @app.route('/reports/<int:report_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -1230,6 +1492,8 @@ def edit_report(report_id):
         report.follow_up = request.form.get('follow_up', report.follow_up)
         
         db.session.commit()
+        fragment_cache.invalidate_report(report.id)
+        pdf_renderer.invalidate_report(report.id)
         flash('Report updated successfully!', 'success')
         return redirect(url_for('view_report', report_id=report.id))
     
@@ -1265,6 +1529,8 @@ def delete_report(report_id):
     
     db.session.delete(report)
     db.session.commit()
+    fragment_cache.invalidate_report(report_id)
+    pdf_renderer.invalidate_report(report_id)
     
     flash('Report deleted successfully!', 'success')
     return redirect(url_for('reports'))
@@ -1389,6 +1655,7 @@ def integration_settings():
         settings.email_notifications = request.form.get('email_notifications') == 'on'
         settings.sms_notifications = request.form.get('sms_notifications') == 'on'
         settings.critical_alerts_only = request.form.get('critical_alerts_only') == 'on'
+        settings.critical_alert_phones = request.form.get('critical_alert_phones', '').strip() or None
         
         # System Settings
         settings.ai_analysis_language = request.form.get('ai_analysis_language', 'en')
@@ -1474,6 +1741,22 @@ def medisina_sync():
         sync_direction = request.json.get('direction', 'export')  # export, import
         patient_ids = request.json.get('patient_ids', [])  # specific patients or empty for all
         
+        # Whole-lab syncs go to the scheduler process when it runs; only a patient selection stays inline
+        if app.config.get('MEDISINA_SCHEDULER_ENABLED') and not patient_ids:
+            active = SyncRun.query.filter(
+                SyncRun.laboratory_id == user.laboratory_id,
+                SyncRun.status.in_(['queued', 'running'])
+            ).first()
+            run = active or queue_sync(user.laboratory_id, sync_direction, user.id)
+            
+            log_activity(f"MediSina Sync Queued - {sync_direction.title()}", "settings", settings.id, None, {
+                'direction': sync_direction,
+                'run_id': run.id,
+                'already_active': active is not None
+            })
+            
+            return jsonify({'success': True, 'queued': True, 'run': run.to_dict()}), 202
+        
         if sync_direction == 'export':
             result = export_to_medisina(settings, patient_ids)
         else:
@@ -1482,6 +1765,7 @@ def medisina_sync():
         log_activity(f"MediSina Sync - {sync_direction.title()}", "settings", settings.id, None, {
             'direction': sync_direction,
             'patient_count': result.get('patient_count', 0),
+            'pages': (result.get('progress') or {}).get('pages_done'),
             'success': result['success']
         })
         
@@ -1490,19 +1774,403 @@ def medisina_sync():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/medisina/export/status')
+@login_required
+def medisina_export_status():
+    """Progress and throughput of the current or last MediSina export"""
+    user = get_current_user()
+    
+    if user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Access denied'})
+    
+    return jsonify({'success': True, 'progress': export_progress(user.laboratory_id)})
+
+@app.route('/api/sms/outbox')
+@login_required
+def sms_outbox_status():
+    """SMS outbox counts for the last day plus the most recent failures and unconfirmed sends"""
+    user = get_current_user()
+    
+    if user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Access denied'})
+    
+    failures = SmsOutbox.query.filter(
+        SmsOutbox.laboratory_id == user.laboratory_id,
+        SmsOutbox.status.in_(['failed', 'skipped', 'unknown'])
+    ).order_by(SmsOutbox.created_at.desc()).limit(20).all()
+    
+    return jsonify({
+        'success': True,
+        'stats': outbox_stats(user.laboratory_id),
+        'recent_failures': [message.to_dict() for message in failures]
+    })
+
+@app.route('/api/instruments/results', methods=['POST'])
+@login_required
+def api_ingest_instrument_results():
+    """Apply an analyzer result file (CSV upload or text/csv body) in one transaction"""
+    user = get_current_user()
+    upload = request.files.get('file')
+    raw = upload.stream if upload else io.BytesIO(request.get_data())
+    filename = secure_filename(upload.filename) if upload and upload.filename else None
+    
+    # A client-supplied Idempotency-Key makes retries of the same upload safe; otherwise the content decides
+    key = request.headers.get('Idempotency-Key')
+    if key and len(key) > 64:
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    key = key or file_key(raw)
+    
+    try:
+        result = ingest_stream(
+            user.laboratory_id, io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''), key,
+            app.config['INSTRUMENT_DEAD_LETTER_DIR'], filename=filename,
+            instrument=request.form.get('instrument') or request.headers.get('X-Instrument'),
+            uploaded_by=user.id
+        )
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': f'Unreadable result file: {str(e)}'}), 400
+    
+    if not result['success']:
+        return jsonify(result), 400
+    if not result['duplicate']:
+        log_activity("Instrument Results Ingested", "ingest_batches", result['batch']['id'], None, {
+            'filename': filename,
+            'rows_applied': result['batch']['rows_applied'],
+            'rows_dead_lettered': result['batch']['rows_dead_lettered']
+        })
+    return jsonify(result), 200 if result['duplicate'] else 201
+
+@app.route('/api/instruments/batches')
+@login_required
+def api_ingest_batches():
+    """Recent instrument result files applied for the lab"""
+    user = get_current_user()
+    batches = IngestBatch.query.filter_by(laboratory_id=user.laboratory_id).order_by(
+        IngestBatch.started_at.desc()
+    ).limit(min(request.args.get('limit', 20, type=int), 100)).all()
+    
+    return jsonify({'success': True, 'batches': [batch.to_dict() for batch in batches]})
+
+@app.route('/sms/status', methods=['POST'])
+def sms_status_callback():
+    """Twilio delivery status callback for messages sent from the outbox"""
+    message_sid = request.form.get('MessageSid')
+    message = SmsOutbox.query.filter_by(message_sid=message_sid).first() if message_sid else None
+    if message is None:
+        return '', 204
+    
+    settings = Settings.query.filter_by(laboratory_id=message.laboratory_id).first()
+    # Twilio signs the URL it was given, which differs from request.url behind the proxy
+    callback_url = app.config.get('SMS_STATUS_CALLBACK_URL') or request.url
+    if not settings or not valid_twilio_signature(settings.twilio_auth_token, callback_url,
+                                                  request.form.to_dict(), request.headers.get('X-Twilio-Signature')):
+        abort(403)
+    
+    record_delivery_status(message_sid, request.form.get('MessageStatus'), request.form.get('ErrorCode'))
+    return '', 204
+
+@app.route('/api/medisina/sync/<int:run_id>')
+@login_required
+def medisina_sync_run(run_id):
+    """Status of a queued or scheduled MediSina sync"""
+    user = get_current_user()
+    
+    if user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Access denied'})
+    
+    run = SyncRun.query.filter_by(id=run_id, laboratory_id=user.laboratory_id).first_or_404()
+    data = run.to_dict()
+    data['result'] = json.loads(run.result) if run.result else None
+    
+    return jsonify({'success': True, 'run': data})
+
+@app.route('/api/medisina/sync/history')
+@login_required
+def medisina_sync_history():
+    """Recent MediSina sync runs with durations"""
+    user = get_current_user()
+    
+    if user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Access denied'})
+    
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    runs = SyncRun.query.filter_by(laboratory_id=user.laboratory_id)\
+        .order_by(SyncRun.created_at.desc()).limit(limit).all()
+    
+    return jsonify({'success': True, 'runs': [run.to_dict() for run in runs]})
+
+# Cursor-paginated JSON list endpoints
+@app.route('/api/patients')
+@login_required
+def api_patients():
+    """Keyset-paginated patient list"""
+    user = get_current_user()
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    
+    page = keyset_paginate(
+        _patients_query(user, request.args.get('search', '')), Patient.created_at, Patient.id,
+        cursor=request.args.get('cursor'), per_page=per_page, total=_pagination_total_mode()
+    )
+    
+    return jsonify({
+        'patients': [{
+            'id': patient.id,
+            'patient_id': patient.patient_id,
+            'first_name': patient.first_name,
+            'last_name': patient.last_name,
+            'gender': patient.gender,
+            'phone': patient.phone,
+            'created_at': patient.created_at.isoformat() if patient.created_at else None
+        } for patient in page.items],
+        'pagination': page.to_dict()
+    })
+
+@app.route('/api/tests')
+@login_required
+def api_tests():
+    """Keyset-paginated test order list"""
+    user = get_current_user()
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    
+    page = keyset_paginate(
+        _test_orders_query(user, request.args.get('status', '')), TestOrder.ordered_at, TestOrder.id,
+        cursor=request.args.get('cursor'), per_page=per_page, total=_pagination_total_mode()
+    )
+    
+    return jsonify({
+        'test_orders': [{
+            'id': order.id,
+            'order_number': order.order_number,
+            'patient_id': order.patient_id,
+            'test_type_id': order.test_type_id,
+            'priority': order.priority,
+            'status': order.status,
+            'result_status': order.result_status,
+            'delta_flag': order.delta_flag,
+            'ordered_at': order.ordered_at.isoformat() if order.ordered_at else None
+        } for order in page.items],
+        'pagination': page.to_dict()
+    })
+
+@app.route('/api/samples')
+@login_required
+def api_samples():
+    """Keyset-paginated sample list"""
+    user = get_current_user()
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+    
+    page = keyset_paginate(
+        _samples_query(user, request.args.get('status', '')), Sample.collection_date, Sample.id,
+        cursor=request.args.get('cursor'), per_page=per_page, total=_pagination_total_mode()
+    )
+    
+    return jsonify({
+        'samples': [{
+            'id': sample.id,
+            'sample_id': sample.sample_id,
+            'patient_id': sample.patient_id,
+            'test_order_id': sample.test_order_id,
+            'sample_type': sample.sample_type,
+            'status': sample.status,
+            'collection_date': sample.collection_date.isoformat() if sample.collection_date else None
+        } for sample in page.items],
+        'pagination': page.to_dict()
+    })
+
+@app.route('/api/lookup/patients')
+@login_required
+def api_lookup_patients():
+    """Typeahead search over the lab's patients by name, patient ID, phone or national ID"""
+    user = get_current_user()
+    patients, truncated = search_patients(
+        user.laboratory_id, request.args.get('q', ''), lookup_limit(request.args.get('limit', type=int))
+    )
+    
+    return jsonify({
+        'results': [patient_option(patient) for patient in patients],
+        'truncated': truncated
+    })
+
+@app.route('/api/lookup/orders')
+@login_required
+def api_lookup_orders():
+    """Typeahead search over the lab's open test orders by order number or patient"""
+    user = get_current_user()
+    orders, truncated = search_open_orders(
+        user.laboratory_id, request.args.get('q', ''), lookup_limit(request.args.get('limit', type=int))
+    )
+    
+    return jsonify({
+        'results': [order_option(order) for order in orders],
+        'truncated': truncated
+    })
+
+@app.route('/api/test-types')
+@login_required
+def api_test_types():
+    """Active test types for order entry"""
+    test_types = TestType.query.filter_by(is_active=True).order_by(TestType.code).all()
+
+    return jsonify({
+        'test_types': [{
+            'id': test_type.id,
+            'code': test_type.code,
+            'name': test_type.name,
+            'category': test_type.category,
+            'sample_type': test_type.sample_type,
+            'unit': test_type.unit
+        } for test_type in test_types]
+    })
+
+@app.route('/api/patients/<int:patient_id>/trends')
+@login_required
+def api_patient_trends(patient_id):
+    """Per-analyte numeric result series for a patient's trend charts"""
+    user = get_current_user()
+    patient = Patient.query.filter_by(id=patient_id, laboratory_id=user.laboratory_id).first_or_404()
+    
+    days = request.args.get('days', type=int)
+    start = datetime.utcnow() - timedelta(days=days) if days else None
+    
+    # Only analytes that actually have numeric results for this patient
+    test_type_query = TestType.query.join(TestOrder).filter(
+        TestOrder.patient_id == patient.id,
+        TestOrder.result_numeric.isnot(None)
+    )
+    test_type_id = request.args.get('test_type_id', type=int)
+    if test_type_id:
+        test_type_query = test_type_query.filter(TestType.id == test_type_id)
+    
+    return jsonify({
+        'patient_id': patient.id,
+        'series': [trend_chart_data(patient.id, test_type, start=start)
+                   for test_type in test_type_query.distinct().order_by(TestType.name).all()]
+    })
+
 # API endpoints for charts and dynamic data
+# Critical result alerts
+@app.route('/api/alerts')
+@login_required
+def api_alerts():
+    """Open critical-result alerts for the dashboard's first paint"""
+    user = get_current_user()
+    alerts = CriticalAlert.query.filter_by(laboratory_id=user.laboratory_id, status='open')\
+        .order_by(CriticalAlert.created_at.desc()).limit(50).all()
+    return jsonify({'alerts': [alert_payload(alert) for alert in alerts]})
+
+@app.route('/api/alerts/stream')
+@login_required
+def api_alerts_stream():
+    """Server-sent stream of critical-result alerts for the user's laboratory"""
+    user = get_current_user()
+    laboratory_id = user.laboratory_id
+    last_event_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_event_id', type=int)
+    stream_seconds = app.config.get('ALERT_STREAM_SECONDS', 55)
+    
+    if not alert_broker.acquire_stream():
+        # Every stream slot of this worker is in use; 204 makes EventSource stop, the page retries later
+        return Response(status=204)
+    try:
+        # Subscribe before reading the backlog so nothing written in between is missed
+        subscription = alert_broker.subscribe(laboratory_id)
+        backlog = []
+        if last_event_id:
+            backlog = [alert_payload(alert) for alert in CriticalAlert.query.filter(
+                CriticalAlert.laboratory_id == laboratory_id, CriticalAlert.id > last_event_id
+            ).order_by(CriticalAlert.id).limit(100)]
+    except Exception:
+        alert_broker.release_stream()
+        raise
+    # Give the connection back before streaming: get_current_user() began a transaction, and an open
+    # stream would otherwise keep a pooled connection idle in transaction for ALERT_STREAM_SECONDS
+    db.session.remove()
+    
+    def format_event(payload):
+        event_id = f"id: {payload['alert_id']}\n" if payload['type'] != 'acknowledged' else ''
+        return f"{event_id}event: {payload['type']}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        # Streams are bounded so a gthread worker thread is never held for long; EventSource reconnects
+        deadline = time.monotonic() + stream_seconds
+        yield 'retry: 2000\n\n'
+        for payload in backlog:
+            yield format_event(payload)
+        while time.monotonic() < deadline:
+            payload = subscription.get(timeout=min(15, max(0.1, deadline - time.monotonic())))
+            if payload is None:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(payload)
+            if payload['type'] in ('critical', 'duplicate'):
+                # Commits at once, so the stream holds no connection between events
+                mark_sse_delivered([payload['alert_id']])
+    
+    def close_stream():
+        subscription.close()
+        alert_broker.release_stream()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the client left before the first byte
+    response.call_on_close(close_stream)
+    return response
+
+@app.route('/api/alerts/<int:alert_id>/acknowledge', methods=['POST'])
+@login_required
+def api_acknowledge_alert(alert_id):
+    """Acknowledge a critical-result alert and its suppressed duplicates"""
+    user = get_current_user()
+    alert = CriticalAlert.query.filter_by(id=alert_id, laboratory_id=user.laboratory_id).first_or_404()
+    
+    payload = acknowledge_alert(alert, user.id)
+    db.session.commit()
+    alert_broker.fan_out([payload], page_staff=False)
+    
+    log_activity("Critical Alert Acknowledged", "critical_alerts", alert.id, None, {
+        'test_order_id': alert.test_order_id
+    })
+    
+    return jsonify({'success': True, 'alert_id': alert.id})
+
+@app.route('/api/alerts/slo')
+@login_required
+def api_alerts_slo():
+    """Write-to-delivery latency histograms for critical alerts"""
+    user = get_current_user()
+    
+    if user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Access denied'})
+    
+    days = min(request.args.get('days', 7, type=int), 90)
+    report = alert_latency_report(user.laboratory_id, datetime.utcnow() - timedelta(days=days),
+                                  sla_seconds=app.config.get('CRITICAL_ALERT_SLA_SECONDS', 60))
+    return jsonify({'success': True, 'latency': report})
+
 @app.route('/api/dashboard-stats')
 @login_required
 def api_dashboard_stats():
     """API endpoint for dashboard statistics"""
     user = get_current_user()
     
+    # Row count plus newest change is enough to tell whether any aggregate below could differ
+    order_count, last_change = db.session.query(
+        func.count(TestOrder.id),
+        func.max(func.coalesce(TestOrder.updated_at, TestOrder.ordered_at))
+    ).filter(
+        TestOrder.laboratory_id == user.laboratory_id
+    ).one()
+    
+    etag = make_etag('dashboard-stats', user.laboratory_id, order_count, last_change, date.today())
+    return conditional(etag, last_change, lambda: _build_dashboard_stats(user))
+
+def _build_dashboard_stats(user):
+    """Aggregate test order statistics for the dashboard charts"""
     # Get test status distribution
     status_counts = db.session.query(
         TestOrder.status,
         func.count(TestOrder.id).label('count')
-    ).join(Patient).filter(
-        Patient.laboratory_id == user.laboratory_id
+    ).filter(
+        TestOrder.laboratory_id == user.laboratory_id
     ).group_by(TestOrder.status).all()
     
     # Get daily test counts for the last 30 days
@@ -1510,8 +2178,8 @@ def api_dashboard_stats():
     daily_counts = db.session.query(
         func.date(TestOrder.ordered_at).label('date'),
         func.count(TestOrder.id).label('count')
-    ).join(Patient).filter(
-        Patient.laboratory_id == user.laboratory_id,
+    ).filter(
+        TestOrder.laboratory_id == user.laboratory_id,
         TestOrder.ordered_at >= thirty_days_ago
     ).group_by('date').all()
     
@@ -1525,6 +2193,12 @@ def api_dashboard_stats():
 def not_found_error(error):
     return render_template('base.html', error_message='Page not found', translations=get_all_translations('en')), 404
 
+@app.errorhandler(InvalidCursor)
+def invalid_cursor_error(error):
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'error': str(error)}), 400
+    return render_template('base.html', error_message='Invalid page link', translations=get_all_translations('en')), 400
+
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Load Test Module
+Runs scripted user scenarios (login, dashboard polling, patient search, order/sample/result entry,
+report generation, bulk export) against gunicorn, with local stand-ins for the AI providers, Twilio
+and MediSina, and writes a throughput and latency percentile report that can be diffed between versions.
+
+Usage:
+    python run_load_test.py --start-server --users 20 --duration 120 --report load_reports/current.json
+    python run_load_test.py --base-url http://localhost:5000 --users 50 --duration 300   # server started by you
+    python run_load_test.py --compare load_reports/v1.json load_reports/v2.json --threshold 0.2
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import signal
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+from llm_standin import LLMStandIn
+from twilio_standin import TwilioStandIn
+from medisina_standin import MediSinaStandIn
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOAD_LAB_NAME = 'Load Test Laboratory'
+LOAD_PASSWORD = 'load-test-password'
+TWILIO_SID = 'ACloadtest'
+TWILIO_TOKEN = 'load-test-token'
+PERCENTILES = (50, 90, 95, 99)
+EXPORT_RUN_TIMEOUT = 300  # seconds a virtual user waits for a queued export to finish
+
+# Scenario name -> relative weight of a virtual user picking it
+SCENARIO_WEIGHTS = {
+    'dashboard_polling': 40,
+    'patient_search': 30,
+    'order_entry': 20,
+    'report_generation': 7,
+    'bulk_export': 3,
+}
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+class LoadStats:
+    """Latencies and failures per step, shared by all virtual users"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # step -> list of seconds
+        self.errors = {}  # step -> {reason: count}
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, step, seconds, error=None):
+        with self.lock:
+            self.samples.setdefault(step, []).append(seconds)
+            if error:
+                reasons = self.errors.setdefault(step, {})
+                reasons[error] = reasons.get(error, 0) + 1
+
+    def _summarize(self, latencies, errors, elapsed):
+        ordered = sorted(latencies)
+        summary = {
+            'requests': len(ordered),
+            'errors': sum(errors.values()),
+            'error_rate': round(sum(errors.values()) / len(ordered), 4) if ordered else 0,
+            'rps': round(len(ordered) / elapsed, 2) if elapsed else None,
+            'mean_ms': round(sum(ordered) / len(ordered) * 1000, 1) if ordered else None,
+            'max_ms': round(ordered[-1] * 1000, 1) if ordered else None
+        }
+        for q in PERCENTILES:
+            value = percentile(ordered, q)
+            summary[f'p{q}_ms'] = round(value * 1000, 1) if value is not None else None
+        return summary
+
+    def report(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        with self.lock:
+            steps = {step: self._summarize(latencies, self.errors.get(step, {}), elapsed)
+                     for step, latencies in sorted(self.samples.items())}
+            for step, reasons in self.errors.items():
+                steps[step]['error_reasons'] = dict(sorted(reasons.items(), key=lambda item: -item[1])[:5])
+            everything = [seconds for latencies in self.samples.values() for seconds in latencies]
+            total = self._summarize(everything, {'all': sum(sum(r.values()) for r in self.errors.values())}, elapsed)
+        return {'elapsed_seconds': round(elapsed, 1), 'total': total, 'steps': steps}
+
+class LoadClient:
+    """A virtual user's HTTP session; every call is timed under a step name"""
+
+    def __init__(self, base_url, stats, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, step, method, path, expect_json=False, **options):
+        options.setdefault('timeout', self.timeout)
+        options.setdefault('allow_redirects', False)
+        started = time.perf_counter()
+        error, response = None, None
+        try:
+            response = self.session.request(method, self.base_url + path, **options)
+            if response.status_code >= 400:
+                error = f'HTTP {response.status_code}'
+            elif response.is_redirect and '/login' in response.headers.get('Location', ''):
+                error = 'session lost'
+            elif expect_json:
+                payload = response.json()
+                if isinstance(payload, dict) and payload.get('success') is False:
+                    error = str(payload.get('error', 'failed'))[:80]
+        except (requests.RequestException, ValueError) as e:
+            error = type(e).__name__
+        self.stats.record(step, time.perf_counter() - started, error)
+        return response if error is None else None
+
+    def login(self, username):
+        return self.request('login', 'POST', '/login', data={
+            'labName': LOAD_LAB_NAME, 'username': username, 'password': LOAD_PASSWORD
+        })
+
+# Scenarios: each takes (client, fixtures, rng) and issues the requests of one user action
+
+def dashboard_polling(client, fixtures, rng):
+    client.request('dashboard', 'GET', '/dashboard')
+    for _ in range(3):
+        client.request('dashboard_stats', 'GET', '/api/dashboard-stats')
+        client.request('alerts', 'GET', '/api/alerts')
+
+def patient_search(client, fixtures, rng):
+    name = rng.choice(fixtures['last_names'])
+    # Typeahead: a request per keystroke after the minimum length
+    for length in range(2, min(len(name), 5) + 1):
+        client.request('lookup_patients', 'GET', '/api/lookup/patients', params={'q': name[:length]})
+    client.request('patient_list', 'GET', '/api/patients', params={'per_page': 20})
+
+def order_entry(client, fixtures, rng):
+    patient_id = rng.choice(fixtures['patient_ids'])
+    if client.request('create_order', 'POST', '/tests/add', data={
+        'patient_id': patient_id, 'test_type_id': rng.choice(fixtures['test_type_ids']), 'priority': 'normal'
+    }) is None:
+        return
+
+    response = client.request('lookup_orders', 'GET', '/api/lookup/orders', params={'q': ''})
+    orders = [o for o in (response.json().get('results', []) if response is not None else [])
+              if o['patient_id'] == patient_id and o['status'] == 'ordered']
+    if not orders:
+        return
+    order = orders[0]
+
+    client.request('accession_sample', 'POST', '/api/samples/accession', expect_json=True, json={
+        'items': [order['order_number']], 'sample_type': 'blood', 'container_type': 'EDTA'
+    })
+    client.request('record_result', 'POST', f"/api/tests/{order['id']}/result", expect_json=True, json={
+        'result_value': f'{rng.uniform(3.0, 12.0):.1f}', 'result_unit': 'mmol/L'
+    })
+
+def report_generation(client, fixtures, rng):
+    client.request('generate_report', 'POST', '/reports/generate', data={
+        'patient_id': rng.choice(fixtures['patient_ids']), 'report_type': 'comprehensive'
+    })
+
+def bulk_export(client, fixtures, rng):
+    response = client.request('medisina_export', 'POST', '/api/medisina/sync', expect_json=True, json={'direction': 'export'})
+    if response is None or response.status_code != 202:
+        return  # the export ran inside the request
+
+    # Queued for sync_scheduler: time it from the click until the run finishes
+    run = response.json()['run']
+    started = time.perf_counter()
+    deadline = time.monotonic() + EXPORT_RUN_TIMEOUT
+    while run['status'] in ('queued', 'running') and time.monotonic() < deadline:
+        time.sleep(0.5)
+        try:
+            run = client.session.get(f"{client.base_url}/api/medisina/sync/{run['id']}", timeout=client.timeout).json()['run']
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+    error = None if run['status'] == 'succeeded' else f"run {run['status']}"
+    client.stats.record('medisina_export_run', time.perf_counter() - started, error)
+
+SCENARIOS = {
+    'dashboard_polling': dashboard_polling,
+    'patient_search': patient_search,
+    'order_entry': order_entry,
+    'report_generation': report_generation,
+    'bulk_export': bulk_export,
+}
+
+def prepare_fixtures(base_url, standins, patients=50, seed=1):
+    """Log in as the lab admin, point the lab's integrations at the stand-ins and create patients"""
+    stats = LoadStats()
+    admin = LoadClient(base_url, stats)
+    if admin.login('load-admin') is None:
+        raise RuntimeError(f'Could not log in to {base_url}')
+
+    admin.request('setup', 'POST', '/settings/integrations', data={
+        'openai_api_key': 'load-test', 'openai_model': 'gpt-4o', 'openai_enabled': 'on',
+        'default_ai_service': 'openai',
+        'twilio_account_sid': TWILIO_SID, 'twilio_auth_token': TWILIO_TOKEN, 'twilio_phone_number': '+15550000000',
+        'sms_enabled': 'on', 'sms_notifications': 'on',
+        'medisina_api_url': standins['medisina'].url, 'medisina_api_key': 'load-test', 'medisina_enabled': 'on',
+        'medisina_sync_interval': '60'
+    })
+
+    rng = random.Random(seed)
+    last_names = ['Ahmadi', 'Hosseini', 'Karimi', 'Rezaei', 'Moradi', 'Jafari', 'Rahimi', 'Kazemi', 'Sadeghi', 'Ebrahimi']
+    for index in range(patients):
+        admin.request('setup', 'POST', '/patients/add', data={
+            'first_name': rng.choice(['Ali', 'Sara', 'Reza', 'Maryam', 'Hamid', 'Neda']),
+            'last_name': rng.choice(last_names), 'gender': rng.choice(['male', 'female']),
+            'phone': f'+98912{index:07d}', 'date_of_birth': f'{rng.randint(1950, 2010)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}'
+        })
+
+    patient_ids, cursor = [], None
+    while True:
+        response = admin.request('setup', 'GET', '/api/patients', params=dict({'per_page': 100}, **({'cursor': cursor} if cursor else {})))
+        if response is None:
+            break
+        payload = response.json()
+        patient_ids += [p['id'] for p in payload['patients']]
+        cursor = payload['pagination'].get('next_cursor')
+        if not cursor:
+            break
+
+    response = admin.request('setup', 'GET', '/api/test-types')
+    test_type_ids = [t['id'] for t in response.json()['test_types']] if response is not None else []
+
+    if not patient_ids or not test_type_ids:
+        raise RuntimeError(f'Setup incomplete: {len(patient_ids)} patients, {len(test_type_ids)} test types '
+                           f'({stats.report()["steps"].get("setup", {}).get("error_reasons")})')
+    return {'patient_ids': patient_ids, 'test_type_ids': test_type_ids, 'last_names': last_names}
+
+class VirtualUser(threading.Thread):
+    """Logs in once, then runs weighted scenarios with think time until the run ends"""
+
+    def __init__(self, number, base_url, stats, fixtures, stop_event, think_time, seed):
+        super().__init__(name=f'vu-{number}', daemon=True)
+        self.client = LoadClient(base_url, stats)
+        self.number = number
+        self.fixtures = fixtures
+        self.stop_event = stop_event
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+
+    def run(self):
+        self.client.login(f'load-user-{self.number}')
+        names, weights = zip(*SCENARIO_WEIGHTS.items())
+        while not self.stop_event.is_set():
+            name = self.rng.choices(names, weights)[0]
+            try:
+                SCENARIOS[name](self.client, self.fixtures, self.rng)
+            except Exception as e:
+                self.client.stats.record(name, 0.0, type(e).__name__)
+            self.stop_event.wait(self.rng.uniform(*self.think_time))
+
+def run_load(base_url, fixtures, users=10, duration=60, ramp_up=10, think_time=(0.5, 2.0), seed=1):
+    """Run virtual users for duration seconds; returns the LoadStats"""
+    stats = LoadStats()
+    stop_event = threading.Event()
+    threads = []
+    for number in range(users):
+        thread = VirtualUser(number, base_url, stats, fixtures, stop_event, think_time, seed + number)
+        thread.start()
+        threads.append(thread)
+        if ramp_up and number < users - 1:
+            time.sleep(ramp_up / users)
+
+    stop_event.wait(max(0, duration - ramp_up))
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=120)
+    stats.finished = time.monotonic()
+    return stats
+
+class LocalServer:
+    """gunicorn plus the SMS relay and the sync scheduler, wired to the stand-ins, on a scratch database"""
+
+    def __init__(self, standins, port=5055, workers=2, threads=4, database_url=None):
+        self.workdir = tempfile.mkdtemp(prefix='medlab-load-')
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.database_url = database_url or f"sqlite:///{os.path.join(self.workdir, 'load.db')}"
+        self.processes = []
+        self.env = dict(os.environ, DATABASE_URL=self.database_url, SESSION_SECRET='load-test',
+                        OPENAI_API_KEY='load-test', TWILIO_API_BASE=standins['twilio'].url,
+                        SMS_RELAY_POLL_SECONDS='1', MEDISINA_SCHEDULER_ENABLED='true',
+                        MEDISINA_SCHEDULER_POLL_SECONDS='1', PDF_CACHE_DIR=os.path.join(self.workdir, 'pdf'),
+                        METRICS_DIR=os.path.join(self.workdir, 'metrics'), WEB_CONCURRENCY=str(workers),
+                        GUNICORN_THREADS=str(threads),
+                        SQL_PROFILER_DEV='false', **standins['llm'].environment())
+        self.env.pop('REDIS_URL', None)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self, timeout=90):
+        # Create the schema once, so the workers do not race each other through create_all
+        subprocess.run([sys.executable, '-c', 'import main'], env=self.env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        log = open(os.path.join(self.workdir, 'server.log'), 'w')
+        self.processes.append(subprocess.Popen([
+            'gunicorn', 'main:app', '--bind', f'127.0.0.1:{self.port}', '--workers', str(self.workers),
+            '--threads', str(self.threads), '--worker-class', 'gthread', '--timeout', '120'
+        ], env=self.env, stdout=log, stderr=subprocess.STDOUT))
+        for script in ('sms_outbox.py', 'sync_scheduler.py'):
+            self.processes.append(subprocess.Popen([sys.executable, script], env=self.env,
+                                                   stdout=log, stderr=subprocess.STDOUT))
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f'{self.url}/readyz', timeout=2).status_code == 200:
+                    logger.info(f"Server ready at {self.url} (logs in {self.workdir}/server.log)")
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f'Server did not become ready; see {self.workdir}/server.log')
+
+    def metrics(self):
+        try:
+            return requests.get(f'{self.url}/metrics', timeout=5).text
+        except requests.RequestException:
+            return ''
+
+    def stop(self):
+        for process in self.processes:
+            process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def format_report(report):
+    lines = [f"{'step':<22}{'reqs':>8}{'err%':>7}{'rps':>8}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}"]
+    for step, s in list(report['steps'].items()) + [('TOTAL', report['total'])]:
+        lines.append(f"{step:<22}{s['requests']:>8}{s['error_rate'] * 100:>6.1f}%{s['rps'] or 0:>8.2f}"
+                     + ''.join(f"{s[key] if s[key] is not None else '-':>9}" for key in ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms')))
+    return '\n'.join(lines)
+
+def compare_reports(baseline, current, threshold=0.2):
+    """Per-step latency and throughput changes; returns (text, regressed steps)"""
+    lines = [f"{'step':<22}{'p50':>18}{'p95':>18}{'p99':>18}{'rps':>16}"]
+    regressed = []
+
+    def change(old, new):
+        if old is None or new is None:
+            return f"{'-':>18}"
+        delta = (new - old) / old if old else 0.0
+        return f"{old:>7}->{new:<7}{delta * 100:+.0f}%".rjust(18)
+
+    for step in sorted(set(baseline['steps']) | set(current['steps'])):
+        old, new = baseline['steps'].get(step), current['steps'].get(step)
+        if old is None or new is None:
+            lines.append(f"{step:<22}{'only in ' + ('current' if old is None else 'baseline'):>18}")
+            continue
+        lines.append(f"{step:<22}" + ''.join(change(old[key], new[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')))
+        if old['p95_ms'] and new['p95_ms'] and new['p95_ms'] > old['p95_ms'] * (1 + threshold):
+            regressed.append(step)
+    return '\n'.join(lines), regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Scenario load test with local integration stand-ins')
+    parser.add_argument('--base-url', help='test a server you started (it must use the stand-in URLs printed at startup)')
+    parser.add_argument('--start-server', action='store_true',
+                        help='start gunicorn, the SMS relay and the sync scheduler on a scratch database')
+    parser.add_argument('--database-url', help='database for --start-server (default: a scratch SQLite file)')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=int, default=60, help='seconds, including ramp-up')
+    parser.add_argument('--ramp-up', type=int, default=10)
+    parser.add_argument('--patients', type=int, default=50, help='patients created before the run')
+    parser.add_argument('--llm-latency', type=float, default=1.5)
+    parser.add_argument('--llm-jitter', type=float, default=0.5)
+    parser.add_argument('--llm-fail-rate', type=float, default=0.0)
+    parser.add_argument('--twilio-fail-rate', type=float, default=0.0)
+    parser.add_argument('--medisina-fail-rate', type=float, default=0.0)
+    parser.add_argument('--medisina-latency', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--report', help='write the JSON report here')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='diff two JSON reports')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 growth that counts as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            text, regressed = compare_reports(json.load(old), json.load(new), args.threshold)
+        print(text)
+        if regressed:
+            print(f"\np95 regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+            sys.exit(1)
+        return
+
+    if not args.base_url and not args.start_server:
+        parser.error('pass --base-url or --start-server')
+
+    standins = {
+        'llm': LLMStandIn(latency=args.llm_latency, jitter=args.llm_jitter, fail_rate=args.llm_fail_rate, seed=args.seed).start(),
+        'twilio': TwilioStandIn(fail_rate=args.twilio_fail_rate, seed=args.seed).start(),
+        'medisina': MediSinaStandIn(fail_rate=args.medisina_fail_rate, latency=args.medisina_latency, seed=args.seed).start()
+    }
+    for name, standin in standins.items():
+        logger.info(f"{name} stand-in at {standin.url}")
+
+    server = None
+    try:
+        if args.start_server:
+            server = LocalServer(standins, args.port, args.workers, args.threads, args.database_url).start()
+        base_url = server.url if server else args.base_url
+
+        fixtures = prepare_fixtures(base_url, standins, args.patients, args.seed)
+        logger.info(f"Running {args.users} users for {args.duration}s against {base_url}")
+        stats = run_load(base_url, fixtures, args.users, args.duration, args.ramp_up, seed=args.seed)
+
+        report = dict(stats.report(), meta={
+            'started_at': datetime.utcnow().isoformat(), 'revision': _git_revision(), 'base_url': base_url,
+            'users': args.users, 'duration': args.duration, 'workers': args.workers, 'threads': args.threads,
+            'database': 'custom' if args.database_url or args.base_url else 'sqlite',
+            'llm_latency': args.llm_latency, 'weights': SCENARIO_WEIGHTS
+        }, standins={
+            'llm_requests': standins['llm'].state.requests_seen,
+            'sms_sent': len(standins['twilio'].state.messages),
+            'medisina_pages': len(standins['medisina'].state.pages)
+        })
+        print(format_report(report))
+
+        if args.report:
+            os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+            with open(args.report, 'w') as handle:
+                json.dump(report, handle, indent=2)
+            if server:
+                with open(os.path.splitext(args.report)[0] + '.metrics.txt', 'w') as handle:
+                    handle.write(server.metrics())
+            logger.info(f"Report written to {args.report}")
+    finally:
+        if server:
+            server.stop()
+            shutil.rmtree(server.workdir, ignore_errors=True)
+        for standin in standins.values():
+            standin.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+SMS Outbox Module
+Handles durable SMS notifications: messages are written to the sms_outbox table in the same
+transaction as the change that triggers them, and a relay process sends them in batches.
+
+Usage:
+    python sms_outbox.py            # relay until SIGTERM
+    python sms_outbox.py --once     # drain one batch, e.g. from cron
+"""
+
+import random
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 200
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE = 60  # seconds; doubled per attempt, capped at OUTBOX_RETRY_MAX
+OUTBOX_RETRY_MAX = 3600
+SENDING_TIMEOUT = timedelta(minutes=10)  # a 'sending' row older than this belonged to a crashed relay
+RELAY_POLL_INTERVAL = 5  # seconds between relay passes when the outbox is empty
+
+def render_message(audience, message_type, data):
+    """SMS body for a patient notification or staff alert, or None for an unknown type"""
+    from sms_service import _generate_patient_message, _generate_staff_alert
+
+    if audience == 'staff':
+        return _generate_staff_alert(message_type, data)
+    return _generate_patient_message(message_type, data)
+
+def enqueue_sms(laboratory_id, recipient, message_type, data, entity_type, entity_id, audience='patient',
+                connection=None):
+    """Add a notification to the outbox inside the caller's transaction; the caller commits
+
+    Returns False when the same message about the same record was already queued for this recipient.
+    Flush event handlers pass the flush's connection, since the session itself cannot execute there.
+    """
+    from sqlalchemy import insert, select
+    from app import db
+    from models import SmsOutbox
+
+    body = render_message(audience, message_type, data)
+    if not recipient or not body:
+        return False
+
+    row = {
+        'laboratory_id': laboratory_id,
+        'recipient': recipient.strip(),
+        'audience': audience,
+        'message_type': message_type,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'body': body.strip(),
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': datetime.utcnow()
+    }
+    table = SmsOutbox.__table__
+    executor = connection if connection is not None else db.session
+    dialect = (connection.dialect if connection is not None else db.session.get_bind().dialect).name
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        statement = dialect_insert(table).values(**row).on_conflict_do_nothing(
+            index_elements=[table.c.recipient, table.c.message_type, table.c.entity_type, table.c.entity_id]
+        )
+        return executor.execute(statement).rowcount == 1
+
+    exists = executor.execute(select(table.c.id).where(
+        table.c.recipient == row['recipient'], table.c.message_type == message_type,
+        table.c.entity_type == entity_type, table.c.entity_id == entity_id
+    )).first()
+    if exists:
+        return False
+    executor.execute(insert(table).values(**row))
+    return True
+
+def retry_delay(attempts):
+    """Seconds until the next try of a message that has failed `attempts` times"""
+    delay = min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+def claim_batch(batch_size=OUTBOX_BATCH_SIZE):
+    """Mark up to batch_size due messages as sending and return them as plain dicts
+
+    On PostgreSQL the claim uses FOR UPDATE SKIP LOCKED, so several relays never pick the same row.
+    """
+    from app import db
+    from models import SmsOutbox
+
+    now = datetime.utcnow()
+    SmsOutbox.query.filter(
+        SmsOutbox.status == 'sending', SmsOutbox.claimed_at < now - SENDING_TIMEOUT
+    ).update({'status': 'pending'}, synchronize_session=False)
+
+    query = SmsOutbox.query.filter(
+        SmsOutbox.status == 'pending', SmsOutbox.next_attempt_at <= now
+    ).order_by(SmsOutbox.next_attempt_at, SmsOutbox.id).limit(batch_size)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    claimed = []
+    for message in query.all():
+        message.status = 'sending'
+        message.claimed_at = now
+        claimed.append({
+            'id': message.id,
+            'laboratory_id': message.laboratory_id,
+            'recipient': message.recipient,
+            'body': message.body,
+            'attempts': message.attempts
+        })
+    db.session.commit()
+    return claimed
+
+def relay_batch(batch_size=None, **dispatcher_options):
+    """Send one batch from the outbox and store each message's outcome; returns counts"""
+    from app import db
+    from models import Settings, SmsOutbox
+    from sms_service import dispatcher_for
+
+    claimed = claim_batch(batch_size or OUTBOX_BATCH_SIZE)
+    counts = {'claimed': len(claimed), 'sent': 0, 'retrying': 0, 'failed': 0, 'unknown': 0, 'skipped': 0}
+    if not claimed:
+        return counts
+
+    by_lab = {}
+    for message in claimed:
+        by_lab.setdefault(message['laboratory_id'], []).append(message)
+    settings_by_lab = {s.laboratory_id: s for s in Settings.query.filter(Settings.laboratory_id.in_(by_lab)).all()}
+
+    updates = []
+    for laboratory_id, messages in by_lab.items():
+        settings = settings_by_lab.get(laboratory_id)
+        if not settings or not settings.sms_enabled or not all(
+                [settings.twilio_account_sid, settings.twilio_auth_token, settings.twilio_phone_number]):
+            for message in messages:
+                updates.append({'id': message['id'], 'status': 'skipped', 'last_error': 'SMS service not configured'})
+            counts['skipped'] += len(messages)
+            continue
+
+        dispatcher = dispatcher_for(settings, **dispatcher_options)
+        try:
+            outcomes = dispatcher.dispatch([{'to': m['recipient'], 'body': m['body'], 'recipient': m['id']} for m in messages])
+        finally:
+            dispatcher.close()
+
+        now = datetime.utcnow()
+        for message, outcome in zip(messages, outcomes):
+            attempts = message['attempts'] + 1
+            update = {'id': message['id'], 'attempts': attempts}
+            if outcome['success']:
+                update.update(status='sent', sent_at=now, message_sid=outcome.get('message_sid'),
+                              delivery_status=outcome.get('status'), error_code=None, last_error=None)
+                counts['sent'] += 1
+            elif outcome.get('unknown'):
+                # Twilio may have queued it; sending again could text the patient twice
+                update.update(status='unknown', error_code=None, last_error=outcome.get('error'))
+                counts['unknown'] += 1
+            elif outcome.get('retryable') and attempts < OUTBOX_MAX_ATTEMPTS:
+                update.update(status='pending', next_attempt_at=now + timedelta(seconds=retry_delay(attempts)),
+                              error_code=str(outcome.get('error_code') or ''), last_error=outcome.get('error'))
+                counts['retrying'] += 1
+            else:
+                update.update(status='failed', error_code=str(outcome.get('error_code') or ''),
+                              last_error=outcome.get('error'))
+                counts['failed'] += 1
+            updates.append(update)
+
+    db.session.bulk_update_mappings(SmsOutbox, updates)
+    db.session.commit()
+
+    logger.info(f"SMS relay: {counts['sent']} sent, {counts['retrying']} retrying, "
+                f"{counts['failed']} failed, {counts['unknown']} unknown, {counts['skipped']} skipped")
+    return counts
+
+# Provider statuses that end a message's life; later callbacks never move it back
+FINAL_DELIVERY_STATUSES = {'delivered', 'undelivered', 'failed'}
+
+def record_delivery_status(message_sid, delivery_status, error_code=None):
+    """Apply a provider status callback to the outbox row; returns the row or None if unknown"""
+    from app import db
+    from models import SmsOutbox
+
+    message = SmsOutbox.query.filter_by(message_sid=message_sid).first()
+    if message is None:
+        return None
+
+    if message.delivery_status not in FINAL_DELIVERY_STATUSES:
+        message.delivery_status = delivery_status
+        if delivery_status == 'delivered':
+            message.delivered_at = datetime.utcnow()
+        if error_code:
+            message.error_code = str(error_code)
+        db.session.commit()
+    return message
+
+def outbox_stats(laboratory_id, since=None):
+    """Message counts by status and delivery status for a lab"""
+    from sqlalchemy import func
+    from app import db
+    from models import SmsOutbox
+
+    since = since or datetime.utcnow() - timedelta(days=1)
+    rows = db.session.query(
+        SmsOutbox.status, SmsOutbox.delivery_status, func.count(SmsOutbox.id)
+    ).filter(
+        SmsOutbox.laboratory_id == laboratory_id, SmsOutbox.created_at >= since
+    ).group_by(SmsOutbox.status, SmsOutbox.delivery_status).all()
+
+    stats = {'status': {}, 'delivery_status': {}}
+    for status, delivery_status, count in rows:
+        stats['status'][status] = stats['status'].get(status, 0) + count
+        if delivery_status:
+            stats['delivery_status'][delivery_status] = stats['delivery_status'].get(delivery_status, 0) + count
+    return stats
+
+class SmsRelay:
+    """Drains the outbox continuously; any number of relays may run side by side"""
+
+    def __init__(self, app, poll_interval=RELAY_POLL_INTERVAL, batch_size=OUTBOX_BATCH_SIZE):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._wake = None
+
+        # Critical alerts publish on this channel so pages go out without waiting for the next poll
+        redis_url = app.config.get('REDIS_URL')
+        if redis_url:
+            try:
+                import redis
+                from critical_alerts import RELAY_WAKE_CHANNEL
+                self._wake = redis.Redis.from_url(redis_url).pubsub(ignore_subscribe_messages=True)
+                self._wake.subscribe(RELAY_WAKE_CHANNEL)
+            except Exception as e:
+                logger.warning(f"SMS relay wake-ups unavailable, polling only: {str(e)}")
+                self._wake = None
+
+    def _wait(self):
+        if self._wake is None:
+            self._stop.wait(self.poll_interval)
+            return
+        try:
+            self._wake.get_message(timeout=self.poll_interval)
+        except Exception as e:
+            logger.warning(f"SMS relay wake-up channel failed: {str(e)}")
+            self._wake = None
+
+    def stop(self, *args):
+        logger.info("SMS relay stopping")
+        self._stop.set()
+
+    def run_forever(self):
+        logger.info(f"SMS relay started (batch {self.batch_size}, poll every {self.poll_interval}s)")
+        while not self._stop.is_set():
+            claimed = 0
+            with self.app.app_context():
+                try:
+                    claimed = relay_batch(self.batch_size)['claimed']
+                except Exception as e:
+                    logger.error(f"SMS relay pass failed: {str(e)}")
+                    from app import db
+                    db.session.rollback()
+            # A full batch means there is probably more waiting; go again straight away
+            if claimed < self.batch_size and not self._stop.is_set():
+                self._wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='SMS outbox relay')
+    parser.add_argument('--once', action='store_true', help='send a single batch and exit')
+    args = parser.parse_args()
+
+    from app import app
+
+    relay = SmsRelay(
+        app,
+        poll_interval=int(app.config.get('SMS_RELAY_POLL_SECONDS', RELAY_POLL_INTERVAL)),
+        batch_size=int(app.config.get('SMS_OUTBOX_BATCH_SIZE', OUTBOX_BATCH_SIZE))
+    )
+
+    if args.once:
+        with app.app_context():
+            relay_batch(relay.batch_size)
+        return
+
+    if app.config.get('METRICS_PORT'):
+        from metrics import start_http_server
+        start_http_server(app.config['METRICS_PORT'])
+
+    signal.signal(signal.SIGTERM, relay.stop)
+    signal.signal(signal.SIGINT, relay.stop)
+    relay.run_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,40 @@
 """
 SMS Service Integration Module
-Handles Twilio SMS notifications for patients and staff
+Handles the Twilio connection test, rate-limited sending for the SMS outbox relay and message
+templates; notifications are queued with sms_outbox.enqueue_sms, never sent inline
 """
+import time
 import logging
+import threading
+import requests
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioException
+from twilio.request_validator import RequestValidator
+from metrics import external_call
+from retry_utils import backoff_delay, retry_after_seconds
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bulk dispatch tuning; overridable through app.config (SMS_RATE_PER_SECOND etc.)
+TWILIO_API_BASE = 'https://api.twilio.com'
+SMS_RATE_PER_SECOND = 10.0  # Twilio's default throughput for a long code is lower; raise for short codes
+SMS_MAX_WORKERS = 8
+SMS_MAX_RETRIES = 4
+SMS_REQUEST_TIMEOUT = 15
+SMS_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def _sms_config(name, default):
+    try:
+        from flask import current_app
+        return current_app.config.get(name) or default
+    except RuntimeError:
+        return default
+
 def test_twilio_connection(account_sid, auth_token, phone_number):
     """Test Twilio SMS service connection"""
     try:
@@ -47,132 +71,158 @@ def test_twilio_connection(account_sid, auth_token, phone_number):
         logger.error(f"SMS connection test failed: {str(e)}")
         return {'success': False, 'error': f'Connection failed: {str(e)}'}
 
-def send_patient_notification(settings, patient_phone, message_type, data):
-    """Send SMS notification to patient"""
-    try:
-        if not settings.sms_enabled or not all([settings.twilio_account_sid, settings.twilio_auth_token, settings.twilio_phone_number]):
-            return {'success': False, 'error': 'SMS service not configured'}
-        
-        client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
-        
-        # Generate message based on type
-        message_content = _generate_patient_message(message_type, data)
-        
-        if not message_content:
-            return {'success': False, 'error': 'Invalid message type'}
-        
-        # Send SMS
-        message = client.messages.create(
-            body=message_content,
-            from_=settings.twilio_phone_number,
-            to=patient_phone
-        )
-        
-        return {
-            'success': True,
-            'message_sid': message.sid,
-            'status': message.status,
-            'message_type': message_type
-        }
-        
-    except TwilioException as e:
-        logger.error(f"Patient SMS notification failed: {str(e)}")
-        return {'success': False, 'error': f'SMS send failed: {str(e)}'}
-    except Exception as e:
-        logger.error(f"Patient notification failed: {str(e)}")
-        return {'success': False, 'error': f'Notification failed: {str(e)}'}
+def valid_twilio_signature(auth_token, url, params, signature):
+    """Check the X-Twilio-Signature of a status callback"""
+    if not auth_token or not signature:
+        return False
+    return RequestValidator(auth_token).validate(url, params, signature)
 
-def send_staff_alert(settings, recipient_phone, alert_type, data):
-    """Send SMS alert to laboratory staff"""
-    try:
-        if not settings.sms_enabled or not all([settings.twilio_account_sid, settings.twilio_auth_token, settings.twilio_phone_number]):
-            return {'success': False, 'error': 'SMS service not configured'}
-        
-        client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
-        
-        # Generate alert message
-        message_content = _generate_staff_alert(alert_type, data)
-        
-        if not message_content:
-            return {'success': False, 'error': 'Invalid alert type'}
-        
-        # Send SMS
-        message = client.messages.create(
-            body=message_content,
-            from_=settings.twilio_phone_number,
-            to=recipient_phone
-        )
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available
+    
+    The default capacity of one token paces sends evenly, so no one-second window exceeds the rate.
+    """
+    
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        # Reserve the token now (the balance may go negative) and sleep off the debt outside the lock
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.sleep(wait)
+
+class BulkSmsDispatcher:
+    """Sends many messages concurrently over one pooled HTTP session to the Twilio Messages API
+    
+    Throughput is capped by a shared token bucket; connection errors, 429 and 5xx responses are retried
+    with backoff.
+    """
+    
+    def __init__(self, account_sid, auth_token, from_number, api_base=None, rate_per_second=None,
+                 max_workers=None, max_retries=None, sleep=time.sleep, on_progress=None, status_callback=None,
+                 request_timeout=None):
+        self.from_number = from_number
+        self.status_callback = status_callback
+        self.url = f"{(api_base or TWILIO_API_BASE).rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.max_workers = int(max_workers or SMS_MAX_WORKERS)
+        self.max_retries = SMS_MAX_RETRIES if max_retries is None else int(max_retries)
+        self.request_timeout = request_timeout or SMS_REQUEST_TIMEOUT
+        self.sleep = sleep
+        self.on_progress = on_progress
+        self.bucket = TokenBucket(rate_per_second or SMS_RATE_PER_SECOND, sleep=sleep)
         
-        return {
-            'success': True,
-            'message_sid': message.sid,
-            'status': message.status,
-            'alert_type': alert_type
-        }
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
-    except TwilioException as e:
-        logger.error(f"Staff SMS alert failed: {str(e)}")
-        return {'success': False, 'error': f'SMS send failed: {str(e)}'}
-    except Exception as e:
-        logger.error(f"Staff alert failed: {str(e)}")
-        return {'success': False, 'error': f'Alert failed: {str(e)}'}
+        self.lock = threading.Lock()
+        self.progress = {'total': 0, 'sent': 0, 'failed': 0, 'unknown': 0, 'retries': 0}
+    
+    def close(self):
+        self.session.close()
+    
+    def send(self, to, body):
+        """Send one message; returns its outcome dict
 
-def send_bulk_notifications(settings, recipients, message_type, data):
-    """Send bulk SMS notifications"""
-    try:
-        if not settings.sms_enabled or not all([settings.twilio_account_sid, settings.twilio_auth_token, settings.twilio_phone_number]):
-            return {'success': False, 'error': 'SMS service not configured'}
-        
-        client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
-        results = []
+        Only failures that cannot have created a message are retried: connection errors (a connect
+        timeout included), 429 and 5xx. A read timeout or an unreadable 2xx means Twilio may have
+        queued the message already, so the outcome is marked unknown and it is not sent again.
+        """
+        outcome = {'phone': to, 'success': False, 'attempts': 0}
+        form = {'To': to, 'From': self.from_number, 'Body': body}
+        if self.status_callback:
+            form['StatusCallback'] = self.status_callback
         
-        for recipient in recipients:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            outcome['attempts'] = attempt + 1
+            retry_after = None
             try:
-                phone = recipient.get('phone')
-                patient_data = recipient.get('data', data)
-                
-                if not phone:
-                    results.append({
-                        'recipient': recipient.get('name', 'Unknown'),
-                        'success': False,
-                        'error': 'No phone number'
-                    })
-                    continue
+                with external_call('twilio', 'send_sms') as call:
+                    response = self.session.post(self.url, data=form, timeout=self.request_timeout)
+                    if response.status_code not in [200, 201]:
+                        call['outcome'] = f'http_{response.status_code}'
+            except requests.exceptions.ReadTimeout as e:
+                outcome.update(error=f'No response from SMS gateway: {str(e)}', retryable=False, unknown=True)
+                return outcome
+            except requests.exceptions.ConnectionError as e:
+                outcome['error'] = f'Connection failed: {str(e)}'
+                outcome['retryable'] = True
+            else:
+                try:
+                    payload = response.json() if response.content else {}
+                except ValueError:
+                    payload = {}
+                    if response.status_code in [200, 201]:
+                        outcome.update(error='Invalid response from SMS gateway', retryable=False, unknown=True)
+                        return outcome
                 
-                message_content = _generate_patient_message(message_type, patient_data)
+                if response.status_code in [200, 201]:
+                    outcome.update(success=True, message_sid=payload.get('sid'), status=payload.get('status'))
+                    outcome.pop('error', None)
+                    outcome.pop('retryable', None)
+                    return outcome
                 
-                message = client.messages.create(
-                    body=message_content,
-                    from_=settings.twilio_phone_number,
-                    to=phone
-                )
+                outcome['error'] = f"Twilio error {response.status_code}: {payload.get('message', response.text[:200])}"
+                outcome['error_code'] = payload.get('code')
+                outcome['retryable'] = response.status_code in SMS_RETRYABLE_STATUS_CODES
+                if not outcome['retryable']:
+                    return outcome
                 
-                results.append({
-                    'recipient': recipient.get('name', phone),
-                    'success': True,
-                    'message_sid': message.sid,
-                    'status': message.status
-                })
-                
-            except Exception as e:
-                results.append({
-                    'recipient': recipient.get('name', 'Unknown'),
-                    'success': False,
-                    'error': str(e)
-                })
-        
-        successful = len([r for r in results if r['success']])
+                retry_after = retry_after_seconds(response)
+            
+            if attempt < self.max_retries:
+                with self.lock:
+                    self.progress['retries'] += 1
+                self.sleep(backoff_delay(attempt, base=0.5, cap=30.0, retry_after=retry_after))
         
-        return {
-            'success': True,
-            'total_sent': successful,
-            'total_recipients': len(recipients),
-            'results': results
-        }
+        return outcome
+    
+    def _send_tracked(self, message):
+        outcome = self.send(message['to'], message['body'])
+        outcome['recipient'] = message.get('recipient', message['to'])
+        with self.lock:
+            self.progress['sent' if outcome['success'] else 'unknown' if outcome.get('unknown') else 'failed'] += 1
+            progress = dict(self.progress)
+        if self.on_progress:
+            self.on_progress(progress)
+        return outcome
+    
+    def dispatch(self, messages):
+        """Send [{'to', 'body', 'recipient'}] concurrently; outcomes are returned in input order"""
+        messages = list(messages)
+        with self.lock:
+            self.progress['total'] += len(messages)
         
-    except Exception as e:
-        logger.error(f"Bulk SMS notification failed: {str(e)}")
-        return {'success': False, 'error': f'Bulk notification failed: {str(e)}'}
+        outcomes = [None] * len(messages)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sms') as executor:
+            futures = {executor.submit(self._send_tracked, message): i for i, message in enumerate(messages)}
+            for future in as_completed(futures):
+                outcomes[futures[future]] = future.result()
+        return outcomes
+
+def dispatcher_for(settings, **options):
+    """BulkSmsDispatcher configured from lab settings and app.config"""
+    options.setdefault('api_base', _sms_config('TWILIO_API_BASE', TWILIO_API_BASE))
+    options.setdefault('rate_per_second', float(_sms_config('SMS_RATE_PER_SECOND', SMS_RATE_PER_SECOND)))
+    options.setdefault('max_workers', int(_sms_config('SMS_MAX_WORKERS', SMS_MAX_WORKERS)))
+    options.setdefault('status_callback', _sms_config('SMS_STATUS_CALLBACK_URL', None))
+    return BulkSmsDispatcher(settings.twilio_account_sid, settings.twilio_auth_token,
+                             settings.twilio_phone_number, **options)
 
 def _generate_patient_message(message_type, data):
     """Generate patient SMS message content"""
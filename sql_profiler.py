@@ -0,0 +1,213 @@
+"""
+SQL Profiler Module
+Handles per-request SQL profiling from engine cursor events: query count, database time and repeated
+statement shapes (N+1 lazy loads), a slow-query log with bind-parameter fingerprints, and in dev
+mode a response header and an on-page summary. Requests are sampled, so it can stay on in production.
+"""
+import re
+import html
+import random
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SQL_PROFILER_SAMPLE_RATE = 0.01  # share of production requests profiled; dev mode profiles all
+SQL_SLOW_QUERY_MS = 200.0  # every statement slower than this is logged, sampled or not
+SQL_N_PLUS_ONE_THRESHOLD = 5  # the same statement shape this often in one request is flagged
+PROFILE_MAX_SHAPES = 200  # distinct shapes tracked per request; beyond that only totals are kept
+
+_WHITESPACE = re.compile(r'\s+')
+# Expanded IN lists and multi-row VALUES vary in length with the data, not with the code path
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)')
+_NUMBERED_PARAM = re.compile(r'(%\(|:)(\w+?)_\d+(\)s)?')
+
+def statement_shape(statement):
+    """Normalized statement text: whitespace collapsed, IN lists and parameter numbering folded"""
+    shape = _WHITESPACE.sub(' ', statement).strip()
+    shape = _PLACEHOLDER_LIST.sub('(?...)', shape)
+    return _NUMBERED_PARAM.sub(lambda m: f"{m.group(1)}{m.group(2)}{m.group(3) or ''}", shape)
+
+def shape_fingerprint(shape):
+    return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:12]
+
+def parameter_fingerprint(parameters):
+    """Types of the bind parameters plus a hash of their values, so slow calls can be correlated
+    without writing patient data to the log"""
+    if isinstance(parameters, dict):
+        values = [parameters[key] for key in sorted(parameters)]
+    elif isinstance(parameters, (list, tuple)):
+        values = list(parameters)
+    else:
+        values = [parameters] if parameters is not None else []
+    if values and isinstance(values[0], (list, tuple, dict)):
+        # executemany: describe the first row, count the rest
+        return f"{len(values)} rows of {parameter_fingerprint(values[0])}"
+
+    types = ','.join(type(value).__name__ for value in values[:12]) + (',...' if len(values) > 12 else '')
+    digest = hashlib.sha1(repr(values).encode('utf-8')).hexdigest()[:10]
+    return f"[{types}]#{digest}"
+
+class RequestProfile:
+    """SQL statistics of one request or background job"""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = {}  # fingerprint -> [count, seconds, shape]
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        shape = statement_shape(statement)
+        key = shape_fingerprint(shape)
+        entry = self.shapes.get(key)
+        if entry is not None:
+            entry[0] += 1
+            entry[1] += seconds
+        elif len(self.shapes) < PROFILE_MAX_SHAPES:
+            self.shapes[key] = [1, seconds, shape]
+
+    def repeated(self, threshold=SQL_N_PLUS_ONE_THRESHOLD):
+        """Shapes issued at least threshold times, most frequent first: [(fingerprint, count, seconds, shape)]"""
+        return sorted(((key, count, seconds, shape) for key, (count, seconds, shape) in self.shapes.items()
+                       if count >= threshold), key=lambda item: -item[1])
+
+    def summary(self, threshold=SQL_N_PLUS_ONE_THRESHOLD):
+        return {
+            'name': self.name,
+            'queries': self.queries,
+            'db_ms': round(self.seconds * 1000, 1),
+            'distinct_statements': len(self.shapes),
+            'repeated': [{'fingerprint': key, 'count': count, 'db_ms': round(seconds * 1000, 1), 'statement': shape[:300]}
+                         for key, count, seconds, shape in self.repeated(threshold)]
+        }
+
+class SqlProfiler:
+    """Per-statement recording (fed by the metrics cursor hooks) plus the Flask request wiring"""
+
+    def __init__(self):
+        self.sample_rate = SQL_PROFILER_SAMPLE_RATE
+        self.slow_query_ms = SQL_SLOW_QUERY_MS
+        self.n_plus_one_threshold = SQL_N_PLUS_ONE_THRESHOLD
+        self.dev_mode = False
+        self._local = threading.local()
+
+    @property
+    def current(self):
+        return getattr(self._local, 'profile', None)
+
+    def listen(self):
+        """Receive every statement's timing from the metrics cursor hooks"""
+        from metrics import listen_queries
+
+        listen_queries(self._record_query)
+
+    def _record_query(self, statement, parameters, seconds):
+        profile = self.current
+        if profile is not None:
+            profile.record(statement, seconds)
+        if seconds * 1000 >= self.slow_query_ms:
+            self._log_slow(statement, parameters, seconds, profile)
+
+    def _log_slow(self, statement, parameters, seconds, profile):
+        from metrics import metrics
+
+        shape = statement_shape(statement)
+        name = profile.name if profile is not None else self._request_name()
+        metrics.inc('medlab_sql_slow_queries_total', {'endpoint': name})
+        logger.warning(f"Slow query {seconds * 1000:.0f} ms in {name} shape={shape_fingerprint(shape)} "
+                       f"params={parameter_fingerprint(parameters)}: {shape[:500]}")
+
+    @staticmethod
+    def _request_name():
+        try:
+            from flask import request
+            return request.endpoint or 'unmatched'
+        except RuntimeError:
+            return 'background'
+
+    @contextmanager
+    def profile(self, name, log=True):
+        """Profile every statement issued in the block on this thread (background jobs)"""
+        previous = self.current
+        profile = self._local.profile = RequestProfile(name)
+        try:
+            yield profile
+        finally:
+            self._local.profile = previous
+            if log:
+                summary = profile.summary(self.n_plus_one_threshold)
+                top = ', '.join(f"{r['count']}x {r['fingerprint']}" for r in summary['repeated'][:5])
+                logger.info(f"SQL profile {name}: {summary['queries']} queries, {summary['db_ms']} ms"
+                            + (f"; most repeated: {top}" if top else ''))
+
+    def init_app(self, app):
+        from flask import request
+
+        self.dev_mode = bool(app.config.get('SQL_PROFILER_DEV'))
+        self.sample_rate = float(app.config.get('SQL_PROFILER_SAMPLE_RATE', self.sample_rate))
+        self.slow_query_ms = float(app.config.get('SQL_SLOW_QUERY_MS', self.slow_query_ms))
+        self.n_plus_one_threshold = int(app.config.get('SQL_N_PLUS_ONE_THRESHOLD', self.n_plus_one_threshold))
+        self.listen()
+
+        @app.before_request
+        def _start_sql_profile():
+            sampled = self.dev_mode or random.random() < self.sample_rate
+            self._local.profile = RequestProfile(request.endpoint or 'unmatched') if sampled else None
+
+        @app.after_request
+        def _finish_sql_profile(response):
+            profile = self.current
+            self._local.profile = None
+            if profile is None:
+                return response
+
+            repeated = profile.repeated(self.n_plus_one_threshold)
+            if repeated:
+                from metrics import metrics
+
+                metrics.inc('medlab_sql_n_plus_one_total', {'endpoint': profile.name})
+                key, count, seconds, shape = repeated[0]
+                logger.warning(f"Possible N+1 in {profile.name}: {count}x shape={key} "
+                               f"({seconds * 1000:.1f} ms of {profile.seconds * 1000:.1f} ms) {shape[:300]}")
+
+            if self.dev_mode:
+                response.headers['X-SQL-Profile'] = (f"queries={profile.queries}; db_ms={profile.seconds * 1000:.1f}; "
+                                                     f"repeated={len(repeated)}")
+                response.headers['Server-Timing'] = f'db;dur={profile.seconds * 1000:.1f};desc="{profile.queries} queries"'
+                if response.mimetype == 'text/html' and not response.direct_passthrough and not response.is_streamed:
+                    self._inject_toolbar(response, profile.summary(self.n_plus_one_threshold))
+            return response
+
+        @app.teardown_request
+        def _drop_sql_profile(exc=None):
+            self._local.profile = None
+
+    @staticmethod
+    def _inject_toolbar(response, summary):
+        """Append a fixed summary panel to an HTML page, just before </body>"""
+        body = response.get_data(as_text=True)
+        position = body.rfind('</body>')
+        if position < 0:
+            return
+
+        rows = ''.join(f"<li>{r['count']}&times; {r['db_ms']} ms <code>{html.escape(r['statement'][:160])}</code></li>"
+                       for r in summary['repeated'][:10])
+        colour = '#b42318' if summary['repeated'] else '#344054'
+        toolbar = (
+            f'<details id="sql-profiler" style="position:fixed;bottom:8px;right:8px;z-index:9999;max-width:40rem;'
+            f'background:#fff;border:1px solid {colour};border-radius:6px;padding:4px 8px;font:12px monospace;'
+            f'color:{colour};direction:ltr">'
+            f"<summary>SQL {summary['queries']} queries &middot; {summary['db_ms']} ms"
+            f"{' &middot; ' + str(len(summary['repeated'])) + ' repeated' if summary['repeated'] else ''}</summary>"
+            f'<ul style="margin:4px 0;padding-left:16px">{rows or "<li>No repeated statements</li>"}</ul></details>'
+        )
+        response.set_data(body[:position] + toolbar + body[position:])
+
+sql_profiler = SqlProfiler()
@@ -483,6 +483,37 @@ const MedLabPro = {
         
         // Check for notifications every minute
         setInterval(() => this.checkNotifications(), 60000);
+        
+        // Critical results are pushed to the dashboard as they are recorded
+        this.subscribeToAlerts();
+    },
+    
+    subscribeToAlerts() {
+        const streamUrl = document.body.dataset.alertStream;
+        if (!streamUrl || !window.EventSource) return;
+        
+        const source = new EventSource(streamUrl);
+        source.addEventListener('error', () => {
+            // Closed for good, e.g. a 204 when the worker has no free stream slot: try again later
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(() => this.subscribeToAlerts(), 30000);
+            }
+        });
+        source.addEventListener('critical', (e) => {
+            const alert = JSON.parse(e.data);
+            this.showNotification(
+                `Critical result: ${alert.patient_name || ''} ${alert.test_name || ''} ${alert.result_value || ''} ${alert.result_unit || ''}`,
+                'error', 15000
+            );
+            if (document.getElementById('dashboard-stats')) {
+                this.updateDashboardStats();
+            }
+        });
+        source.addEventListener('acknowledged', () => {
+            if (document.getElementById('dashboard-stats')) {
+                this.updateDashboardStats();
+            }
+        });
     },
     
     updateDashboardStats() {
@@ -616,11 +647,168 @@ const Search = {
     }
 };
 
+// Typeahead pickers backed by the lookup API
+// <input data-typeahead="/api/lookup/patients" data-typeahead-target="hiddenInputId">
+// The chosen entry's id becomes the hidden input's value, its label and detail data-label/data-detail
+const Typeahead = {
+    delay: 250,
+    minChars: 2,
+    
+    init() {
+        document.querySelectorAll('[data-typeahead]').forEach(input => this.attach(input));
+        
+        // A picker's hidden value is what gets submitted, so a form cannot go out without a choice
+        document.addEventListener('submit', (e) => {
+            e.target.querySelectorAll('[data-typeahead-required]').forEach(hidden => {
+                if (hidden.value) return;
+                e.preventDefault();
+                const input = e.target.querySelector(`[data-typeahead-target="${hidden.id}"]`);
+                if (input) {
+                    MedLabPro.setFieldError(input, 'Please choose an entry from the list');
+                    input.focus();
+                }
+            });
+        });
+    },
+    
+    attach(input) {
+        const state = {
+            hidden: document.getElementById(input.dataset.typeaheadTarget),
+            minChars: input.dataset.typeaheadMinChars !== undefined ? parseInt(input.dataset.typeaheadMinChars, 10) : this.minChars,
+            list: document.createElement('ul'),
+            results: [],
+            active: -1,
+            cache: new Map(),
+            controller: null
+        };
+        state.list.className = 'absolute z-50 w-full mt-1 bg-white dark:bg-gray-700 border border-gray-200 dark:border-gray-600 rounded-lg shadow-lg max-h-72 overflow-y-auto hidden';
+        input.insertAdjacentElement('afterend', state.list);
+        
+        const search = MedLabPro.debounce(() => this.search(input, state), this.delay);
+        input.addEventListener('input', () => {
+            // Editing the text invalidates the previous choice
+            if (state.hidden) {
+                state.hidden.value = '';
+                delete state.hidden.dataset.label;
+                delete state.hidden.dataset.detail;
+            }
+            search();
+        });
+        input.addEventListener('focus', () => {
+            if (!state.hidden?.value) search();
+        });
+        input.addEventListener('keydown', (e) => this.handleKey(e, input, state));
+        input.addEventListener('blur', () => setTimeout(() => this.close(state), 150));
+    },
+    
+    search(input, state) {
+        const query = input.value.trim();
+        if (query.length < state.minChars) {
+            this.close(state);
+            return;
+        }
+        if (state.cache.has(query)) {
+            this.render(input, state, state.cache.get(query));
+            return;
+        }
+        
+        // Only the latest keystroke's request matters
+        if (state.controller) state.controller.abort();
+        state.controller = new AbortController();
+        
+        const url = `${input.dataset.typeahead}?q=${encodeURIComponent(query)}`;
+        fetch(url, { signal: state.controller.signal, headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(data => {
+                if (state.cache.size > 50) state.cache.clear();
+                state.cache.set(query, data);
+                if (input.value.trim() === query) this.render(input, state, data);
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') console.warn('Lookup failed:', error);
+            });
+    },
+    
+    render(input, state, data) {
+        state.results = data.results || [];
+        state.active = -1;
+        state.list.innerHTML = '';
+        
+        if (!state.results.length) {
+            const empty = document.createElement('li');
+            empty.className = 'px-4 py-2 text-sm text-gray-500 dark:text-gray-400';
+            empty.textContent = 'No matches';
+            state.list.appendChild(empty);
+        }
+        state.results.forEach((result, index) => {
+            const item = document.createElement('li');
+            item.className = 'px-4 py-2 cursor-pointer hover:bg-blue-50 dark:hover:bg-gray-600';
+            const label = document.createElement('div');
+            label.className = 'text-sm text-gray-900 dark:text-white';
+            label.textContent = result.label;
+            const detail = document.createElement('div');
+            detail.className = 'text-xs text-gray-500 dark:text-gray-400';
+            detail.textContent = result.detail || '';
+            item.append(label, detail);
+            item.addEventListener('mousedown', (e) => {
+                e.preventDefault();
+                this.choose(input, state, index);
+            });
+            state.list.appendChild(item);
+        });
+        if (data.truncated) {
+            const more = document.createElement('li');
+            more.className = 'px-4 py-2 text-xs text-gray-400 italic';
+            more.textContent = 'More matches - keep typing to narrow down';
+            state.list.appendChild(more);
+        }
+        state.list.classList.remove('hidden');
+    },
+    
+    handleKey(e, input, state) {
+        if (state.list.classList.contains('hidden') || !state.results.length) return;
+        
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            const step = e.key === 'ArrowDown' ? 1 : -1;
+            state.active = (state.active + step + state.results.length) % state.results.length;
+            Array.from(state.list.children).forEach((item, index) => {
+                item.classList.toggle('bg-blue-50', index === state.active);
+            });
+        } else if (e.key === 'Enter' && state.active >= 0) {
+            e.preventDefault();
+            this.choose(input, state, state.active);
+        } else if (e.key === 'Escape') {
+            this.close(state);
+        }
+    },
+    
+    choose(input, state, index) {
+        const result = state.results[index];
+        input.value = result.label;
+        if (state.hidden) {
+            // Pages read the chosen entry from the hidden input: its id as the value, the rest as data-*
+            state.hidden.value = result.id;
+            state.hidden.dataset.label = result.label;
+            state.hidden.dataset.detail = result.detail || '';
+            state.hidden.dispatchEvent(new Event('change', { bubbles: true }));
+        }
+        MedLabPro.setFieldError(input, null);
+        this.close(state);
+    },
+    
+    close(state) {
+        state.list.classList.add('hidden');
+        state.active = -1;
+    }
+};
+
 // Initialize application when DOM is loaded
 document.addEventListener('DOMContentLoaded', () => {
     MedLabPro.init();
     DataTable.init('main-table');
     Search.init();
+    Typeahead.init();
 });
 
 // Global functions for template use
@@ -632,5 +820,5 @@ window.setLanguage = (lang) => MedLabPro.setLanguage(lang);
 
 // Export for module use
 if (typeof module !== 'undefined' && module.exports) {
-    module.exports = { MedLabPro, DataTable, Search };
+    module.exports = { MedLabPro, DataTable, Search, Typeahead };
 }
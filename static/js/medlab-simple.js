@@ -196,16 +196,18 @@ function loadPatientInfo() {
         bloodTestSelection.classList.remove('hidden');
     }
     
-    // Populate patient info
+    // Populate patient info from the typeahead's choice (label and detail are kept on the hidden input)
     const patientInfoContent = document.getElementById('patientInfoContent');
     if (patientInfoContent) {
         patientInfoContent.innerHTML = `
             <div class="bg-white dark:bg-gray-700 p-4 rounded-lg">
                 <h4 class="font-semibold text-gray-800 dark:text-gray-200">Patient Information</h4>
-                <p class="text-gray-600 dark:text-gray-400">Patient ID: ${patientSelect.value}</p>
-                <p class="text-gray-600 dark:text-gray-400">Name: ${patientSelect.options[patientSelect.selectedIndex].text}</p>
+                <p class="text-gray-600 dark:text-gray-400">Patient: <span data-field="detail"></span></p>
+                <p class="text-gray-600 dark:text-gray-400">Name: <span data-field="label"></span></p>
             </div>
         `;
+        patientInfoContent.querySelector('[data-field="detail"]').textContent = patientSelect.dataset.detail || patientSelect.value;
+        patientInfoContent.querySelector('[data-field="label"]').textContent = patientSelect.dataset.label || '';
     }
     
     console.log('Patient info loaded successfully');
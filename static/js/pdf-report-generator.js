@@ -20,15 +20,16 @@ class PDFReportGenerator {
     }
 
     init() {
-        this.loadPDFLibrary();
+        // jsPDF/html2canvas are only fetched when a client-side custom PDF is actually requested
         this.createGeneratorModal();
         this.setupEventListeners();
     }
 
     async loadPDFLibrary() {
         // Load jsPDF and html2canvas for PDF generation
-        if (!window.jsPDF) {
+        if (!window.jsPDF && !document.getElementById('jspdfScript')) {
             const script = document.createElement('script');
+            script.id = 'jspdfScript';
             script.src = 'https://cdnjs.cloudflare.com/ajax/libs/jspdf/2.5.1/jspdf.umd.min.js';
             document.head.appendChild(script);
             
@@ -212,6 +213,7 @@ class PDFReportGenerator {
         generateBtn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Generating...';
 
         try {
+            await this.loadPDFLibrary();
             const options = this.getReportOptions();
             const reportContent = await this.buildReportContent(options);
             const pdf = await this.createPDFDocument(reportContent, options);
@@ -802,6 +804,40 @@ class PDFReportGenerator {
         });
     }
 
+    // Download a stored report as a server-rendered PDF, polling while it is still rendering
+    async downloadServerReport(reportId, attempts = 15) {
+        for (let attempt = 0; attempt < attempts; attempt++) {
+            const response = await fetch(`/reports/${reportId}/download`, { credentials: 'same-origin' });
+
+            if (response.status === 202) {
+                const retryAfter = parseInt(response.headers.get('Retry-After') || '2', 10);
+                await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+                continue;
+            }
+
+            if (!response.ok) {
+                throw new Error(`Download failed with status ${response.status}`);
+            }
+
+            const disposition = response.headers.get('Content-Disposition') || '';
+            const match = disposition.match(/filename="?([^";]+)"?/);
+            const fileName = match ? match[1] : `report_${reportId}.pdf`;
+
+            const blob = await response.blob();
+            const url = URL.createObjectURL(blob);
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = fileName;
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            URL.revokeObjectURL(url);
+            return;
+        }
+
+        throw new Error('PDF is still being generated, please try again');
+    }
+
     // Static method to trigger PDF generation
     static generateReport(reportData) {
         const event = new CustomEvent('generatePDFReport', {
@@ -817,4 +853,13 @@ window.pdfReportGenerator = new PDFReportGenerator();
 // Global function for template use
 function generatePDFReport(reportData) {
     window.pdfReportGenerator.open(reportData);
+}
+
+function downloadServerPDF(reportId) {
+    return window.pdfReportGenerator.downloadServerReport(reportId).catch((error) => {
+        console.error('Report download failed:', error);
+        if (window.medlabApp) {
+            window.medlabApp.showNotification(error.message, 'error');
+        }
+    });
 }
\ No newline at end of file
@@ -19,6 +19,14 @@ const CORE_CACHE_FILES = [
     '/static/img/icon-512.png'
 ];
 
+// Resources the server tags with ETag/Last-Modified; always revalidated before use
+const REVALIDATE_PATTERNS = [
+    /^\/reports\/\d+$/,
+    /^\/reports\/\d+\/download$/,
+    /^\/api\/dashboard-stats$/,
+    /^\/export-patient-reports$/
+];
+
 // Install event - cache core files
 self.addEventListener('install', (event) => {
     console.log('Service Worker: Installing...');
@@ -77,6 +85,12 @@ self.addEventListener('fetch', (event) => {
         return;
     }
 
+    // Versioned resources are revalidated with the server instead of served blindly from cache
+    if (REVALIDATE_PATTERNS.some((pattern) => pattern.test(url.pathname))) {
+        event.respondWith(revalidateRequest(request));
+        return;
+    }
+
     // Handle API requests differently
     if (url.pathname.startsWith('/api/')) {
         event.respondWith(handleApiRequest(request));
@@ -125,6 +139,51 @@ self.addEventListener('fetch', (event) => {
     );
 });
 
+// Conditional revalidation: a 304 from the server means the cached copy is still current
+async function revalidateRequest(request) {
+    const cache = await caches.open(DYNAMIC_CACHE);
+    const cachedResponse = await cache.match(request);
+    const headers = new Headers(request.headers);
+
+    if (cachedResponse) {
+        const etag = cachedResponse.headers.get('ETag');
+        const lastModified = cachedResponse.headers.get('Last-Modified');
+        if (etag) {
+            headers.set('If-None-Match', etag);
+        }
+        if (lastModified) {
+            headers.set('If-Modified-Since', lastModified);
+        }
+    }
+
+    try {
+        const networkResponse = await fetch(request.url, {
+            headers,
+            credentials: 'same-origin',
+            cache: 'no-store'
+        });
+
+        if (networkResponse.status === 304 && cachedResponse) {
+            return cachedResponse;
+        }
+
+        if (networkResponse.ok && networkResponse.headers.get('ETag')) {
+            cache.put(request, networkResponse.clone());
+        }
+
+        return networkResponse;
+    } catch (error) {
+        if (cachedResponse) {
+            return cachedResponse;
+        }
+
+        return new Response('Offline', {
+            status: 503,
+            statusText: 'Service Unavailable'
+        });
+    }
+}
+
 // Handle API requests with offline support
 async function handleApiRequest(request) {
     try {
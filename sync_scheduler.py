@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+MediSina Sync Scheduler Module
+Runs per-lab MediSina auto-syncs and queued manual syncs in a dedicated worker process.
+Any number of scheduler instances may run; a PostgreSQL advisory lock per laboratory
+makes sure only one of them syncs a given lab at a time.
+
+Usage:
+    python sync_scheduler.py            # run until SIGTERM
+    python sync_scheduler.py --once     # single pass, e.g. from cron
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import signal
+import socket
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# First key of the two-int advisory lock; the second is the laboratory id
+ADVISORY_LOCK_NAMESPACE = 0x4D53  # "MS"
+
+POLL_INTERVAL = 30  # seconds between scheduler passes
+INTERVAL_JITTER = 0.1  # +/- fraction applied to each lab's sync interval
+STALE_RUN_AFTER = timedelta(hours=6)
+
+def jittered_interval(laboratory_id, last_run_id, interval_minutes, jitter=INTERVAL_JITTER):
+    """Sync interval stretched or shrunk by up to +/- jitter
+
+    Seeded by the lab and its last run so every scheduler instance computes the same due time,
+    while labs configured with the same interval drift apart instead of firing together.
+    """
+    rng = random.Random(f'{laboratory_id}:{last_run_id}')
+    return timedelta(minutes=interval_minutes * (1 + rng.uniform(-jitter, jitter)))
+
+def initial_offset(laboratory_id, interval_minutes):
+    """Spread first syncs over one interval after the scheduler starts"""
+    fraction = (zlib.crc32(str(laboratory_id).encode('ascii')) % 1000) / 1000.0
+    return timedelta(minutes=interval_minutes * fraction)
+
+@contextmanager
+def laboratory_lock(laboratory_id):
+    """Hold a cross-process lock for one laboratory's sync; yields False if another instance has it"""
+    from sqlalchemy import text
+    from db_config import session_engine
+
+    engine = session_engine()
+    if engine.dialect.name != 'postgresql':
+        # SQLite development databases are single-node; the claim in _claim_run still prevents doubles
+        yield True
+        return
+
+    # Session-level advisory locks live as long as this connection, and die with the process
+    # (behind PgBouncer this is a direct connection, see DATABASE_DIRECT_URL)
+    connection = engine.connect()
+    try:
+        acquired = connection.execute(
+            text('SELECT pg_try_advisory_lock(:namespace, :laboratory_id)'),
+            {'namespace': ADVISORY_LOCK_NAMESPACE, 'laboratory_id': laboratory_id}
+        ).scalar()
+        connection.commit()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                connection.execute(
+                    text('SELECT pg_advisory_unlock(:namespace, :laboratory_id)'),
+                    {'namespace': ADVISORY_LOCK_NAMESPACE, 'laboratory_id': laboratory_id}
+                )
+                connection.commit()
+    finally:
+        connection.close()
+
+def queue_sync(laboratory_id, direction, user_id=None):
+    """Queue a manual sync for the scheduler; returns the SyncRun"""
+    from app import db
+    from models import SyncRun
+
+    run = SyncRun(laboratory_id=laboratory_id, direction=direction, trigger='manual',
+                  status='queued', requested_by=user_id)
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+def execute_sync(settings, direction):
+    """Run export and/or import for a lab; returns (success, records, per-direction results)"""
+    from medisina_api import export_to_medisina, import_from_medisina
+    from sql_profiler import sql_profiler
+    from db_config import statement_timeouts
+
+    results = {}
+    # Syncs are rare and long, so they are always profiled; the summary shows lazy-load storms per page
+    with statement_timeouts.statement_class('export'):
+        if direction in ('export', 'both'):
+            with sql_profiler.profile(f'medisina_export lab {settings.laboratory_id}'):
+                results['export'] = export_to_medisina(settings)
+        if direction in ('import', 'both'):
+            with sql_profiler.profile(f'medisina_import lab {settings.laboratory_id}'):
+                results['import'] = import_from_medisina(settings)
+
+    records = (results.get('export', {}).get('patient_count', 0)
+               + results.get('import', {}).get('total_processed', 0))
+    # "No patients found" is not a failure of a scheduled export
+    success = all(r.get('success') or r.get('error') == 'No patients found for export' for r in results.values())
+    return success, records, results
+
+class SyncScheduler:
+    """Polls for due and queued syncs and runs them under per-lab locks"""
+
+    def __init__(self, app, poll_interval=POLL_INTERVAL, max_workers=2):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.host = f'{socket.gethostname()}:{os.getpid()}'
+        self.started_at = datetime.utcnow()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='medisina-sync')
+        self.running = {}  # laboratory_id -> future, for labs this instance is syncing right now
+        self._stop = threading.Event()
+
+    def stop(self, *args):
+        logger.info("Sync scheduler stopping")
+        self._stop.set()
+
+    def run_forever(self):
+        logger.info(f"Sync scheduler {self.host} started (poll every {self.poll_interval}s)")
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Sync scheduler pass failed: {str(e)}")
+            # Jittered sleep so scheduler replicas do not poll in lockstep
+            self._stop.wait(self.poll_interval * random.uniform(0.8, 1.2))
+        self.executor.shutdown(wait=True)
+
+    def tick(self):
+        """One pass: dispatch queued manual runs, then labs whose interval has elapsed"""
+        from models import Settings, SyncRun
+
+        self.running = {lab: f for lab, f in self.running.items() if not f.done()}
+
+        with self.app.app_context():
+            self._fail_stale_runs()
+
+            queued = SyncRun.query.filter_by(status='queued').order_by(SyncRun.created_at).limit(50).all()
+            for run in queued:
+                self._dispatch(run.laboratory_id, run_id=run.id)
+
+            now = datetime.utcnow()
+            for settings in Settings.query.filter_by(medisina_enabled=True, medisina_auto_sync=True).all():
+                if self._is_due(settings, now):
+                    self._dispatch(settings.laboratory_id)
+
+    def _dispatch(self, laboratory_id, run_id=None):
+        if laboratory_id in self.running:
+            return
+        self.running[laboratory_id] = self.executor.submit(self._run_locked, laboratory_id, run_id)
+
+    def _is_due(self, settings, now):
+        from models import SyncRun
+
+        interval = settings.medisina_sync_interval or 60
+        last_run = SyncRun.query.filter(
+            SyncRun.laboratory_id == settings.laboratory_id,
+            SyncRun.status.in_(['running', 'succeeded', 'failed'])
+        ).order_by(SyncRun.started_at.desc()).first()
+
+        if last_run is None:
+            return now >= self.started_at + initial_offset(settings.laboratory_id, interval)
+        if last_run.status == 'running':
+            return False
+        return now >= last_run.started_at + jittered_interval(settings.laboratory_id, last_run.id, interval)
+
+    def _fail_stale_runs(self):
+        """Runs left 'running' by a crashed scheduler would otherwise block their lab forever"""
+        from app import db
+        from models import SyncRun
+
+        cutoff = datetime.utcnow() - STALE_RUN_AFTER
+        stale = SyncRun.query.filter(SyncRun.status == 'running', SyncRun.started_at < cutoff).all()
+        for run in stale:
+            run.status = 'failed'
+            run.error = 'Abandoned: scheduler stopped while the sync was running'
+            run.finished_at = datetime.utcnow()
+        if stale:
+            db.session.commit()
+
+    def _run_locked(self, laboratory_id, run_id=None):
+        with self.app.app_context():
+            try:
+                with laboratory_lock(laboratory_id) as acquired:
+                    if not acquired:
+                        logger.debug(f"Lab {laboratory_id} is being synced by another scheduler")
+                        return None
+                    return self._run(laboratory_id, run_id)
+            except Exception as e:
+                logger.error(f"Sync of lab {laboratory_id} failed: {str(e)}")
+                return None
+
+    def _claim_run(self, laboratory_id, run_id):
+        """Atomically move a queued run (or a new scheduled one) to running; None if already taken"""
+        from app import db
+        from models import Settings, SyncRun
+
+        now = datetime.utcnow()
+        if run_id is not None:
+            claimed = SyncRun.query.filter_by(id=run_id, status='queued').update(
+                {'status': 'running', 'started_at': now, 'host': self.host}, synchronize_session=False
+            )
+            db.session.commit()
+            return db.session.get(SyncRun, run_id) if claimed else None
+
+        # Re-check under the lock: another instance may have just finished this lab's sync
+        settings = Settings.query.filter_by(laboratory_id=laboratory_id).first()
+        if settings is None or not self._is_due(settings, now):
+            return None
+
+        run = SyncRun(laboratory_id=laboratory_id, direction='both', trigger='schedule',
+                      status='running', started_at=now, host=self.host)
+        db.session.add(run)
+        db.session.commit()
+        return run
+
+    def _run(self, laboratory_id, run_id=None):
+        from app import db
+        from models import Settings
+
+        run = self._claim_run(laboratory_id, run_id)
+        if run is None:
+            return None
+
+        settings = Settings.query.filter_by(laboratory_id=laboratory_id).first()
+        started = time.monotonic()
+        try:
+            if settings is None or not settings.medisina_enabled:
+                success, records, results = False, 0, {'error': 'MediSina integration not enabled'}
+            else:
+                success, records, results = execute_sync(settings, run.direction)
+        except Exception as e:
+            db.session.rollback()
+            success, records, results = False, 0, {'error': str(e)}
+
+        run.status = 'succeeded' if success else 'failed'
+        run.records = records
+        run.result = json.dumps(results, default=str)
+        if not success:
+            errors = [r.get('error') for r in results.values() if isinstance(r, dict) and r.get('error')]
+            run.error = '; '.join(errors) or results.get('error')
+        run.finished_at = datetime.utcnow()
+        run.duration_ms = int((time.monotonic() - started) * 1000)
+        db.session.commit()
+
+        logger.info(f"MediSina {run.trigger} sync of lab {laboratory_id} {run.status}: "
+                    f"{records} records in {run.duration_ms} ms")
+        return run.id
+
+def main():
+    parser = argparse.ArgumentParser(description='MediSina auto-sync scheduler')
+    parser.add_argument('--once', action='store_true', help='run a single pass and exit')
+    args = parser.parse_args()
+
+    from app import app
+
+    scheduler = SyncScheduler(
+        app,
+        poll_interval=int(app.config.get('MEDISINA_SCHEDULER_POLL_SECONDS', POLL_INTERVAL)),
+        max_workers=int(app.config.get('MEDISINA_SCHEDULER_CONCURRENCY', 2))
+    )
+
+    if args.once:
+        scheduler.tick()
+        scheduler.executor.shutdown(wait=True)
+        return
+
+    if app.config.get('METRICS_PORT'):
+        from metrics import start_http_server
+        start_http_server(app.config['METRICS_PORT'])
+
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    scheduler.run_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for batch sample accessioning of scanned tubes
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from sqlalchemy import event
+from accession import accession_samples
+from models import Laboratory, Patient, TestType, TestOrder, Sample
+from app import app, db
+
+class TestBatchAccession(unittest.TestCase):
+    """A rack is resolved, inserted and transitioned in bulk, with per-item results"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Accession Lab')
+        db.session.add(lab)
+        db.session.flush()
+        self.lab_id = lab.id
+        patient = Patient(patient_id='ACC0001', first_name='Test', last_name='Patient', laboratory_id=lab.id)
+        test_type = TestType(code='CBC', name='Complete Blood Count')
+        db.session.add_all([patient, test_type])
+        db.session.flush()
+        db.session.add_all([
+            TestOrder(order_number=f'RACK{i:03d}', patient_id=patient.id, test_type_id=test_type.id, status='ordered')
+            for i in range(96)
+        ] + [TestOrder(order_number='DONE001', patient_id=patient.id, test_type_id=test_type.id, status='completed')])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_full_rack_in_constant_statements(self):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            result = accession_samples(self.lab_id, [f'RACK{i:03d}' for i in range(96)], {'sample_type': 'blood'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(result['accepted'], 96)
+        self.assertEqual(result['collected_orders'], 96)
+        self.assertLess(len(statements), 12)
+        self.assertEqual(Sample.query.count(), 96)
+        self.assertEqual(TestOrder.query.filter_by(status='collected').count(), 96)
+        self.assertEqual(len({r['sample_id'] for r in result['results']}), 96)
+
+    def test_invalid_items_do_not_fail_the_batch(self):
+        result = accession_samples(self.lab_id, [
+            'RACK000', {'order_number': 'RACK001', 'barcode': 'TUBE-1'}, 'RACK000', 'NOPE', 'DONE001',
+            {'order_number': 'RACK002', 'barcode': 'TUBE-1'}
+        ], {'sample_type': 'serum'})
+
+        self.assertEqual([r['success'] for r in result['results']], [True, True, False, False, False, False])
+        self.assertEqual(result['results'][1]['sample_id'], 'TUBE-1')
+        self.assertEqual(result['results'][2]['error'], 'Order scanned twice in this batch')
+        self.assertEqual(result['results'][4]['error'], 'Order is completed')
+
+        # Scanning the same tube again needs an explicit recollect
+        again = accession_samples(self.lab_id, ['RACK000', {'order_number': 'RACK001', 'recollect': True}],
+                                  {'sample_type': 'serum'})
+        self.assertEqual([r['success'] for r in again['results']], [False, True])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for the query plan benchmark checks (no database needed)
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from benchmark_queries import find_seq_scans, compare_timing
+
+def node(node_type, relation=None, *children):
+    plan = {'Node Type': node_type, 'Plans': list(children)}
+    if relation:
+        plan['Relation Name'] = relation
+    return plan
+
+class TestFindSeqScans(unittest.TestCase):
+    """Only sequential scans of large, non-allowed tables count, at any depth"""
+
+    def test_nested_plan(self):
+        plan = node('Limit', None,
+                    node('Nested Loop', None,
+                         node('Index Scan', 'patients'),
+                         node('Hash Join', None, node('Seq Scan', 'test_orders'), node('Seq Scan', 'test_types'))),
+                    node('Seq Scan', 'samples'))
+        big = {'patients', 'test_orders', 'samples'}
+
+        self.assertEqual(find_seq_scans(plan, big), ['samples', 'test_orders'])
+        self.assertEqual(find_seq_scans(plan, big, allowed={'test_orders'}), ['samples'])
+        self.assertEqual(find_seq_scans(node('Index Only Scan', 'patients'), big), [])
+
+class TestCompareTiming(unittest.TestCase):
+    """Regressions need both the relative and the absolute margin; a missing baseline is reported"""
+
+    def test_regression(self):
+        baseline = {'patients_list': 10.0, 'tiny': 0.2}
+        self.assertIsNone(compare_timing('patients_list', 14.0, baseline))
+        self.assertIn('+60%', compare_timing('patients_list', 16.0, baseline))
+        self.assertIsNone(compare_timing('patients_list', 16.0, baseline, max_regression=1.0))
+        # Sub-millisecond queries may double without failing
+        self.assertIsNone(compare_timing('tiny', 0.6, baseline))
+
+    def test_missing_baseline(self):
+        self.assertIn('no baseline', compare_timing('new_query', 1.0, {'patients_list': 10.0}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for critical-result detection, staff paging, duplicate suppression, latency histograms and the alert stream
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from critical_alerts import alert_broker, acknowledge_alert, latency_histogram
+from models import Laboratory, User, Settings, Patient, TestType, TestOrder, CriticalAlert, SmsOutbox
+from app import app, db
+
+class TestLatencyHistogram(unittest.TestCase):
+    """Cumulative buckets and SLA attainment"""
+
+    def test_buckets_and_percentiles(self):
+        summary = latency_histogram([0.2, 0.8, 3.0, 45.0, 90.0, None], sla_seconds=60)
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['buckets']['0.25'], 1)
+        self.assertEqual(summary['buckets']['5'], 3)
+        self.assertEqual(summary['buckets']['+Inf'], 5)
+        self.assertEqual(summary['within_sla'], 0.8)
+
+class TestCriticalResultPipeline(unittest.TestCase):
+    """A critical result pages on-call staff once and reaches subscribed dashboards"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Alert Lab')
+        db.session.add(lab)
+        db.session.flush()
+        self.lab_id = lab.id
+        db.session.add(Settings(laboratory_id=lab.id, sms_enabled=True, twilio_account_sid='AC123',
+                                twilio_auth_token='token', twilio_phone_number='+15550000000',
+                                critical_alert_phones='+989120000001, +989120000002'))
+        self.patient = Patient(patient_id='CRIT0001', first_name='Test', last_name='Patient', laboratory_id=lab.id)
+        self.test_type = TestType(code='K', name='Potassium', unit='mmol/L')
+        db.session.add_all([self.patient, self.test_type])
+        db.session.commit()
+        self.subscription = alert_broker.subscribe(lab.id)
+
+    def tearDown(self):
+        self.subscription.close()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _critical_order(self, number, value):
+        order = TestOrder(order_number=number, patient_id=self.patient.id, test_type_id=self.test_type.id)
+        db.session.add(order)
+        db.session.commit()
+        order.result_value = value
+        order.result_unit = 'mmol/L'
+        order.result_status = 'critical'
+        db.session.commit()
+        return order
+
+    def test_pages_once_and_suppresses_repeats(self):
+        first = self._critical_order('K-1', '6.9')
+        event = self.subscription.get(timeout=2)
+        self.assertEqual(event['type'], 'critical')
+        self.assertEqual(event['test_order_id'], first.id)
+        self.assertEqual(SmsOutbox.query.filter_by(entity_type='critical_alert').count(), 2)
+
+        # Saving the same value again is not a new alert
+        first.result_notes = 'Repeat requested'
+        db.session.commit()
+        self.assertEqual(CriticalAlert.query.count(), 1)
+
+        # A second critical potassium while the first is open is de-escalated
+        self._critical_order('K-2', '7.1')
+        self.assertEqual(self.subscription.get(timeout=2)['type'], 'duplicate')
+        duplicate = CriticalAlert.query.filter_by(status='suppressed').one()
+        self.assertEqual(SmsOutbox.query.filter_by(entity_type='critical_alert').count(), 2)
+
+        alert = CriticalAlert.query.filter_by(status='open').one()
+        self.assertEqual(duplicate.duplicate_of_id, alert.id)
+        acknowledge_alert(alert, None)
+        db.session.commit()
+        self.assertEqual(CriticalAlert.query.filter_by(status='acknowledged').count(), 2)
+
+class TestAlertStream(unittest.TestCase):
+    """Streams are dashboard-only, capped per worker and hold no database connection"""
+
+    def setUp(self):
+        import routes  # noqa: F401
+
+        app.config['TESTING'] = True
+        app.secret_key = app.secret_key or 'test-secret'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Stream Lab')
+        db.session.add(lab)
+        db.session.flush()
+        user = User(username='stream', password_hash='x', laboratory_id=lab.id)
+        db.session.add(user)
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user.id
+        self.max_streams = alert_broker.max_streams
+        alert_broker.max_streams = 1
+
+    def tearDown(self):
+        alert_broker.max_streams = self.max_streams
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_stream_slots_and_session(self):
+        stream = self.client.get('/api/alerts/stream', buffered=False)
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(alert_broker.streams_open, 1)
+        self.assertFalse(db.session().in_transaction())
+
+        # The worker's only slot is taken
+        self.assertEqual(self.client.get('/api/alerts/stream').status_code, 204)
+        stream.close()
+        self.assertEqual(alert_broker.streams_open, 0)
+
+    def test_only_the_dashboard_subscribes(self):
+        self.assertIn(b'data-alert-stream', self.client.get('/dashboard').data)
+        self.assertNotIn(b'data-alert-stream', self.client.get('/patients').data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for the database configuration (pool sizing, PgBouncer mode, route-class statement timeouts)
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from db_config import engine_options, pool_sizing, route_class, StatementTimeouts
+
+POSTGRES = 'postgresql://medlab:secret@db:5432/medlabpro'
+
+class TestEngineOptions(unittest.TestCase):
+    """Pools follow the gunicorn threads; PgBouncer gets no session-level settings"""
+
+    def test_pool_follows_threads(self):
+        self.assertEqual(pool_sizing({'GUNICORN_THREADS': 4}), (4, 2))
+        self.assertEqual(pool_sizing({'GUNICORN_THREADS': 8}), (8, 4))
+        self.assertEqual(pool_sizing({'GUNICORN_THREADS': 4, 'DB_POOL_SIZE': 6, 'DB_MAX_OVERFLOW': 0}), (6, 0))
+
+    def test_direct_postgresql(self):
+        options = engine_options({'SQLALCHEMY_DATABASE_URI': POSTGRES, 'GUNICORN_THREADS': 4,
+                                  'DB_STATEMENT_TIMEOUT_MS': 3000})
+        self.assertEqual((options['pool_size'], options['max_overflow']), (4, 2))
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertIn('-c statement_timeout=3000', options['connect_args']['options'])
+        self.assertNotIn('prepare_threshold', options['connect_args'])
+
+    def test_pgbouncer(self):
+        options = engine_options({'SQLALCHEMY_DATABASE_URI': POSTGRES.replace('postgresql:', 'postgresql+psycopg:'),
+                                  'DB_PGBOUNCER': True})
+        self.assertNotIn('options', options['connect_args'])
+        self.assertIsNone(options['connect_args']['prepare_threshold'])
+
+    def test_sqlite_keeps_its_pool(self):
+        options = engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite:///medlab.db'})
+        self.assertEqual(set(options), {'pool_recycle', 'pool_pre_ping'})
+
+class TestRouteClasses(unittest.TestCase):
+    """Only non-default classes pay for a SET LOCAL, unless PgBouncer leaves no session default"""
+
+    def test_classes(self):
+        timeouts = StatementTimeouts()
+        self.assertEqual(route_class('export_patient_reports'), 'export')
+        self.assertEqual(route_class('login'), 'interactive')
+        self.assertIsNone(timeouts.set_local_statement('interactive'))
+        self.assertEqual(timeouts.set_local_statement('export'), 'SET LOCAL statement_timeout = 120000')
+        self.assertEqual(timeouts.set_local_statement('maintenance'), 'SET LOCAL statement_timeout = 0')
+
+    def test_pgbouncer_sets_the_default_class_too(self):
+        from flask import Flask
+
+        timeouts = StatementTimeouts()
+        app = Flask(__name__)
+        app.config.update(DB_PGBOUNCER=True, DB_STATEMENT_TIMEOUT_MS=3000)
+        timeouts.init_app(app)
+        self.assertEqual(timeouts.set_local_statement('interactive'), 'SET LOCAL statement_timeout = 3000')
+        self.assertEqual(timeouts.set_local_statement('export'), 'SET LOCAL statement_timeout = 120000')
+
+class TestStatementClassInApp(unittest.TestCase):
+    """Switching class inside an app context looks at the thread's session, not the registry"""
+
+    def test_app_imports_under_maintenance_class(self):
+        # app.py runs create_all/migrations inside statement_class('maintenance')
+        from app import app, db
+        from db_config import statement_timeouts
+
+        with app.app_context():
+            db.session.execute(db.text('SELECT 1'))
+            self.assertTrue(db.session().in_transaction())
+            with statement_timeouts.statement_class('maintenance'):
+                self.assertEqual(statement_timeouts.current_class, 'maintenance')
+            self.assertEqual(statement_timeouts.current_class, 'interactive')
+            db.session.rollback()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the vectorized delta check core
+"""
+
+import unittest
+import sys
+
+import numpy as np
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from delta_checks import compute_deltas, match_priors
+
+class TestComputeDeltas(unittest.TestCase):
+    """Change, percent and rate-of-change thresholds"""
+
+    def test_each_limit_flags_independently(self):
+        nan = np.nan
+        deltas = compute_deltas(
+            current=[150.0, 105.0, 2.0, 100.0],
+            previous=[100.0, 100.0, 1.0, 100.0],
+            elapsed_days=[10.0, 10.0, 0.5, 1.0],
+            absolute_limit=np.array([nan, 4.0, nan, nan]),
+            percent_limit=np.array([50.0, nan, nan, 10.0]),
+            rate_limit=np.array([nan, nan, 1.5, nan])
+        )
+
+        self.assertEqual(deltas['failed'].tolist(), [True, True, True, False])
+        self.assertAlmostEqual(deltas['percent'][0], 50.0)
+        self.assertAlmostEqual(deltas['rate'][2], 2.0)
+
+    def test_zero_previous_and_missing_pairs_do_not_fail(self):
+        deltas = compute_deltas([5.0, np.nan], [0.0, np.nan], [1.0, np.nan],
+                                np.array([np.nan, 1.0]), np.array([10.0, 10.0]), np.array([np.nan, np.nan]))
+
+        self.assertTrue(np.isnan(deltas['percent'][0]))
+        self.assertEqual(deltas['failed'].tolist(), [False, False])
+
+class TestMatchPriors(unittest.TestCase):
+    """Latest strictly-earlier prior within the same patient/test group"""
+
+    def test_matches_latest_earlier_prior_in_group(self):
+        index = match_priors(
+            current_groups=[0, 1, 0, 2],
+            current_times=[300, 150, 100, 50],
+            prior_groups=[0, 0, 1, 0, 2],
+            prior_times=[100, 200, 100, 300, 50]
+        )
+
+        # group 0 @300 -> prior @200 (index 1); group 1 @150 -> index 2;
+        # group 0 @100 has nothing earlier; group 2 @50 only matches itself, which is not earlier
+        self.assertEqual(index.tolist(), [1, 2, -1, -1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for liveness/readiness reporting and the integration circuit breakers
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from health import CircuitBreaker, HealthMonitor
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Repeated failures open the breaker; one trial call is let through after the cool-down"""
+
+    def test_opens_and_recovers(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker('medisina', failure_threshold=3, reset_seconds=30, clock=clock)
+        for _ in range(3):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure('503')
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.snapshot()['state'], 'open')
+
+        clock.now = 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # only one trial while half-open
+        breaker.record_success()
+        self.assertEqual(breaker.snapshot(), {'state': 'closed', 'failures': 0, 'retry_in_seconds': None,
+                                              'last_error': '503'})
+
+    def test_failed_trial_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker('llm:openai', failure_threshold=1, reset_seconds=10, clock=clock)
+        breaker.record_failure('timeout')
+        clock.now = 10
+        self.assertTrue(breaker.allow())
+        breaker.record_failure('timeout')
+        self.assertEqual(breaker.snapshot()['state'], 'open')
+        self.assertEqual(breaker.snapshot()['retry_in_seconds'], 10)
+
+class TestProbeCache(unittest.TestCase):
+    """The database is probed at most once per TTL"""
+
+    def test_probe_is_reused_within_ttl(self):
+        monitor = HealthMonitor()
+        calls = []
+        monitor._probe_database = lambda: calls.append(1) or {'database': {'ok': True}, 'queues': {}}
+        for _ in range(5):
+            monitor.cached_probe()
+        self.assertEqual(len(calls), 1)
+
+        monitor.db_ttl = 0
+        monitor.cached_probe()
+        self.assertEqual(len(calls), 2)
+
+class TestThreadSaturation(unittest.TestCase):
+    """A worker goes not-ready once every request thread but the probe's own is busy"""
+
+    def setUp(self):
+        from app import app
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_saturation_threshold_is_whole_threads(self):
+        monitor = HealthMonitor()
+        monitor.request_threads, monitor.saturation_ratio = 4, 0.8
+        monitor.cached_probe = lambda: {'database': {'ok': True}, 'queues': {}, 'checked_at': 'now'}
+
+        monitor.in_flight = 3  # the probe plus two requests
+        self.assertTrue(monitor.readiness()['ready'])
+
+        monitor.in_flight = 4  # the probe plus three, so no thread is left
+        report = monitor.readiness()
+        self.assertFalse(report['ready'])
+        self.assertEqual(report['reasons'], ['request threads saturated'])
+        self.assertEqual(report['requests']['in_flight'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
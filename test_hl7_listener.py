@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Tests for the HL7 v2 MLLP listener (framing, parsing, pipelined ACKs, batched writes)
+"""
+
+import unittest
+import asyncio
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from hl7_listener import MllpFrameDecoder, MllpServer, frame, parse_message, send_messages
+
+def oru(control_id, order_number, value, patient_id='HL70001', flag=''):
+    return '\r'.join([
+        f'MSH|^~\\&|ANALYZER|WARD1|MEDLAB|LAB|20260101120000||ORU^R01|{control_id}|P|2.5',
+        f'PID|1||{patient_id}^^^HOSP||Doe^Jane||19800215|F|||||555\\F\\0100',
+        f'OBR|1|{order_number}||GLU^Glucose|||20260101110000',
+        f'OBX|1|NM|GLU^Glucose||{value}|mg/dL|70-100|{flag}|||F|||20260101115500'
+    ])
+
+class TestHL7Parsing(unittest.TestCase):
+    """Frames are split across reads and segments parsed with their own delimiters"""
+
+    def test_frames_split_across_reads(self):
+        decoder = MllpFrameDecoder()
+        data = b'\r' + frame('MSH|first') + frame('MSH|second')
+        payloads = []
+        for i in range(0, len(data), 5):
+            payloads += decoder.feed(data[i:i + 5])
+        self.assertEqual(payloads, [b'MSH|first', b'MSH|second'])
+
+    def test_oversized_frame_is_refused(self):
+        decoder = MllpFrameDecoder(max_message_bytes=16)
+        with self.assertRaises(ValueError):
+            decoder.feed(b'\x0b' + b'x' * 32)
+
+    def test_parse_result_message(self):
+        parsed = parse_message(oru('MSG1', 'ORD1', '5.4', flag='H'))
+        self.assertEqual((parsed['type'], parsed['trigger'], parsed['control_id']), ('ORU', 'R01', 'MSG1'))
+        self.assertEqual(parsed['sending_facility'], 'WARD1')
+        self.assertEqual(parsed['patient']['patient_id'], 'HL70001')
+        self.assertEqual(parsed['patient']['phone'], '555|0100')
+        self.assertEqual(str(parsed['patient']['date_of_birth']), '1980-02-15')
+        result = parsed['results'][0]
+        self.assertEqual((result['order_number'], result['value'], result['flag'], result['status']),
+                         ('ORD1', '5.4', 'H', 'F'))
+
+    def test_message_without_control_id_is_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_message('MSH|^~\\&|A|B|C|D|20260101||ORU^R01||P|2.5')
+
+class TestMllpServer(unittest.TestCase):
+    """ACKs come back in order, one per message, with the writer seeing batches"""
+
+    def _run(self, messages, write_batch, **options):
+        async def scenario():
+            server = await MllpServer(host='127.0.0.1', port=0, write_batch=write_batch, **options).start()
+            try:
+                return server, await send_messages('127.0.0.1', server.port, messages)
+            finally:
+                await server.stop()
+        return asyncio.run(scenario())
+
+    def test_pipelined_acks_in_order(self):
+        batches = []
+
+        def write_batch(messages):
+            batches.append(len(messages))
+            return [('AE', 'bad value') if m['results'][0]['value'] == 'x' else ('AA', '') for m in messages]
+
+        messages = [oru(f'M{i}', f'ORD{i}', 'x' if i == 7 else str(i)) for i in range(50)]
+        messages.append('garbage')
+        server, acks = self._run(messages, write_batch, batch_size=20, max_in_flight=10)
+
+        self.assertEqual(len(acks), 51)
+        self.assertEqual([ack.split('MSA|')[1].split('|')[1] for ack in acks[:50]], [f'M{i}' for i in range(50)])
+        self.assertIn('MSA|AE|M7|bad value', acks[7])
+        self.assertIn('MSA|AR|', acks[50])
+        self.assertEqual(sum(batches), 50)
+        self.assertTrue(all(size <= 20 for size in batches))
+
+    def test_failed_batch_asks_sender_to_resend(self):
+        def write_batch(messages):
+            raise RuntimeError('database unavailable')
+
+        _, acks = self._run([oru('M1', 'ORD1', '90')], write_batch)
+        self.assertIn('MSA|AR|M1|', acks[0])
+
+class TestHL7Apply(unittest.TestCase):
+    """Orders and results are written through the ingestion path, and only once"""
+
+    def setUp(self):
+        from app import app, db
+        from models import Laboratory, TestType
+
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app, self.db = app, db
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='HL7 Lab')
+        db.session.add_all([lab, TestType(code='GLU', name='Glucose', unit='mg/dL', normal_range='70-100')])
+        db.session.commit()
+        self.lab_id = lab.id
+
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.ctx.pop()
+
+    def test_order_then_result_then_resend(self):
+        from hl7_listener import apply_messages
+        from models import Patient, TestOrder, IngestBatch
+
+        order = '\r'.join([
+            'MSH|^~\\&|HIS|WARD1|MEDLAB|LAB|20260101100000||ORM^O01|ORM1|P|2.5',
+            'PID|1||HL70001^^^HOSP||Doe^Jane||19800215|F',
+            'ORC|NW|ORD1|||||^^^^^S||20260101100000|||1234^House^Greg',
+            'OBR|1|ORD1||GLU^Glucose'
+        ])
+        outcomes = apply_messages(self.lab_id, [parse_message(order), parse_message(oru('ORU1', 'ORD1', '250', flag='H')),
+                                                parse_message(oru('ORU2', 'NOPE', '90'))])
+        self.assertEqual([code for code, _ in outcomes], ['AA', 'AA', 'AE'])
+
+        saved = TestOrder.query.filter_by(order_number='ORD1').one()
+        self.assertEqual((saved.status, saved.priority, saved.ordered_by), ('completed', 'urgent', 'Greg House'))
+        self.assertEqual((saved.result_value, saved.result_status), ('250', 'abnormal'))
+        self.assertEqual(Patient.query.count(), 1)
+
+        resent = apply_messages(self.lab_id, [parse_message(oru('ORU1', 'ORD1', '260'))])
+        self.assertEqual(resent[0][0], 'AA')
+        self.assertEqual(TestOrder.query.filter_by(order_number='ORD1').one().result_value, '250')
+        self.assertEqual(IngestBatch.query.filter_by(source='hl7').count(), 2)
+
+    def _orm(self, control_id, patient_id, *obrs):
+        return parse_message('\r'.join(
+            [f'MSH|^~\\&|HIS|WARD1|MEDLAB|LAB|20260101100000||ORM^O01|{control_id}|P|2.5',
+             f'PID|1||{patient_id}^^^HOSP||Doe^John||19750101|M']
+            + [f'ORC|NW|{number}\rOBR|{i}|{number}||{code}' for i, (number, code) in enumerate(obrs, 1)]
+        ))
+
+    def test_obx_must_match_the_order_test(self):
+        from hl7_listener import apply_messages
+        from models import TestOrder
+
+        apply_messages(self.lab_id, [self._orm('ORM1', 'HL70002', ('ORD2', 'GLU'))])
+        panel = oru('ORU1', 'ORD2', '5.1', patient_id='HL70002').replace('OBX|1|NM|GLU^Glucose',
+                                                                           'OBX|1|NM|WBC^White cells')
+        doubled = oru('ORU2', 'ORD2', '95', patient_id='HL70002') + '\rOBX|2|NM|GLU^Glucose||96|mg/dL|70-100||||F'
+        outcomes = apply_messages(self.lab_id, [parse_message(panel), parse_message(doubled)])
+
+        self.assertEqual([code for code, _ in outcomes], ['AE', 'AE'])
+        self.assertIn('0 OBX results for test GLU of order ORD2', outcomes[0][1])
+        self.assertIn('2 OBX results', outcomes[1][1])
+        self.assertIsNone(TestOrder.query.filter_by(order_number='ORD2').one().result_value)
+
+    def test_failed_order_leaves_nothing_of_its_message(self):
+        from hl7_listener import apply_messages
+        from models import Patient, TestOrder
+
+        outcomes = apply_messages(self.lab_id, [self._orm('ORM1', 'HL70003', ('ORD3', 'GLU'), ('ORD4', 'NOPE'))])
+
+        self.assertEqual(outcomes, [('AE', 'Unknown test code NOPE')])
+        self.assertEqual((Patient.query.count(), TestOrder.query.count()), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
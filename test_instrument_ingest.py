@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for analyzer result file ingestion (bulk matching, classification, dead letters, idempotency)
+"""
+
+import unittest
+import tempfile
+from datetime import datetime, timedelta
+import shutil
+import csv
+import os
+import sys
+from unittest.mock import patch
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from sqlalchemy.exc import OperationalError
+from instrument_ingest import ingest_file, DropDirectoryWatcher
+from models import Laboratory, Patient, TestType, TestOrder, CriticalAlert, IngestBatch
+from app import app, db
+
+class TestInstrumentIngest(unittest.TestCase):
+    """A result file is applied in one transaction and only once"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.workdir = tempfile.mkdtemp()
+
+        lab = Laboratory(name='Instrument Lab')
+        db.session.add(lab)
+        db.session.flush()
+        self.lab_id = lab.id
+        patient = Patient(patient_id='INS0001', first_name='Test', last_name='Patient', laboratory_id=lab.id)
+        glucose = TestType(code='GLU', name='Glucose', unit='mg/dL', normal_range='70-100')
+        potassium = TestType(code='K', name='Potassium', unit='mmol/L', normal_range='3.5-5.1')
+        db.session.add_all([patient, glucose, potassium])
+        db.session.flush()
+        db.session.add_all(
+            [TestOrder(order_number=f'GLU{i:04d}', patient_id=patient.id, test_type_id=glucose.id) for i in range(300)]
+            + [TestOrder(order_number='K0001', patient_id=patient.id, test_type_id=potassium.id),
+               TestOrder(order_number='DONE01', patient_id=patient.id, test_type_id=glucose.id, status='reported')]
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _write(self, name, rows, directory=None):
+        path = os.path.join(directory or self.workdir, name)
+        with open(path, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(['Accession', 'Assay', 'Result', 'Units', 'Flag'])
+            writer.writerows(rows)
+        return path
+
+    def test_file_is_applied_classified_and_dead_lettered(self):
+        rows = [[f'GLU{i:04d}', 'GLU', str(80 + i % 50), 'mg/dL', ''] for i in range(300)]
+        rows += [['K0001', 'K', '6.9', 'mmol/L', 'H'], ['NOPE', 'GLU', '90', 'mg/dL', ''],
+                 ['DONE01', 'GLU', '90', 'mg/dL', ''], ['GLU0001', 'K', '4.0', 'mmol/L', '']]
+        path = self._write('run1.csv', rows)
+        dead_letter_dir = os.path.join(self.workdir, 'dead_letter')
+
+        result = ingest_file(self.lab_id, path, dead_letter_dir, chunk_rows=128)
+        batch = result['batch']
+        self.assertEqual((batch['rows_total'], batch['rows_applied'], batch['rows_dead_lettered']), (304, 301, 3))
+        self.assertEqual(batch['critical_results'], 1)
+
+        db.session.expire_all()
+        self.assertEqual(TestOrder.query.filter_by(order_number='GLU0000').one().result_status, 'normal')
+        self.assertEqual(TestOrder.query.filter_by(order_number='GLU0030').one().result_status, 'abnormal')
+        self.assertEqual(TestOrder.query.filter_by(order_number='GLU0000').one().result_si_unit, 'mmol/L')
+        self.assertIsNotNone(TestOrder.query.filter_by(order_number='GLU0001').one().delta_checked_at)
+        self.assertEqual(CriticalAlert.query.count(), 1)
+
+        with open(batch['dead_letter_path']) as handle:
+            rejected = list(csv.reader(handle))
+        self.assertEqual([row[0] for row in rejected[1:]], ['NOPE', 'DONE01', 'GLU0001'])
+        self.assertEqual(rejected[0][-1], 'error')
+
+        # The same file again is recognised by its content hash and changes nothing
+        again = ingest_file(self.lab_id, path, dead_letter_dir)
+        self.assertTrue(again['duplicate'])
+        self.assertEqual(IngestBatch.query.count(), 1)
+
+    def test_censored_results_skip_critical_and_delta_checks(self):
+        now = datetime.utcnow()
+        orders = {order.order_number: order for order in TestOrder.query.filter(
+            TestOrder.order_number.in_(['GLU0000', 'GLU0001', 'GLU0002'])).all()}
+        for days, number in ((2, 'GLU0000'), (1, 'GLU0001'), (0, 'GLU0002')):
+            orders[number].ordered_at = now - timedelta(days=days)
+        db.session.commit()
+
+        ingest_file(self.lab_id, self._write('run3.csv', [['GLU0000', 'GLU', '100', 'mg/dL', ''],
+                                                          ['GLU0001', 'GLU', '<40', 'mg/dL', ''],
+                                                          ['K0001', 'K', '<2.0', 'mmol/L', '']]), self.workdir)
+        ingest_file(self.lab_id, self._write('run4.csv', [['GLU0002', 'GLU', '160', 'mg/dL', '']]), self.workdir)
+
+        db.session.expire_all()
+        potassium = TestOrder.query.filter_by(order_number='K0001').one()
+        self.assertEqual((potassium.result_qualifier, potassium.result_status), ('<', 'abnormal'))
+        self.assertEqual(potassium.delta_flag, 'censored')
+        self.assertEqual(CriticalAlert.query.count(), 0)
+
+        # The censored result in between is not used as the prior
+        latest = TestOrder.query.filter_by(order_number='GLU0002').one()
+        self.assertEqual(latest.delta_prior_order_id, orders['GLU0000'].id)
+        self.assertEqual(latest.delta_flag, 'fail')
+
+    def test_watcher_moves_files_after_ingestion(self):
+        lab_dir = os.path.join(self.workdir, str(self.lab_id))
+        os.makedirs(lab_dir)
+        self._write('run2.csv', [['GLU0002', 'GLU', '95', 'mg/dL', '']], lab_dir)
+        with open(os.path.join(lab_dir, 'broken.csv'), 'w') as handle:
+            handle.write('no,useful,columns\n')
+
+        watcher = DropDirectoryWatcher(app, self.workdir, stable_seconds=0)
+        self.assertEqual(watcher.scan_once(), 2)
+        self.assertTrue(os.path.exists(os.path.join(lab_dir, 'processed', 'run2.csv')))
+        self.assertTrue(os.path.exists(os.path.join(lab_dir, 'failed', 'broken.csv')))
+
+    def test_watcher_keeps_files_on_operational_errors(self):
+        lab_dir = os.path.join(self.workdir, str(self.lab_id))
+        os.makedirs(lab_dir)
+        path = self._write('run3.csv', [['GLU0003', 'GLU', '101', 'mg/dL', '']], lab_dir)
+        with open(os.path.join(lab_dir, 'binary.csv'), 'wb') as handle:
+            handle.write(b'Accession,Assay,Result\n\xff\xfe\xfa,GLU,1\n')
+
+        watcher = DropDirectoryWatcher(app, self.workdir, stable_seconds=0)
+        with patch('instrument_ingest.apply_result_rows', side_effect=OperationalError('UPDATE', {}, 'server closed')):
+            self.assertEqual(watcher.scan_once(), 1)
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(os.path.join(lab_dir, 'failed', 'binary.csv')))
+
+        self.assertEqual(watcher.scan_once(), 1)
+        self.assertTrue(os.path.exists(os.path.join(lab_dir, 'processed', 'run3.csv')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Unit tests for numeric result parsing, SI normalization and series summaries
+"""
+
+import unittest
+import sys
+
+import numpy as np
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from lab_results import (parse_numeric_result, parse_result, normalize_to_si, numeric_fields, series_summary, normalize_batch,
+                         parse_reference_range, classify_results)
+
+class TestNumericResults(unittest.TestCase):
+    """Free-text results to typed values"""
+
+    def test_plain_and_qualified_values(self):
+        self.assertEqual(parse_numeric_result('145'), 145.0)
+        self.assertEqual(parse_numeric_result(' 8.2 %'), 8.2)
+        self.assertEqual(parse_numeric_result('<5'), 5.0)
+        self.assertEqual(parse_numeric_result('>= 1.3 mg/dL'), 1.3)
+
+    def test_separators_and_persian_digits(self):
+        self.assertEqual(parse_numeric_result('8,2'), 8.2)
+        self.assertEqual(parse_numeric_result('1,250'), 1250.0)
+        self.assertEqual(parse_numeric_result('۱۴۵'), 145.0)
+        self.assertEqual(parse_numeric_result('۸٫۲'), 8.2)
+        self.assertEqual(parse_numeric_result('0,125'), 0.125)
+        self.assertEqual(parse_numeric_result('1.250,5'), 1250.5)
+        self.assertEqual(parse_numeric_result('1,250.5'), 1250.5)
+        self.assertEqual(parse_numeric_result('.5'), 0.5)
+        self.assertEqual(parse_numeric_result('-,5'), -0.5)
+
+    def test_censored_values_keep_their_qualifier(self):
+        self.assertEqual(parse_result('<5'), ('<', 5.0))
+        self.assertEqual(parse_result('≥ 0,5 mg/L'), ('>=', 0.5))
+        self.assertEqual(parse_result('145'), (None, 145.0))
+        self.assertEqual(numeric_fields('<0.1', 'mmol/L', 'K')['result_qualifier'], '<')
+        self.assertIsNone(numeric_fields('Positive', None)['result_qualifier'])
+
+    def test_non_numeric_results(self):
+        self.assertIsNone(parse_numeric_result(None))
+        self.assertIsNone(parse_numeric_result('Positive'))
+        self.assertIsNone(parse_numeric_result(''))
+
+    def test_si_normalization(self):
+        self.assertEqual(normalize_to_si('GLU', 100.0, 'mg/dL'), (5.55, 'mmol/L'))
+        self.assertEqual(normalize_to_si('HB', 13.5, 'g/dL'), (135.0, 'g/L'))
+        value, unit = normalize_to_si('HBA1C', 8.2, '%')
+        self.assertAlmostEqual(value, 66.12, places=2)
+        self.assertEqual(unit, 'mmol/mol')
+        self.assertEqual(normalize_to_si('XYZ', 1.0, 'ratio'), (None, None))
+
+    def test_numeric_fields_fall_back_to_test_type_unit(self):
+        fields = numeric_fields('245', None, 'CHOL', 'mg/dL')
+        self.assertEqual(fields['result_numeric'], 245.0)
+        self.assertEqual(fields['result_si_unit'], 'mmol/L')
+
+class TestBatchNormalization(unittest.TestCase):
+    """Vectorized normalization and range classification for instrument batches"""
+
+    def test_batch_matches_single_result_path(self):
+        values, units, codes = ['100', '8.2', 'hemolyzed', '13.5'], ['mg/dL', '%', 'mg/dL', 'g/dL'], ['GLU', 'HBA1C', 'GLU', 'HB']
+        numeric, si_values, si_units, qualifiers = normalize_batch(values, units, codes)
+        for i in range(len(values)):
+            expected = numeric_fields(values[i], units[i], codes[i])
+            self.assertEqual(qualifiers[i], expected['result_qualifier'])
+            if expected['result_numeric'] is None:
+                self.assertTrue(np.isnan(numeric[i]))
+                self.assertIsNone(si_units[i])
+            else:
+                self.assertEqual(si_values[i], expected['result_si_value'])
+                self.assertEqual(si_units[i], expected['result_si_unit'])
+
+    def test_reference_ranges(self):
+        self.assertEqual(parse_reference_range('70-100'), (70.0, 100.0))
+        self.assertEqual(parse_reference_range('3.5 – 5.1 mmol/L'), (3.5, 5.1))
+        self.assertEqual(parse_reference_range('<5.7'), (None, 5.7))
+        self.assertEqual(parse_reference_range('>40'), (40.0, None))
+        self.assertEqual(parse_reference_range('negative'), (None, None))
+
+    def test_classification(self):
+        numeric, si_values, si_units, qualifiers = normalize_batch(
+            ['90', '130', '6.9', '4.0', 'pos', '<2.0'], ['mg/dL', 'mg/dL', 'mmol/L', 'mmol/L', '', 'mmol/L'],
+            ['GLU', 'GLU', 'K', 'K', 'HIV', 'K'])
+        statuses = classify_results(numeric, [70, 70, 3.5, np.nan, np.nan, 3.5], [100, 100, 5.1, np.nan, np.nan, 5.1],
+                                    si_values, si_units, ['GLU', 'GLU', 'K', 'K', 'HIV', 'K'], qualifiers)
+        # A censored '<2.0' is below the range but not a critical value
+        self.assertEqual(list(statuses), ['normal', 'abnormal', 'critical', None, None, 'abnormal'])
+
+class TestSeriesSummary(unittest.TestCase):
+    """Statistics over an analyte time series"""
+
+    def test_rising_series(self):
+        timestamps = np.array(['2024-01-01', '2024-01-31', '2024-03-01'], dtype='datetime64[s]')
+        values = np.array([100.0, 110.0, 120.0])
+        summary = series_summary(timestamps, values)
+
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['last'], 120.0)
+        self.assertAlmostEqual(summary['trend_per_30_days'], 10.0, places=1)
+
+    def test_empty_series(self):
+        summary = series_summary(np.array([], dtype='datetime64[s]'), np.array([]))
+        self.assertEqual(summary, {'count': 0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the LLM stand-in used by load tests (provider response shapes, failure injection)
+"""
+
+import unittest
+import urllib.request
+import urllib.error
+import json
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from llm_standin import LLMStandIn
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())
+
+class TestLLMStandIn(unittest.TestCase):
+    """Every provider gets a well-formed answer carrying the canned JSON analysis"""
+
+    def setUp(self):
+        self.standin = LLMStandIn().start()
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def test_provider_shapes(self):
+        env = self.standin.environment()
+        messages = {'model': 'm', 'messages': [{'role': 'user', 'content': 'CBC'}]}
+
+        openai = post(f"{env['OPENAI_API_BASE']}/chat/completions", messages)
+        self.assertIn('overall_assessment', json.loads(openai['choices'][0]['message']['content']))
+        self.assertGreater(openai['usage']['completion_tokens'], 0)
+
+        anthropic = post(f"{env['ANTHROPIC_API_BASE']}/v1/messages", messages)
+        self.assertIn('recommendations', json.loads(anthropic['content'][0]['text']))
+
+        gemini = post(f"{env['GEMINI_API_BASE']}/v1beta/models/gemini-2.5-pro:generateContent", {'contents': []})
+        self.assertIn('red_flags', json.loads(gemini['candidates'][0]['content']['parts'][0]['text']))
+
+        post(f"{env['OPENROUTER_API_BASE']}/chat/completions", messages)
+        self.assertEqual(self.standin.state.by_provider,
+                         {'openai': 1, 'anthropic': 1, 'gemini': 1, 'openrouter': 1})
+
+    def test_failure_injection(self):
+        self.standin.state.fail_first = 1
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            post(f'{self.standin.url}/v1/chat/completions', {})
+        self.assertEqual(raised.exception.code, 500)
+        self.assertIn('choices', post(f'{self.standin.url}/v1/chat/completions', {}))
+
+if __name__ == '__main__':
+    unittest.main()
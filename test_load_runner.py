@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Smoke test for the load-test runner: a few seconds against gunicorn and the stand-ins
+"""
+
+import unittest
+import random
+import shutil
+import socket
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from run_load_test import (LoadClient, LoadStats, LocalServer, SCENARIOS, prepare_fixtures, run_load,
+                           LLMStandIn, TwilioStandIn, MediSinaStandIn)
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+@unittest.skipUnless(shutil.which('gunicorn'), 'gunicorn is not installed')
+class TestLoadRunnerSmoke(unittest.TestCase):
+    """Setup finds patients and test types, and every scenario runs without errors"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.standins = {
+            'llm': LLMStandIn(latency=0.05, jitter=0.0).start(),
+            'twilio': TwilioStandIn().start(),
+            'medisina': MediSinaStandIn(latency=0.0).start()
+        }
+        cls.server = LocalServer(cls.standins, port=free_port(), workers=1, threads=4)
+        try:
+            cls.server.start()
+        except Exception:
+            cls.tearDownClass()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.server.workdir, ignore_errors=True)
+        for standin in cls.standins.values():
+            standin.stop()
+
+    def test_scenarios_and_short_run(self):
+        fixtures = prepare_fixtures(self.server.url, self.standins, patients=3)
+        self.assertEqual(len(fixtures['patient_ids']), 3)
+        self.assertTrue(fixtures['test_type_ids'])
+
+        stats = LoadStats()
+        client = LoadClient(self.server.url, stats)
+        self.assertIsNotNone(client.login('load-smoke'))
+        for scenario in SCENARIOS.values():
+            scenario(client, fixtures, random.Random(1))
+        steps = stats.report()['steps']
+        self.assertEqual({step: s['error_reasons'] for step, s in steps.items() if s['errors']}, {})
+        # The queued export was run by the scheduler, not just accepted
+        self.assertIn('medisina_export_run', steps)
+        self.assertTrue(self.standins['medisina'].state.pages)
+        self.assertTrue(self.standins['llm'].state.requests_seen)
+
+        report = run_load(self.server.url, fixtures, users=2, duration=3, ramp_up=1, think_time=(0.1, 0.3)).report()
+        self.assertGreater(report['total']['requests'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
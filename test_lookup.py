@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the typeahead lookups of patients and open test orders
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from lookup import search_patients, search_open_orders, lookup_limit, LOOKUP_MAX_LIMIT
+from models import Laboratory, Patient, TestType, TestOrder
+from app import app, db
+
+class TestLookups(unittest.TestCase):
+    """Prefix matching, lab scoping and bounded results"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab, other_lab = Laboratory(name='Lookup Lab'), Laboratory(name='Other Lab')
+        db.session.add_all([lab, other_lab])
+        db.session.flush()
+        self.lab_id = lab.id
+
+        patients = [Patient(patient_id=f'P{i:06d}', first_name='Sara', last_name=f'Ahmadi{i}',
+                            phone=f'0912000{i:04d}', laboratory_id=lab.id) for i in range(30)]
+        patients.append(Patient(patient_id='P100_00', first_name='Reza', last_name='Karimi', laboratory_id=lab.id))
+        patients.append(Patient(patient_id='X000001', first_name='Sara', last_name='Outsider', laboratory_id=other_lab.id))
+        test_type = TestType(code='GLU', name='Glucose')
+        db.session.add_all(patients + [test_type])
+        db.session.flush()
+
+        db.session.add_all([
+            TestOrder(order_number='ORD0001', patient_id=patients[0].id, test_type_id=test_type.id, status='ordered'),
+            TestOrder(order_number='ORD0002', patient_id=patients[30].id, test_type_id=test_type.id, status='processing'),
+            TestOrder(order_number='ORD0003', patient_id=patients[30].id, test_type_id=test_type.id, status='completed')
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_results_are_bounded_and_lab_scoped(self):
+        patients, truncated = search_patients(self.lab_id, 'sara', limit=10)
+        self.assertEqual(len(patients), 10)
+        self.assertTrue(truncated)
+        self.assertTrue(all(p.laboratory_id == self.lab_id for p in patients))
+        self.assertEqual(lookup_limit(1000), LOOKUP_MAX_LIMIT)
+
+    def test_words_match_name_prefixes(self):
+        patients, truncated = search_patients(self.lab_id, 'kar re')
+        self.assertEqual([p.last_name for p in patients], ['Karimi'])
+        self.assertFalse(truncated)
+        self.assertEqual(search_patients(self.lab_id, 'r'), ([], False))
+
+    def test_identifier_prefixes_and_escaped_wildcards(self):
+        self.assertEqual(len(search_patients(self.lab_id, '09120000012')[0]), 1)
+        # '_' is literal, not a single-character wildcard
+        patients, _ = search_patients(self.lab_id, 'p100_')
+        self.assertEqual([p.patient_id for p in patients], ['P100_00'])
+
+    def test_open_orders(self):
+        orders, _ = search_open_orders(self.lab_id, '')
+        self.assertEqual({o.order_number for o in orders}, {'ORD0001', 'ORD0002'})
+        orders, _ = search_open_orders(self.lab_id, 'karimi')
+        self.assertEqual([o.order_number for o in orders], ['ORD0002'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Tests for MediSina sync (paged gzip export with resume, watermark import with upserts)
+against the local stand-in server
+"""
+
+import unittest
+import gzip
+import json
+import sys
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from medisina_standin import MediSinaStandIn
+from sqlalchemy import event
+from health import circuit_breaker
+from medisina_api import gzip_json, post_with_retry, export_to_medisina, import_from_medisina
+from patient_loaders import latest_test_orders
+from models import Laboratory, Patient, TestType, TestOrder, SyncCheckpoint
+from app import app, db
+
+class TestExportTransport(unittest.TestCase):
+    """Compression and retry behaviour of a single page"""
+
+    def setUp(self):
+        self.standin = MediSinaStandIn(fail_first=2).start()
+        self.sleeps = []
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def test_gzip_roundtrip(self):
+        body, raw_size = gzip_json({'patients': [{'name': 'علی'}] * 50})
+        self.assertLess(len(body), raw_size)
+        self.assertEqual(json.loads(gzip.decompress(body))['patients'][0]['name'], 'علی')
+
+    def test_transient_failures_are_retried(self):
+        body, _ = gzip_json({'patients': []})
+        response, retries, error = post_with_retry(
+            f'{self.standin.url}/api/v1/patients/import', body,
+            {'Content-Type': 'application/json', 'Content-Encoding': 'gzip', 'Idempotency-Key': 'run:1'},
+            max_retries=3, sleep=self.sleeps.append
+        )
+        self.assertIsNone(error)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(retries, 2)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_gives_up_after_max_retries(self):
+        body, _ = gzip_json({'patients': []})
+        response, retries, error = post_with_retry(
+            f'{self.standin.url}/api/v1/patients/import', body, {'Content-Encoding': 'gzip'},
+            max_retries=1, sleep=self.sleeps.append
+        )
+        self.assertIsNone(response)
+        self.assertIn('503', error)
+
+    def test_only_server_failures_trip_the_breaker(self):
+        breaker = circuit_breaker('medisina')
+        breaker.record_success()
+
+        def session_answering(status):
+            response = SimpleNamespace(status_code=status, text='', headers={})
+            return SimpleNamespace(post=lambda *args, **kwargs: response)
+
+        for status in (400, 429):
+            post_with_retry('http://medisina.invalid', b'', {}, max_retries=1, sleep=self.sleeps.append,
+                            session=session_answering(status))
+        self.assertEqual(breaker.snapshot()['failures'], 0)
+
+        post_with_retry('http://medisina.invalid', b'', {}, max_retries=1, sleep=self.sleeps.append,
+                        session=session_answering(503))
+        self.assertEqual(breaker.snapshot()['failures'], 1)
+        breaker.record_success()
+
+class TestResumableExport(unittest.TestCase):
+    """A failed export resumes from the last acknowledged page"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['MEDISINA_EXPORT_MAX_RETRIES'] = 0
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Export Lab')
+        db.session.add(lab)
+        db.session.flush()
+        for i in range(25):
+            db.session.add(Patient(patient_id=f'EXP{i:04d}', first_name='Test', last_name=f'Patient {i}',
+                                   laboratory_id=lab.id))
+        db.session.commit()
+        self.lab_id = lab.id
+
+        self.standin = MediSinaStandIn().start()
+        self.settings = SimpleNamespace(medisina_enabled=True, laboratory_id=lab.id,
+                                        medisina_api_url=self.standin.url, medisina_api_key='key')
+
+    def tearDown(self):
+        self.standin.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        app.config['MEDISINA_EXPORT_MAX_RETRIES'] = 5
+
+    def test_interrupted_export_resumes(self):
+        # Every request fails: the first page is not acknowledged and the run is left resumable
+        self.standin.state.fail_rate = 1.0
+        result = export_to_medisina(self.settings, page_size=10, sleep=lambda s: None)
+        self.assertFalse(result['success'])
+        self.assertTrue(result['resumable'])
+
+        # Let two pages through, then fail again
+        self.standin.state.fail_rate = 0.0
+        original = self.standin.state.should_fail
+        calls = {'n': 0}
+
+        def fail_third():
+            calls['n'] += 1
+            return calls['n'] == 3
+        self.standin.state.should_fail = fail_third
+
+        result = export_to_medisina(self.settings, page_size=10, sleep=lambda s: None)
+        self.assertFalse(result['success'])
+        self.assertEqual(result['progress']['records_done'], 20)
+
+        self.standin.state.should_fail = original
+        result = export_to_medisina(self.settings, page_size=10, sleep=lambda s: None)
+        self.assertTrue(result['success'])
+        self.assertTrue(result['resumed'])
+        self.assertEqual(result['patient_count'], 25)
+        self.assertEqual(len(self.standin.state.patients), 25)
+
+        checkpoint = SyncCheckpoint.query.filter_by(laboratory_id=self.lab_id, direction='export').first()
+        self.assertEqual(checkpoint.status, 'completed')
+        self.assertEqual(checkpoint.pages_done, 3)
+
+    def test_last_page_flag_on_exact_multiple(self):
+        result = export_to_medisina(self.settings, page_size=5, sleep=lambda s: None)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['progress']['pages_done'], 5)
+
+        pages = sorted(self.standin.state.pages.values(), key=lambda info: info['page'])
+        self.assertEqual([info['is_last_page'] for info in pages], [False] * 4 + [True])
+
+class TestLatestPerPatient(unittest.TestCase):
+    """Latest-N loaders fetch a whole batch of patients in one statement"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Loader Lab')
+        test_type = TestType(code='GLU', name='Glucose')
+        db.session.add_all([lab, test_type])
+        db.session.flush()
+        self.patient_ids = []
+        base = datetime(2024, 1, 1)
+        for i in range(6):
+            patient = Patient(patient_id=f'LDR{i:04d}', first_name='Test', last_name=f'Patient {i}',
+                              laboratory_id=lab.id)
+            db.session.add(patient)
+            db.session.flush()
+            self.patient_ids.append(patient.id)
+            for day in range(4):
+                db.session.add(TestOrder(order_number=f'O{i}-{day}', patient_id=patient.id,
+                                         test_type_id=test_type.id, ordered_at=base + timedelta(days=day)))
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_latest_orders_in_one_query(self):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            orders = latest_test_orders(self.patient_ids, limit=2)
+            names = [order.test_type.name for group in orders.values() for order in group]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(names, ['Glucose'] * 12)
+        first = orders[self.patient_ids[0]]
+        self.assertEqual([order.order_number for order in first], ['O0-3', 'O0-2'])
+
+    def test_undated_orders_rank_first(self):
+        # DESC NULLS FIRST matches the (patient_id, ordered_at, id) index order on PostgreSQL
+        db.session.add(TestOrder(order_number='O0-undated', patient_id=self.patient_ids[0],
+                                 test_type_id=TestType.query.first().id))
+        db.session.commit()
+        TestOrder.query.filter_by(order_number='O0-undated').update({'ordered_at': None})
+        db.session.commit()
+
+        first = latest_test_orders(self.patient_ids[:1], limit=2)[self.patient_ids[0]]
+        self.assertEqual([order.order_number for order in first], ['O0-undated', 'O0-3'])
+
+class TestIncrementalImport(unittest.TestCase):
+    """Watermark import only fetches what changed and upserts in bulk"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Import Lab')
+        db.session.add(lab)
+        db.session.commit()
+        self.lab_id = lab.id
+
+        self.standin = MediSinaStandIn().start()
+        for i in range(30):
+            self._remote_patient(f'IMP{i:04d}', f'2099-01-01T00:00:{i:02d}')
+        self.settings = SimpleNamespace(medisina_enabled=True, laboratory_id=lab.id,
+                                        medisina_api_url=self.standin.url, medisina_api_key='key')
+
+    def tearDown(self):
+        self.standin.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _remote_patient(self, patient_id, updated_at, phone=None):
+        self.standin.state.patients[patient_id] = {
+            'patient_info': {'patient_id': patient_id, 'first_name': 'Remote', 'last_name': patient_id, 'phone': phone},
+            'medical_info': {},
+            'updated_at': updated_at
+        }
+
+    def test_resync_only_reads_changes(self):
+        result = import_from_medisina(self.settings, page_size=10)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['imported_count'], 30)
+        self.assertEqual(result['watermark'], '2099-01-01T00:00:29')
+        self.assertEqual(Patient.query.filter_by(laboratory_id=self.lab_id).count(), 30)
+
+        # Nothing changed: only the record at the inclusive watermark comes back
+        result = import_from_medisina(self.settings, page_size=10)
+        self.assertEqual(result['total_processed'], 1)
+        self.assertEqual(result['imported_count'], 0)
+        self.assertEqual(result['updated_count'], 0)
+
+        self._remote_patient('IMP0003', '2099-01-02T00:00:00', phone='0912000003')
+        result = import_from_medisina(self.settings, page_size=10)
+        self.assertEqual(result['updated_count'], 1)
+        self.assertEqual(Patient.query.filter_by(patient_id='IMP0003').first().phone, '0912000003')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics registry (exposition format, merging across worker processes)
+"""
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from metrics import MetricsRegistry, llm_usage, _label_key
+
+class TestMetricsRegistry(unittest.TestCase):
+    """Samples of every worker are merged; exited workers keep their counters, not their gauges"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = MetricsRegistry()
+        self.registry.directory = self.directory
+        self.registry._flusher_pid = os.getpid()  # no background flusher in tests
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_worker(self, pid, rows):
+        with open(os.path.join(self.directory, f'{pid}.json'), 'w') as handle:
+            json.dump(rows, handle)
+
+    def test_histogram_exposition(self):
+        labels = {'endpoint': 'dashboard', 'method': 'GET'}
+        for seconds in (0.004, 0.02, 0.3, 45):
+            self.registry.observe('medlab_http_request_duration_seconds', seconds, labels)
+
+        text = self.registry.exposition()
+        self.assertIn('# TYPE medlab_http_request_duration_seconds histogram', text)
+        self.assertIn('medlab_http_request_duration_seconds_bucket{endpoint="dashboard",method="GET",le="0.005"} 1', text)
+        self.assertIn('medlab_http_request_duration_seconds_bucket{endpoint="dashboard",method="GET",le="0.5"} 3', text)
+        self.assertIn('medlab_http_request_duration_seconds_bucket{endpoint="dashboard",method="GET",le="30"} 3', text)
+        self.assertIn('medlab_http_request_duration_seconds_bucket{endpoint="dashboard",method="GET",le="+Inf"} 4', text)
+        self.assertIn('medlab_http_request_duration_seconds_count{endpoint="dashboard",method="GET"} 4', text)
+
+    def test_workers_are_merged(self):
+        key = _label_key({'endpoint': 'patients', 'method': 'GET', 'status': 200})
+        self.registry.inc('medlab_http_requests_total', {'endpoint': 'patients', 'method': 'GET', 'status': 200}, 2)
+        # A live sibling (the parent process stands in for it) and an exited worker
+        self._write_worker(os.getppid(), [['medlab_http_requests_total', key, 3],
+                                          ['medlab_db_pool_checked_out', [['pid', str(os.getppid())]], 4]])
+        self._write_worker(999999999, [['medlab_http_requests_total', key, 5],
+                                       ['medlab_db_pool_checked_out', [['pid', '999999999']], 9]])
+
+        text = self.registry.exposition()
+        self.assertIn('medlab_http_requests_total{endpoint="patients",method="GET",status="200"} 10', text)
+        self.assertIn(f'medlab_db_pool_checked_out{{pid="{os.getppid()}"}} 4', text)
+        self.assertNotIn('pid="999999999"', text)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '999999999.json')))
+
+        # Folded counters are counted once, not again on the next scrape
+        self.assertIn('status="200"} 10', self.registry.exposition())
+
+    def test_llm_usage(self):
+        self.assertEqual(llm_usage({'usage': {'prompt_tokens': 12, 'completion_tokens': 30}}), (12, 30))
+
+        class Usage:
+            input_tokens, output_tokens = 7, 9
+
+        class Response:
+            usage = Usage()
+        self.assertEqual(llm_usage(Response()), (7, 9))
+        self.assertEqual(llm_usage(None), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for keyset pagination cursors and the paginated JSON list endpoints
+"""
+
+import unittest
+import sys
+from datetime import datetime, timedelta
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from app import app, db
+from models import Laboratory, User, Patient
+from pagination import encode_cursor, decode_cursor, keyset_paginate, InvalidCursor
+import routes  # noqa: F401
+
+class TestCursors(unittest.TestCase):
+    """Cursors round-trip; anything else is rejected rather than queried"""
+
+    def test_round_trip(self):
+        stamp = datetime(2025, 3, 1, 8, 30)
+        self.assertEqual(decode_cursor(encode_cursor('next', (stamp, 42))), ('next', [stamp, 42]))
+        self.assertEqual(decode_cursor(encode_cursor('prev', (None, 7))), ('prev', [None, 7]))
+        self.assertEqual(decode_cursor(None), (None, None))
+
+    def test_invalid_cursors(self):
+        stamp = datetime(2025, 3, 1, 8, 30)
+        for cursor in ['not-base64!', encode_cursor('sideways', (stamp, 1)), encode_cursor('next', (stamp,)),
+                       encode_cursor('next', (stamp, 1, 2)), encode_cursor('next', ('yesterday', 1)),
+                       encode_cursor('next', (stamp, '1')), encode_cursor('next', (stamp, True))]:
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+class TestKeysetPages(unittest.TestCase):
+    """Pages cover every row once in both directions, including rows without a timestamp"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.secret_key = app.secret_key or 'test-secret'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Paging Lab')
+        db.session.add(lab)
+        db.session.flush()
+        self.lab_id = lab.id
+        user = User(username='paging', password_hash='x', laboratory_id=lab.id)
+        start = datetime(2025, 1, 1)
+        patients = [Patient(patient_id=f'PG{i:04d}', first_name='Page', last_name=f'P{i}', laboratory_id=lab.id,
+                            created_at=start + timedelta(days=i // 2)) for i in range(6)]
+        patients += [Patient(patient_id=f'PGN{i}', first_name='Page', last_name=f'N{i}', laboratory_id=lab.id)
+                     for i in range(2)]
+        db.session.add_all([user] + patients)
+        db.session.flush()
+        for patient in patients[6:]:
+            patient.created_at = None
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _page(self, cursor=None):
+        query = Patient.query.filter_by(laboratory_id=self.lab_id)
+        return keyset_paginate(query, Patient.created_at, Patient.id, cursor=cursor, per_page=3, total='exact')
+
+    def test_walk_forward_and_back(self):
+        pages = [self._page()]
+        while pages[-1].has_next:
+            pages.append(self._page(pages[-1].next_cursor))
+        forward = [[patient.patient_id for patient in page.items] for page in pages]
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(pages[0].total, 8)
+        self.assertEqual(set(forward[0][:2]), {'PGN0', 'PGN1'})  # no timestamp sorts as newest
+        self.assertEqual(sum(forward, [])[2:], [f'PG{i:04d}' for i in reversed(range(6))])
+
+        backward = [forward[-1]]
+        page = pages[-1]
+        while page.has_prev:
+            page = self._page(page.prev_cursor)
+            backward.insert(0, [patient.patient_id for patient in page.items])
+        self.assertEqual(backward, forward)
+
+    def test_api_rejects_bad_cursor(self):
+        response = self.client.get('/api/patients?cursor=' + encode_cursor('next', (datetime(2025, 1, 1),)))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.get_json()['success'])
+
+        response = self.client.get('/api/patients?cursor=garbage')
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_clamps_per_page(self):
+        self.assertEqual(self.client.get('/api/patients?per_page=0').get_json()['pagination']['per_page'], 1)
+        self.assertEqual(len(self.client.get('/api/patients?per_page=-5').get_json()['patients']), 1)
+        self.assertEqual(self.client.get('/api/patients?per_page=500').get_json()['pagination']['per_page'], 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests for report fragment caching, conditional GETs and the PDF download fallback
+"""
+
+import unittest
+import shutil
+import sys
+import tempfile
+from unittest.mock import patch, PropertyMock
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from flask import Flask
+from fragment_cache import FragmentCache, DiskFragmentStore
+from http_caching import conditional, make_etag
+from pdf_renderer import PDFRenderer
+
+class TestFragmentCache(unittest.TestCase):
+    """A new report version misses the cache; invalidation drops every version"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = FragmentCache(DiskFragmentStore(self.cache_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_key_changes_with_version(self):
+        v1 = FragmentCache.report_key(7, 1, 'en', 'abc')
+        v2 = FragmentCache.report_key(7, 2, 'en', 'abc')
+        self.assertNotEqual(v1, v2)
+        self.assertNotEqual(v1, FragmentCache.report_key(7, 1, 'fa', 'abc'))
+        self.assertNotEqual(v1, FragmentCache.report_key(7, 1, 'en', 'def'))
+
+        renders = []
+        render = lambda: renders.append(1) or f'<p>render {len(renders)}</p>'
+        self.assertEqual(self.cache.get_or_render(v1, render), '<p>render 1</p>')
+        self.assertEqual(self.cache.get_or_render(v1, render), '<p>render 1</p>')
+        self.assertEqual(self.cache.get_or_render(v2, render), '<p>render 2</p>')
+        self.assertEqual(len(renders), 2)
+
+        self.cache.invalidate_report(7)
+        self.assertIsNone(self.cache.get(v1))
+        self.assertIsNone(self.cache.get(v2))
+
+class TestConditionalGet(unittest.TestCase):
+    """A matching If-None-Match gets an empty 304 with the same validators"""
+
+    def setUp(self):
+        self.builds = 0
+        app = Flask(__name__)
+
+        @app.route('/resource/<int:version>')
+        def resource(version):
+            def build():
+                self.builds += 1
+                return 'payload'
+            return conditional(make_etag('resource', version), None, build)
+
+        self.client = app.test_client()
+
+    def test_matching_etag_gets_304(self):
+        first = self.client.get('/resource/1')
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        self.assertEqual(first.headers['Cache-Control'], 'private, no-cache')
+
+        again = self.client.get('/resource/1', headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.headers['ETag'], etag)
+        self.assertEqual(again.data, b'')
+        self.assertEqual(self.builds, 1)
+
+        changed = self.client.get('/resource/2', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+class TestPDFFallback(unittest.TestCase):
+    """Without WeasyPrint the download is the JSON export, and startup says so"""
+
+    def setUp(self):
+        from app import app, db
+        from models import Laboratory, User, Patient, Report
+        import routes  # noqa: F401
+
+        app.config['TESTING'] = True
+        app.secret_key = app.secret_key or 'test-secret'
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='PDF Fallback Lab')
+        db.session.add(lab)
+        db.session.flush()
+        user = User(username='pdf-fallback', password_hash='x', laboratory_id=lab.id)
+        patient = Patient(patient_id='PDF0001', first_name='Pdf', last_name='Patient', laboratory_id=lab.id)
+        db.session.add_all([user, patient])
+        db.session.flush()
+        report = Report(report_number='RPTPDF0001', patient_id=patient.id, report_type='individual_test')
+        db.session.add(report)
+        db.session.commit()
+        self.report_id = report.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user.id
+
+    def tearDown(self):
+        from app import db
+
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_download_falls_back_to_json(self):
+        with patch.object(PDFRenderer, 'available', new_callable=PropertyMock, return_value=False):
+            response = self.client.get(f'/reports/{self.report_id}/download')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertIn('report_RPTPDF0001.json', response.headers['Content-Disposition'])
+        self.assertEqual(response.get_json()['report_number'], 'RPTPDF0001')
+
+    def test_missing_engine_is_logged(self):
+        renderer = PDFRenderer()
+        with patch.object(PDFRenderer, 'available', new_callable=PropertyMock, return_value=False), \
+                self.assertLogs('pdf_renderer', level='WARNING') as logs:
+            renderer.init_app(Flask(__name__, instance_path=tempfile.mkdtemp()))
+        self.assertIn('WeasyPrint', logs.output[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for concurrent, rate-limited bulk SMS dispatch against the local Twilio stand-in
+"""
+
+import unittest
+import time
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from twilio_standin import TwilioStandIn
+from sms_service import TokenBucket, BulkSmsDispatcher
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+class TestTokenBucket(unittest.TestCase):
+    """Throughput cap"""
+
+    def test_burst_then_steady_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(5, capacity=5, clock=clock, sleep=clock.sleep)
+        for _ in range(15):
+            bucket.acquire()
+        # 5 tokens of burst, then 10 more at 5 per second
+        self.assertAlmostEqual(clock.now, 2.0, places=3)
+
+class TestBulkDispatch(unittest.TestCase):
+    """Concurrent sends with retries and per-recipient outcomes"""
+
+    def setUp(self):
+        self.standin = TwilioStandIn(auth_token='token', fail_first=3).start()
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def _dispatcher(self, **options):
+        options.setdefault('rate_per_second', 200)
+        return BulkSmsDispatcher('AC123', 'token', '+15550000000', api_base=self.standin.url, **options)
+
+    def test_all_messages_delivered_despite_transient_failures(self):
+        progress = []
+        dispatcher = self._dispatcher(max_workers=8, on_progress=progress.append)
+        outcomes = dispatcher.dispatch([
+            {'to': f'+98912{i:07d}', 'body': f'Result {i} ready', 'recipient': f'Patient {i}'} for i in range(40)
+        ])
+        dispatcher.close()
+
+        self.assertTrue(all(outcome['success'] for outcome in outcomes))
+        self.assertEqual(outcomes[7]['recipient'], 'Patient 7')
+        self.assertEqual(len(self.standin.state.messages), 40)
+        self.assertEqual(dispatcher.progress['retries'], 3)
+        self.assertEqual(progress[-1]['sent'], 40)
+
+    def test_rate_limit_is_respected(self):
+        self.standin.state.fail_first = 0
+        self.standin.state.max_per_second = 25
+        dispatcher = self._dispatcher(rate_per_second=20, max_workers=8)
+
+        started = time.monotonic()
+        outcomes = dispatcher.dispatch([{'to': f'+98912{i:07d}', 'body': 'hi'} for i in range(30)])
+        dispatcher.close()
+
+        self.assertTrue(all(outcome['success'] for outcome in outcomes))
+        self.assertEqual(self.standin.state.rate_limited, 0)
+        self.assertGreaterEqual(time.monotonic() - started, 1.4)
+
+    def test_invalid_numbers_are_not_retried(self):
+        self.standin.state.fail_first = 0
+        dispatcher = self._dispatcher()
+        outcomes = dispatcher.dispatch([{'to': '+989120000001', 'body': 'hi'}, {'to': '0912', 'body': 'hi'}])
+        dispatcher.close()
+
+        self.assertEqual([outcome['success'] for outcome in outcomes], [True, False])
+        self.assertEqual((outcomes[1]['error_code'], outcomes[1]['attempts']), (21211, 1))
+
+    def test_read_timeout_is_not_resent(self):
+        # Twilio accepted the message but the answer came too late; a resend would text the patient twice
+        self.standin.state.fail_first = 0
+        self.standin.state.latency = 0.5
+        dispatcher = self._dispatcher(request_timeout=0.1)
+        outcome = dispatcher.send('+989120000002', 'hi')
+        dispatcher.close()
+        time.sleep(0.6)
+
+        self.assertEqual((outcome['success'], outcome['unknown'], outcome['attempts']), (False, True, 1))
+        self.assertEqual(len(self.standin.state.messages), 1)
+
+    def test_connect_failures_are_retried(self):
+        dispatcher = BulkSmsDispatcher('AC123', 'token', '+15550000000', api_base='http://127.0.0.1:9',
+                                       rate_per_second=200, max_retries=2, sleep=lambda seconds: None)
+        outcome = dispatcher.send('+989120000003', 'hi')
+        dispatcher.close()
+
+        self.assertEqual((outcome['success'], outcome['retryable'], outcome['attempts']), (False, True, 3))
+        self.assertNotIn('unknown', outcome)
+
+if __name__ == '__main__':
+    unittest.main()
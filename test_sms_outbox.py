@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the SMS outbox: deduplicated enqueue and batched relay against the Twilio stand-in
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from twilio_standin import TwilioStandIn
+from sms_outbox import enqueue_sms, relay_batch, record_delivery_status
+from models import Laboratory, Settings, SmsOutbox
+from app import app, db
+
+class TestSmsOutbox(unittest.TestCase):
+    """Messages are queued once and relayed with their outcome stored"""
+
+    def setUp(self):
+        self.standin = TwilioStandIn(auth_token='token').start()
+        app.config['TESTING'] = True
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['TWILIO_API_BASE'] = self.standin.url
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Outbox Lab')
+        db.session.add(lab)
+        db.session.flush()
+        db.session.add(Settings(laboratory_id=lab.id, sms_enabled=True, twilio_account_sid='AC123',
+                                twilio_auth_token='token', twilio_phone_number='+15550000000'))
+        db.session.commit()
+        self.lab_id = lab.id
+
+    def tearDown(self):
+        self.standin.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        app.config['TWILIO_API_BASE'] = None
+
+    def _enqueue(self, phone, entity_id):
+        return enqueue_sms(self.lab_id, phone, 'test_ready', {'patient_name': 'Test', 'test_number': 'T1'},
+                           'test_order', entity_id)
+
+    def test_duplicates_are_dropped(self):
+        self.assertTrue(self._enqueue('+989120000001', 1))
+        self.assertFalse(self._enqueue('+989120000001', 1))
+        self.assertTrue(self._enqueue('+989120000001', 2))
+        db.session.commit()
+        self.assertEqual(SmsOutbox.query.count(), 2)
+
+    def test_relay_stores_outcomes(self):
+        self._enqueue('+989120000001', 1)
+        self._enqueue('0912', 2)
+        db.session.commit()
+
+        counts = relay_batch(max_retries=0)
+        self.assertEqual((counts['sent'], counts['failed']), (1, 1))
+
+        sent = SmsOutbox.query.filter_by(entity_id=1).first()
+        self.assertEqual(sent.status, 'sent')
+        self.assertEqual(sent.delivery_status, 'queued')
+        self.assertEqual(len(self.standin.state.messages), 1)
+        self.assertEqual(SmsOutbox.query.filter_by(entity_id=2).first().error_code, '21211')
+
+        record_delivery_status(sent.message_sid, 'delivered')
+        record_delivery_status(sent.message_sid, 'sent')  # out-of-order callback is ignored
+        self.assertEqual(SmsOutbox.query.filter_by(entity_id=1).first().delivery_status, 'delivered')
+
+        # Nothing is due any more
+        self.assertEqual(relay_batch()['claimed'], 0)
+
+    def test_unanswered_send_is_not_relayed_again(self):
+        self.standin.state.latency = 0.5
+        self._enqueue('+989120000001', 1)
+        db.session.commit()
+
+        counts = relay_batch(request_timeout=0.1)
+        self.assertEqual(counts['unknown'], 1)
+        message = SmsOutbox.query.filter_by(entity_id=1).first()
+        self.assertEqual((message.status, message.attempts), ('unknown', 1))
+        self.assertEqual(relay_batch()['claimed'], 0)
+
+    def test_transient_failure_is_retried_later(self):
+        self.standin.state.fail_rate = 1.0
+        self._enqueue('+989120000001', 1)
+        db.session.commit()
+
+        counts = relay_batch(max_retries=0)
+        self.assertEqual(counts['retrying'], 1)
+        message = SmsOutbox.query.first()
+        self.assertEqual((message.status, message.attempts), ('pending', 1))
+        self.assertGreater(message.next_attempt_at, message.created_at)
+        self.assertEqual(relay_batch()['claimed'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
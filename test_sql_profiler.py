@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQL profiler (statement shapes, N+1 detection, parameter fingerprints, cursor hooks)
+"""
+
+import unittest
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+import metrics
+from sql_profiler import statement_shape, parameter_fingerprint, RequestProfile, SqlProfiler
+
+class TestStatementShapes(unittest.TestCase):
+    """Statements from the same code path share a shape whatever their data"""
+
+    def test_in_lists_and_numbering_fold(self):
+        short = 'SELECT * FROM test_orders WHERE test_orders.patient_id IN (%(patient_id_1_1)s, %(patient_id_1_2)s)'
+        long = ('SELECT *\n  FROM test_orders WHERE test_orders.patient_id IN '
+                '(%(patient_id_1_1)s, %(patient_id_1_2)s, %(patient_id_1_3)s)')
+        self.assertEqual(statement_shape(short), statement_shape(long))
+        self.assertEqual(statement_shape('SELECT * FROM patients WHERE id IN (?, ?, ?)'),
+                         'SELECT * FROM patients WHERE id IN (?...)')
+
+    def test_repeated_lazy_loads_are_flagged(self):
+        profile = RequestProfile('patients')
+        profile.record('SELECT * FROM patients LIMIT ?', 0.002)
+        for _ in range(12):
+            profile.record('SELECT * FROM test_orders WHERE ? = test_orders.patient_id', 0.001)
+
+        repeated = profile.repeated(threshold=5)
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], 12)
+        summary = profile.summary(threshold=5)
+        self.assertEqual((summary['queries'], summary['distinct_statements']), (13, 2))
+
+    def test_parameter_fingerprint_hides_values(self):
+        fingerprint = parameter_fingerprint({'name': 'Jane Doe', 'lab': 3})
+        self.assertTrue(fingerprint.startswith('[int,str]#'))
+        self.assertNotIn('Jane', fingerprint)
+        self.assertEqual(fingerprint, parameter_fingerprint({'lab': 3, 'name': 'Jane Doe'}))
+        self.assertTrue(parameter_fingerprint([(1, 'a'), (2, 'b')]).startswith('2 rows of [int,str]'))
+
+class TestSharedCursorHooks(unittest.TestCase):
+    """One pair of cursor hooks times each statement for both the metrics and the profiler"""
+
+    def test_single_listener_feeds_profiler(self):
+        profiler = SqlProfiler()
+        profiler.listen()
+        profiler.listen()
+        self.assertEqual(metrics._query_observers.count(profiler._record_query), 1)
+        self.assertTrue(event.contains(Engine, 'after_cursor_execute', metrics._after_cursor_execute))
+        self.assertFalse(hasattr(profiler, '_after_cursor_execute'))
+
+        engine = create_engine('sqlite://')
+        try:
+            with profiler.profile('hooks', log=False) as profile, engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                connection.execute(text('SELECT 2'))
+        finally:
+            metrics._query_observers.remove(profiler._record_query)
+            engine.dispose()
+        self.assertEqual(profile.queries, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests for the MediSina sync scheduler (due times, run claims, stale runs, queued manual syncs)
+"""
+
+import unittest
+import sys
+from datetime import datetime, timedelta
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from app import app, db
+from models import Laboratory, User, Settings, SyncRun
+from sync_scheduler import SyncScheduler, jittered_interval, initial_offset, STALE_RUN_AFTER
+
+class SchedulerTestCase(unittest.TestCase):
+    """One lab with MediSina auto-sync every 60 minutes"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        lab = Laboratory(name='Sync Lab')
+        db.session.add(lab)
+        db.session.flush()
+        self.lab_id = lab.id
+        self.settings = Settings(laboratory_id=lab.id, medisina_enabled=True, medisina_auto_sync=True,
+                                 medisina_sync_interval=60)
+        db.session.add(self.settings)
+        db.session.commit()
+        self.scheduler = SyncScheduler(app, max_workers=1)
+
+    def tearDown(self):
+        self.scheduler.executor.shutdown(wait=True)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _run(self, status, started_at, **kwargs):
+        run = SyncRun(laboratory_id=self.lab_id, direction='both', status=status, started_at=started_at, **kwargs)
+        db.session.add(run)
+        db.session.commit()
+        return run
+
+class TestJitteredInterval(unittest.TestCase):
+    """Intervals stay within +/- jitter and are the same on every scheduler instance"""
+
+    def test_bounds_and_determinism(self):
+        intervals = [jittered_interval(lab, run, 60) for lab in range(1, 20) for run in range(1, 20)]
+        self.assertTrue(all(timedelta(minutes=54) <= i <= timedelta(minutes=66) for i in intervals))
+        self.assertGreater(len(set(intervals)), 1)
+        self.assertEqual(jittered_interval(3, 7, 60), jittered_interval(3, 7, 60))
+        self.assertEqual(jittered_interval(3, 7, 60, jitter=0), timedelta(minutes=60))
+
+class TestIsDue(SchedulerTestCase):
+    """A lab is due one jittered interval after its last run started, never while one is running"""
+
+    def test_first_run_waits_for_initial_offset(self):
+        start = self.scheduler.started_at + initial_offset(self.lab_id, 60)
+        self.assertFalse(self.scheduler._is_due(self.settings, start - timedelta(seconds=1)))
+        self.assertTrue(self.scheduler._is_due(self.settings, start))
+
+    def test_due_after_jittered_interval(self):
+        now = datetime.utcnow()
+        run = self._run('succeeded', now - timedelta(hours=2))
+        due_at = run.started_at + jittered_interval(self.lab_id, run.id, 60)
+        self.assertFalse(self.scheduler._is_due(self.settings, due_at - timedelta(seconds=1)))
+        self.assertTrue(self.scheduler._is_due(self.settings, due_at))
+
+        # Queued runs do not count as the last run
+        self._run('queued', None)
+        self.assertTrue(self.scheduler._is_due(self.settings, due_at))
+
+    def test_not_due_while_running(self):
+        self._run('running', datetime.utcnow() - timedelta(hours=3))
+        self.assertFalse(self.scheduler._is_due(self.settings, datetime.utcnow()))
+
+class TestClaimRun(SchedulerTestCase):
+    """A run is claimed by exactly one scheduler"""
+
+    def test_queued_run_is_claimed_once(self):
+        run = self._run('queued', None, trigger='manual')
+        other = SyncScheduler(app, max_workers=1)
+        try:
+            claimed = self.scheduler._claim_run(self.lab_id, run.id)
+            self.assertEqual((claimed.id, claimed.status, claimed.host), (run.id, 'running', self.scheduler.host))
+            self.assertIsNone(other._claim_run(self.lab_id, run.id))
+        finally:
+            other.executor.shutdown(wait=True)
+
+    def test_scheduled_run_is_not_claimed_twice(self):
+        self._run('succeeded', datetime.utcnow() - timedelta(hours=2))
+        claimed = self.scheduler._claim_run(self.lab_id, None)
+        self.assertEqual((claimed.trigger, claimed.status), ('schedule', 'running'))
+        # The new run is running, so the lab is no longer due
+        self.assertIsNone(self.scheduler._claim_run(self.lab_id, None))
+        self.assertEqual(SyncRun.query.filter_by(status='running').count(), 1)
+
+class TestStaleRuns(SchedulerTestCase):
+    """Runs left running by a crashed scheduler are failed after STALE_RUN_AFTER"""
+
+    def test_only_stale_runs_fail(self):
+        stale = self._run('running', datetime.utcnow() - STALE_RUN_AFTER - timedelta(minutes=1))
+        recent = self._run('running', datetime.utcnow() - timedelta(minutes=5))
+        self.scheduler._fail_stale_runs()
+
+        self.assertEqual(db.session.get(SyncRun, stale.id).status, 'failed')
+        self.assertIn('Abandoned', db.session.get(SyncRun, stale.id).error)
+        self.assertEqual(db.session.get(SyncRun, recent.id).status, 'running')
+
+class TestQueuedManualSync(SchedulerTestCase):
+    """With the scheduler enabled, a whole-lab sync from the settings page is queued, not run inline"""
+
+    def setUp(self):
+        import routes  # noqa: F401
+
+        super().setUp()
+        app.secret_key = app.secret_key or 'test-secret'
+        user = User(username='sync-admin', password_hash='x', role='admin', laboratory_id=self.lab_id)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user.id
+        self.scheduler_enabled = app.config.get('MEDISINA_SCHEDULER_ENABLED')
+        app.config['MEDISINA_SCHEDULER_ENABLED'] = True
+
+    def tearDown(self):
+        app.config['MEDISINA_SCHEDULER_ENABLED'] = self.scheduler_enabled
+        super().tearDown()
+
+    def test_sync_is_queued_once(self):
+        response = self.client.post('/api/medisina/sync', json={'direction': 'export'})
+        self.assertEqual(response.status_code, 202)
+        run = response.get_json()['run']
+        self.assertEqual((run['status'], run['direction'], run['trigger']), ('queued', 'export', 'manual'))
+
+        # A second request while the first is still queued returns the same run
+        again = self.client.post('/api/medisina/sync', json={'direction': 'export'})
+        self.assertEqual(again.get_json()['run']['id'], run['id'])
+        self.assertEqual(SyncRun.query.count(), 1)
+        self.assertEqual(SyncRun.query.one().requested_by, self.user_id)
+
+if __name__ == '__main__':
+    unittest.main()
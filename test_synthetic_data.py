@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the synthetic dataset generator (determinism, referential integrity, distributions)
+"""
+
+import unittest
+from datetime import datetime
+import sys
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from synthetic_data import SyntheticDataset, TEST_CATALOG, TABLES, lab_shares
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+def catalog():
+    return [{'id': n + 1, 'code': code, 'sample_type': sample_type, 'unit': unit, 'low': low, 'high': high,
+             'range': f'{low}-{high}', 'si_unit': si_unit, 'si_factor': si_factor, 'weight': weight}
+            for n, (code, _, _, sample_type, unit, low, high, si_unit, si_factor, weight) in enumerate(TEST_CATALOG)]
+
+LAB = {'id': 3, 'name': 'Lab', 'test_types': catalog(), 'user_ids': [10, 11, 12], 'technician_ids': [11, 12]}
+
+class TestSyntheticDataset(unittest.TestCase):
+    """Rows are reproducible from the seed and reference each other consistently"""
+
+    def generate(self, seed=7, count=2000):
+        dataset = SyntheticDataset(seed=seed, now=NOW)
+        dataset.start_ids_after({'patients': 100, 'test_orders': 500})
+        return dataset.generate(LAB, count)
+
+    def test_same_seed_same_rows(self):
+        self.assertEqual(self.generate(), self.generate())
+        self.assertNotEqual(self.generate(seed=8)['patients'], self.generate()['patients'])
+
+    def test_rows_reference_each_other(self):
+        rows = self.generate()
+        for table, columns in TABLES:
+            self.assertTrue(all(len(row) == len(columns) for row in rows[table]), table)
+
+        patient_ids = {row[0] for row in rows['patients']}
+        self.assertEqual(min(patient_ids), 101)
+        orders = {row[0]: row for row in rows['test_orders']}
+        self.assertEqual(min(orders), 501)
+        self.assertTrue(all(row[2] in patient_ids for row in orders.values()))
+        # Samples only for collected orders, one each, same patient
+        self.assertEqual(len({row[3] for row in rows['samples']}), len(rows['samples']))
+        self.assertTrue(all(orders[row[3]][6] != 'ordered' and orders[row[3]][2] == row[2] for row in rows['samples']))
+        self.assertTrue(all(row[2] in patient_ids for row in rows['reports']))
+
+    def test_distributions(self):
+        rows = self.generate(count=5000)
+        orders = rows['test_orders']
+        self.assertAlmostEqual(len(orders) / 5000, 4.0, delta=0.4)
+
+        results = [row[12] for row in orders if row[12]]
+        self.assertTrue(all(row[7] is not None for row in orders if row[6] in ('completed', 'reported')))
+        self.assertAlmostEqual(results.count('normal') / len(results), 0.83, delta=0.03)
+        self.assertLess(results.count('critical') / len(results), 0.04)
+        # Old orders are finished, in-flight ones are recent
+        self.assertGreater(sum(row[6] == 'reported' for row in orders) / len(orders), 0.6)
+
+    def test_lab_shares(self):
+        shares = lab_shares(1000, 4)
+        self.assertEqual(sum(shares), 1000)
+        self.assertEqual(shares, sorted(shares, reverse=True))
+
+if __name__ == '__main__':
+    unittest.main()
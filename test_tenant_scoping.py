@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the denormalized laboratory_id on orders, samples and reports and its migrations
+"""
+
+import unittest
+import warnings
+import sys
+from datetime import datetime
+
+# Add the current directory to Python path
+sys.path.insert(0, '.')
+
+from sqlalchemy import text
+from app import app, db
+from models import Laboratory, Patient, TestType, TestOrder, Sample, Report
+from migrations import run_migrations, create_indexes, backfill_results
+
+class TenantTestCase(unittest.TestCase):
+    """Two labs with one patient each"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        labs = [Laboratory(name='Tenant Lab A'), Laboratory(name='Tenant Lab B')]
+        db.session.add_all(labs)
+        db.session.flush()
+        self.lab_ids = [lab.id for lab in labs]
+        self.patients = [Patient(patient_id=f'TEN{i}', first_name='Tenant', last_name=str(i), laboratory_id=lab.id)
+                         for i, lab in enumerate(labs)]
+        test_type = TestType(code='TENGLU', name='Glucose')
+        db.session.add_all(self.patients + [test_type])
+        db.session.commit()
+        self.test_type_id = test_type.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _order(self, number, **kwargs):
+        return TestOrder(order_number=number, test_type_id=self.test_type_id, **kwargs)
+
+class TestInheritLaboratoryId(TenantTestCase):
+    """New rows take the owning patient's laboratory unless one is given"""
+
+    def test_from_patient_id(self):
+        order = self._order('TEN-O1', patient_id=self.patients[1].id)
+        db.session.add(order)
+        db.session.flush()
+        sample = Sample(sample_id='TEN-S1', patient_id=self.patients[1].id, test_order_id=order.id,
+                        sample_type='blood', collection_date=datetime.utcnow())
+        report = Report(report_number='TEN-R1', patient_id=self.patients[1].id, report_type='individual_test')
+        db.session.add_all([sample, report])
+        db.session.commit()
+
+        self.assertEqual([order.laboratory_id, sample.laboratory_id, report.laboratory_id], [self.lab_ids[1]] * 3)
+
+    def test_from_relationship_and_explicit(self):
+        related = self._order('TEN-O2', patient=self.patients[0])
+        db.session.add(related)
+        explicit = self._order('TEN-O3', patient_id=self.patients[0].id, laboratory_id=self.lab_ids[1])
+        db.session.add(explicit)
+        db.session.commit()
+
+        self.assertEqual(related.laboratory_id, self.lab_ids[0])
+        self.assertEqual(explicit.laboratory_id, self.lab_ids[1])
+
+class TestTenantMigrations(TenantTestCase):
+    """The backfill runs on every start; index builds are left to the maintenance command"""
+
+    def test_backfill_catches_rows_written_after_it(self):
+        db.session.add(self._order('TEN-O4', patient_id=self.patients[0].id))
+        db.session.commit()
+        db.session.execute(text('UPDATE test_orders SET laboratory_id = NULL'))
+        db.session.commit()
+
+        self.assertEqual(run_migrations()['rows_backfilled'], {'test_orders': 1})
+        self.assertEqual(db.session.execute(text('SELECT laboratory_id FROM test_orders')).scalar(), self.lab_ids[0])
+
+        self.assertEqual(run_migrations()['rows_backfilled'], {})
+
+        # A replica still on the previous release inserts an order without laboratory_id
+        db.session.execute(text('UPDATE test_orders SET laboratory_id = NULL'))
+        db.session.commit()
+        self.assertEqual(run_migrations()['rows_backfilled'], {'test_orders': 1})
+        self.assertEqual(db.session.execute(text('SELECT laboratory_id FROM test_orders')).scalar(), self.lab_ids[0])
+
+    def test_indexes_only_reported_at_startup(self):
+        db.session.execute(text('DROP INDEX ix_test_orders_lab_ordered'))
+        db.session.commit()
+
+        # Expression indexes such as ix_test_orders_number_lower are found too, so only the dropped one is missing
+        self.assertEqual(run_migrations()['indexes_missing'], ['ix_test_orders_lab_ordered'])
+        self.assertEqual(create_indexes(), ['ix_test_orders_lab_ordered'])
+        self.assertEqual(run_migrations()['indexes_missing'], [])
+
+    def test_result_backfill_is_batched_and_rerunnable(self):
+        values = ['5.4', '<0.5', 'positive', '120']
+        db.session.add_all([self._order(f'TEN-B{i}', patient_id=self.patients[0].id, result_value=value)
+                            for i, value in enumerate(values)])
+        db.session.commit()
+        db.session.execute(text('UPDATE test_orders SET result_numeric = NULL, result_qualifier = NULL'))
+        db.session.commit()
+
+        self.assertEqual(backfill_results(batch_size=1), 3)
+        rows = db.session.execute(text('SELECT result_value, result_numeric, result_qualifier FROM test_orders '
+                                       'ORDER BY id')).all()
+        self.assertEqual([tuple(row) for row in rows],
+                         [('5.4', 5.4, None), ('<0.5', 0.5, '<'), ('positive', None, None), ('120', 120.0, None)])
+        self.assertEqual(backfill_results(batch_size=1), 0)
+
+    def test_startup_reflection_does_not_warn(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            run_migrations()
+
+if __name__ == '__main__':
+    unittest.main()
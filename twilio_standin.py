@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Twilio Stand-in Server
+Minimal local imitation of the Twilio Messages API (POST /2010-04-01/Accounts/<sid>/Messages.json)
+for exercising bulk SMS dispatch without sending real messages. Standard library only.
+
+Usage:
+    python twilio_standin.py --port 8766 --max-per-second 10 --fail-rate 0.05
+    # then set TWILIO_API_BASE=http://localhost:8766
+"""
+
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import logging
+import argparse
+import threading
+from collections import deque
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<sid>[^/]+)/Messages\.json$')
+
+class StandInState:
+    """Messages accepted so far, plus rate limiting and failure injection knobs"""
+
+    def __init__(self, auth_token=None, max_per_second=None, fail_rate=0.0, fail_first=0, latency=0.0, seed=None):
+        self.auth_token = auth_token
+        self.max_per_second = max_per_second
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_seen = 0
+        self.rate_limited = 0
+        self.recent = deque()  # monotonic times of accepted messages in the last second
+        self.messages = []
+
+    def admit(self):
+        """None when the request may proceed, otherwise the (status, Twilio error code) to answer with"""
+        with self.lock:
+            self.requests_seen += 1
+            if self.requests_seen <= self.fail_first or self.random.random() < self.fail_rate:
+                return 503, 20500
+
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] >= 1.0:
+                self.recent.popleft()
+            if self.max_per_second and len(self.recent) >= self.max_per_second:
+                self.rate_limited += 1
+                return 429, 20429
+            self.recent.append(now)
+            return None
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server_version = 'TwilioStandIn/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, code, message, headers=None):
+        self._send_json(status, {'code': code, 'message': message, 'status': status}, headers)
+
+    def _authorized(self, account_sid):
+        state = self.server.state
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Basic '):
+            return False
+        try:
+            sid, _, token = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+        except ValueError:
+            return False
+        return sid == account_sid and (state.auth_token is None or token == state.auth_token)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path == '/_standin/stats':
+            with state.lock:
+                return self._send_json(200, {
+                    'requests_seen': state.requests_seen,
+                    'rate_limited': state.rate_limited,
+                    'messages': len(state.messages)
+                })
+        self._error(404, 20404, 'The requested resource was not found')
+
+    def do_POST(self):
+        state = self.server.state
+        match = MESSAGES_PATH.match(self.path.split('?', 1)[0])
+        if not match:
+            return self._error(404, 20404, 'The requested resource was not found')
+
+        account_sid = match.group('sid')
+        if not self._authorized(account_sid):
+            return self._error(401, 20003, 'Authenticate')
+
+        rejection = state.admit()
+        if rejection:
+            status, code = rejection
+            return self._error(status, code, 'Too Many Requests' if status == 429 else 'Service unavailable',
+                               {'Retry-After': '1'} if status == 429 else None)
+
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        to = form.get('To', [''])[0]
+        body = form.get('Body', [''])[0]
+        if not re.match(r'^\+\d{8,15}$', to):
+            return self._error(400, 21211, f"The 'To' number {to} is not a valid phone number.")
+        if not body:
+            return self._error(400, 21602, 'Message body is required.')
+
+        if state.latency:
+            time.sleep(state.latency)
+
+        message = {
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': account_sid,
+            'to': to,
+            'from': form.get('From', [''])[0],
+            'body': body,
+            'status': 'queued'
+        }
+        with state.lock:
+            state.messages.append(message)
+        self._send_json(201, message)
+
+class TwilioStandIn:
+    """Runs the stand-in on a background thread, for tests"""
+
+    def __init__(self, host='127.0.0.1', port=0, **state_options):
+        self.server = ThreadingHTTPServer((host, port), StandInHandler)
+        self.server.state = StandInState(**state_options)
+        self.thread = None
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Twilio Messages API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--max-per-second', type=int, default=None, help='answer 429 above this many messages per second')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before accepting each message')
+    args = parser.parse_args()
+
+    standin = TwilioStandIn(args.host, args.port, max_per_second=args.max_per_second,
+                            fail_rate=args.fail_rate, latency=args.latency)
+    print(f'Twilio stand-in listening on {standin.url}')
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.stop()
+
+if __name__ == '__main__':
+    main()